@@ -36,19 +36,27 @@ sizeC as input.
 
 from omero.gateway import BlitzGateway
 import omero
-import omero.util.script_utils as script_utils
-import omero.util.roi_handling_utils as roi_utils
+from omero.script_helpers import plane_cache
+from omero.script_helpers.lazy import lazy_import
+from omero.script_helpers.prefetch import prefetch
+from omero.script_helpers.process_pool import map_images
+from omero.script_helpers.uploader import create_image_from_numpy_seq
 from omero.rtypes import rlong, rstring, robject, unwrap
 import omero.scripts as scripts
-from numpy import zeros, hstack, vstack, asarray, math
+import math
 import logging
-from PIL import Image
 from io import BytesIO
 
+numpy = lazy_import("numpy")
+Image = lazy_import("PIL.Image")
+script_utils = lazy_import("omero.util.script_utils")
+roi_utils = lazy_import("omero.util.roi_handling_utils")
+
 logger = logging.getLogger('kymograph')
 
 
-def get_line_data(image, x1, y1, x2, y2, line_w=2, the_z=0, the_c=0, the_t=0):
+def get_line_data(image, x1, y1, x2, y2, line_w=2, the_z=0, the_c=0, the_t=0,
+                  bounds=None):
     """
     Grab pixel data covering the specified line, and rotates it horizontally.
 
@@ -64,6 +72,9 @@ def get_line_data(image, x1, y1, x2, y2, line_w=2, the_z=0, the_c=0, the_t=0):
     @param the_z:           Z index within pixels
     @param the_c:           Channel index
     @param the_t:           Time index
+    @param bounds:          Optional (x, y, w, h) around the line, e.g. of the
+                            whole polyline. It is rendered once per Z/C/T and
+                            cached, and the line's region is cut from it.
     """
     size_x = image.getSizeX()
     size_y = image.getSizeY()
@@ -103,9 +114,18 @@ def get_line_data(image, x1, y1, x2, y2, line_w=2, the_z=0, the_c=0, the_t=0):
     h = int(bottom - top)
 
     # get the Tile - render single channel white
-    image.set_active_channels([the_c + 1], None, ['FFFFFF'])
-    jpeg_data = image.renderJpegRegion(the_z, the_t, x, y, w, h)
-    pil = Image.open(BytesIO(jpeg_data))
+    region = (x, y, w, h)
+    if bounds is None or not plane_cache.contains(bounds, region):
+        bounds = region
+
+    def render():
+        image.set_active_channels([the_c + 1], None, ['FFFFFF'])
+        jpeg_data = image.renderJpegRegion(the_z, the_t, *bounds)
+        return numpy.asarray(Image.open(BytesIO(jpeg_data)))
+
+    key = ("rendered", image.getPixelsId(), the_z, the_c, the_t, bounds)
+    rendered = plane_cache.get_cache().get(key, render)
+    pil = Image.fromarray(plane_cache.crop(rendered, bounds, region))
 
     # pad if we wanted a bigger region
     if pad_left > 0 or pad_right > 0 or pad_top > 0 or pad_bottom > 0:
@@ -133,7 +153,7 @@ def get_line_data(image, x1, y1, x2, y2, line_w=2, the_z=0, the_c=0, the_t=0):
     cropped = rotated.crop((crop_x, crop_y, crop_x2, crop_y2))
 
     # return numpy array
-    rgb_plane = asarray(cropped)
+    rgb_plane = numpy.asarray(cropped)
     # greyscale image. r, g, b all same. Just use first
     return rgb_plane[::, ::, 0]
 
@@ -147,6 +167,8 @@ def polyline_kymograph(conn, script_params, image, polylines, line_width,
     """
     size_c = image.getSizeC()
     size_t = image.getSizeT()
+    size_x = image.getSizeX()
+    size_y = image.getSizeY()
 
     use_all_times = "Use_All_Timepoints" in script_params and \
         script_params['Use_All_Timepoints'] is True
@@ -175,13 +197,18 @@ def polyline_kymograph(conn, script_params, image, polylines, line_width,
                 line_data = []
                 points = shape['points']
                 the_z = shape['theZ']
+                # all segments are cut from one rendering of the polyline
+                bounds = plane_cache.bounds_by_plane(
+                    [(the_z, the_t, points)], line_width + 1, size_x, size_y,
+                    conn.getMaxPlaneSize()).get((the_z, the_t))
                 for l in range(len(points)-1):
                     x1, y1 = points[l]
                     x2, y2 = points[l+1]
                     ld = get_line_data(image, x1, y1, x2, y2,
-                                       line_width, the_z, the_c, the_t)
+                                       line_width, the_z, the_c, the_t,
+                                       bounds)
                     line_data.append(ld)
-                row_data = hstack(line_data)
+                row_data = numpy.hstack(line_data)
                 t_rows.append(row_data)
 
             # have to handle any mismatch in line lengths by padding shorter
@@ -192,17 +219,18 @@ def polyline_kymograph(conn, script_params, image, polylines, line_width,
                 row_height, row_length = t_row.shape
                 if row_length < longest:
                     padding = longest - row_length
-                    pad_data = zeros((row_height, padding), dtype=t_row.dtype)
-                    t_rows[t] = hstack([t_row, pad_data])
-            c_data = vstack(t_rows)
+                    pad_data = numpy.zeros((row_height, padding),
+                                           dtype=t_row.dtype)
+                    t_rows[t] = numpy.hstack([t_row, pad_data])
+            c_data = numpy.vstack(t_rows)
             yield c_data
 
     name = "%s_kymograph" % image.getName()
     desc = "Kymograph generated from Image ID: %s, polyline: %s" \
         % (image.getId(), first_shape['points'])
     desc += "\nwith each timepoint being %s vertical pixels" % line_width
-    return conn.createImageFromNumpySeq(
-        plane_gen(), name, 1, size_c, 1, description=desc,
+    return create_image_from_numpy_seq(
+        conn, prefetch(plane_gen()), name, 1, size_c, 1, description=desc,
         dataset=dataset)
 
 
@@ -253,26 +281,152 @@ def lines_kymograph(conn, script_params, image, lines, line_width, dataset):
                     r_length = row_length
                 if row_length < r_length:
                     padding = r_length - row_length
-                    pad_data = zeros((row_height, padding),
-                                     dtype=row_data.dtype)
-                    row_data = hstack([row_data, pad_data])
+                    pad_data = numpy.zeros((row_height, padding),
+                                           dtype=row_data.dtype)
+                    row_data = numpy.hstack([row_data, pad_data])
                 elif row_length > r_length:
                     row_data = row_data[:, 0:r_length]
                 t_rows.append(row_data)
-            yield vstack(t_rows)
+            yield numpy.vstack(t_rows)
 
     name = "%s_kymograph" % image.getName()
     desc = "Kymograph generated from Image ID: %s, line: %s" \
         % (image.getId(), first_line)
     desc += "\nwith each timepoint being %s vertical pixels" % line_width
-    return conn.createImageFromNumpySeq(
-        plane_gen(), name, 1, size_c, 1, description=desc,
+    return create_image_from_numpy_seq(
+        conn, prefetch(plane_gen()), name, 1, size_c, 1, description=desc,
         dataset=dataset)
 
 
+def process_image(conn, image_id, script_params):
+    """
+    Create a kymograph for each ROI of an image with lines or polylines.
+    Run in a worker process by process_images.
+
+    @return:    The IDs of the new images, and whether they could be
+                linked to the dataset of the image
+    """
+    image = conn.getObject("Image", image_id)
+    line_width = script_params['Line_Width']
+    new_images = []      # kymographs derived from the current image.
+    c_names = []
+    colors = []
+    for ch in image.getChannels():
+        c_names.append(ch.getLabel())
+        colors.append(ch.getColor().getRGB())
+
+    size_t = image.getSizeT()
+    pixels = image.getPrimaryPixels()
+
+    dataset = image.getParent()
+    if dataset is not None and not dataset.canLink():
+        dataset = None
+
+    roi_service = conn.getRoiService()
+    result = roi_service.findByImage(image.getId(), None)
+
+    # kymograph strategy - Using Line and Polyline ROIs:
+    # NB: Use ALL time points unless >1 shape AND 'use_all_timepoints' =
+    # False
+    # If > 1 shape per time-point (per ROI), pick one!
+    # 1 - Single line. Use this shape for all time points
+    # 2 - Many lines. Use the first one to fix length. Subsequent lines to
+    # update start and direction
+    # 3 - Single polyline. Use this shape for all time points
+    # 4 - Many polylines. Use the first one to fix length.
+    for roi in result.rois:
+        lines = {}          # map of theT: line
+        polylines = {}      # map of theT: polyline
+        for s in roi.copyShapes():
+            if s is None:
+                continue
+            the_t = unwrap(s.getTheT())
+            the_z = unwrap(s.getTheZ())
+            z = 0
+            t = 0
+            if the_t is not None:
+                t = the_t
+            if the_z is not None:
+                z = the_z
+            # TODO: Add some filter of shapes. E.g. text? / 'lines' only
+            # etc.
+            if type(s) == omero.model.LineI:
+                x1 = s.getX1().getValue()
+                x2 = s.getX2().getValue()
+                y1 = s.getY1().getValue()
+                y2 = s.getY2().getValue()
+                lines[t] = {'theZ': z, 'x1': x1, 'y1': y1, 'x2': x2,
+                            'y2': y2}
+
+            elif type(s) == omero.model.PolylineI:
+                v = s.getPoints().getValue()
+                points = roi_utils.points_string_to_xy_list(v)
+                polylines[t] = {'theZ': z, 'points': points}
+
+        if len(lines) > 0:
+            new_img = lines_kymograph(
+                conn, script_params, image, lines, line_width, dataset)
+            new_images.append(new_img)
+            lines = []
+        elif len(polylines) > 0:
+            new_img = polyline_kymograph(
+                conn, script_params, image, polylines, line_width, dataset)
+            new_images.append(new_img)
+
+    # look-up the interval for each time-point
+    t_interval = None
+    infos = list(pixels.copyPlaneInfo(theC=0, theT=size_t-1, theZ=0))
+    if len(infos) > 0 and infos[0].getDeltaT() is not None:
+        duration = infos[0].getDeltaT(units="SECOND").getValue()
+        if size_t == 1:
+            t_interval = duration
+        else:
+            t_interval = duration/(size_t-1)
+    elif pixels.timeIncrement is not None:
+        t_interval = pixels.timeIncrement
+    elif "Time_Increment" in script_params:
+        t_interval = script_params["Time_Increment"]
+
+    pixel_size = None
+    if pixels.physicalSizeX is not None:
+        pixel_size = pixels.physicalSizeX
+    elif "Pixel_Size" in script_params:
+        pixel_size = script_params['Pixel_Size']
+
+    # Save channel names and colors for each new image
+    for img in new_images:
+        for i, c in enumerate(img.getChannels()):
+            lc = c.getLogicalChannel()
+            lc.setName(c_names[i])
+            lc.save()
+            r, g, b = colors[i]
+            # need to reload channels to avoid optimistic lock on update
+            c_obj = conn.getQueryService().get("Channel", c.id)
+            c_obj.red = omero.rtypes.rint(r)
+            c_obj.green = omero.rtypes.rint(g)
+            c_obj.blue = omero.rtypes.rint(b)
+            c_obj.alpha = omero.rtypes.rint(255)
+            conn.getUpdateService().saveObject(c_obj)
+        img.resetRDefs()  # reset based on colors above
+
+        # If we know pixel sizes, set them on the new image
+        if pixel_size is not None or t_interval is not None:
+            px = conn.getQueryService().get("Pixels", img.getPixelsId())
+            microm = getattr(omero.model.enums.UnitsLength, "MICROMETER")
+            if pixel_size is not None:
+                pixel_size = omero.model.LengthI(pixel_size, microm)
+                px.setPhysicalSizeX(pixel_size)
+            if t_interval is not None:
+                t_per_pixel = t_interval / line_width
+                t_per_pixel = omero.model.LengthI(t_per_pixel, microm)
+                px.setPhysicalSizeY(t_per_pixel)
+            conn.getUpdateService().saveObject(px)
+    print(plane_cache.get_cache().report())
+    return [img.getId() for img in new_images], dataset is not None
+
+
 def process_images(conn, script_params):
     """Process each image passed to script, generating new Kymograph images."""
-    line_width = script_params['Line_Width']
     new_kymographs = []
     message = ""
 
@@ -289,128 +443,21 @@ def process_images(conn, script_params):
         message += "No ROI containing line or polyline was found."
         return None, message
 
-    for image in images:
-        if image.getSizeT() == 1:
-            continue
-        new_images = []      # kymographs derived from the current image.
-        c_names = []
-        colors = []
-        for ch in image.getChannels():
-            c_names.append(ch.getLabel())
-            colors.append(ch.getColor().getRGB())
-
-        size_t = image.getSizeT()
-        pixels = image.getPrimaryPixels()
-
-        dataset = image.getParent()
-        if dataset is not None and not dataset.canLink():
-            dataset = None
-
-        roi_service = conn.getRoiService()
-        result = roi_service.findByImage(image.getId(), None)
-
-        # kymograph strategy - Using Line and Polyline ROIs:
-        # NB: Use ALL time points unless >1 shape AND 'use_all_timepoints' =
-        # False
-        # If > 1 shape per time-point (per ROI), pick one!
-        # 1 - Single line. Use this shape for all time points
-        # 2 - Many lines. Use the first one to fix length. Subsequent lines to
-        # update start and direction
-        # 3 - Single polyline. Use this shape for all time points
-        # 4 - Many polylines. Use the first one to fix length.
-        for roi in result.rois:
-            lines = {}          # map of theT: line
-            polylines = {}      # map of theT: polyline
-            for s in roi.copyShapes():
-                if s is None:
-                    continue
-                the_t = unwrap(s.getTheT())
-                the_z = unwrap(s.getTheZ())
-                z = 0
-                t = 0
-                if the_t is not None:
-                    t = the_t
-                if the_z is not None:
-                    z = the_z
-                # TODO: Add some filter of shapes. E.g. text? / 'lines' only
-                # etc.
-                if type(s) == omero.model.LineI:
-                    x1 = s.getX1().getValue()
-                    x2 = s.getX2().getValue()
-                    y1 = s.getY1().getValue()
-                    y2 = s.getY2().getValue()
-                    lines[t] = {'theZ': z, 'x1': x1, 'y1': y1, 'x2': x2,
-                                'y2': y2}
-
-                elif type(s) == omero.model.PolylineI:
-                    v = s.getPoints().getValue()
-                    points = roi_utils.points_string_to_xy_list(v)
-                    polylines[t] = {'theZ': z, 'points': points}
-
-            if len(lines) > 0:
-                new_img = lines_kymograph(
-                    conn, script_params, image, lines, line_width, dataset)
-                new_images.append(new_img)
-                lines = []
-            elif len(polylines) > 0:
-                new_img = polyline_kymograph(
-                    conn, script_params, image, polylines, line_width, dataset)
-                new_images.append(new_img)
-
-        # look-up the interval for each time-point
-        t_interval = None
-        infos = list(pixels.copyPlaneInfo(theC=0, theT=size_t-1, theZ=0))
-        if len(infos) > 0 and infos[0].getDeltaT() is not None:
-            duration = infos[0].getDeltaT(units="SECOND").getValue()
-            if size_t == 1:
-                t_interval = duration
-            else:
-                t_interval = duration/(size_t-1)
-        elif pixels.timeIncrement is not None:
-            t_interval = pixels.timeIncrement
-        elif "Time_Increment" in script_params:
-            t_interval = script_params["Time_Increment"]
-
-        pixel_size = None
-        if pixels.physicalSizeX is not None:
-            pixel_size = pixels.physicalSizeX
-        elif "Pixel_Size" in script_params:
-            pixel_size = script_params['Pixel_Size']
-
-        # Save channel names and colors for each new image
-        for img in new_images:
-            for i, c in enumerate(img.getChannels()):
-                lc = c.getLogicalChannel()
-                lc.setName(c_names[i])
-                lc.save()
-                r, g, b = colors[i]
-                # need to reload channels to avoid optimistic lock on update
-                c_obj = conn.getQueryService().get("Channel", c.id)
-                c_obj.red = omero.rtypes.rint(r)
-                c_obj.green = omero.rtypes.rint(g)
-                c_obj.blue = omero.rtypes.rint(b)
-                c_obj.alpha = omero.rtypes.rint(255)
-                conn.getUpdateService().saveObject(c_obj)
-            img.resetRDefs()  # reset based on colors above
-
-            # If we know pixel sizes, set them on the new image
-            if pixel_size is not None or t_interval is not None:
-                px = conn.getQueryService().get("Pixels", img.getPixelsId())
-                microm = getattr(omero.model.enums.UnitsLength, "MICROMETER")
-                if pixel_size is not None:
-                    pixel_size = omero.model.LengthI(pixel_size, microm)
-                    px.setPhysicalSizeX(pixel_size)
-                if t_interval is not None:
-                    t_per_pixel = t_interval / line_width
-                    t_per_pixel = omero.model.LengthI(t_per_pixel, microm)
-                    px.setPhysicalSizeY(t_per_pixel)
-                conn.getUpdateService().saveObject(px)
+    results = map_images(
+        conn, process_image,
+        [image.getId() for image in images if image.getSizeT() > 1],
+        script_params)
+    new_images = []
+    linked = False
+    for image_ids, linked in results:
+        # the kymographs of the last image, for the message
+        new_images = [conn.getObject("Image", i) for i in image_ids]
         new_kymographs.extend(new_images)
 
     if not new_kymographs:
         message += "No kymograph created. See 'Error' or 'Info' for details."
     else:
-        if not dataset:
+        if not linked:
             link_message = " but could not be attached"
         else:
             link_message = ""
@@ -29,14 +29,15 @@ kymograph images that have been created by the 'Kymograph.py' Script.
 """
 
 from omero.gateway import BlitzGateway
-import omero
 from omero.rtypes import rlong, rstring, robject
 from omero.model import ImageAnnotationLinkI, ImageI
 import omero.scripts as scripts
-import omero.util.script_utils as script_utils
-import omero.util.roi_handling_utils as roi_utils
+from omero.script_helpers.lazy import lazy_import
+from omero.script_helpers.shape_index import ShapeIndex
 import logging
 
+script_utils = lazy_import("omero.util.script_utils")
+
 logger = logging.getLogger('kymograph_analysis')
 
 
@@ -50,8 +51,10 @@ def process_images(conn, script_params):
     if not images:
         return None, message
     # Check for line and polyline ROIs and filter images list
-    images = [image for image in images if
-              image.getROICount(["Polyline", "Line"]) > 0]
+    lines = ShapeIndex.load(conn, [image.getId() for image in images],
+                            ("Line", "Polyline"))
+    with_lines = set(lines.column("image"))
+    images = [image for image in images if image.getId() in with_lines]
     if not images:
         message += "No ROI containing line or polyline was found."
         return None, message
@@ -65,8 +68,7 @@ def process_images(conn, script_params):
                 " not a kymograph." % (image.getName(), image.getId())
             continue
 
-        roi_service = conn.getRoiService()
-        result = roi_service.findByImage(image.getId(), None)
+        shapes = lines.for_image(image.getId())
 
         secs_per_pixel_y = image.getPixelSizeY()
         microns_per_pixel_x = image.getPixelSizeX()
@@ -81,48 +83,46 @@ def process_images(conn, script_params):
             " x_end (pixels), dt (pixels), dx (pixels), x/t, speed(um/sec)," \
             "avg x/t, avg speed(um/sec)"
         table_data = ""
-        for roi in result.rois:
-            for s in roi.copyShapes():
-                if s is None:
-                    continue    # seems possible in some situations
-                if type(s) == omero.model.LineI:
-                    table_data += "\nLine ID: %s" % s.getId().getValue()
-                    x1 = s.getX1().getValue()
-                    x2 = s.getX2().getValue()
-                    y1 = s.getY1().getValue()
-                    y2 = s.getY2().getValue()
+        shape_ids = shapes.column("id")
+        for index, shape_type in enumerate(shapes.type_names):
+            points = shapes.shape_points(index)
+            if shape_type == "Line":
+                table_data += "\nLine ID: %s" % shape_ids[index]
+                (x1, y1), (x2, y2) = points
+                dx = abs(x1-x2)
+                dy = abs(y1-y2)
+                dx_per_y = float(dx)/dy
+                speed = ""
+                if microns_per_sec:
+                    speed = dx_per_y * microns_per_sec
+                table_data += "\n"
+                table_data += ",".join(
+                    [str(x) for x in (y1, x1, y2, x2, dy, dx, dx_per_y,
+                                      speed)])
+
+            elif not points:
+                logger.warning("Invalid Polyline coords: shape %s",
+                               shape_ids[index])
+
+            else:
+                table_data += "\nPolyline ID: %s" % shape_ids[index]
+                x_start, y_start = points[0]
+                for i in range(1, len(points)):
+                    x1, y1 = points[i-1]
+                    x2, y2 = points[i]
                     dx = abs(x1-x2)
                     dy = abs(y1-y2)
                     dx_per_y = float(dx)/dy
+                    av_x_per_y = abs(float(x2-x_start)/(y2-y_start))
                     speed = ""
+                    avg_speed = ""
                     if microns_per_sec:
                         speed = dx_per_y * microns_per_sec
+                        avg_speed = av_x_per_y * microns_per_sec
                     table_data += "\n"
                     table_data += ",".join(
                         [str(x) for x in (y1, x1, y2, x2, dy, dx, dx_per_y,
-                                          speed)])
-
-                elif type(s) == omero.model.PolylineI:
-                    table_data += "\nPolyline ID: %s" % s.getId().getValue()
-                    v = s.getPoints().getValue()
-                    points = roi_utils.points_string_to_xy_list(v)
-                    x_start, y_start = points[0]
-                    for i in range(1, len(points)):
-                        x1, y1 = points[i-1]
-                        x2, y2 = points[i]
-                        dx = abs(x1-x2)
-                        dy = abs(y1-y2)
-                        dx_per_y = float(dx)/dy
-                        av_x_per_y = abs(float(x2-x_start)/(y2-y_start))
-                        speed = ""
-                        avg_speed = ""
-                        if microns_per_sec:
-                            speed = dx_per_y * microns_per_sec
-                            avg_speed = av_x_per_y * microns_per_sec
-                        table_data += "\n"
-                        table_data += ",".join(
-                            [str(x) for x in (y1, x1, y2, x2, dy, dx, dx_per_y,
-                                              speed, av_x_per_y, avg_speed)])
+                                          speed, av_x_per_y, avg_speed)])
 
         # write table data to csv...
         if len(table_data) > 0:
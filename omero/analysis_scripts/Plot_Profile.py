@@ -33,21 +33,28 @@ from omero.gateway import BlitzGateway
 import omero
 from omero.rtypes import rstring, rlong, robject, unwrap
 import omero.scripts as scripts
-import omero.util.script_utils as script_utils
-import omero.util.roi_handling_utils as roi_utils
-from numpy import hstack, average
+from omero.script_helpers import plane_cache
+from omero.script_helpers.lazy import lazy_import
+from omero.script_helpers.process_pool import map_images
 import logging
 
+numpy = lazy_import("numpy")
+script_utils = lazy_import("omero.util.script_utils")
+roi_utils = lazy_import("omero.util.roi_handling_utils")
+
 logger = logging.getLogger('plot_profile')
 
 
-def process_polylines(conn, script_params, image, polylines, line_width, fout):
+def process_polylines(conn, script_params, image, polylines, line_width, fout,
+                      pixels=None):
     """
     Output data from one or more polylines on an image. Attach csv to image.
 
     @param polylines list of theT:T, theZ:Z, points: list of (x,y)}
+    @param pixels    PixelsWrapper to read from, e.g. a CachedPixels
     """
-    pixels = image.getPrimaryPixels()
+    if pixels is None:
+        pixels = image.getPrimaryPixels()
     the_cs = script_params['Channels']
 
     for pl in polylines:
@@ -66,12 +73,12 @@ def process_polylines(conn, script_params, image, polylines, line_width, fout):
                     pixels, x1, y1, x2, y2, line_width,
                     the_z, the_c, the_t)
                 ldata.append(ld)
-            line_data = hstack(ldata)
+            line_data = numpy.hstack(ldata)
 
             if script_params['Sum_or_Average'] == 'Sum':
                 output_data = line_data.sum(axis=0)
             else:
-                output_data = average(line_data, axis=0)
+                output_data = numpy.average(line_data, axis=0)
 
             line_header = script_params['Sum_or_Average'] == \
                 'Average, with raw data' and 'Average,' or ""
@@ -91,7 +98,8 @@ def process_polylines(conn, script_params, image, polylines, line_width, fout):
                     fout.write('\n')
 
 
-def process_lines(conn, script_params, image, lines, line_width, fout):
+def process_lines(conn, script_params, image, lines, line_width, fout,
+                  pixels=None):
     """
     Creates a new kymograph Image from one or more lines.
     If one line, use this for every time point.
@@ -100,7 +108,8 @@ def process_lines(conn, script_params, image, lines, line_width, fout):
     the first.
     """
 
-    pixels = image.getPrimaryPixels()
+    if pixels is None:
+        pixels = image.getPrimaryPixels()
     the_cs = script_params['Channels']
 
     for l in lines:
@@ -118,7 +127,7 @@ def process_lines(conn, script_params, image, lines, line_width, fout):
             if script_params['Sum_or_Average'] == 'Sum':
                 output_data = line_data.sum(axis=0)
             else:
-                output_data = average(line_data, axis=0)
+                output_data = numpy.average(line_data, axis=0)
 
             line_header = script_params['Sum_or_Average'] == \
                 'Average, with raw data' and 'Average,' or ""
@@ -138,9 +147,104 @@ def process_lines(conn, script_params, image, lines, line_width, fout):
                     fout.write('\n')
 
 
-def process_images(conn, script_params):
+def process_image(conn, image_id, script_params):
+    """
+    Output the data of the lines and polylines on an image to a csv file,
+    attached to the image.
 
+    @return:    ID of the FileAnnotation or None, and its message
+    """
     line_width = script_params['Line_Width']
+
+    image = conn.getObject("Image", image_id)
+    c_names = []
+    colors = []
+    for ch in image.getChannels():
+        c_names.append(ch.getLabel())
+        colors.append(ch.getColor().getRGB())
+
+    size_c = image.getSizeC()
+
+    if script_params.get('Channels') is None:
+        script_params = dict(script_params, Channels=range(size_c))
+
+    roi_service = conn.getRoiService()
+    result = roi_service.findByImage(image.getId(), None)
+
+    lines = []
+    polylines = []
+
+    for roi in result.rois:
+        roi_id = roi.getId().getValue()
+        for s in roi.copyShapes():
+            the_t = unwrap(s.getTheT())
+            the_z = unwrap(s.getTheZ())
+            z = 0
+            t = 0
+            if the_t is not None:
+                t = the_t
+            if the_z is not None:
+                z = the_z
+            # TODO: Add some filter of shapes e.g. text? / 'lines' only
+            # etc.
+            if type(s) == omero.model.LineI:
+                x1 = s.getX1().getValue()
+                x2 = s.getX2().getValue()
+                y1 = s.getY1().getValue()
+                y2 = s.getY2().getValue()
+                lines.append({'id': roi_id, 'theT': t, 'theZ': z,
+                              'x1': x1, 'y1': y1, 'x2': x2, 'y2': y2})
+
+            elif type(s) == omero.model.PolylineI:
+                v = s.getPoints().getValue()
+                points = roi_utils.points_string_to_xy_list(v)
+                polylines.append({'id': roi_id, 'theT': t, 'theZ': z,
+                                  'points': points})
+
+    if len(lines) == 0 and len(polylines) == 0:
+        return None, None
+
+    # read the area under all lines of a plane once per channel, instead
+    # of once for every line and polyline segment
+    shapes = [(line['theZ'], line['theT'], [(line['x1'], line['y1']),
+                                            (line['x2'], line['y2'])])
+              for line in lines]
+    shapes += [(pl['theZ'], pl['theT'], pl['points']) for pl in polylines]
+    bounds = plane_cache.bounds_by_plane(
+        shapes, line_width + 1, image.getSizeX(), image.getSizeY(),
+        conn.getMaxPlaneSize())
+    pixels = plane_cache.CachedPixels(image.getPrimaryPixels(),
+                                      bounds=bounds)
+
+    # prepare column headers, including line-id if we are going to output
+    # raw data.
+    line_id = script_params['Sum_or_Average'] == 'Average, with raw data' \
+        and 'Line, ' or ""
+    col_header = 'Image_ID, ROI_ID, Z, T, C, %sLine data %s of Line" \
+        " Width %s\n' % (line_id, script_params['Sum_or_Average'],
+                         script_params['Line_Width'])
+
+    # prepare a csv file to write our data to...
+    file_name = "Plot_Profile_%s.csv" % image.getId()
+    with open(file_name, 'w') as f:
+        f.write(col_header)
+        if len(lines) > 0:
+            process_lines(conn, script_params, image, lines, line_width, f,
+                          pixels)
+        if len(polylines) > 0:
+            process_polylines(
+                conn, script_params, image, polylines, line_width, f,
+                pixels)
+
+    file_ann, fa_message = script_utils.create_link_file_annotation(
+        conn, file_name, image, output="Line Plot csv (Excel) file",
+        mimetype="text/csv", description=None)
+    print(plane_cache.get_cache().report())
+    return file_ann and file_ann.getId(), fa_message
+
+
+def process_images(conn, script_params):
+
     file_anns = []
     message = ""
 
@@ -157,81 +261,15 @@ def process_images(conn, script_params):
         message += "No ROI containing line or polyline was found."
         return None, message
 
-    for image in images:
-
-        c_names = []
-        colors = []
-        for ch in image.getChannels():
-            c_names.append(ch.getLabel())
-            colors.append(ch.getColor().getRGB())
-
-        size_c = image.getSizeC()
-
-        if 'Channels' in script_params:
-            script_params['Channels'] = [i-1 for i in
-                                         script_params['Channels']]
-        else:
-            script_params['Channels'] = range(size_c)
-
-        roi_service = conn.getRoiService()
-        result = roi_service.findByImage(image.getId(), None)
-
-        lines = []
-        polylines = []
-
-        for roi in result.rois:
-            roi_id = roi.getId().getValue()
-            for s in roi.copyShapes():
-                the_t = unwrap(s.getTheT())
-                the_z = unwrap(s.getTheZ())
-                z = 0
-                t = 0
-                if the_t is not None:
-                    t = the_t
-                if the_z is not None:
-                    z = the_z
-                # TODO: Add some filter of shapes e.g. text? / 'lines' only
-                # etc.
-                if type(s) == omero.model.LineI:
-                    x1 = s.getX1().getValue()
-                    x2 = s.getX2().getValue()
-                    y1 = s.getY1().getValue()
-                    y2 = s.getY2().getValue()
-                    lines.append({'id': roi_id, 'theT': t, 'theZ': z,
-                                  'x1': x1, 'y1': y1, 'x2': x2, 'y2': y2})
-
-                elif type(s) == omero.model.PolylineI:
-                    v = s.getPoints().getValue()
-                    points = roi_utils.points_string_to_xy_list(v)
-                    polylines.append({'id': roi_id, 'theT': t, 'theZ': z,
-                                      'points': points})
-
-        if len(lines) == 0 and len(polylines) == 0:
-            continue
-
-        # prepare column headers, including line-id if we are going to output
-        # raw data.
-        line_id = script_params['Sum_or_Average'] == 'Average, with raw data' \
-            and 'Line, ' or ""
-        col_header = 'Image_ID, ROI_ID, Z, T, C, %sLine data %s of Line" \
-            " Width %s\n' % (line_id, script_params['Sum_or_Average'],
-                             script_params['Line_Width'])
-
-        # prepare a csv file to write our data to...
-        file_name = "Plot_Profile_%s.csv" % image.getId()
-        with open(file_name, 'w') as f:
-            f.write(col_header)
-            if len(lines) > 0:
-                process_lines(conn, script_params, image, lines, line_width, f)
-            if len(polylines) > 0:
-                process_polylines(
-                    conn, script_params, image, polylines, line_width, f)
-
-        file_ann, fa_message = script_utils.create_link_file_annotation(
-            conn, file_name, image, output="Line Plot csv (Excel) file",
-            mimetype="text/csv", description=None)
-        if file_ann:
-            file_anns.append(file_ann)
+    # channel indexes from 0, or all channels of each image
+    if 'Channels' in script_params:
+        script_params['Channels'] = [i-1 for i in script_params['Channels']]
+    for file_ann_id, file_message in map_images(
+            conn, process_image, [image.getId() for image in images],
+            script_params):
+        if file_ann_id:
+            file_anns.append(conn.getObject("FileAnnotation", file_ann_id))
+            fa_message = file_message
 
     if not file_anns:
         fa_message = "No Analysis files created. See 'Info' or 'Error' for"\
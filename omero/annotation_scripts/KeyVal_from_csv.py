@@ -30,34 +30,42 @@ from omero.gateway import BlitzGateway
 from omero.rtypes import rstring, rlong
 import omero.scripts as scripts
 from omero.cmd import Delete2
+from omero.script_helpers.annotations import (load_annotations, map_values,
+                                              of_type)
+from omero.script_helpers.hierarchy import resolve_images
+from omero.script_helpers.journal import open_journal
+from omero.script_helpers.lazy import lazy_import
+from omero.script_helpers.progress import Progress
 
 import sys
 import csv
 import copy
 
-from omero.util.populate_roi import DownloadingOriginalFileProvider
+populate_roi = lazy_import("omero.util.populate_roi")
 
-from collections import OrderedDict
 
+def get_map_annotations(obj):
+    """The map annotation dicts of the object, see load_annotations()"""
+    return load_annotations(obj._conn, obj.OMERO_CLASS, [obj.id],
+                            types=("MapAnnotation",))[obj.id]
 
-def get_existing_map_annotations(obj):
-    """Get all Map Annotations linked to the object"""
-    ord_dict = OrderedDict()
-    for ann in obj.listAnnotations():
-        if isinstance(ann, omero.gateway.MapAnnotationWrapper):
-            kvs = ann.getValue()
-            for k, v in kvs:
-                if k not in ord_dict:
-                    ord_dict[k] = set()
-                ord_dict[k].add(v)
-    return ord_dict
 
+def get_existing_map_annotations(obj, annotations=None):
+    """
+    Get all Map Annotations linked to the object
 
-def remove_map_annotations(conn, object):
+    annotations: its annotation dicts, if loaded with others at once
+    """
+    if annotations is None:
+        annotations = get_map_annotations(obj)
+    return map_values(annotations)
+
+
+def remove_map_annotations(conn, object, annotations=None):
     """Remove ALL Map Annotations on the object"""
-    anns = list(object.listAnnotations())
-    mapann_ids = [ann.id for ann in anns
-                  if isinstance(ann, omero.gateway.MapAnnotationWrapper)]
+    if annotations is None:
+        annotations = get_map_annotations(object)
+    mapann_ids = [ann["id"] for ann in of_type(annotations, "MapAnnotation")]
 
     try:
         delete = Delete2(targetObjects={'MapAnnotation': mapann_ids})
@@ -73,18 +81,20 @@ def remove_map_annotations(conn, object):
 def get_original_file(omero_object, file_ann_id=None):
     """Find file linked to object. Option to filter by ID."""
     file_ann = None
-    for ann in omero_object.listAnnotations():
-        if isinstance(ann, omero.gateway.FileAnnotationWrapper):
-            file_name = ann.getFile().getName()
-            # Pick file by Ann ID (or name if ID is None)
-            if (file_ann_id is None and file_name.endswith(".csv")) or (
-                    ann.getId() == file_ann_id):
-                file_ann = ann
+    annotations = load_annotations(
+        omero_object._conn, omero_object.OMERO_CLASS, [omero_object.id],
+        types=("FileAnnotation",))[omero_object.id]
+    for ann in annotations:
+        file_name = ann["file_name"]
+        # Pick file by Ann ID (or name if ID is None)
+        if (file_ann_id is None and file_name.endswith(".csv")) or (
+                ann["id"] == file_ann_id):
+            file_ann = ann
     if file_ann is None:
         sys.stderr.write("Error: File does not exist.\n")
         sys.exit(1)
 
-    return file_ann.getFile()._obj
+    return file_ann["file"]
 
 
 def link_file_ann(conn, object_type, object_id, file_ann_id):
@@ -102,32 +112,31 @@ def link_file_ann(conn, object_type, object_id, file_ann_id):
         omero_object.linkAnnotation(file_ann)
 
 
-def get_children_by_name(omero_obj):
+def get_children_by_name(conn, omero_obj):
 
     images_by_name = {}
     wells_by_name = {}
 
-    if omero_obj.OMERO_CLASS == "Dataset":
-        for img in omero_obj.listChildren():
-            img_name = img.getName()
-            if img_name in images_by_name:
-                sys.stderr.write("File names not unique: {}".format(img_name))
-                sys.exit(1)
-            images_by_name[img_name] = img
-    elif omero_obj.OMERO_CLASS == "Plate":
-        for well in omero_obj.listChildren():
-            label = well.getWellPos()
-            wells_by_name[label] = well
-            for ws in well.listChildren():
-                img = ws.getImage()
-                img_name = img.getName()
-                if img_name in images_by_name:
-                    sys.stderr.write(
-                        "File names not unique: {}".format(img_name))
-                    sys.exit(1)
-                images_by_name[img_name] = img
-    else:
+    if omero_obj.OMERO_CLASS not in ("Dataset", "Plate"):
         sys.stderr.write(f'{omero_obj.OMERO_CLASS} objects not supported')
+        return images_by_name, wells_by_name
+
+    # Image names and Well positions in one query, rather than listing
+    # the children of every Well
+    selection = resolve_images(conn, omero_obj.OMERO_CLASS, [omero_obj.id])
+    images = dict((img.id, img) for img in selection.load_images(conn))
+    for image_id, img_name in zip(selection.image_ids.tolist(),
+                                  selection.names):
+        if image_id not in images:
+            continue
+        if img_name in images_by_name:
+            sys.stderr.write("File names not unique: {}".format(img_name))
+            sys.exit(1)
+        images_by_name[img_name] = images[image_id]
+    if omero_obj.OMERO_CLASS == "Plate":
+        wells = dict((well.id, well) for well in selection.load_wells(conn))
+        for label, well_id in selection.wells_by_label().items():
+            wells_by_name[label] = wells[well_id]
 
     return images_by_name, wells_by_name
 
@@ -139,6 +148,11 @@ def keyval_from_csv(conn, script_params):
     nimg_processed = 0
     nimg_updated = 0
     missing_names = 0
+    # rows annotated, to resume from if the run fails
+    journal = open_journal(conn, "KeyVal_from_csv", script_params)
+    if journal.resumed:
+        print("Resuming: %s row(s) already annotated" % len(journal))
+    progress = Progress(label="rows")
 
     for target_object in conn.getObjects(data_type, ids):
 
@@ -151,7 +165,7 @@ def keyval_from_csv(conn, script_params):
 
         original_file = get_original_file(target_object, file_ann_id)
         print("Original File", original_file.id.val, original_file.name.val)
-        provider = DownloadingOriginalFileProvider(conn)
+        provider = populate_roi.DownloadingOriginalFileProvider(conn)
 
         # read the csv
         temp_file = provider.get_original_file_data(original_file)
@@ -189,8 +203,18 @@ def keyval_from_csv(conn, script_params):
         print("header", header)
 
         # create dictionaries for well/image name:object
-        images_by_name, wells_by_name = get_children_by_name(target_object)
+        images_by_name, wells_by_name = get_children_by_name(
+            conn, target_object)
         nimg_processed += len(images_by_name)
+        # the key-value pairs of all the Images and Wells, in one query each
+        existing = {}
+        for object_type, objects in (("Image", images_by_name),
+                                     ("Well", wells_by_name)):
+            loaded = load_annotations(
+                conn, object_type, [o.id for o in objects.values()],
+                types=("MapAnnotation",))
+            existing.update(((object_type, oid), annotations)
+                            for oid, annotations in loaded.items())
 
         image_index = header.index("image") if "image" in header else -1
         well_index = header.index("well") if "well" in header else -1
@@ -201,9 +225,19 @@ def keyval_from_csv(conn, script_params):
         print("image_index:", image_index, "well_index:", well_index,
               "plate_index:", plate_index)
         rows = data[1:]
+        progress.add_total(sum(1 for row_index in range(len(rows))
+                               if not journal.done((target_object.id,
+                                                    row_index))))
 
         # loop over csv rows...
-        for row in rows:
+        for row_index, row in enumerate(rows):
+            row_unit = (target_object.id, row_index)
+            if journal.done(row_unit):
+                if journal.get(row_unit):
+                    nimg_updated += 1
+                continue
+            # counted as it starts, rows that are skipped below too
+            progress.update()
             # try to find 'image', then 'well', then 'plate'
             image_name = row[image_index]
             well_name = None
@@ -240,21 +274,30 @@ def keyval_from_csv(conn, script_params):
                 continue
 
             cols_to_ignore = [image_index, well_index, plate_index]
-            updated = annotate_object(conn, obj, header, row, cols_to_ignore)
+            # loaded again if another row annotates the object too
+            annotations = existing.pop((obj.OMERO_CLASS, obj.id), None)
+            updated = annotate_object(conn, obj, header, row, cols_to_ignore,
+                                      annotations)
+            journal.record(row_unit, updated)
             if updated:
                 nimg_updated += 1
 
+    journal.finish()
     message = "Added kv pairs to {}/{} files".format(
         nimg_updated, nimg_processed)
     if missing_names > 0:
-        message += f". {missing_names} image names not found."
+        message += f". {missing_names} image names not found"
+    message += ". " + progress.finish()
     return message
 
 
-def annotate_object(conn, obj, header, row, cols_to_ignore):
+def annotate_object(conn, obj, header, row, cols_to_ignore,
+                    annotations=None):
 
     obj_updated = False
-    existing_kv = get_existing_map_annotations(obj)
+    if annotations is None:
+        annotations = get_map_annotations(obj)
+    existing_kv = get_existing_map_annotations(obj, annotations)
     updated_kv = copy.deepcopy(existing_kv)
     print("Existing kv:")
     for k, vset in existing_kv.items():
@@ -278,7 +321,7 @@ def annotate_object(conn, obj, header, row, cols_to_ignore):
     if existing_kv != updated_kv:
         obj_updated = True
         print("The key-values pairs are different")
-        remove_map_annotations(conn, obj)
+        remove_map_annotations(conn, obj, annotations)
         map_ann = omero.gateway.MapAnnotationWrapper(conn)
         namespace = omero.constants.metadata.NSCLIENTMAPANNOTATION
         map_ann.setNs(namespace)
@@ -318,6 +361,11 @@ def run_script():
             "File_Annotation", grouping="3",
             description="File ID containing metadata to populate."),
 
+        scripts.Bool(
+            "Resume_From_Journal", grouping="4", default=False,
+            description="Skip the rows annotated by the last run with the"
+            " same parameters, if it failed"),
+
         authors=["Christian Evenhuis"],
         institutions=["MIF UTS"],
         contact="https://forum.image.sc/tag/omero"
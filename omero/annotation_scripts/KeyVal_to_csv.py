@@ -23,11 +23,11 @@ Created by Christian Evenhuis
 
 """
 
-import omero
 from omero.gateway import BlitzGateway
 from omero.rtypes import rstring, rlong
 import omero.scripts as scripts
 from omero.cmd import Delete2
+from omero.script_helpers.annotations import load_annotations, map_values
 
 import tempfile
 
@@ -36,16 +36,12 @@ import os
 from collections import OrderedDict
 
 
-def get_existing_map_annotions(obj):
-    ord_dict = OrderedDict()
-    for ann in obj.listAnnotations():
-        if(isinstance(ann, omero.gateway.MapAnnotationWrapper)):
-            kvs = ann.getValue()
-            for k, v in kvs:
-                if k not in ord_dict:
-                    ord_dict[k] = set()
-                ord_dict[k].add(v)
-    return ord_dict
+def get_existing_map_annotions(obj, annotations=None):
+    # annotations: the annotation dicts of obj, if loaded with others
+    if annotations is None:
+        annotations = load_annotations(obj._conn, obj.OMERO_CLASS, [obj.id],
+                                       types=("MapAnnotation",))[obj.id]
+    return map_values(annotations)
 
 
 def attach_csv_file(conn, obj, data):
@@ -145,37 +141,44 @@ def run_script():
         print(ids)
         print("datasets:")
         print(datasets)
+        # the files of all the datasets at once
+        files = load_annotations(conn, data_type, [ds.id for ds in datasets],
+                                 types=("FileAnnotation",))
         for ds in datasets:
             # name of the file
             csv_name = "{}_metadata_out.csv".format(ds.getName())
             print(csv_name)
 
             # remove the csv if it exists
-            for ann in ds.listAnnotations():
-                if(isinstance(ann, omero.gateway.FileAnnotationWrapper)):
-                    if(ann.getFileName() == csv_name):
-                        # if the name matches delete it
-                        try:
-                            delete = Delete2(
-                                targetObjects={'FileAnnotation':
-                                               [ann.getId()]})
-                            handle = conn.c.sf.submit(delete)
-                            conn.c.waitOnCmd(
-                                handle, loops=10,
-                                ms=500, failonerror=True,
-                                failontimeout=False, closehandle=False)
-                            print("Deleted existing csv")
-                        except Exception as ex:
-                            print("Failed to delete existing csv: {}".format(
-                                ex.message))
-                else:
-                    print("No exisiting file")
+            for ann in files[ds.id]:
+                if(ann["file_name"] == csv_name):
+                    # if the name matches delete it
+                    try:
+                        delete = Delete2(
+                            targetObjects={'FileAnnotation': [ann["id"]]})
+                        handle = conn.c.sf.submit(delete)
+                        conn.c.waitOnCmd(
+                            handle, loops=10,
+                            ms=500, failonerror=True,
+                            failontimeout=False, closehandle=False)
+                        print("Deleted existing csv")
+                    except Exception as ex:
+                        print("Failed to delete existing csv: {}".format(
+                            ex.message))
+            if not files[ds.id]:
+                print("No exisiting file")
 
             # assemble the metadata into an OrderedDict
             kv_dict = OrderedDict()
-            for img in ds.listChildren():
+            images = list(ds.listChildren())
+            # the key-value pairs of all the images in one query
+            annotations = load_annotations(
+                conn, "Image", [img.id for img in images],
+                types=("MapAnnotation",))
+            for img in images:
                 fn = img.getName()
-                kv_dict[fn] = get_existing_map_annotions(img)
+                kv_dict[fn] = get_existing_map_annotions(
+                    img, annotations[img.id])
 
             # attach the data
             mess = attach_csv_file(conn, ds, kv_dict)
@@ -30,15 +30,16 @@ from omero.gateway import BlitzGateway
 from omero.rtypes import rstring, rlong
 import omero.scripts as scripts
 from omero.cmd import Delete2
+from omero.script_helpers.lazy import lazy_import
 
 import sys
 import csv
 import copy
 
-from omero.util.populate_roi import DownloadingOriginalFileProvider
-
 from collections import OrderedDict
 
+populate_roi = lazy_import("omero.util.populate_roi")
+
 
 def get_existing_map_annotations(obj):
     """Get all Map Annotations linked to the object"""
@@ -169,7 +170,7 @@ def keyval_from_csv(conn, script_params):
 
         original_file = get_original_file(target_object, file_ann_id)
         print("Original File", original_file.id.val, original_file.name.val)
-        provider = DownloadingOriginalFileProvider(conn)
+        provider = populate_roi.DownloadingOriginalFileProvider(conn)
 
         # read the csv
         temp_file = provider.get_original_file_data(original_file)
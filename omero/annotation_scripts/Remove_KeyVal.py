@@ -27,15 +27,36 @@ Created by Christian Evenhuis
 """
 
 from omero.gateway import BlitzGateway
-import omero
 from omero.rtypes import rlong, rstring, wrap
 import omero.scripts as scripts
+from omero.script_helpers.annotations import load_annotations
+from omero.script_helpers.hierarchy import resolve_images
 
 
-def remove_map_annotations(conn, obj):
-    anns = list(obj.listAnnotations())
-    mapann_ids = [ann.id for ann in anns
-                  if isinstance(ann, omero.gateway.MapAnnotationWrapper)]
+def get_map_annotations(conn, objs):
+    """
+    The map annotations of objs, loaded with one query per object type
+    @param conn:             Blitz Gateway connection wrapper
+    @param objs:             The objects, e.g. from get_objects()
+    @return:                 Dict of (type, id): list of annotation dicts
+    """
+    ids_by_type = {}
+    for obj in objs:
+        ids_by_type.setdefault(obj.OMERO_CLASS, []).append(obj.id)
+    annotations = {}
+    for object_type, ids in ids_by_type.items():
+        loaded = load_annotations(conn, object_type, ids,
+                                  types=("MapAnnotation",))
+        annotations.update(((object_type, oid), anns)
+                           for oid, anns in loaded.items())
+    return annotations
+
+
+def remove_map_annotations(conn, obj, annotations=None):
+    if annotations is None:
+        annotations = get_map_annotations(conn, [obj])[
+            obj.OMERO_CLASS, obj.id]
+    mapann_ids = [ann["id"] for ann in annotations]
     if len(mapann_ids) == 0:
         return 0
 
@@ -73,17 +94,18 @@ def get_objects(conn, script_params):
         for ds in objs:
             print("Processing Images from Dataset: {}".format(ds.getName()))
             objs_ret.append(ds)
-            imgs = list(ds.listChildren())
-            objs_ret.extend(imgs)
+        # one query for the Images of all Datasets
+        selection = resolve_images(conn, data_type, [ds.id for ds in objs])
+        objs_ret.extend(selection.load_images(conn))
     elif data_type == "Plate":
         for plate in objs:
             print("Processing Wells and Images from Plate:", plate.getName())
             objs_ret.append(plate)
-            for well in plate.listChildren():
-                objs_ret.append(well)
-                for ws in well.listChildren():
-                    img = ws.getImage()
-                    objs_ret.append(img)
+        # one query for the Wells and Images of all Plates, not one per Well
+        selection = resolve_images(conn, data_type,
+                                   [plate.id for plate in objs])
+        objs_ret.extend(selection.load_wells(conn))
+        objs_ret.extend(selection.load_images(conn))
     else:
         print("Processing Images identified by ID")
         objs_ret = objs
@@ -137,11 +159,13 @@ if __name__ == "__main__":
 
         # do the editing...
         objs = get_objects(conn, script_params)
+        annotations = get_map_annotations(conn, objs)
 
         nfailed = 0
         for obj in objs:
             print("Processing object:", obj)
-            ret = remove_map_annotations(conn, obj)
+            ret = remove_map_annotations(
+                conn, obj, annotations[obj.OMERO_CLASS, obj.id])
             nfailed = nfailed + ret
 
         # now handle the result, displaying message and returning image if
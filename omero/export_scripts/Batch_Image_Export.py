@@ -31,20 +31,43 @@ zip file for download.
 
 import omero.scripts as scripts
 from omero.gateway import BlitzGateway
-import omero.util.script_utils as script_utils
 import omero
 from omero.rtypes import rstring, rlong, robject
 from omero.constants.namespaces import NSCREATED, NSOMETIFF
+from omero.constants.projection import ProjectionType
+from omero.script_helpers.render_pool import (RenderingEnginePool,
+                                              get_rendering_models)
+from omero.script_helpers.instrumentation import get_timings, watch_calls
+from omero.script_helpers.journal import open_journal
+from omero.script_helpers.lazy import lazy_import
+from omero.script_helpers.local_render import (LocalRenderingEngine,
+                                               get_rendering_def_id,
+                                               load_settings,
+                                               local_rendering)
+from omero.script_helpers.planner import (DRY_RUN_PARAM, IN_MEMORY,
+                                          STREAMING, TILED, Plan,
+                                          bytes_per_pixel, choose_mode,
+                                          pool_planes, tile_count)
+from omero.script_helpers.progress import Progress
+from omero.script_helpers.tiles import (level_for_size, resolution_sizes,
+                                        set_level, tile_grid)
 import os
+import io
 
 import glob
 import zipfile
 from datetime import datetime
 
-try:
-    from PIL import Image  # see ticket:2597
-except ImportError:
-    import Image
+script_utils = lazy_import("omero.util.script_utils")
+Image = lazy_import("PIL.Image")
+
+# Choose_Z_Section options that project the Z range
+PROJECTIONS = {'Max projection': ProjectionType.MAXIMUMINTENSITY,
+               'Mean projection': ProjectionType.MEANINTENSITY,
+               'Sum projection': ProjectionType.SUMINTENSITY}
+
+# bytes of the OME-TIFF downloaded at a time
+OME_TIFF_BUFFER = 65536
 
 # keep track of log strings.
 log_strings = []
@@ -80,21 +103,85 @@ def compress(target, base):
         zip_file.close()
 
 
-def save_plane(image, format, c_name, z_range, project_z, t=0, channel=None,
-               greyscale=False, zoom_percent=None, folder_name=None):
+def render_plane(re, pixels_id, size_c, z_range, projection=None, t=0,
+                 channel=None, model=None, z_step=1, level=None):
     """
-    Renders and saves an image to disk.
+    Renders a plane, on a rendering engine set up for the image with its
+    saved settings. Run as a job of a RenderingEnginePool.
 
-    @param image:           The image to render
-    @param format:          The format to save as
-    @param c_name:          The name to use
+    @param re:              The rendering engine
+    @param pixels_id:       The ID of the image's pixels
+    @param size_c:          Number of channels of the image
     @param z_range:         Tuple of (zIndex,) OR (zStart, zStop) for
                             projection
+    @param projection:      ProjectionType to project z_range with, or
+                            None
     @param t:               T index
     @param channel:         Active channel index. If None, use current
                             rendering settings
-    @param greyscale:       If true, all visible channels will be
+    @param model:           Rendering model to use with channel, e.g.
                             greyscale
+    @param z_step:          Project every z_step-th Z section
+    @param level:           Resolution level of a 'Big' image to render
+                            tile by tile, 0 is the full resolution. If
+                            None, render the plane in one go
+    @return:                The rendered plane as a PIL Image
+    """
+
+    # if channel == None: use current rendering settings
+    if channel is not None:
+        for c in range(size_c):
+            re.setActive(c, c == channel)
+        if model is not None:
+            re.setModel(model)
+
+    # All Z and T indices in this script are 1-based, but the rendering
+    # engine uses 0-based.
+    if level is not None:
+        return render_tiled_plane(re, z_range[0]-1, t-1, level)
+    if projection is not None and len(z_range) > 1:
+        # zStop is exclusive, the end of the projection inclusive
+        jpeg = re.renderProjectedCompressed(
+            projection, t-1, z_step, z_range[0]-1, z_range[1]-2)
+    else:
+        plane_def = omero.romio.PlaneDef()
+        plane_def.z = z_range[0]-1
+        plane_def.t = t-1
+        jpeg = re.renderCompressed(plane_def)
+    return Image.open(io.BytesIO(jpeg))
+
+
+def render_tiled_plane(re, z, t, level):
+    """
+    Renders plane z, t of a 'Big' image at a resolution level, one tile of
+    the server's tile size at a time, into a single PIL Image.
+    """
+    set_level(re, level)
+    size_x, size_y = resolution_sizes(re)[level]
+    tile_width, tile_height = re.getTileSize()
+    plane = Image.new("RGB", (size_x, size_y))
+    for x, y, w, h in tile_grid(size_x, size_y, tile_width, tile_height):
+        plane_def = omero.romio.PlaneDef()
+        plane_def.z = z
+        plane_def.t = t
+        plane_def.region = omero.romio.RegionDef(x, y, w, h)
+        tile = Image.open(io.BytesIO(re.renderCompressed(plane_def)))
+        plane.paste(tile, (x, y))
+    return plane
+
+
+def save_plane(image, plane, format, c_name, z_range, t=0,
+               zoom_percent=None, folder_name=None):
+    """
+    Saves a rendered plane to disk.
+
+    @param image:           The image the plane was rendered from
+    @param plane:           The rendered plane, a PIL Image
+    @param format:          The format to save as
+    @param c_name:          The name to use
+    @param z_range:         Tuple of (zIndex,) OR (zStart, zStop) for
+                            projection
+    @param t:               T index
     @param zoom_percent:    Resize image by this percent if specified
     @param folder_name:     Indicate where to save the plane
     """
@@ -103,24 +190,9 @@ def save_plane(image, format, c_name, z_range, project_z, t=0, channel=None,
     log("")
     log("save_plane..")
     log("channel: %s" % c_name)
-    log("z: %s" % z_range)
+    log("z: %s" % (z_range,))
     log("t: %s" % t)
 
-    # if channel == None: use current rendering settings
-    if channel is not None:
-        image.setActiveChannels([channel+1])    # use 1-based Channel indices
-        if greyscale:
-            image.setGreyscaleRenderingModel()
-        else:
-            image.setColorRenderingModel()
-    if project_z:
-        # imageWrapper only supports projection of full Z range (can't
-        # specify)
-        image.setProjection('intmax')
-
-    # All Z and T indices in this script are 1-based, but this method uses
-    # 0-based.
-    plane = image.renderImage(z_range[0]-1, t-1)
     if zoom_percent:
         w, h = plane.size
         fraction = (float(zoom_percent) / 100)
@@ -185,16 +257,18 @@ def save_as_ome_tiff(conn, image, folder_name=None):
         i += 1
 
     log("  Saving file as: %s" % img_name)
-    file_size, block_gen = image.exportOmeTiff(bufsize=65536)
-    with open(str(img_name), "wb") as f:
+    file_size, block_gen = image.exportOmeTiff(bufsize=OME_TIFF_BUFFER)
+    with get_timings().phase("export OME-TIFF"), \
+            open(str(img_name), "wb") as f:
         for piece in block_gen:
             f.write(piece)
 
 
 def save_planes_for_image(conn, image, size_c, split_cs, merged_cs,
                           channel_names=None, z_range=None, t_range=None,
-                          greyscale=False, zoom_percent=None, project_z=False,
-                          format="PNG", folder_name=None):
+                          greyscale=False, zoom_percent=None, projection=None,
+                          format="PNG", folder_name=None, z_step=1,
+                          level=None, local=True):
     """
     Saves all the required planes for a single image, either as individual
     planes or projection.
@@ -209,7 +283,13 @@ def save_planes_for_image(conn, image, size_c, split_cs, merged_cs,
     @param greyscale:           If true, all visible channels will be
                                 greyscale
     @param zoomPercent:         Resize image by this percent if specified.
-    @param projectZ:            If true, project over Z range.
+    @param projection:          ProjectionType to project the Z range with,
+                                or None
+    @param z_step:              Project every z_step-th Z section
+    @param level:               Resolution level to render a 'Big' image
+                                at, tile by tile. None for other images
+    @param local:               If False, render on the server even when
+                                the planes could be rendered locally
     """
 
     channels = []
@@ -220,16 +300,6 @@ def save_planes_for_image(conn, image, size_c, split_cs, merged_cs,
         for i in range(size_c):
             channels.append(i)
 
-    # set up rendering engine with the pixels
-    """
-    renderingEngine.lookupPixels(pixelsId)
-    if not renderingEngine.lookupRenderingDef(pixelsId):
-        renderingEngine.resetDefaults()
-    if not renderingEngine.lookupRenderingDef(pixelsId):
-        raise "Failed to lookup Rendering Def"
-    renderingEngine.load()
-    """
-
     if t_range is None:
         # use 1-based indices throughout script
         t_indexes = [image.getDefaultT()+1]
@@ -239,6 +309,8 @@ def save_planes_for_image(conn, image, size_c, split_cs, merged_cs,
         else:
             t_indexes = [t_range[0]]
 
+    # list the planes to save, as (c_name, z_range, t, channel, greyscale)
+    planes = []
     c_name = 'merged'
     for c in channels:
         if c is not None:
@@ -253,19 +325,61 @@ def save_planes_for_image(conn, image, size_c, split_cs, merged_cs,
         for t in t_indexes:
             if z_range is None:
                 default_z = image.getDefaultZ()+1
-                save_plane(image, format, c_name, (default_z,), project_z, t,
-                           c, g_scale, zoom_percent, folder_name)
-            elif project_z:
-                save_plane(image, format, c_name, z_range, project_z, t, c,
-                           g_scale, zoom_percent, folder_name)
+                planes.append((c_name, (default_z,), t, c, g_scale))
+            elif projection is not None:
+                planes.append((c_name, z_range, t, c, g_scale))
             else:
                 if len(z_range) > 1:
                     for z in range(z_range[0], z_range[1]):
-                        save_plane(image, format, c_name, (z,), project_z, t,
-                                   c, g_scale, zoom_percent, folder_name)
+                        planes.append((c_name, (z,), t, c, g_scale))
                 else:
-                    save_plane(image, format, c_name, z_range, project_z, t,
-                               c, g_scale, zoom_percent, folder_name)
+                    planes.append((c_name, z_range, t, c, g_scale))
+
+    # render concurrently, save in order. Rendering is timed as the wait
+    # for the next rendered plane, so the phases add up to the wall time.
+    timings = get_timings()
+    pixels_id = image.getPrimaryPixels().getId()
+    with RenderingEnginePool(conn, compression=0.9) as pool:
+        models = {}
+        if split_cs:
+            models = pool.submit(get_rendering_models, pixels_id).result()
+
+        settings = None
+        if level is None and local and local_rendering():
+            settings = load_settings(conn, pool.submit(
+                get_rendering_def_id, pixels_id).result())
+        if settings is not None:
+            # render from the raw planes, downloading each plane once for
+            # all the channels and the merged image that show it
+            planes.sort(key=lambda plane: (plane[2], plane[1]))
+            with LocalRenderingEngine(conn, settings) as engine:
+                for c_name, z, t, c, g_scale in planes:
+                    with timings.phase("render"):
+                        engine.load()
+                        plane = render_plane(
+                            engine, pixels_id, size_c, z, projection, t, c,
+                            models.get(g_scale and 'greyscale' or 'rgb'),
+                            z_step)
+                    with timings.phase("write to disk"):
+                        save_plane(image, plane, format, c_name, z, t,
+                                   zoom_percent, folder_name)
+                    timings.count("planes saved")
+            return
+
+        def render(re, pixels_id, plane):
+            c_name, z, t, c, g_scale = plane
+            model = models.get(g_scale and 'greyscale' or 'rgb')
+            return render_plane(re, pixels_id, size_c, z, projection, t, c,
+                                model, z_step, level)
+
+        rendered = pool.imap(render, [pixels_id] * len(planes), planes)
+        for c_name, z, t, c, g_scale in planes:
+            with timings.phase("render"):
+                plane = next(rendered)
+            with timings.phase("write to disk"):
+                save_plane(image, plane, format, c_name, z, t, zoom_percent,
+                           folder_name)
+            timings.count("planes saved")
 
 
 def batch_image_export(conn, script_params):
@@ -278,8 +392,8 @@ def batch_image_export(conn, script_params):
     folder_name = script_params["Folder_Name"]
     folder_name = os.path.basename(folder_name)
     format = script_params["Format"]
-    project_z = "Choose_Z_Section" in script_params and \
-        script_params["Choose_Z_Section"] == 'Max projection'
+    projection = PROJECTIONS.get(script_params.get("Choose_Z_Section"))
+    z_step = script_params.get("Z_Step", 1)
 
     if (not split_cs) and (not merged_cs):
         log("Not chosen to save Individual Channels OR Merged Image")
@@ -299,14 +413,17 @@ def batch_image_export(conn, script_params):
         if "Choose_Z_Section" in script_params:
             z_choice = script_params["Choose_Z_Section"]
             # NB: all Z indices in this script are 1-based
-            if z_choice == 'ALL Z planes':
+            z_start_end = "OR_specify_Z_start_AND..." in script_params and \
+                "...specify_Z_end" in script_params
+            if z_choice == 'ALL Z planes' or (
+                    z_choice in PROJECTIONS and not z_start_end):
                 z_range = (1, size_z+1)
-            elif "OR_specify_Z_index" in script_params:
+            elif "OR_specify_Z_index" in script_params and \
+                    not (z_choice in PROJECTIONS and z_start_end):
                 z_index = script_params["OR_specify_Z_index"]
                 z_index = min(z_index, size_z)
                 z_range = (z_index,)
-            elif "OR_specify_Z_start_AND..." in script_params and \
-                    "...specify_Z_end" in script_params:
+            elif z_start_end:
                 start = script_params["OR_specify_Z_start_AND..."]
                 start = min(start, size_z)
                 end = script_params["...specify_Z_end"]
@@ -368,55 +485,163 @@ def batch_image_export(conn, script_params):
 
     log("Processing %s images" % len(images))
 
-    # somewhere to put images
-    curr_dir = os.getcwd()
-    exp_dir = os.path.join(curr_dir, folder_name)
-    try:
-        os.mkdir(exp_dir)
-    except OSError:
-        pass
     # max size (default 12kx12k)
     size = conn.getDownloadAsMaxSizeSetting()
     size = int(size)
+    plan = Plan()
+
+    def plan_image(img):
+        """
+        Adds the export of img to the plan. Returns how to export it, as
+        (mode, level, projection, z_range, t_range), or None if it can't
+        be exported.
+        """
+        name = "image %s" % img.id
+        size_x = img.getSizeX()
+        size_y = img.getSizeY()
+        size_c = img.getSizeC()
+        size_z = img.getSizeZ()
+        size_t = img.getSizeT()
+        raw_plane = size_x * size_y * bytes_per_pixel(img.getPixelsType())
+
+        if format == 'OME-TIFF':
+            re = img._prepareRE()
+            try:
+                big = re.requiresPixelsPyramid()
+            finally:
+                re.close()
+            if big:
+                plan.skip(name, "Can't export a 'Big' image to %s." % format)
+                return None
+            planes = size_z * size_c * size_t
+            plan.add(name, STREAMING, planes=planes,
+                     bytes_down=planes * raw_plane, files=1,
+                     memory=OME_TIFF_BUFFER)
+            return STREAMING, None, None, None, None
+
+        z_range = get_z_range(size_z, script_params)
+        t_range = get_t_range(size_t, script_params)
+        image_projection = projection
+        n_t = t_range[1] - t_range[0] if t_range and len(t_range) > 1 else 1
+        z_read = [1]
+        if z_range is not None and len(z_range) > 1:
+            z_read = range(z_range[0], z_range[1])
+        n_z = len(z_read)
+        if projection is not None:
+            z_read = z_read[::z_step]
+            n_z = 1
+        outputs = ((1 if merged_cs else 0) + (size_c if split_cs else 0)) \
+            * n_t * n_z
+
+        # locally: the raw planes of all channels and the rendered plane,
+        # on the server: the rendered planes in flight
+        rgb = size_x * size_y * 3
+        local = size_c * raw_plane + rgb if local_rendering() else None
+        mode = choose_mode(local, pool_planes() * rgb, plan.budget)
+        level = None
+        tiles = 0
+        if size_x * size_y > size or mode == TILED:
+            # 'Big' images are exported at the most detailed resolution
+            # level within the size limit and the memory budget
+            re = img._prepareRE()
+            try:
+                if re.requiresPixelsPyramid():
+                    sizes = resolution_sizes(re)
+                    level = level_for_size(sizes, min(
+                        size, plan.budget // (3 * pool_planes())))
+                    tile_width, tile_height = re.getTileSize()
+            finally:
+                re.close()
+            if level is not None:
+                mode = TILED
+                size_x, size_y = sizes[level]
+                rgb = size_x * size_y * 3
+                tiles = outputs * tile_count(size_x, size_y, tile_width,
+                                             tile_height)
+                image_projection = None
+            elif size_x * size_y > size:
+                plan.skip(name, "Can't export image over %s pixels. "
+                          "See 'omero.client.download_as.max_size'" % size)
+                return None
+            else:
+                # planes of other images can only be rendered whole
+                mode = STREAMING
+
+        zoom = float(zoom_percent or 100) / 100
+        if mode == IN_MEMORY:
+            planes = n_t * len(z_read) * size_c
+            plan.add(name, mode, planes=planes, bytes_down=planes * raw_plane,
+                     bytes_up=int(outputs * rgb * zoom * zoom),
+                     memory=local, files=outputs)
+        else:
+            plan.add(name, mode, planes=outputs, tiles=tiles,
+                     bytes_down=outputs * rgb,
+                     bytes_up=int(outputs * rgb * zoom * zoom),
+                     memory=pool_planes() * rgb, files=outputs)
+        return mode, level, image_projection, z_range, t_range
 
+    exports = {}
     ids = []
-    # do the saving to disk
+    for img in images:
+        pixels_id = img.getPrimaryPixels().getId()
+        if pixels_id in ids:
+            continue
+        ids.append(pixels_id)
+        exports[img.id] = plan_image(img)
+    for name, reason in plan.skipped:
+        log("  ** %s: %s **" % (name, reason))
+    log(plan.report())
+    if len(images) == 1 and plan.skipped:
+        return None, plan.skipped[0][1]
+    if script_params.get(DRY_RUN_PARAM):
+        return None, message + plan.report()
+
+    # somewhere to put images, kept with the journal of exported images
+    # until the export completes
+    journal = open_journal(conn, "Batch_Image_Export", script_params)
+    exp_dir = os.path.join(journal.directory, folder_name)
+    try:
+        os.mkdir(exp_dir)
+    except OSError:
+        pass
+    if not journal.shared:
+        log("Another export with the same parameters is running: "
+            "exporting to a directory of this run's own")
+    if journal.resumed:
+        log("Resuming: %s image(s) already exported" % len(journal))
+        # drop the files of an image whose export was interrupted
+        exported = set(name for names in journal.values() for name in names)
+        for name in os.listdir(exp_dir):
+            if name not in exported and name != 'Batch_Image_Export.txt':
+                os.remove(os.path.join(exp_dir, name))
 
+    # do the saving to disk
+    progress = Progress(sum(1 for img in images if exports.get(img.id) and
+                            not journal.done(img.id)), "images")
     for img in images:
+        if not exports.get(img.id):
+            continue
         log("Processing image: ID %s: %s" % (img.id, img.getName()))
-        pixels = img.getPrimaryPixels()
-        if (pixels.getId() in ids):
+        if journal.done(img.id):
+            log("  Already exported")
             continue
-        ids.append(pixels.getId())
+        before = set(os.listdir(exp_dir))
+        mode, level, image_projection, z_range, t_range = exports[img.id]
 
         if format == 'OME-TIFF':
-            if img._prepareRE().requiresPixelsPyramid():
-                log("  ** Can't export a 'Big' image to OME-TIFF. **")
-                if len(images) == 1:
-                    return None, "Can't export a 'Big' image to %s." % format
-                continue
-            else:
-                save_as_ome_tiff(conn, img, folder_name)
+            save_as_ome_tiff(conn, img, exp_dir)
         else:
-            size_x = pixels.getSizeX()
-            size_y = pixels.getSizeY()
-            if size_x*size_y > size:
-                msg = "Can't export image over %s pixels. " \
-                      "See 'omero.client.download_as.max_size'" % size
-                log("  ** %s. **" % msg)
-                if len(images) == 1:
-                    return None, msg
-                continue
-            else:
-                log("Exporting image as %s: %s" % (format, img.getName()))
+            if level is not None:
+                log("  Exporting resolution level %d of 'Big' image, "
+                    "under %s pixels" % (level, size))
+                if projection is not None:
+                    log("  ** Can't project a 'Big' image, exporting "
+                        "planes. **")
+            log("Exporting image as %s: %s" % (format, img.getName()))
 
             log("\n----------- Saving planes from image: '%s' ------------"
                 % img.getName())
             size_c = img.getSizeC()
-            size_z = img.getSizeZ()
-            size_t = img.getSizeT()
-            z_range = get_z_range(size_z, script_params)
-            t_range = get_t_range(size_t, script_params)
             log("Using:")
             if z_range is None:
                 log("  Z-index: Last-viewed")
@@ -424,8 +649,9 @@ def batch_image_export(conn, script_params):
                 log("  Z-index: %d" % z_range[0])
             else:
                 log("  Z-range: %s-%s" % (z_range[0], z_range[1]-1))
-            if project_z:
-                log("  Z-projection: ON")
+            if image_projection is not None:
+                log("  Z-projection: %s, every %d Z-section(s)"
+                    % (script_params["Choose_Z_Section"], z_step))
             if t_range is None:
                 log("  T-index: Last-viewed")
             elif len(t_range) == 1:
@@ -447,8 +673,10 @@ def batch_image_export(conn, script_params):
                 save_planes_for_image(conn, img, size_c, split_cs, merged_cs,
                                       channel_names, z_range, t_range,
                                       greyscale, zoom_percent,
-                                      project_z=project_z, format=format,
-                                      folder_name=folder_name)
+                                      projection=image_projection,
+                                      format=format, folder_name=exp_dir,
+                                      z_step=z_step, level=level,
+                                      local=mode == IN_MEMORY)
             finally:
                 # Make sure we close Rendering Engine
                 img._re.close()
@@ -459,28 +687,39 @@ def batch_image_export(conn, script_params):
             for s in log_strings:
                 log_file.write(s)
                 log_file.write("\n")
+        new_files = sorted(set(os.listdir(exp_dir)) - before - set([name]))
+        journal.record(img.id, new_files)
+        progress.update(nbytes=sum(
+            os.path.getsize(os.path.join(exp_dir, f)) for f in new_files))
+    summary = progress.finish()
 
     if len(os.listdir(exp_dir)) == 0:
+        journal.finish()
         return None, "No files exported. See 'info' for more details"
     # zip everything up (unless we've only got a single ome-tiff)
     if format == 'OME-TIFF' and len(os.listdir(exp_dir)) == 1:
         ometiff_ids = [t.id for t in parent.listAnnotations(ns=NSOMETIFF)]
         conn.deleteObjects("Annotation", ometiff_ids)
-        export_file = os.path.join(folder_name, os.listdir(exp_dir)[0])
+        export_file = os.path.join(exp_dir, os.listdir(exp_dir)[0])
         namespace = NSOMETIFF
         output_display_name = "OME-TIFF"
         mimetype = 'image/tiff'
     else:
         export_file = "%s.zip" % folder_name
-        compress(export_file, folder_name)
+        with get_timings().phase("zip"):
+            compress(export_file, exp_dir)
         mimetype = 'application/zip'
         output_display_name = "Batch export zip"
         namespace = NSCREATED + "/omero/export_scripts/Batch_Image_Export"
 
-    file_annotation, ann_message = script_utils.create_link_file_annotation(
-        conn, export_file, parent, output=output_display_name,
-        namespace=namespace, mimetype=mimetype)
-    message += ann_message
+    with get_timings().phase("upload"):
+        file_annotation, ann_message = \
+            script_utils.create_link_file_annotation(
+                conn, export_file, parent, output=output_display_name,
+                namespace=namespace, mimetype=mimetype)
+    message += ann_message + " " + summary
+    get_timings().attach_json(conn, parent)
+    journal.finish()
     return file_annotation, message
 
 
@@ -496,8 +735,9 @@ def run_script():
     default_z_option = 'Default-Z (last-viewed)'
     z_choices = [rstring(default_z_option),
                  rstring('ALL Z planes'),
-                 # currently ImageWrapper only allows full Z-stack projection
                  rstring('Max projection'),
+                 rstring('Mean projection'),
+                 rstring('Sum projection'),
                  rstring('Other (see below)')]
     default_t_option = 'Default-T (last-viewed)'
     t_choices = [rstring(default_t_option),
@@ -557,6 +797,11 @@ See http://help.openmicroscopy.org/export.html#batch""",
             "...specify_Z_end", grouping="5.3",
             description="Choose a specific Z-index to export", min=1),
 
+        scripts.Int(
+            "Z_Step", grouping="5.4",
+            description="Project every Nth Z-section of the range",
+            min=1, default=1),
+
         scripts.String(
             "Choose_T_Section", grouping="6",
             description="Default T is last viewed T for each image, OR choose"
@@ -589,6 +834,16 @@ See http://help.openmicroscopy.org/export.html#batch""",
             description="Name of folder (and zip file) to store images",
             default='Batch_Image_Export'),
 
+        scripts.Bool(
+            "Resume_From_Journal", grouping="10", default=False,
+            description="Skip the images exported by the last run with the"
+            " same parameters, if it failed"),
+
+        scripts.Bool(
+            "Dry_Run", grouping="11", default=False,
+            description="Only report the planes, bytes, memory and files"
+            " the export needs, without exporting"),
+
         version="4.3.0",
         authors=["William Moore", "OME Team"],
         institutions=["University of Dundee"],
@@ -600,6 +855,7 @@ See http://help.openmicroscopy.org/export.html#batch""",
         script_params = {}
 
         conn = BlitzGateway(client_obj=client)
+        watch_calls(conn)
 
         script_params = client.getInputs(unwrap=True)
         for key, value in script_params.items():
@@ -613,6 +869,7 @@ See http://help.openmicroscopy.org/export.html#batch""",
 
         # return this fileAnnotation to the client.
         client.setOutput("Message", rstring(message))
+        get_timings().set_output(client)
         if file_annotation is not None:
             client.setOutput("File_Annotation",
                              robject(file_annotation._obj))
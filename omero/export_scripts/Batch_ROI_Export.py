@@ -24,14 +24,20 @@
 
 import omero.scripts as scripts
 from omero.gateway import BlitzGateway
-from omero.rtypes import rlong, rint, rstring, robject, unwrap
-from omero.model import RectangleI, EllipseI, LineI, PolygonI, PolylineI, \
-    MaskI, LabelI, PointI
-from math import sqrt, pi
-import re
+from omero.rtypes import rlong, rint, rstring, robject
+from omero.script_helpers.instrumentation import get_timings, watch_calls
+from omero.script_helpers.rasterize import (
+    MaskCache, load_mask_bytes, local_stats, shape_box, shape_stats,
+    union_box)
+from omero.script_helpers.shape_index import UNSET, ShapeIndex
+from omero.script_helpers.tiles import TileReader
+import math
 
 DEFAULT_FILE_NAME = "Batch_ROI_Export.csv"
-INSIGHT_POINT_LIST_RE = re.compile(r'points\[([^\]]+)\]')
+
+# the shapes of a plane are measured in one region up to this size, else
+# each in its own box
+MAX_REGION_PIXELS = 4096 * 4096
 
 
 def log(data):
@@ -39,8 +45,56 @@ def log(data):
     print(data)
 
 
-def get_export_data(conn, script_params, image, units=None):
-    """Get pixel data for shapes on image and returns list of dicts."""
+def get_local_stats(conn, image, shapes, plane_shapes, ch_indexes,
+                    masks=None):
+    """
+    Measure the shapes on each plane from one read of the region around
+    them, instead of asking the server for each plane.
+
+    :param shapes:          ShapeIndex of the shapes of image
+    :param plane_shapes:    Dict of (z, t): indexes of the shapes on it
+    :param masks:           MaskCache. Default: a new one
+    :return:                Dict of (shape ID, z, t): ShapeStats
+    """
+    if masks is None:
+        masks = MaskCache()
+    size_x, size_y = image.getSizeX(), image.getSizeY()
+    boxes = [shape_box(shapes, i, size_x, size_y) for i in range(len(shapes))]
+    shape_ids = shapes.column("id")
+    mask_bytes = {}
+    if shapes.is_type("Mask").any():
+        mask_bytes = load_mask_bytes(conn, shapes.of_type("Mask").column("id"))
+    stats = {}
+    with TileReader(conn, image.getPrimaryPixels()) as reader:
+        for (z, t), indexes in plane_shapes.items():
+            region = union_box([boxes[i] for i in indexes])
+            whole = region[2] * region[3] <= MAX_REGION_PIXELS
+            if whole:
+                data = [reader.read_region(z, c, t, region)
+                        for c in ch_indexes]
+            for i in indexes:
+                x, y, w, h = boxes[i]
+                if whole:
+                    x, y = x - region[0], y - region[1]
+                    planes = [d[y:y + h, x:x + w] for d in data]
+                else:
+                    planes = [reader.read_region(z, c, t, boxes[i])
+                              for c in ch_indexes]
+                mask = masks.mask(shapes, i, boxes[i], mask_bytes)
+                stats[shape_ids[i], z, t] = shape_stats(
+                    shape_ids[i], ch_indexes, planes, mask)
+    return stats
+
+
+def get_export_data(conn, script_params, image, units=None, shapes=None,
+                    masks=None):
+    """
+    Get pixel data for shapes on image and returns list of dicts.
+
+    :param shapes:  ShapeIndex with the shapes of image, e.g. of all the
+                    images exported. Default: loaded for image
+    :param masks:   MaskCache for the shapes measured locally
+    """
     log("Image ID %s..." % image.id)
 
     # Get pixel size in SAME units for all images
@@ -52,7 +106,6 @@ def get_export_data(conn, script_params, image, units=None):
         pixel_size_y = image.getPixelSizeY(units=units)
         pixel_size_y = pixel_size_y.getValue() if pixel_size_y else None
 
-    roi_service = conn.getRoiService()
     all_planes = script_params["Export_All_Planes"]
     include_points = script_params.get("Include_Points_Coords", False)
     size_c = image.getSizeC()
@@ -71,11 +124,11 @@ def get_export_data(conn, script_params, image, units=None):
     ch_names = [ch_name.replace(",", ".") for ch_name in ch_names]
     image_name = image.getName().replace(",", ".")
 
-    result = roi_service.findByImage(image.getId(), None)
-
-    rois = result.rois
-    # Sort by ROI.id (same as in iviewer)
-    rois.sort(key=lambda r: r.id.val)
+    # Sorted by ROI.id (same as in iviewer)
+    if shapes is None:
+        shapes = ShapeIndex.load(conn, [image.getId()])
+    else:
+        shapes = shapes.for_image(image.getId())
     export_data = []
 
     well_id = None
@@ -88,59 +141,75 @@ def get_export_data(conn, script_params, image, units=None):
             well_column = well.getColumn()
             well_label = well.getWellPos()
 
-    for roi in rois:
-        for shape in roi.copyShapes():
-            label = unwrap(shape.getTextValue())
-            # wrap label in double quotes in case it contains comma
-            label = "" if label is None else '"%s"' % label.replace(",", ".")
-            shape_type = shape.__class__.__name__.rstrip('I').lower()
-            # If shape has no Z or T, we may go through all planes...
-            the_z = unwrap(shape.theZ)
-            z_indexes = [the_z]
-            if the_z is None and all_planes:
-                z_indexes = range(image.getSizeZ())
-            # Same for T...
-            the_t = unwrap(shape.theT)
-            t_indexes = [the_t]
-            if the_t is None and all_planes:
-                t_indexes = range(image.getSizeT())
-
-            # get pixel intensities
-            for z in z_indexes:
-                for t in t_indexes:
-                    if z is None or t is None:
-                        stats = None
-                    else:
-                        stats = roi_service.getShapeStatsRestricted(
-                            [shape.id.val], z, t, ch_indexes)
-                    for c, ch_index in enumerate(ch_indexes):
-                        row_data = {
-                            "image_id": image.getId(),
-                            "image_name": '"%s"' % image_name,
-                            "roi_id": roi.id.val,
-                            "shape_id": shape.id.val,
-                            "type": shape_type,
-                            "text": label,
-                            "z": z + 1 if z is not None else "",
-                            "t": t + 1 if t is not None else "",
-                            "channel": ch_names[ch_index],
-                            "points": stats[0].pointsCount[c] if stats else "",
-                            "min": stats[0].min[c] if stats else "",
-                            "max": stats[0].max[c] if stats else "",
-                            "sum": stats[0].sum[c] if stats else "",
-                            "mean": stats[0].mean[c] if stats else "",
-                            "std_dev": stats[0].stdDev[c] if stats else ""
-                        }
-                        # For SPW data, add Well info...
-                        if well_id is not None:
-                            row_data['well_id'] = well_id
-                            row_data['well_row'] = well_row
-                            row_data['well_column'] = well_column
-                            row_data['well_label'] = well_label
-                        add_shape_coords(shape, row_data,
-                                         pixel_size_x, pixel_size_y,
-                                         include_points)
-                        export_data.append(row_data)
+    # If shape has no Z or T, we may go through all planes...
+    planes = []
+    for the_z, the_t in zip(shapes.column("z"), shapes.column("t")):
+        z_indexes = [None if the_z == UNSET else the_z]
+        if the_z == UNSET and all_planes:
+            z_indexes = range(image.getSizeZ())
+        # Same for T...
+        t_indexes = [None if the_t == UNSET else the_t]
+        if the_t == UNSET and all_planes:
+            t_indexes = range(image.getSizeT())
+        planes.append([(z, t) for z in z_indexes for t in t_indexes])
+
+    # get pixel intensities of all the shapes on a plane at once
+    plane_shapes = {}
+    for index, shape_planes in enumerate(planes):
+        for z, t in shape_planes:
+            if z is not None and t is not None:
+                plane_shapes.setdefault((z, t), []).append(index)
+    shape_ids = shapes.column("id")
+    if not plane_shapes:
+        stats = {}
+    elif local_stats():
+        stats = get_local_stats(conn, image, shapes, plane_shapes,
+                                ch_indexes, masks)
+    else:
+        stats = {}
+        roi_service = conn.getRoiService()
+        for (z, t), indexes in plane_shapes.items():
+            for plane_stats in roi_service.getShapeStatsRestricted(
+                    [shape_ids[i] for i in indexes], z, t, ch_indexes):
+                stats[plane_stats.shapeId, z, t] = plane_stats
+
+    coords = get_shape_coords(shapes, pixel_size_x, pixel_size_y,
+                              include_points)
+    roi_ids = shapes.column("roi")
+    type_names = shapes.type_names
+    for index, shape_id in enumerate(shape_ids):
+        label = shapes.text[index]
+        # wrap label in double quotes in case it contains comma
+        label = "" if label is None else '"%s"' % label.replace(",", ".")
+        shape_type = type_names[index].lower()
+        for z, t in planes[index]:
+            stat = stats.get((shape_id, z, t))
+            for c, ch_index in enumerate(ch_indexes):
+                row_data = {
+                    "image_id": image.getId(),
+                    "image_name": '"%s"' % image_name,
+                    "roi_id": roi_ids[index],
+                    "shape_id": shape_id,
+                    "type": shape_type,
+                    "text": label,
+                    "z": z + 1 if z is not None else "",
+                    "t": t + 1 if t is not None else "",
+                    "channel": ch_names[ch_index],
+                    "points": stat.pointsCount[c] if stat else "",
+                    "min": stat.min[c] if stat else "",
+                    "max": stat.max[c] if stat else "",
+                    "sum": stat.sum[c] if stat else "",
+                    "mean": stat.mean[c] if stat else "",
+                    "std_dev": stat.stdDev[c] if stat else ""
+                }
+                # For SPW data, add Well info...
+                if well_id is not None:
+                    row_data['well_id'] = well_id
+                    row_data['well_row'] = well_row
+                    row_data['well_column'] = well_column
+                    row_data['well_label'] = well_label
+                row_data.update(coords[index])
+                export_data.append(row_data)
 
     return export_data
 
@@ -176,72 +245,47 @@ COLUMN_NAMES = ["image_id",
                 "Y2"]
 
 
-def add_shape_coords(shape, row_data, pixel_size_x, pixel_size_y,
+def get_shape_coords(shapes, pixel_size_x, pixel_size_y,
                      include_points=True):
-    """Add shape coordinates and length or area to the row_data dict."""
-    if shape.getTextValue():
-        row_data['Text'] = shape.getTextValue().getValue()
-    if isinstance(shape, (RectangleI, EllipseI, PointI, LabelI, MaskI)):
-        row_data['X'] = shape.getX().getValue()
-        row_data['Y'] = shape.getY().getValue()
-    if isinstance(shape, (RectangleI, MaskI)):
-        row_data['Width'] = shape.getWidth().getValue()
-        row_data['Height'] = shape.getHeight().getValue()
-        row_data['area'] = row_data['Width'] * row_data['Height']
-    if isinstance(shape, EllipseI):
-        row_data['RadiusX'] = shape.getRadiusX().getValue()
-        row_data['RadiusY'] = shape.getRadiusY().getValue()
-        row_data['area'] = pi * row_data['RadiusX'] * row_data['RadiusY']
-    if isinstance(shape, LineI):
-        row_data['X1'] = shape.getX1().getValue()
-        row_data['X2'] = shape.getX2().getValue()
-        row_data['Y1'] = shape.getY1().getValue()
-        row_data['Y2'] = shape.getY2().getValue()
-        dx = (row_data['X1'] - row_data['X2'])
-        dx = dx if pixel_size_x is None else dx * pixel_size_x
-        dy = (row_data['Y1'] - row_data['Y2'])
-        dy = dy if pixel_size_y is None else dy * pixel_size_y
-        row_data['length'] = sqrt((dx * dx) + (dy * dy))
-    if isinstance(shape, (PolygonI, PolylineI)):
-        point_list = shape.getPoints().getValue()
-        match = INSIGHT_POINT_LIST_RE.search(point_list)
-        if match is not None:
-            point_list = match.group(1)
-        if include_points:
-            row_data['Points'] = '"%s"' % point_list
-    if isinstance(shape, PolylineI):
-        coords = point_list.strip(" ").split(" ")
-        try:
-            coords = [[float(x.strip(", ")) for x in coord.split(",", 1)]
-                      for coord in coords]
-        except ValueError:
-            log("Invalid Polyline coords: %s" % coords)
-        else:
-            lengths = []
-            for i in range(len(coords)-1):
-                dx = (coords[i][0] - coords[i + 1][0])
-                dy = (coords[i][1] - coords[i + 1][1])
-                dx = dx if pixel_size_x is None else dx * pixel_size_x
-                dy = dy if pixel_size_y is None else dy * pixel_size_y
-                lengths.append(sqrt((dx * dx) + (dy * dy)))
-            row_data['length'] = sum(lengths)
-    if isinstance(shape, PolygonI):
-        # https://www.mathopenref.com/coordpolygonarea.html
-        coords = point_list.strip(" ").split(" ")
-        try:
-            coords = [[float(x.strip(", ")) for x in coord.split(",", 1)]
-                      for coord in coords]
-        except ValueError:
-            log("Invalid Polygon coords: %s" % coords)
-        else:
-            total = 0
-            for c in range(len(coords)):
-                coord = coords[c]
-                next_c = coords[(c + 1) % len(coords)]
-                total += (coord[0] * next_c[1]) - (next_c[0] * coord[1])
-            row_data['area'] = abs(0.5 * total)
-    if 'area' in row_data and pixel_size_x and pixel_size_y:
-        row_data['area'] = row_data['area'] * pixel_size_x * pixel_size_y
+    """
+    List of dicts of the coordinates and length or area of each shape of
+    the ShapeIndex shapes.
+    """
+    lengths = shapes.lengths(pixel_size_x, pixel_size_y).tolist()
+    areas = shapes.areas().tolist()
+    boxes = shapes.shapes[["x", "y", "width", "height"]].tolist()
+    shape_ids = shapes.column("id")
+    all_coords = []
+    for index, shape_type in enumerate(shapes.type_names):
+        coords = {}
+        if shapes.text[index]:
+            coords['Text'] = shapes.text[index]
+        points = shapes.shape_points(index)
+        x, y, width, height = boxes[index]
+        if shape_type in ("Rectangle", "Mask"):
+            coords['X'], coords['Y'] = x, y
+            coords['Width'], coords['Height'] = width, height
+        if shape_type in ("Ellipse", "Point", "Label"):
+            coords['X'], coords['Y'] = points[0]
+        if shape_type == "Ellipse":
+            coords['RadiusX'], coords['RadiusY'] = width / 2, height / 2
+        if shape_type == "Line":
+            (coords['X1'], coords['Y1']), (coords['X2'], coords['Y2']) = \
+                points
+        if shape_type in ("Polygon", "Polyline"):
+            if not points:
+                log("Invalid %s coords: shape %s" % (shape_type,
+                                                     shape_ids[index]))
+            if include_points:
+                coords['Points'] = '"%s"' % shapes.points_string(index)
+        if not math.isnan(lengths[index]):
+            coords['length'] = lengths[index]
+        if not math.isnan(areas[index]):
+            coords['area'] = areas[index]
+            if pixel_size_x and pixel_size_y:
+                coords['area'] = areas[index] * pixel_size_x * pixel_size_y
+        all_coords.append(coords)
+    return all_coords
 
 
 def get_file_name(script_params):
@@ -325,14 +369,21 @@ def batch_roi_export(conn, script_params):
     file_name = get_file_name(script_params)
     csv_header = get_csv_header(units_symbol)
 
+    # the shapes of all the images at once
+    shapes = ShapeIndex.load(conn, [image.getId() for image in images])
+    masks = MaskCache()
+
     row_count = 0
     with open(file_name, 'w') as csv_file:
         csv_file.write(csv_header)
         for image in images:
-            for row in get_export_data(conn, script_params, image, units):
+            for row in get_export_data(conn, script_params, image, units,
+                                       shapes, masks):
                 cells = [str(row.get(name, "")) for name in COLUMN_NAMES]
                 csv_file.write("\n" + ",".join(cells))
                 row_count += 1
+    if local_stats():
+        log(masks.report())
 
     file_ann = conn.createFileAnnfromLocalFile(file_name, mimetype="text/csv")
 
@@ -393,6 +444,7 @@ def run_script():
 
     try:
         conn = BlitzGateway(client_obj=client)
+        watch_calls(conn)
 
         script_params = client.getInputs(unwrap=True)
         log("script_params:")
@@ -410,6 +462,7 @@ def run_script():
                 client.setOutput("File_Annotation", robject(file_ann._obj))
 
         client.setOutput("Message", rstring(message))
+        get_timings().set_output(client)
 
     finally:
         client.closeSession()
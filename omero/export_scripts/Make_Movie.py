@@ -56,20 +56,21 @@ params:
 """
 
 import omero.scripts as scripts
-import omero.util.script_utils as script_utils
-import omero.util.figureUtil as figureUtil
 import omero
 import omero.min  # Constants etc.
 import os
 import sys
 import re
-import numpy
 import omero.util.pixelstypetopython as pixelstypetopython
 from struct import unpack
 from omero.rtypes import wrap, rstring, rint, rlong, robject
 from omero.gateway import BlitzGateway
 from omero.constants.namespaces import NSCREATED
 from omero.constants.metadata import NSMOVIE
+from omero.script_helpers import colours
+from omero.script_helpers.lazy import lazy_import
+from omero.script_helpers.planner import (DRY_RUN_PARAM, STREAMING, Plan,
+                                          choose_mode)
 
 from io import BytesIO
 try:
@@ -77,14 +78,13 @@ try:
 except ImportError:
     StringTypes = str
 
-try:
-    from PIL import Image, ImageDraw  # see ticket:2597
-except ImportError:
-    import Image
-    import ImageDraw  # see ticket:2597
+numpy = lazy_import("numpy")
+Image = lazy_import("PIL.Image")
+ImageDraw = lazy_import("PIL.ImageDraw")
+script_utils = lazy_import("omero.util.script_utils")
+figureUtil = lazy_import("omero.util.figureUtil")
 
-COLOURS = script_utils.COLOURS
-COLOURS.update(script_utils.EXTRA_COLOURS)    # name:(rgba) map
+COLOURS = dict(colours.COLOURS, **colours.EXTRA_COLOURS)    # name:(rgba) map
 
 MPEG = 'MPEG'
 QT = 'Quicktime'
@@ -551,6 +551,24 @@ def write_movie(command_args, conn):
         ovlpos = ((mw-size_x) / 2, (mh-size_y) / 2)
         canvas = Image.new("RGBA", (mw, mh), canvas_colour)
 
+    # frames are rendered, drawn on a copy of the canvas and saved one at
+    # a time, so a movie is streamed or not made at all
+    plan = Plan()
+    frame_size = size_x * size_y * 3
+    memory = frame_size + 2 * mw * mh * 4
+    if choose_mode(None, memory, plan.budget) == STREAMING:
+        plan.add(omero_image.getName(), STREAMING, planes=len(tz_list),
+                 bytes_down=len(tz_list) * frame_size,
+                 bytes_up=len(tz_list) * mw * mh * 3, memory=memory,
+                 files=len(tz_list) + 1)
+    else:
+        plan.skip(omero_image.getName(), "frames of %d x %d pixels don't "
+                  "fit in the memory budget" % (mw, mh))
+    print(plan.report())
+    if command_args.get(DRY_RUN_PARAM) or plan.skipped:
+        omero_image._re.close()
+        return None, message + plan.report()
+
     format = command_args["Format"]
     file_names = []
 
@@ -784,6 +802,11 @@ def run_script():
             " OriginalFile holding the movie and links it to the Image.",
             default=True),
 
+        scripts.Bool(
+            "Dry_Run", default=False,
+            description="Only report the frames, bytes, memory and files"
+            " the movie needs, without making it"),
+
         version="4.2.0",
         authors=["Donald MacDonald", "OME Team"],
         institutions=["University of Dundee"],
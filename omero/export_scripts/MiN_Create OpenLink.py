@@ -19,15 +19,12 @@ from omero.rtypes import rstring, rlong, robject, unwrap
 import time
 import omero.scripts as scripts
 from omero.gateway import BlitzGateway
+from omero.script_helpers.annotations import load_annotations
+from omero.script_helpers.hierarchy import resolve_images
 import datetime
 import re
-import subprocess
 from pathlib import Path
 
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.utils import formatdate
 import json
 import glob
 
@@ -381,21 +378,35 @@ def createSymlinks(linkNames, linkTarget):
                 print("# skip:: Link still exists: ", src)
 
 
-def addAttachment(obj, tdir):
+def getAttachments(objs):
+    # the file annotations of all objs (of one type) with one query
+    objs = list(objs)
+    if not objs:
+        return {}
+    return load_annotations(objs[0]._conn, objs[0].OMERO_CLASS, [obj.getId() for obj in objs],
+                            types=("FileAnnotation",))
+
+
+def addAttachment(obj, tdir, annotations=None):
+    import subprocess
+
     global ORIGINAL_REP
     if tdir is not None:
-        for ann in obj.listAnnotations():
-            if isinstance(ann, omero.gateway.FileAnnotationWrapper):
-                print("# Annotation File ID:", ann.getFile().getId(), ann.getFile().getName())
+        if annotations is None:
+            annotations = getAttachments([obj])[obj.getId()]
+        for ann in annotations:
+            if ann["file"] is not None:
+                fileId = unwrap(ann["file"].id)
+                print("# Annotation File ID:", fileId, ann["file_name"])
                 # TODO: link - if file still exists - skip
-                carg = "find %s -name %s" % (ORIGINAL_REP, ann.getFile().getId())
+                carg = "find %s -name %s" % (ORIGINAL_REP, fileId)
                 paths = [line[0:] for line in subprocess.check_output(carg, shell=True).splitlines()]
                 if len(paths) > 1:
                     print("# ATTENTION: file annotation target is not unique: %s --> use first match" % (
                         "\n".join(paths)))
 
                 linkNames = []
-                linkNames.append(os.path.join(tdir, ann.getFile().getName()))
+                linkNames.append(os.path.join(tdir, ann["file_name"]))
                 linkTarget = []
                 linkTarget.append(str(paths[0].decode('utf-8')))
                 createSymlinks(linkNames, linkTarget)
@@ -435,6 +446,8 @@ def addImages(conn, slot, images, user, addAttachments, allowedToShare, targetDi
     userName = user.getName()
     global MANAGED_REP
 
+    images = list(images)
+    attachments = getAttachments(images) if addAttachments else {}
     # proof images
     for image in images:
         user_is_owner = userIsOwner(conn, userName, image.id)
@@ -468,7 +481,7 @@ def addImages(conn, slot, images, user, addAttachments, allowedToShare, targetDi
 
             # add available attachments if required
             if addAttachments:
-                addAttachment(image, targetDir)
+                addAttachment(image, targetDir, attachments[image.getId()])
         else:
             print("# ATTENTION: You are not allowed to share image: %s" % image.getId())
 
@@ -477,6 +490,8 @@ def addImages(conn, slot, images, user, addAttachments, allowedToShare, targetDi
 
 
 def addDatasets(conn, slot, datasets, user, addAttachments, allowedToShare, targetDir=None):
+    datasets = list(datasets)
+    attachments = getAttachments(datasets) if addAttachments else {}
     for dataset in datasets:
         # check if parent project dir still exists
         if not targetDir:
@@ -492,30 +507,36 @@ def addDatasets(conn, slot, datasets, user, addAttachments, allowedToShare, targ
             linkDir = createObjectDir("D", linkDir, dataset, dataset.getName())
 
             if addAttachments:
-                addAttachment(dataset, linkDir)
+                addAttachment(dataset, linkDir, attachments[dataset.getId()])
 
             addImages(conn, slot, dataset.listChildren(), user, addAttachments, allowedToShare, linkDir)
 
 
 def addProjects(conn, slot, projects, user, addAttachments, allowedToShare):
+    projects = list(projects)
+    attachments = getAttachments(projects) if addAttachments else {}
     for project in projects:
         linkDir = createObjectDir("P", slot, project, project.getName())
         if linkDir is not None:
             if addAttachments:
-                addAttachment(project, linkDir)
+                addAttachment(project, linkDir, attachments[project.getId()])
 
             addDatasets(conn, slot, project.listChildren(), user, addAttachments, allowedToShare, linkDir)
 
 
 def addScreens(conn, slot, screens, user, addAttachments, allowedToShare):
+    screens = list(screens)
+    attachments = getAttachments(screens) if addAttachments else {}
     for screen in screens:
         linkDir = createObjectDir("S", slot, screen, screen.getName())
         if linkDir is not None:
             if addAttachments:
-                addAttachment(screen, linkDir)
+                addAttachment(screen, linkDir, attachments[screen.getId()])
             addPlates(conn, slot, screen.listChildren(), user, addAttachments, allowedToShare, linkDir)
 
 def addPlates(conn, slot, plates, user, addAttachments, allowedToShare,targetDir=None):
+    plates = list(plates)
+    attachments = getAttachments(plates) if addAttachments else {}
     for plate in plates:
         # check if parent screen dir still exists
         if not targetDir:
@@ -531,12 +552,9 @@ def addPlates(conn, slot, plates, user, addAttachments, allowedToShare,targetDir
             linkDir = createObjectDir("PL", linkDir, plate, plate.getName())
 
             if addAttachments:
-                addAttachment(plate, linkDir)
-            # generate imageList from the wellsamples
-            imageList = []
-            for well in plate.listChildren():
-                for wellsample in well.listChildren():
-                    imageList.append(wellsample.getImage())
+                addAttachment(plate, linkDir, attachments[plate.getId()])
+            # generate imageList from the wellsamples with a single query
+            imageList = resolve_images(conn, "Plate", [plate.getId()]).load_images(conn)
 
             addImages(conn, slot, imageList, user, addAttachments, allowedToShare, linkDir)
 
@@ -580,6 +598,11 @@ def email_results(conn, imageIDs, email, smtpObj):
     @param report:  The results report
     @param params:  The script parameters
     """
+    # imported here, not when the server lists the script parameters
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+    from email.utils import formatdate
+
     sharerName = conn.getUser().getName()
     msg = MIMEMultipart()
     msg['From'] = ADMIN_EMAIL
@@ -607,6 +630,8 @@ def notifyMembers(conn):
     if len(NOTIFICATION_LIST) == 0:
         return
     else:
+        import smtplib
+
         start = time.time()
         smtpObj = smtplib.SMTP(SMTP_IP)
 
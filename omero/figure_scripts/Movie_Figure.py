@@ -34,9 +34,6 @@ Saves the figure as a jpg or png attached to the first image in the figure.
 """
 
 import omero.scripts as scripts
-import omero.util.image_utils as image_utils
-import omero.util.figureUtil as figUtil
-import omero.util.script_utils as script_utils
 from omero.gateway import BlitzGateway
 import omero
 from omero.rtypes import rint, rlong, rstring, robject, wrap
@@ -44,17 +41,21 @@ import os
 import io
 from omero.constants.namespaces import NSCREATED
 from omero.constants.projection import ProjectionType
+from omero.script_helpers import colours
+from omero.script_helpers.render_pool import RenderingEnginePool
+from omero.script_helpers.lazy import lazy_import
+from omero.script_helpers.panel_cache import PanelCache
 from datetime import date
 import math
 
-try:
-    from PIL import Image, ImageDraw  # see ticket:2597
-except ImportError:
-    import Image
-    import ImageDraw  # see ticket:2597
+Image = lazy_import("PIL.Image")
+ImageDraw = lazy_import("PIL.ImageDraw")
+image_utils = lazy_import("omero.util.image_utils")
+figUtil = lazy_import("omero.util.figureUtil")
+script_utils = lazy_import("omero.util.script_utils")
 
-COLOURS = script_utils.COLOURS    # name:(rgba) map
-OVERLAY_COLOURS = dict(COLOURS, **script_utils.EXTRA_COLOURS)
+COLOURS = colours.COLOURS    # name:(rgba) map
+OVERLAY_COLOURS = dict(COLOURS, **colours.EXTRA_COLOURS)
 
 log_lines = []    # make a log / legend of the figure
 
@@ -94,8 +95,6 @@ def createmovie_figure(conn, pixel_ids, t_indexes, z_start, z_end, width,
     mode = "RGB"
     white = (255, 255, 255)
 
-    # create a rendering engine
-    re = conn.createRenderingEngine()
     query_service = conn.getQueryService()
 
     row_panels = []
@@ -104,48 +103,20 @@ def createmovie_figure(conn, pixel_ids, t_indexes, z_start, z_end, width,
     max_image_width = 0
     physical_size_x = 0
 
-    for row, pixels_id in enumerate(pixel_ids):
-        log("Rendering row %d" % (row))
+    panels = PanelCache(conn)
 
+    def render_row(re, pixels_id):
+        """
+        Render the frames of one row, on an engine set up for pixels_id,
+        or read them from the cache. Returns (pixels, resized frames, log
+        lines).
+        """
+        re = panels.engine(re)
+        lines = []
         pixels = query_service.get("Pixels", pixels_id)
-        size_x = pixels.getSizeX().getValue()
-        size_y = pixels.getSizeY().getValue()
         size_z = pixels.getSizeZ().getValue()
         size_t = pixels.getSizeT().getValue()
 
-        if pixels.getPhysicalSizeX():
-            physical_x = pixels.getPhysicalSizeX().getValue()
-            units_x = pixels.getPhysicalSizeX().getSymbol()
-        else:
-            physical_x = 0
-            units_x = ""
-        if pixels.getPhysicalSizeY():
-            physical_y = pixels.getPhysicalSizeY().getValue()
-            units_y = pixels.getPhysicalSizeY().getSymbol()
-        else:
-            physical_y = 0
-            units_y = ""
-        log("  Pixel size: x: %s %s  y: %s %s"
-            % (str(physical_x), units_x, str(physical_y), units_y))
-        if row == 0:    # set values for primary image
-            physical_size_x = physical_x
-            physical_size_y = physical_y
-        else:            # compare primary image with current one
-            if physical_size_x != physical_x or physical_size_y != physical_y:
-                log(" WARNING: Images have different pixel lengths. Scales"
-                    " are not comparable.")
-
-        log("  Image dimensions (pixels): x: %d  y: %d" % (size_x, size_y))
-        max_image_width = max(max_image_width, size_x)
-
-        # set up rendering engine with the pixels
-        re.lookupPixels(pixels_id)
-        if not re.lookupRenderingDef(pixels_id):
-            re.resetDefaults()
-        if not re.lookupRenderingDef(pixels_id):
-            raise "Failed to lookup Rendering Def"
-        re.load()
-
         pro_start = z_start
         pro_end = z_end
         # make sure we're within Z range for projection.
@@ -153,18 +124,18 @@ def createmovie_figure(conn, pixel_ids, t_indexes, z_start, z_end, width,
             pro_end = size_z - 1
             if pro_start > size_z:
                 pro_start = 0
-            log(" WARNING: Current image has fewer Z-sections than the"
-                " primary image.")
+            lines.append(" WARNING: Current image has fewer Z-sections than"
+                         " the primary image.")
 
         # if we have an invalid z-range (start or end less than 0), show
         # default Z only
         if pro_start < 0 or pro_end < 0:
             pro_start = re.getDefaultZ()
             pro_end = pro_start
-            log("  Display Z-section: %d" % (pro_end+1))
+            lines.append("  Display Z-section: %d" % (pro_end+1))
         else:
-            log("  Projecting z range: %d - %d   (max Z is %d)"
-                % (pro_start+1, pro_end+1, size_z))
+            lines.append("  Projecting z range: %d - %d   (max Z is %d)"
+                         % (pro_start+1, pro_end+1, size_z))
 
         # now get each channel in greyscale (or colour)
         # a list of renderedImages (data as Strings) for the split-view row
@@ -172,8 +143,8 @@ def createmovie_figure(conn, pixel_ids, t_indexes, z_start, z_end, width,
 
         for time in t_indexes:
             if time >= size_t:
-                log(" WARNING: This image does not have Time frame: %d. "
-                    "(max is %d)" % (time+1, size_t))
+                lines.append(" WARNING: This image does not have Time frame:"
+                             " %d. (max is %d)" % (time+1, size_t))
             else:
                 if pro_start != pro_end:
                     rendered_img = re.renderProjectedCompressed(
@@ -187,6 +158,47 @@ def createmovie_figure(conn, pixel_ids, t_indexes, z_start, z_end, width,
                 image = Image.open(io.BytesIO(rendered_img))
                 resized_image = image_utils.resize_image(image, width, height)
                 rendered_images.append(resized_image)
+        return pixels, rendered_images, lines
+
+    # render the rows concurrently, each on its own rendering engine
+    with RenderingEnginePool(conn) as pool:
+        rows = pool.map(render_row, pixel_ids)
+    log(panels.report())
+
+    for row, (pixels, rendered_images, lines) in enumerate(rows):
+        log("Rendering row %d" % (row))
+
+        pixels_id = pixel_ids[row]
+        size_x = pixels.getSizeX().getValue()
+        size_y = pixels.getSizeY().getValue()
+        size_t = pixels.getSizeT().getValue()
+
+        if pixels.getPhysicalSizeX():
+            physical_x = pixels.getPhysicalSizeX().getValue()
+            units_x = pixels.getPhysicalSizeX().getSymbol()
+        else:
+            physical_x = 0
+            units_x = ""
+        if pixels.getPhysicalSizeY():
+            physical_y = pixels.getPhysicalSizeY().getValue()
+            units_y = pixels.getPhysicalSizeY().getSymbol()
+        else:
+            physical_y = 0
+            units_y = ""
+        log("  Pixel size: x: %s %s  y: %s %s"
+            % (str(physical_x), units_x, str(physical_y), units_y))
+        if row == 0:    # set values for primary image
+            physical_size_x = physical_x
+            physical_size_y = physical_y
+        else:            # compare primary image with current one
+            if physical_size_x != physical_x or physical_size_y != physical_y:
+                log(" WARNING: Images have different pixel lengths. Scales"
+                    " are not comparable.")
+
+        log("  Image dimensions (pixels): x: %d  y: %d" % (size_x, size_y))
+        max_image_width = max(max_image_width, size_x)
+        for line in lines:
+            log(line)
 
         # make a canvas for the row of splitview images...
         # (will add time labels above each row)
@@ -34,27 +34,29 @@ ROIs as zoomed panels beside the images.
 """
 
 import omero.scripts as scripts
-import omero.util.image_utils as image_utils
-import omero.util.figureUtil as figUtil
-import omero.util.script_utils as script_utils
 from omero.gateway import BlitzGateway
-from omero.rtypes import rlong, rint, rstring, robject, wrap, unwrap
+from omero.rtypes import rlong, rint, rstring, robject, wrap
 from omero.constants.namespaces import NSCREATED
-import omero.model
 from omero.constants.projection import ProjectionType
+from omero.script_helpers import colours
+from omero.script_helpers.local_render import local_engine
+from omero.script_helpers.render_pool import prepare_engine
+from omero.script_helpers.lazy import lazy_import
+from omero.script_helpers.panel_cache import PanelCache
+from omero.script_helpers.shape_index import UNSET, ShapeIndex
 import os
 import io
 from datetime import date
 
-try:
-    from PIL import Image, ImageDraw  # see ticket:2597
-except ImportError:
-    import Image
-    import ImageDraw  # see ticket:2597
+Image = lazy_import("PIL.Image")
+ImageDraw = lazy_import("PIL.ImageDraw")
+image_utils = lazy_import("omero.util.image_utils")
+figUtil = lazy_import("omero.util.figureUtil")
+script_utils = lazy_import("omero.util.script_utils")
 
 
-COLOURS = script_utils.COLOURS
-OVERLAY_COLOURS = dict(COLOURS, **script_utils.EXTRA_COLOURS)
+COLOURS = colours.COLOURS
+OVERLAY_COLOURS = dict(COLOURS, **colours.EXTRA_COLOURS)
 
 log_strings = []
 
@@ -102,6 +104,10 @@ def get_roi_movie_view(re, query_service, pixels, time_shape_map,
     """
     This takes a ROI rectangle from an image and makes a movie canvas of the
     region in the ROI, zoomed by a defined factor.
+
+    @param re       The rendering engine, set up for pixels. If it renders
+                    locally (has render_projection), only the ROI of frames
+                    after the first is rendered.
     """
 
     mode = "RGB"
@@ -125,14 +131,7 @@ def get_roi_movie_view(re, query_service, pixels, time_shape_map,
     log("  Image dimensions (pixels): x: %d  y: %d" % (size_x, size_y))
     log(" Projecting Movie Frame ROIs...")
 
-    # set up rendering engine with the pixels
     pixels_id = pixels.getId().getValue()
-    re.lookupPixels(pixels_id)
-    if not re.lookupRenderingDef(pixels_id):
-        re.resetDefaults()
-    if not re.lookupRenderingDef(pixels_id):
-        raise "Failed to lookup Rendering Def"
-    re.load()
 
     # now get each channel in greyscale (or colour)
     # a list of renderedImages (data as Strings) for the split-view row
@@ -176,14 +175,21 @@ def get_roi_movie_view(re, query_service, pixels, time_shape_map,
             % (timepoint+1, time_labels[t], pro_start+1, pro_end+1, size_z,
                roi_x, roi_y))
 
-        merged = re.renderProjectedCompressed(
-            algorithm, timepoint, stepping, pro_start, pro_end)
-        full_merged_image = Image.open(io.BytesIO(merged))
-        if full_first_frame is None:
-            full_first_frame = full_merged_image
-        roi_merged_image = full_merged_image.crop(box)
-        # make sure this is not just a lazy copy of the full image
-        roi_merged_image.load()
+        region = (box[0], box[1], box[2] - box[0], box[3] - box[1])
+        if full_first_frame is not None and \
+                hasattr(re, "render_projection") and re.contains(region):
+            # the full image is only shown for the first frame
+            roi_merged_image = Image.fromarray(re.render_projection(
+                algorithm, timepoint, stepping, pro_start, pro_end, region))
+        else:
+            merged = re.renderProjectedCompressed(
+                algorithm, timepoint, stepping, pro_start, pro_end)
+            full_merged_image = Image.open(io.BytesIO(merged))
+            if full_first_frame is None:
+                full_first_frame = full_merged_image
+            roi_merged_image = full_merged_image.crop(box)
+            # make sure this is not just a lazy copy of the full image
+            roi_merged_image.load()
         if roi_zoom != 1:
             new_size = (int(roi_width*roi_zoom), int(roi_height*roi_zoom))
             roi_merged_image = roi_merged_image.resize(new_size)
@@ -248,42 +254,32 @@ def draw_rectangle(image, roi_x, roi_y, roi_x2, roi_y2, colour, stroke=1):
         roi_y2 -= 1
 
 
-def get_rectangle(roi_service, image_id, roi_label):
+def get_rectangle(rectangles, image_id, roi_label):
     """
     Returns (x, y, width, height, timeShapeMap) of the all rectanges in the
     first ROI of the image where timeShapeMap is a map of tIndex:
     (x,y,zMin,zMax)
     x, y, Width and Height are from the first rectangle (assumed that all are
     same size!)
+
+    @param rectangles:  ShapeIndex of the rectangles of the images
     """
 
-    result = roi_service.findByImage(image_id, None)
+    rectangles = rectangles.for_image(image_id).of_type("Rectangle")
+    boxes = rectangles.shapes[["x", "y", "width", "height"]].tolist()
+    # t and z of a shape are optional
+    z_indexes = [0 if z == UNSET else z for z in rectangles.column("z")]
+    t_indexes = [0 if t == UNSET else t for t in rectangles.column("t")]
 
     roi_text = roi_label.lower()
-    roi_count = 0
-    rect_count = 0
-    found_labelled_roi = False
-
-    for roi in result.rois:
-        rectangles = [shape for shape in roi.copyShapes()
-                      if isinstance(shape, omero.model.RectangleI)]
-        if len(rectangles) == 0:
-            continue
-
+    rect = None
+    for shapes in rectangles.rois():
         time_shape_map = {}  # map of tIndex: (x,y,zMin,zMax) for a single roi
-        for shape in rectangles:
-            the_t = unwrap(shape.getTheT())
-            the_z = unwrap(shape.getTheZ())
-            t = 0
-            z = 0
-            if the_t is not None:
-                t = the_t
-            if the_z is not None:
-                z = the_z
-            x = int(shape.getX().getValue())
-            y = int(shape.getY().getValue())
-            text = shape.getTextValue() and shape.getTextValue().getValue() \
-                or None
+        for i in shapes:
+            t = t_indexes[i]
+            z = z_indexes[i]
+            x = int(boxes[i][0])
+            y = int(boxes[i][1])
 
             # build a map of tIndex: (x,y,zMin,zMax)
             if t in time_shape_map:
@@ -294,27 +290,18 @@ def get_rectangle(roi_service, image_id, roi_label):
             else:
                 time_shape_map[t] = (x, y, z, z)
 
-            # get ranges for whole ROI
-            if rect_count == 0:
-                width = shape.getWidth().getValue()
-                height = shape.getHeight().getValue()
-                x1 = x
-                y1 = y
-            rect_count += 1
-            if text is not None and text.lower() == roi_text:
-                found_labelled_roi = True
+        # get ranges for whole ROI
+        x1, y1, width, height = boxes[shapes[0]]
+        rect = (int(x1), int(y1), int(width), int(height), time_shape_map)
         # will return after the first ROI that matches text
-        if found_labelled_roi:
-            return (int(x1), int(y1), int(width), int(height), time_shape_map)
-        else:
-            if rect_count > 0:
-                roi_count += 1
-            rect_count = 0    # try another ROI
+        texts = [rectangles.text[i].lower() for i in shapes
+                 if rectangles.text[i]]
+        if roi_text in texts:
+            return rect
 
     # if we got here without finding an ROI that matched, simply return any
     # ROI we have (last one)
-    if roi_count > 0:
-        return (int(x1), int(y1), int(width), int(height), time_shape_map)
+    return rect
 
 
 def get_split_view(conn, image_ids, pixel_ids, merged_indexes, merged_colours,
@@ -342,14 +329,16 @@ def get_split_view(conn, image_ids, pixel_ids, merged_indexes, merged_colours,
                         between rows.
     """
 
-    roi_service = conn.getRoiService()
     re = conn.createRenderingEngine()
+    panels = PanelCache(conn)
     query_service = conn.getQueryService()    # only needed for movie
+    # the rectangles of all the images at once
+    rectangles = ShapeIndex.load(conn, image_ids, ("Rectangle",))
 
     # establish dimensions and roiZoom for the primary image
     # getTheseValues from the server
     for iid in image_ids:
-        rect = get_rectangle(roi_service, iid, roi_label)
+        rect = get_rectangle(rectangles, iid, roi_label)
         if rect is not None:
             break
 
@@ -398,7 +387,7 @@ def get_split_view(conn, image_ids, pixel_ids, merged_indexes, merged_colours,
 
         # need to get the roi dimensions from the server
         image_id = image_ids[row]
-        roi = get_rectangle(roi_service, image_id, roi_label)
+        roi = get_rectangle(rectangles, image_id, roi_label)
         if roi is None:
             log("No Rectangle ROI found for this image")
             del image_labels[row]    # remove the corresponding labels
@@ -419,11 +408,17 @@ def get_split_view(conn, image_ids, pixel_ids, merged_indexes, merged_colours,
 
         log("  ROI location (top-left of first frame) x: %d  y: %d  and size"
             " width: %d  height: %d" % (roi_x, roi_y, roi_width, roi_height))
-        # get the split pane and full merged image
-        roi_split_pane, full_merged_image, top_spacer = get_roi_movie_view(
-            re, query_service, pixels, time_shape_map, merged_indexes,
-            merged_colours, roi_width, roi_height, roi_zoom, spacer, algorithm,
-            stepping, font_size, max_columns, show_roi_duration)
+        # get the split pane and full merged image, rendering from the raw
+        # planes if the settings allow, or reading them from the cache
+        prepare_engine(re, pixels_id)
+        with local_engine(conn, re) as engine:
+            roi_split_pane, full_merged_image, top_spacer = \
+                get_roi_movie_view(
+                    panels.engine(re, engine), query_service, pixels,
+                    time_shape_map,
+                    merged_indexes, merged_colours, roi_width, roi_height,
+                    roi_zoom, spacer, algorithm, stepping, font_size,
+                    max_columns, show_roi_duration)
 
         # and now zoom the full-sized merged image, add scalebar
         merged_image = image_utils.resize_image(full_merged_image, width,
@@ -456,6 +451,8 @@ def get_split_view(conn, image_ids, pixel_ids, merged_indexes, merged_colours,
         roi_split_panes.append(roi_split_pane)
         top_spacers.append(top_spacer)
 
+    log(panels.report())
+
     # make a figure to combine all split-view rows
     # each row has 1/2 spacer above and below the panels. Need extra 1/2
     # spacer top and bottom
@@ -35,26 +35,30 @@ ROIs as zoomed panels beside the images.
 
 import omero
 import omero.scripts as scripts
-import omero.util.image_utils as image_utils
-import omero.util.figureUtil as figUtil
-import omero.util.script_utils as script_utils
 from omero.gateway import BlitzGateway
-from omero.rtypes import rlong, robject, rstring, wrap, unwrap
+from omero.rtypes import rlong, robject, rstring, wrap
 import os
 from omero.constants.namespaces import NSCREATED
 from omero.constants.projection import ProjectionType
+from omero.script_helpers import colours
+from omero.script_helpers.render_pool import (RenderingEnginePool,
+                                              get_channel_colours)
+from omero.script_helpers.local_render import local_engine
+from omero.script_helpers.lazy import lazy_import
+from omero.script_helpers.panel_cache import PanelCache
+from omero.script_helpers.shape_index import UNSET, ShapeIndex
 import io
 from datetime import date
 
-try:
-    from PIL import Image, ImageDraw  # see ticket:2597
-except ImportError:
-    import Image
-    import ImageDraw  # see ticket:2597
+Image = lazy_import("PIL.Image")
+ImageDraw = lazy_import("PIL.ImageDraw")
+image_utils = lazy_import("omero.util.image_utils")
+figUtil = lazy_import("omero.util.figureUtil")
+script_utils = lazy_import("omero.util.script_utils")
 
 
-COLOURS = script_utils.COLOURS    # name:(rgba) map
-OVERLAY_COLOURS = dict(COLOURS, **script_utils.EXTRA_COLOURS)
+COLOURS = colours.COLOURS    # name:(rgba) map
+OVERLAY_COLOURS = dict(COLOURS, **colours.EXTRA_COLOURS)
 
 log_strings = []
 
@@ -75,13 +79,16 @@ def get_roi_split_view(re, pixels, z_start, z_end, split_indexes,
     This takes a ROI rectangle from an image and makes a split view canvas of
     the region in the ROI, zoomed by a defined factor.
 
-    @param    re        The OMERO rendering engine.
+    @param    re        The OMERO rendering engine, set up for pixels.
+    @return             (split view canvas, full merged image, top spacer,
+                        log lines)
     """
 
     if algorithm is None:    # omero::constants::projection::ProjectionType
         algorithm = ProjectionType.MAXIMUMINTENSITY
     mode = "RGB"
     white = (255, 255, 255)
+    lines = []
 
     size_x = pixels.getSizeX().getValue()
     size_y = pixels.getSizeY().getValue()
@@ -96,10 +103,12 @@ def get_roi_split_view(re, pixels, z_start, z_end, split_indexes,
         physical_y = pixels.getPhysicalSizeY().getValue()
     else:
         physical_y = 0
-    log("  Pixel size (um): x: %.3f  y: %.3f" % (physical_x, physical_y))
-    log("  Image dimensions (pixels): x: %d  y: %d" % (size_x, size_y))
+    lines.append("  Pixel size (um): x: %.3f  y: %.3f"
+                 % (physical_x, physical_y))
+    lines.append("  Image dimensions (pixels): x: %d  y: %d"
+                 % (size_x, size_y))
 
-    log(" Projecting ROIs...")
+    lines.append(" Projecting ROIs...")
     pro_start = z_start
     pro_end = z_end
     # make sure we're within Z range for projection.
@@ -107,26 +116,12 @@ def get_roi_split_view(re, pixels, z_start, z_end, split_indexes,
         pro_end = size_z - 1
         if pro_start > size_z:
             pro_start = 0
-        log(" WARNING: Current image has fewer Z-sections than the primary"
-            " image projection.")
+        lines.append(" WARNING: Current image has fewer Z-sections than the"
+                     " primary image projection.")
     if pro_start < 0:
         pro_start = 0
-    log("  Projecting z range: %d - %d   (max Z is %d)"
-        % (pro_start+1, pro_end+1, size_z))
-    # set up rendering engine with the pixels
-    pixels_id = pixels.getId().getValue()
-    re.lookupPixels(pixels_id)
-    if not re.lookupRenderingDef(pixels_id):
-        re.resetDefaults()
-    if not re.lookupRenderingDef(pixels_id):
-        raise "Failed to lookup Rendering Def"
-    re.load()
-
-    # if we are missing some merged colours, get them from rendering engine.
-    for index in merged_indexes:
-        if index not in merged_colours:
-            color = tuple(re.getRGBA(index))
-            merged_colours[index] = color
+    lines.append("  Projecting z range: %d - %d   (max Z is %d)"
+                 % (pro_start+1, pro_end+1, size_z))
 
     # now get each channel in greyscale (or colour)
     # a list of renderedImages (data as Strings) for the split-view row
@@ -158,7 +153,7 @@ def get_roi_split_view(re, pixels, z_start, z_end, split_indexes,
                 re.setRGBA(index, 255, 255, 255, 255)
             info = (channel_names[index], re.getChannelWindowStart(index),
                     re.getChannelWindowEnd(index))
-            log("  Render channel: %s  start: %d  end: %d" % info)
+            lines.append("  Render channel: %s  start: %d  end: %d" % info)
             if pro_start == pro_end:
                 # if it's a single plane, we can render a region (region not
                 # supported with projection)
@@ -199,7 +194,7 @@ def get_roi_split_view(re, pixels, z_start, z_end, split_indexes,
 
     # get the combined image, using the existing rendering settings
     channels_string = ", ".join([str(i) for i in merged_indexes])
-    log("  Rendering merged channels: %s" % channels_string)
+    lines.append("  Rendering merged channels: %s" % channels_string)
     if pro_start != pro_end:
         merged = re.renderProjectedCompressed(
             algorithm, t_index, stepping, pro_start, pro_end)
@@ -218,8 +213,8 @@ def get_roi_split_view(re, pixels, z_start, z_end, split_indexes,
         roi_merged_image = roi_merged_image.resize(new_size, Image.ANTIALIAS)
 
     if channel_mismatch:
-        log(" WARNING channel mismatch: The current image has fewer channels"
-            " than the primary image.")
+        lines.append(" WARNING channel mismatch: The current image has fewer"
+                     " channels than the primary image.")
 
     if panel_width == 0:  # e.g. No split-view panels
         panel_width = roi_merged_image.size[0]
@@ -289,7 +284,7 @@ def get_roi_split_view(re, pixels, z_start, z_end, split_indexes,
     image_utils.paste_image(roi_merged_image, canvas, px, panel_y)
 
     # return the roi splitview canvas, as well as the full merged image
-    return (canvas, full_merged_image, panel_y)
+    return (canvas, full_merged_image, panel_y, lines)
 
 
 def draw_rectangle(image, roi_x, roi_y, roi_x2, roi_y2, colour, stroke=1):
@@ -303,67 +298,37 @@ def draw_rectangle(image, roi_x, roi_y, roi_x2, roi_y2, colour, stroke=1):
         roi_y2 -= 1
 
 
-def get_rectangle(roi_service, image_id, roi_label):
+def get_rectangle(rectangles, image_id, roi_label):
     """
     Returns (x, y, width, height, zMin, zMax, tMin, tMax) of the first
     rectange in the image that has @roi_label as text
+
+    @param rectangles:  ShapeIndex of the rectangles of the images
     """
 
-    result = roi_service.findByImage(image_id, None)
+    rectangles = rectangles.for_image(image_id).of_type("Rectangle")
+    boxes = rectangles.shapes[["x", "y", "width", "height"]].tolist()
+    # t and z of a shape are optional
+    z_indexes = [0 if z == UNSET else z for z in rectangles.column("z")]
+    t_indexes = [0 if t == UNSET else t for t in rectangles.column("t")]
 
     roi_text = roi_label.lower()
-    roi_count = 0
-    rect_count = 0
-    found_labelled_roi = False
-
-    for roi in result.rois:
-        roi_count += 1
-        # go through all the shapes of the ROI
-        for shape in roi.copyShapes():
-            if type(shape) == omero.model.RectangleI:
-                the_t = unwrap(shape.getTheT())
-                the_z = unwrap(shape.getTheZ())
-                t = 0
-                z = 0
-                if the_t is not None:
-                    t = the_t
-                if the_z is not None:
-                    z = the_z
-                x = shape.getX().getValue()
-                y = shape.getY().getValue()
-                tv = shape.getTextValue()
-                if tv is not None:
-                    text = tv.getValue()
-                else:
-                    text = ""
-
-                # get ranges for whole ROI
-                if rect_count == 0:
-                    z_min = z
-                    z_max = z_min
-                    t_min = t
-                    t_max = t_min
-                    width = shape.getWidth().getValue()
-                    height = shape.getHeight().getValue()
-                else:
-                    z_min = min(z_min, z)
-                    z_max = max(z_max, z)
-                    t_min = min(t_min, t)
-                    t_max = max(t_max, t)
-                rect_count += 1
-                if text is not None and text.lower() == roi_text:
-                    found_labelled_roi = True
-        if found_labelled_roi:
-            return (int(x), int(y), int(width), int(height), int(z_min),
-                    int(z_max), int(t_min), int(t_max))
-        else:
-            rect_count = 0    # try another ROI
+    rect = None
+    for shapes in rectangles.rois():
+        # get ranges for whole ROI
+        z = [z_indexes[i] for i in shapes]
+        t = [t_indexes[i] for i in shapes]
+        x, y = boxes[shapes[-1]][:2]
+        width, height = boxes[shapes[0]][2:]
+        rect = (int(x), int(y), int(width), int(height), int(min(z)),
+                int(max(z)), int(min(t)), int(max(t)))
+        texts = [(rectangles.text[i] or "").lower() for i in shapes]
+        if roi_text in texts:
+            return rect
 
     # if we got here without finding an ROI that matched, simply return any
     # ROI we have (last one)
-    if roi_count > 0:
-        return (int(x), int(y), int(width), int(height), int(z_min),
-                int(z_max), int(t_min), int(t_max))
+    return rect
 
 
 def get_split_view(conn, image_ids, pixel_ids, split_indexes, channel_names,
@@ -397,13 +362,13 @@ def get_split_view(conn, image_ids, pixel_ids, split_indexes, channel_names,
                         between rows.
     """
 
-    roi_service = conn.getRoiService()
-    re = conn.createRenderingEngine()
     query_service = conn.getQueryService()    # only needed for movie
+    # the rectangles of all the images at once
+    rectangles = ShapeIndex.load(conn, image_ids, ("Rectangle",))
 
     # establish dimensions and roiZoom for the primary image
     # getTheseValues from the server
-    rect = get_rectangle(roi_service, image_ids[0], roi_label)
+    rect = get_rectangle(rectangles, image_ids[0], roi_label)
     if rect is None:
         raise Exception("No ROI found for the first image.")
     roi_x, roi_y, roi_width, roi_height, y_min, y_max, t_min, t_max = rect
@@ -446,17 +411,51 @@ def get_split_view(conn, image_ids, pixel_ids, split_indexes, channel_names,
     show_labels_above_every_row = False
     invalid_images = []      # note any image row indexes that don't have ROIs.
 
+    # need to get the roi dimensions from the server
+    rois = [get_rectangle(rectangles, image_ids[row], roi_label)
+            for row in range(len(pixel_ids))]
+    valid_rows = [row for row, roi in enumerate(rois) if roi is not None]
+
+    panels = PanelCache(conn)
+
+    def render_row(re, pixels_id, roi, show_top_labels):
+        """
+        Get the split pane and full merged image of one row, on an engine
+        set up for pixels_id.
+        """
+        roi_x, roi_y, roi_width, roi_height, z_min, z_max, t_start, t_end = roi
+        pixels = query_service.get("Pixels", pixels_id)
+        # render the panels from the raw planes if the settings allow, or
+        # read them from the cache
+        with local_engine(conn, re) as engine:
+            return (pixels,) + get_roi_split_view(
+                panels.engine(re, engine), pixels, z_min, z_max,
+                split_indexes, channel_names, merged_names, colour_channels,
+                merged_indexes, merged_colours, roi_x, roi_y, roi_width,
+                roi_height, roi_zoom, t_start, spacer, algorithm, stepping,
+                fontsize, show_top_labels)
+
+    # render the rows concurrently, each on its own rendering engine
+    with RenderingEnginePool(conn) as pool:
+        # if we are missing some merged colours, get them from the first
+        # image
+        missing = [i for i in merged_indexes if i not in merged_colours]
+        if missing and valid_rows:
+            merged_colours.update(pool.submit(
+                get_channel_colours, pixel_ids[valid_rows[0]],
+                missing).result())
+        # only show top labels for first row
+        rendered = dict(zip(valid_rows, pool.map(
+            render_row, [pixel_ids[row] for row in valid_rows],
+            [rois[row] for row in valid_rows],
+            [show_labels_above_every_row or row == 0
+             for row in valid_rows])))
+    log(panels.report())
+
     for row, pixels_id in enumerate(pixel_ids):
         log("Rendering row %d" % (row))
 
-        if show_labels_above_every_row:
-            show_top_labels = True
-        else:
-            show_top_labels = (row == 0)  # only show top labels for first row
-
-        # need to get the roi dimensions from the server
-        image_id = image_ids[row]
-        roi = get_rectangle(roi_service, image_id, roi_label)
+        roi = rois[row]
         if roi is None:
             log("No Rectangle ROI found for this image")
             invalid_images.append(row)
@@ -464,7 +463,8 @@ def get_split_view(conn, image_ids, pixel_ids, split_indexes, channel_names,
 
         roi_x, roi_y, roi_width, roi_height, z_min, z_max, t_start, t_end = roi
 
-        pixels = query_service.get("Pixels", pixels_id)
+        pixels, roi_split_pane, full_merged_image, top_spacer, lines = \
+            rendered[row]
         size_x = pixels.getSizeX().getValue()
         size_y = pixels.getSizeY().getValue()
 
@@ -483,12 +483,8 @@ def get_split_view(conn, image_ids, pixel_ids, split_indexes, channel_names,
             " %d  height: %d" % (roi_x, roi_y, roi_width, roi_height))
         log("  ROI time: %d - %d   zRange: %d - %d"
             % (t_start+1, t_end+1, z_start+1, z_end+1))
-        # get the split pane and full merged image
-        roi_split_pane, full_merged_image, top_spacer = get_roi_split_view(
-            re, pixels, z_start, z_end, split_indexes, channel_names,
-            merged_names, colour_channels, merged_indexes, merged_colours,
-            roi_x, roi_y, roi_width, roi_height, roi_zoom, t_start, spacer,
-            algorithm, stepping, fontsize, show_top_labels)
+        for line in lines:
+            log(line)
 
         # and now zoom the full-sized merged image, add scalebar
         merged_image = image_utils.resize_image(full_merged_image, width,
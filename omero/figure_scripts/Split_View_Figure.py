@@ -32,26 +32,29 @@ image per row, displayed as a split view with merged image.
 """
 
 import omero.scripts as scripts
-import omero.util.figureUtil as figUtil
-import omero.util.image_utils as image_utils
-import omero.util.script_utils as script_utils
 import omero
 from omero.gateway import BlitzGateway
 from omero.rtypes import rint, rlong, rstring, robject, wrap
 from omero.constants.namespaces import NSCREATED
 from omero.constants.projection import ProjectionType
+from omero.script_helpers import colours
+from omero.script_helpers.render_pool import (RenderingEnginePool,
+                                              get_channel_colours)
+from omero.script_helpers.local_render import local_engine
+from omero.script_helpers.lazy import lazy_import
+from omero.script_helpers.panel_cache import PanelCache
 import os
 import io
 from datetime import date
 
-try:
-    from PIL import Image, ImageDraw  # see ticket:2597
-except ImportError:
-    import Image
-    import ImageDraw  # see ticket:2597
+Image = lazy_import("PIL.Image")
+ImageDraw = lazy_import("PIL.ImageDraw")
+image_utils = lazy_import("omero.util.image_utils")
+figUtil = lazy_import("omero.util.figureUtil")
+script_utils = lazy_import("omero.util.script_utils")
 
-COLOURS = script_utils.COLOURS    # name:(rgba) map
-OVERLAY_COLOURS = dict(COLOURS, **script_utils.EXTRA_COLOURS)
+COLOURS = colours.COLOURS    # name:(rgba) map
+OVERLAY_COLOURS = dict(COLOURS, **colours.EXTRA_COLOURS)
 
 
 # keep track of log strings.
@@ -105,8 +108,6 @@ def get_split_view(conn, pixel_ids, z_start, z_end, split_indexes,
     mode = "RGB"
     white = (255, 255, 255)
 
-    # create a rendering engine
-    re = conn.createRenderingEngine()
     query_service = conn.getQueryService()
 
     row_panels = []
@@ -127,43 +128,16 @@ def get_split_view(conn, pixel_ids, z_start, z_end, split_indexes,
     else:
         log("Images show last-viewed Z-section")
 
-    for row, pixels_id in enumerate(pixel_ids):
-        log("Rendering row %d" % (row+1))
-
+    def render_row(re, pixels_id):
+        """
+        Render the merged and split panels of one row, on an engine set up
+        for pixels_id. Returns (pixels, merged, split panels, log lines).
+        """
+        lines = []
         pixels = query_service.get("Pixels", pixels_id)
-        size_x = pixels.getSizeX().getValue()
-        size_y = pixels.getSizeY().getValue()
         size_z = pixels.getSizeZ().getValue()
         size_c = pixels.getSizeC().getValue()
 
-        if pixels.getPhysicalSizeX():
-            physical_x = pixels.getPhysicalSizeX().getValue()
-        else:
-            physical_x = 0
-        if pixels.getPhysicalSizeY():
-            physical_y = pixels.getPhysicalSizeY().getValue()
-        else:
-            physical_y = 0
-        log("  Pixel size (um): x: %.3f  y: %.3f" % (physical_x, physical_y))
-        if row == 0:    # set values for primary image
-            physical_size_x = physical_x
-            physical_size_y = physical_y
-        else:  # compare primary image with current one
-            if physical_size_x != physical_x or physical_size_y != physical_y:
-                log(" WARNING: Images have different pixel lengths."
-                    " Scales are not comparable.")
-
-        log("  Image dimensions (pixels): x: %d  y: %d" % (size_x, size_y))
-        max_image_width = max(max_image_width, size_x)
-
-        # set up rendering engine with the pixels
-        re.lookupPixels(pixels_id)
-        if not re.lookupRenderingDef(pixels_id):
-            re.resetDefaults()
-        if not re.lookupRenderingDef(pixels_id):
-            raise "Failed to lookup Rendering Def"
-        re.load()
-
         pro_start = z_start
         pro_end = z_end
         # make sure we're within Z range for projection.
@@ -171,23 +145,23 @@ def get_split_view(conn, pixel_ids, z_start, z_end, split_indexes,
             pro_end = size_z - 1
             if pro_start > size_z:
                 pro_start = 0
-            log(" WARNING: Current image has fewer Z-sections than the"
-                " primary image.")
+            lines.append(" WARNING: Current image has fewer Z-sections than"
+                         " the primary image.")
 
         # if we have an invalid z-range (start or end less than 0), show
         # default Z only
         if pro_start < 0 or pro_end < 0:
             pro_start = re.getDefaultZ()
             pro_end = pro_start
-            log("  Display Z-section: %d" % (pro_end+1))
+            lines.append("  Display Z-section: %d" % (pro_end+1))
         else:
-            log("  Projecting z range: %d - %d   (max Z is %d)"
-                % (pro_start+1, pro_end+1, size_z))
+            lines.append("  Projecting z range: %d - %d   (max Z is %d)"
+                         % (pro_start+1, pro_end+1, size_z))
 
         # turn on channels in merged_indexes
         for i in range(size_c):
             re.setActive(i, False)      # Turn all off first
-        log("Turning on merged_indexes: %s ..." % merged_indexes)
+        lines.append("Turning on merged_indexes: %s ..." % merged_indexes)
         for i in merged_indexes:
             if i >= size_c:
                 channel_mismatch = True
@@ -198,7 +172,7 @@ def get_split_view(conn, pixel_ids, z_start, z_end, split_indexes,
 
         # get the combined image, using the existing rendering settings
         channels_string = ", ".join([channel_names[i] for i in merged_indexes])
-        log("  Rendering merged channels: %s" % channels_string)
+        lines.append("  Rendering merged channels: %s" % channels_string)
         if pro_start != pro_end:
             overlay = re.renderProjectedCompressed(
                 algorithm, timepoint, stepping, pro_start, pro_end)
@@ -231,8 +205,6 @@ def get_split_view(conn, pixel_ids, z_start, z_end, split_indexes,
                         if index in merged_colours:
                             rgba = tuple(merged_colours[index])
                             re.setRGBA(index, *rgba)        # set coloured
-                        else:
-                            merged_colours[index] = re.getRGBA(index)
                     else:
                         # otherwise set white (max alpha)
                         re.setRGBA(index, 255, 255, 255, 255)
@@ -241,7 +213,8 @@ def get_split_view(conn, pixel_ids, z_start, z_end, split_indexes,
                     re.setRGBA(index, 255, 255, 255, 255)
                 info = (index, re.getChannelWindowStart(index),
                         re.getChannelWindowEnd(index))
-                log("  Render channel: %s  start: %d  end: %d" % info)
+                lines.append("  Render channel: %s  start: %d  end: %d"
+                             % info)
                 if pro_start != pro_end:
                     rendered_img = re.renderProjectedCompressed(
                         algorithm, timepoint, stepping, pro_start, pro_end)
@@ -255,8 +228,61 @@ def get_split_view(conn, pixel_ids, z_start, z_end, split_indexes,
                 re.setActive(index, False)  # turn the channel off again!
 
         if channel_mismatch:
-            log(" WARNING channel mismatch: The current image has fewer"
-                " channels than the primary image.")
+            lines.append(" WARNING channel mismatch: The current image has"
+                         " fewer channels than the primary image.")
+        return pixels, overlay, rendered_images, lines
+
+    panels = PanelCache(conn)
+
+    def render_row_locally(re, pixels_id):
+        """
+        Render a row from the raw planes if its settings allow, so that
+        all panels of the row share one download of each plane. Panels
+        rendered before with the same settings are read from the cache.
+        """
+        with local_engine(conn, re) as engine:
+            return render_row(panels.engine(re, engine), pixels_id)
+
+    # render the rows concurrently, each on its own rendering engine
+    with RenderingEnginePool(conn) as pool:
+        if colour_channels and pixel_ids:
+            # split channels that are also merged take the colour of the
+            # primary image
+            missing = [i for i in split_indexes if i in merged_indexes and
+                       i not in merged_colours]
+            if missing:
+                merged_colours.update(pool.submit(
+                    get_channel_colours, pixel_ids[0], missing).result())
+        rows = pool.map(render_row_locally, pixel_ids)
+    log(panels.report())
+
+    for row, (pixels, overlay, rendered_images, lines) in enumerate(rows):
+        log("Rendering row %d" % (row+1))
+
+        size_x = pixels.getSizeX().getValue()
+        size_y = pixels.getSizeY().getValue()
+
+        if pixels.getPhysicalSizeX():
+            physical_x = pixels.getPhysicalSizeX().getValue()
+        else:
+            physical_x = 0
+        if pixels.getPhysicalSizeY():
+            physical_y = pixels.getPhysicalSizeY().getValue()
+        else:
+            physical_y = 0
+        log("  Pixel size (um): x: %.3f  y: %.3f" % (physical_x, physical_y))
+        if row == 0:    # set values for primary image
+            physical_size_x = physical_x
+            physical_size_y = physical_y
+        else:  # compare primary image with current one
+            if physical_size_x != physical_x or physical_size_y != physical_y:
+                log(" WARNING: Images have different pixel lengths."
+                    " Scales are not comparable.")
+
+        log("  Image dimensions (pixels): x: %d  y: %d" % (size_x, size_y))
+        max_image_width = max(max_image_width, size_x)
+        for line in lines:
+            log(line)
 
         # make a canvas for the row of splitview images...
         # extra image for combined image
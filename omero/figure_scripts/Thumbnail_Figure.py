@@ -36,20 +36,19 @@ project.
 from io import BytesIO
 import omero.scripts as scripts
 from omero.gateway import BlitzGateway
-import omero.util.script_utils as script_utils
 from omero.rtypes import rint, rlong, rstring, robject
 from omero.constants.namespaces import NSCREATED
+from omero.script_helpers.lazy import lazy_import
+from omero.script_helpers.thumbnail_cache import ThumbnailCache
 import os
 
-try:
-    from PIL import Image, ImageDraw, ImageFont
-except ImportError:
-    import Image
-    import ImageDraw  # see ticket:2597
-    import ImageFont
-
 from omero.gateway import THISPATH as GATEWAYPATH
 
+Image = lazy_import("PIL.Image")
+ImageDraw = lazy_import("PIL.ImageDraw")
+ImageFont = lazy_import("PIL.ImageFont")
+script_utils = lazy_import("omero.util.script_utils")
+
 
 WHITE = (255, 255, 255)
 
@@ -110,7 +109,7 @@ def paint_thumbnail_grid(thumbnail_store, length, spacing, pixel_ids,
     Option to add a vertical label to the left of the canvas
     Creates a PIL 'Image' which is returned
 
-    @param thumbnail_store: The omero thumbnail store.
+    @param thumbnail_store: The omero thumbnail store, or a ThumbnailCache.
     @param length:          Length of longest thumbnail side, int
     @param spacing:         The spacing between thumbnails and around the
                             edges. int
@@ -271,7 +270,9 @@ def paint_dataset_canvas(conn, images, title, tag_ids=None,
     fig_canvas = None
     spacing = length//40 + 2
 
-    thumbnail_store = conn.createThumbnailStore()
+    # thumbnails fetched by earlier figures are read from disk, unless the
+    # rendering settings changed since
+    thumbnail_store = ThumbnailCache(conn)
     metadata_service = conn.getMetadataService()
 
     if len(images) == 0:
@@ -296,6 +297,8 @@ def paint_dataset_canvas(conn, images, title, tag_ids=None,
         image_names[image_id] = name
         timestamp_min = min(timestamp_min, image.getDate())
         timestamp_max = max(timestamp_max, image.getDate())
+    # when the rendering settings of all images last changed, in one go
+    thumbnail_store.settings_events(image_pixel_map.values())
 
     # set-up fonts
     fontsize = length/7 + 5
@@ -469,6 +472,7 @@ def paint_dataset_canvas(conn, images, title, tag_ids=None,
     for pane in tag_panes:
         paste_image(pane, full_canvas, p_x, p_y)
         p_y += pane.size[1] + tagset_spacer
+    log(thumbnail_store.report())
 
     # create dates for the image timestamps. If dates are not the same, show
     # first - last.
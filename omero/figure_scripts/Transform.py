@@ -25,29 +25,35 @@ Flip or Rotate an Image and create a new Image in OMERO
 
 import omero
 import omero.scripts as scripts
-from numpy import rot90, fliplr, flipud
 from omero.gateway import BlitzGateway
 from omero.rtypes import rint, rlong, rstring, robject
+from omero.script_helpers.batch_writer import BatchWriter
+from omero.script_helpers.lazy import lazy_import
+from omero.script_helpers.prefetch import prefetch
+from omero.script_helpers.process_pool import map_images
+from omero.script_helpers.uploader import create_image_from_numpy_seq
+
+numpy = lazy_import("numpy")
 
 
 def rotate90(plane):
-    return rot90(plane)
+    return numpy.rot90(plane)
 
 
 def rotate180(plane):
-    return rot90(plane, 2)
+    return numpy.rot90(plane, 2)
 
 
 def rotate270(plane):
-    return rot90(plane, 3)
+    return numpy.rot90(plane, 3)
 
 
 def flipHorizontal(plane):
-    return fliplr(plane)
+    return numpy.fliplr(plane)
 
 
 def flipVertical(plane):
-    return flipud(plane)
+    return numpy.flipud(plane)
 
 
 # The transforms that we support
@@ -101,36 +107,55 @@ def createImageFromTransform(conn, image, transforms):
             yield p
 
     # Create new image with the plane generator prepared above (don't need all
-    # the planes in memory at once)
+    # the planes in memory at once), fetching the next planes while each one
+    # is uploaded
     imageName = "%s-transformed" % image.getName()
     dataset = image.getParent()
     tfList = "\n".join(transforms)
     description = "Created from Image ID: %s by applying the following"\
         " transforms:\n%s" % (image.id, tfList)
 
-    newImg = conn.createImageFromNumpySeq(
-        planeGen(), imageName, sizeZ=sizeZ, sizeC=sizeC, sizeT=sizeT,
-        description=description, dataset=dataset)
+    newImg = create_image_from_numpy_seq(
+        conn, prefetch(planeGen()), imageName, sizeZ=sizeZ, sizeC=sizeC,
+        sizeT=sizeT, description=description, dataset=dataset)
 
     # Apply colors from the original image to the new one
-    for i, c in enumerate(newImg.getChannels()):
-        lc = c.getLogicalChannel()
-        lc.setName(cNames[i])
-        lc.save()
-        r, g, b = colors[i]
-        # need to reload channels to avoid optimistic lock on update
-        cObj = conn.getQueryService().get("Channel", c.id)
-        cObj.red = rint(r)
-        cObj.green = rint(g)
-        cObj.blue = rint(b)
-        cObj.alpha = rint(255)
-        conn.getUpdateService().saveObject(cObj)
+    channels = newImg.getChannels()
+    # need to reload channels to avoid optimistic lock on update
+    params = omero.sys.ParametersI()
+    params.addIds([c.id for c in channels])
+    cObjs = dict((cObj.id.val, cObj) for cObj in
+                 conn.getQueryService().findAllByQuery(
+                     "select c from Channel c where c.id in (:ids)", params))
+    # save names and colors of all channels together
+    with BatchWriter(conn) as writer:
+        for i, c in enumerate(channels):
+            lc = c.getLogicalChannel()
+            lc.setName(cNames[i])
+            writer.add(lc._obj)
+            r, g, b = colors[i]
+            cObj = cObjs[c.id]
+            cObj.red = rint(r)
+            cObj.green = rint(g)
+            cObj.blue = rint(b)
+            cObj.alpha = rint(255)
+            writer.add(cObj)
 
     newImg.resetRDefs()  # reset based on colors above
 
     return newImg
 
 
+def transformImage(conn, imageId, transforms):
+    """
+    createImageFromTransform() in a worker process of transformImages.
+
+    @return:            ID of the new Image
+    """
+    image = conn.getObject("Image", imageId)
+    return createImageFromTransform(conn, image, transforms).getId()
+
+
 def transformImages(conn, scriptParams):
     """
     Processes the list of Images and returns a single Image or Dataset and
@@ -143,11 +168,10 @@ def transformImages(conn, scriptParams):
 
     transforms = scriptParams["Transforms"]
 
-    newImages = []
-    for image in conn.getObjects("Image", scriptParams["IDs"]):
-
-        newImg = createImageFromTransform(conn, image, transforms)
-        newImages.append(newImg)
+    imageIds = [image.getId() for image in
+                conn.getObjects("Image", scriptParams["IDs"])]
+    newImages = [conn.getObject("Image", newId) for newId in
+                 map_images(conn, transformImage, imageIds, transforms)]
 
     # Handle what we're returning to client
     if len(newImages) == 0:
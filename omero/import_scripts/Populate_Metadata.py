@@ -27,15 +27,19 @@ from omero.gateway import BlitzGateway
 from omero.rtypes import rstring, rlong
 import omero.scripts as scripts
 import omero.model
+from omero.script_helpers.lazy import lazy_import
 
+import importlib.util
 import sys
 
-from omero.util.populate_roi import DownloadingOriginalFileProvider
+populate_roi = lazy_import("omero.util.populate_roi")
 
-try:
+# only look for the metadata plugin here: it is imported when the script
+# runs
+if importlib.util.find_spec("omero_metadata") is not None:
     # Hopefully this will import
     # https://github.com/ome/omero-metadata/blob/v0.3.1/src/populate_metadata.py
-    from omero_metadata.populate import ParsingContext
+    populate = lazy_import("omero_metadata.populate")
     OBJECT_TYPES = (
         'Plate',
         'Screen',
@@ -44,9 +48,8 @@ try:
         'Image',
     )
     DEPRECATED = ""
-
-except ImportError:
-    from omero.util.populate_metadata import ParsingContext
+else:
+    populate = lazy_import("omero.util.populate_metadata")
     OBJECT_TYPES = (
         'Plate',
         'Screen',
@@ -119,7 +122,7 @@ def populate_metadata(client, conn, script_params):
         link_file_ann(conn, data_type, object_id, file_ann_id)
     original_file = get_original_file(
         conn, data_type, object_id, file_ann_id)
-    provider = DownloadingOriginalFileProvider(conn)
+    provider = populate_roi.DownloadingOriginalFileProvider(conn)
     data_for_preprocessing = provider.get_original_file_data(original_file)
     temp_name = data_for_preprocessing.name
     # 5.9.1 returns NamedTempFile where name is a string.
@@ -129,7 +132,7 @@ def populate_metadata(client, conn, script_params):
         return "Please upgrade omero-py to 5.9.1 or later"
     objecti = getattr(omero.model, data_type + 'I')
     omero_object = objecti(int(object_id), False)
-    ctx = ParsingContext(client, omero_object, "")
+    ctx = populate.ParsingContext(client, omero_object, "")
 
     try:
         if hasattr(ctx, "parse_from_handle"):
@@ -33,7 +33,9 @@ params:
 """
 
 import omero.scripts as scripts
-from omero.util.populate_roi import PlateAnalysisCtxFactory
+from omero.script_helpers.lazy import lazy_import
+
+populate_roi = lazy_import("omero.util.populate_roi")
 
 client = scripts.client(
     'Populate_ROI.py',
@@ -48,7 +50,7 @@ associated with a plate
 This script is executed by the server on initial import, and should typically\
 not need to be run by users.""")
 
-factory = PlateAnalysisCtxFactory(client.getSession())
+factory = populate_roi.PlateAnalysisCtxFactory(client.getSession())
 analysis_ctx = factory.get_analysis_ctx(client.getInput("Plate_ID").val)
 n_measurements = analysis_ctx.get_measurement_count()
 
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2024 University of Muenster. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+The annotations of many objects, loaded at once.
+
+``obj.listAnnotations()`` costs a round-trip per object, so reading the
+key-value pairs of a screen costs one per image. :func:`load_annotations`
+reads the annotations linked to all the objects with one query per 1000
+objects, and returns them as small dicts grouped by object::
+
+    annotations = load_annotations(conn, "Image", image_ids,
+                                   types=("MapAnnotation",))
+    for image_id in image_ids:
+        key_values = map_values(annotations[image_id])
+
+Each dict has the annotation ``id``, its ``type`` (e.g. 'MapAnnotation'),
+``ns`` and the ``link_id`` to the object, and by type:
+
+- MapAnnotation: ``values``, the list of [key, value]
+- FileAnnotation: ``file``, the OriginalFile, and its ``file_name``
+- other annotations: ``value``, their text, number or boolean
+"""
+
+from collections import OrderedDict
+
+from omero.rtypes import rlist, rstring, unwrap
+from omero.sys import ParametersI
+
+# the field with the value of the other annotation types
+VALUE_FIELDS = {"TagAnnotation": "textValue",
+                "CommentAnnotation": "textValue",
+                "XmlAnnotation": "textValue",
+                "LongAnnotation": "longValue",
+                "DoubleAnnotation": "doubleValue",
+                "BooleanAnnotation": "boolValue",
+                "TermAnnotation": "termValue",
+                "TimestampAnnotation": "timeValue"}
+
+ANNOTATION_TYPES = ("MapAnnotation", "FileAnnotation") + tuple(
+    sorted(VALUE_FIELDS))
+
+LINK_QUERY = ("select link from %sAnnotationLink link "
+              "join fetch link.child a where link.parent.id in (:ids)")
+NS_FILTER = " and a.ns in (:ns)"
+TYPE_FILTER = " and a.class in (%s)"
+FILE_QUERY = ("select a from FileAnnotation a join fetch a.file "
+              "where a.id in (:ids)")
+
+# object IDs per query
+ID_BATCH = 1000
+
+
+def _type_name(obj):
+    """'MapAnnotationI' -> 'MapAnnotation'."""
+    name = obj.__class__.__name__
+    return name[:-1] if name.endswith("I") else name
+
+
+def build_query(object_type, ns=None, types=None):
+    """
+    The HQL of the annotation links of object_type, filtered by namespace
+    and annotation types.
+    """
+    query = LINK_QUERY % object_type
+    if ns is not None:
+        query += NS_FILTER
+    if types is not None:
+        for name in types:
+            if name not in ANNOTATION_TYPES:
+                raise ValueError("Unknown annotation type: %s" % name)
+        query += TYPE_FILTER % ", ".join(types)
+    return query
+
+
+def _annotation_dict(link):
+    ann = link.child
+    data = {"id": unwrap(ann.id), "type": _type_name(ann),
+            "ns": unwrap(ann.ns), "link_id": unwrap(link.id)}
+    if data["type"] == "MapAnnotation":
+        data["values"] = [[nv.name, nv.value]
+                          for nv in (ann.getMapValue() or [])]
+    elif data["type"] == "FileAnnotation":
+        data["file"] = None
+        data["file_name"] = None
+    elif data["type"] in VALUE_FIELDS:
+        data["value"] = unwrap(getattr(ann, VALUE_FIELDS[data["type"]]))
+    return data
+
+
+def load_annotations(conn, object_type, ids, ns=None, types=None):
+    """
+    The annotations linked to objects of object_type, e.g. 'Image'.
+
+    :param ids:     The object IDs
+    :param ns:      A namespace, or list of namespaces, to keep
+    :param types:   Names from ANNOTATION_TYPES to keep. Default: all
+    :return:        Dict of object ID: list of annotation dicts, in the
+                    order they were linked. Every ID is a key.
+    """
+    ids = list(ids)
+    if isinstance(ns, str):
+        ns = [ns]
+    query = build_query(object_type, ns, types)
+    query_service = conn.getQueryService()
+    annotations = OrderedDict((oid, []) for oid in ids)
+    files = {}
+    for start in range(0, len(ids), ID_BATCH):
+        params = ParametersI()
+        params.addIds(ids[start:start + ID_BATCH])
+        if ns is not None:
+            params.add("ns", rlist([rstring(n) for n in ns]))
+        links = query_service.findAllByQuery(query, params,
+                                             conn.SERVICE_OPTS)
+        for link in sorted(links, key=lambda link: unwrap(link.id)):
+            data = _annotation_dict(link)
+            annotations.setdefault(unwrap(link.parent.id), []).append(data)
+            if data["type"] == "FileAnnotation":
+                files.setdefault(data["id"], []).append(data)
+    # the OriginalFiles, which the links cannot fetch
+    file_ids = list(files)
+    for start in range(0, len(file_ids), ID_BATCH):
+        params = ParametersI()
+        params.addIds(file_ids[start:start + ID_BATCH])
+        for ann in query_service.findAllByQuery(FILE_QUERY, params,
+                                                conn.SERVICE_OPTS):
+            for data in files[unwrap(ann.id)]:
+                data["file"] = ann.file
+                data["file_name"] = unwrap(ann.file.name)
+    return annotations
+
+
+def of_type(annotations, *types):
+    """The annotation dicts of any of types."""
+    return [ann for ann in annotations if ann["type"] in types]
+
+
+def map_values(annotations):
+    """
+    The key-value pairs of the map annotations among annotations, as an
+    OrderedDict of key: set of values.
+    """
+    key_values = OrderedDict()
+    for ann in of_type(annotations, "MapAnnotation"):
+        for key, value in ann["values"]:
+            key_values.setdefault(key, set()).add(value)
+    return key_values
@@ -0,0 +1,416 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2024 University of Muenster. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Runs a list of script jobs from the command line, without the scripting
+service.
+
+The scripting service starts a new process and session for every script it
+runs. ``omero-scripts-batch`` logs in once and calls the main function of
+each script, e.g. ``batch_image_export(conn, script_params)``, with the
+parameters of the job::
+
+    omero-scripts-batch jobs.yaml -s omero.example.org -u alice --jobs 4
+
+The job file, YAML or JSON, lists the jobs, with parameters shared by all::
+
+    params:
+      Data_Type: Dataset
+    jobs:
+      - name: plate-1
+        script: util_scripts/Dataset_To_Plate.py
+        function: datasets_to_plates
+        params: {IDs: [101], Images_Per_Well: 4}
+      - name: export-1
+        script: export_scripts/Batch_Image_Export.py
+        function: batch_image_export
+        params: {Data_Type: Image, IDs: [1, 2, 3], Format: PNG}
+        after: [plate-1]
+
+``script`` is relative to the directory of the scripts (``--scripts-dir``,
+default: the installed ones) or an absolute path. Parameters that a job
+leaves out take the defaults of the script, as on the server, unless the
+job sets ``script_defaults: false``. A job starts once the jobs it is
+``after`` are done, and is skipped if one of them failed.
+
+Up to ``--jobs`` (default ``OMERO_SCRIPTS_BATCH_JOBS``, else 4) jobs run
+at once, each in a worker process that joins the session of the runner and
+runs one job after the other. With ``--jobs 1`` the jobs run in the
+runner's own process. Each job runs in a new temporary directory, and its
+output goes to ``<name>.log`` in ``--log-dir``. The runner prints a line
+per job and, with ``--report``, writes the results as JSON. It exits with 1
+if a job failed or was skipped.
+"""
+
+import argparse
+import getpass
+import importlib.util
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from contextlib import redirect_stderr, redirect_stdout
+
+from omero.script_helpers import process_pool
+from omero.script_helpers.journal import close_journals
+from omero.script_helpers.lazy import lazy_import
+from omero.script_helpers.process_pool import worker_args
+
+yaml = lazy_import("yaml")
+
+DEFAULT_JOBS = 4
+ENV_JOBS = "OMERO_SCRIPTS_BATCH_JOBS"
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_LOG_DIR = "omero_batch_logs"
+
+OK, FAILED, SKIPPED = "ok", "failed", "skipped"
+
+
+def read_jobs(path):
+    """The jobs of a YAML or JSON job file, see :func:`parse_jobs`."""
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    if os.path.splitext(path)[1].lower() == ".json":
+        data = json.loads(text)
+    else:
+        try:
+            data = yaml.safe_load(text)
+        except ImportError:
+            raise ValueError("Reading %s needs PyYAML; write the jobs as "
+                             "JSON instead" % path)
+    return parse_jobs(data)
+
+
+def parse_jobs(data):
+    """
+    Checks and completes the jobs of a job file.
+
+    :param data:    The list of jobs, or a dict with the ``jobs`` and the
+                    ``params`` shared by all
+    :return:        List of job dicts with name, script, function, params,
+                    after and script_defaults
+    """
+    shared = {}
+    if isinstance(data, dict):
+        shared = data.get("params") or {}
+        data = data.get("jobs")
+    if not isinstance(data, list) or not data:
+        raise ValueError("No jobs found")
+    jobs = []
+    names = set()
+    for i, entry in enumerate(data):
+        name = str(entry.get("name") or "job-%d" % (i + 1))
+        if name in names:
+            raise ValueError("Two jobs are named %s" % name)
+        for key in ("script", "function"):
+            if not entry.get(key):
+                raise ValueError("Job %s has no %s" % (name, key))
+        params = dict(shared)
+        params.update(entry.get("params") or {})
+        after = entry.get("after") or []
+        if isinstance(after, str):
+            after = [after]
+        jobs.append({"name": name, "script": entry["script"],
+                     "function": entry["function"], "params": params,
+                     "after": [str(a) for a in after],
+                     "script_defaults": entry.get("script_defaults", True)})
+        names.add(name)
+    for job in jobs:
+        for other in job["after"]:
+            if other not in names:
+                raise ValueError("Job %s is after unknown job %s"
+                                 % (job["name"], other))
+    return jobs
+
+
+def script_path(script, scripts_dir=None):
+    """The path of script, relative to scripts_dir or absolute."""
+    if os.path.isabs(script):
+        return script
+    return os.path.join(scripts_dir or SCRIPTS_DIR, script)
+
+
+def load_script(path):
+    """A new module of the script at path, with nothing run but imports."""
+    name = "batch_%s" % re.sub(r"\W", "_", os.path.basename(path)[:-3])
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def script_defaults(path):
+    """The default values of the parameters of the script at path."""
+    from omero.rtypes import unwrap
+    from omero.scripts import parse_file
+    defaults = {}
+    for name, param in parse_file(path).inputs.items():
+        if param.useDefault:
+            defaults[name] = unwrap(param.prototype)
+    return defaults
+
+
+def job_params(job, path):
+    """The parameters of job, with the script's defaults filled in."""
+    params = script_defaults(path) if job["script_defaults"] else {}
+    params.update(job["params"])
+    return params
+
+
+def message_of(result):
+    """The message in the result of a script function, or None."""
+    if isinstance(result, str):
+        return result
+    if isinstance(result, (tuple, list)):
+        for value in reversed(result):
+            if isinstance(value, str):
+                return value
+    return None
+
+
+def log_name(name):
+    return "%s.log" % re.sub(r"[^\w.-]", "_", name)
+
+
+def run_job(conn, job, scripts_dir=None, log_dir=None):
+    """
+    Calls the function of job with conn and its parameters, in a new
+    temporary directory.
+
+    :param log_dir: Directory for the output of the job, else stdout
+    :return:        The result dict, with the job's name, status
+                    ('ok' or 'failed'), seconds, message and error
+    """
+    result = OrderedDict([("name", job["name"]), ("script", job["script"]),
+                          ("function", job["function"]), ("status", OK),
+                          ("seconds", 0.0), ("message", None),
+                          ("error", None), ("log", None)])
+    started = time.time()
+    cwd = os.getcwd()
+    scratch = tempfile.mkdtemp(prefix="omero-job-")
+    if log_dir is not None:
+        result["log"] = os.path.join(log_dir, log_name(job["name"]))
+        out = open(result["log"], "w", encoding="utf-8")
+    else:
+        out = sys.stdout
+    try:
+        with redirect_stdout(out), redirect_stderr(out):
+            try:
+                path = script_path(job["script"], scripts_dir)
+                params = job_params(job, path)
+                func = getattr(load_script(path), job["function"])
+                os.chdir(scratch)
+                result["message"] = message_of(func(conn, params))
+            except (Exception, SystemExit) as exc:
+                traceback.print_exc()
+                result["status"] = FAILED
+                result["error"] = "%s: %s" % (exc.__class__.__name__, exc)
+    finally:
+        # a failed job leaves its journal for a later job to resume
+        close_journals()
+        os.chdir(cwd)
+        shutil.rmtree(scratch, ignore_errors=True)
+        if out is not sys.stdout:
+            out.close()
+    result["seconds"] = round(time.time() - started, 3)
+    return result
+
+
+def _run_in_worker(job, scripts_dir, log_dir):
+    # the workers join the session as those of map_images do
+    return run_job(process_pool._conn, job, scripts_dir, log_dir)
+
+
+class _InProcess(object):
+    """Runs the jobs one by one when they are submitted."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def submit(self, func, job, scripts_dir, log_dir):
+        future = Future()
+        future.set_result(run_job(self.conn, job, scripts_dir, log_dir))
+        return future
+
+
+def _executor(conn, workers):
+    if workers == 1:
+        return _InProcess(conn)
+    # multiprocessing imports subprocess and more: only when needed
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    return ProcessPoolExecutor(
+        workers, multiprocessing.get_context("spawn"),
+        process_pool._init_worker, worker_args(conn))
+
+
+def skipped(job, reason):
+    return OrderedDict([("name", job["name"]), ("script", job["script"]),
+                        ("function", job["function"]), ("status", SKIPPED),
+                        ("seconds", 0.0), ("message", None),
+                        ("error", reason), ("log", None)])
+
+
+def run_jobs(conn, jobs, workers=None, scripts_dir=None, log_dir=None,
+             out=print):
+    """
+    Runs jobs, up to workers at once, each once the jobs it is after are
+    done.
+
+    :param workers:     Default from the OMERO_SCRIPTS_BATCH_JOBS
+                        environment variable, else 4
+    :param out:         Callable that writes a line per finished job
+    :return:            The result dicts, in the order the jobs finished
+    """
+    if workers is None:
+        workers = int(os.environ.get(ENV_JOBS, DEFAULT_JOBS))
+    workers = max(1, min(workers, len(jobs)))
+    if log_dir is not None and not os.path.isdir(log_dir):
+        os.makedirs(log_dir)
+    results = OrderedDict()
+    pending = list(jobs)
+    running = {}
+
+    def finish(result):
+        results[result["name"]] = result
+        line = "[%d/%d] %s %s in %.1f s" % (
+            len(results), len(jobs), result["name"], result["status"],
+            result["seconds"])
+        detail = result["message"] or result["error"]
+        out(line + (": %s" % detail if detail else ""))
+
+    with _executor(conn, workers) as executor:
+        while pending or running:
+            changed = True
+            while changed:
+                changed = False
+                for job in list(pending):
+                    status = [results[a]["status"] if a in results else None
+                              for a in job["after"]]
+                    if FAILED in status or SKIPPED in status:
+                        pending.remove(job)
+                        finish(skipped(job, "A job it is after did not "
+                                            "finish"))
+                        changed = True
+                    elif all(s == OK for s in status) and \
+                            len(running) < workers:
+                        pending.remove(job)
+                        future = executor.submit(_run_in_worker, job,
+                                                 scripts_dir, log_dir)
+                        running[future] = job
+                        changed = True
+            if not running:
+                # the rest wait for each other
+                for job in pending:
+                    finish(skipped(job, "Its jobs wait for each other"))
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = running.pop(future)
+                try:
+                    finish(future.result())
+                except Exception as exc:
+                    # the worker process died
+                    result = skipped(job, "%s: %s" % (
+                        exc.__class__.__name__, exc))
+                    result["status"] = FAILED
+                    finish(result)
+    return list(results.values())
+
+
+def connect(args):
+    """A BlitzGateway logged in, or joined to the session of args.key."""
+    import omero
+    from omero.gateway import BlitzGateway
+
+    if args.key:
+        client = omero.client(args.server, args.port)
+        client.joinSession(args.key).detachOnDestroy()
+        conn = BlitzGateway(client_obj=client)
+    else:
+        password = args.password
+        if password is None:
+            password = getpass.getpass("Password for %s: " % args.user)
+        conn = BlitzGateway(args.user, password, host=args.server,
+                            port=args.port, secure=True)
+        if not conn.connect():
+            raise SystemExit("Could not log in to %s as %s"
+                             % (args.server, args.user))
+    if args.group is not None:
+        conn.SERVICE_OPTS.setOmeroGroup(args.group)
+    return conn
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="omero-scripts-batch", description=__doc__.split("\n\n")[0])
+    parser.add_argument("job_file", help="YAML or JSON list of jobs")
+    parser.add_argument("-s", "--server", default="localhost")
+    parser.add_argument("-p", "--port", type=int, default=4064)
+    parser.add_argument("-u", "--user", default=getpass.getuser())
+    parser.add_argument("-w", "--password",
+                        help="asked for if not given")
+    parser.add_argument("-k", "--key", help="join this session instead")
+    parser.add_argument("-g", "--group", help="group ID to run the jobs in, "
+                        "-1 for all groups")
+    parser.add_argument("--jobs", type=int,
+                        help="jobs to run at once (default: %s or %d)"
+                        % (ENV_JOBS, DEFAULT_JOBS))
+    parser.add_argument("--scripts-dir", default=SCRIPTS_DIR,
+                        help="directory the scripts are relative to")
+    parser.add_argument("--log-dir", default=DEFAULT_LOG_DIR,
+                        help="directory for the output of each job")
+    parser.add_argument("--report", help="write the results as JSON here")
+    args = parser.parse_args(argv)
+
+    try:
+        jobs = read_jobs(args.job_file)
+    except (OSError, ValueError) as exc:
+        parser.error(str(exc))
+    conn = connect(args)
+    try:
+        results = run_jobs(conn, jobs, args.jobs, args.scripts_dir,
+                           args.log_dir)
+    finally:
+        # leave a joined session open for its owner
+        conn.close(hard=not args.key)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(results, f, indent=2)
+    failed = [r for r in results if r["status"] != OK]
+    print("%d job(s) done, %d failed or skipped"
+          % (len(results) - len(failed), len(failed)))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
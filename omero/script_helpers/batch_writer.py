@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2024 University of Muenster. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Saves model objects in chunks instead of one call per object.
+
+Objects are queued with :meth:`BatchWriter.add` and saved with one
+``saveArray`` call per chunk::
+
+    with BatchWriter(conn) as writer:
+        for image in images:
+            pixels = image.getPrimaryPixels()._obj
+            pixels.setPhysicalSizeX(size)
+            writer.add(pixels)
+    print(writer.report())
+
+A chunk is saved in one transaction, so one bad object fails the whole
+chunk. A failed chunk is split in two halves that are retried on their
+own, down to single objects, so that everything else is still saved. The
+objects that could not be saved are listed in ``failed`` with their error.
+
+The chunk size defaults to 500 and can be set with the
+``OMERO_SCRIPTS_BATCH_SIZE`` environment variable.
+"""
+
+import os
+
+DEFAULT_CHUNK_SIZE = 500
+ENV_CHUNK_SIZE = "OMERO_SCRIPTS_BATCH_SIZE"
+
+
+class BatchWriter(object):
+    """
+    :param conn:            The BlitzGateway connection
+    :param chunk_size:      Objects per saveArray call. Default from the
+                            OMERO_SCRIPTS_BATCH_SIZE environment
+                            variable, else 500
+    :param return_objects:  Use saveAndReturnArray and keep the saved
+                            objects in ``results``, in the order added
+    :param ctx:             Call context, e.g. conn.SERVICE_OPTS
+    """
+
+    def __init__(self, conn, chunk_size=None, return_objects=False,
+                 ctx=None):
+        if chunk_size is None:
+            chunk_size = int(os.environ.get(ENV_CHUNK_SIZE,
+                                            DEFAULT_CHUNK_SIZE))
+        self._conn = conn
+        self.chunk_size = max(1, chunk_size)
+        self.return_objects = return_objects
+        self.ctx = ctx
+        self._pending = []          # (object, callback)
+        self.results = []
+        self.failed = []            # (object, exception)
+        self.saved = 0
+        self.calls = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def add(self, obj, callback=None):
+        """
+        Queue obj to be saved, saving the queue once it is a full chunk.
+        callback(obj) is called once obj is saved, with the saved object
+        if return_objects is set.
+        """
+        self._pending.append((obj, callback))
+        if len(self._pending) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Save all queued objects."""
+        pending, self._pending = self._pending, []
+        if pending:
+            self._save(pending)
+
+    def close(self):
+        """Save all queued objects. Same as :meth:`flush`."""
+        self.flush()
+
+    def _save(self, items):
+        objs = [obj for obj, callback in items]
+        update = self._conn.getUpdateService()
+        self.calls += 1
+        try:
+            if self.return_objects:
+                saved = update.saveAndReturnArray(objs, self.ctx)
+            else:
+                update.saveArray(objs, self.ctx)
+                saved = objs
+        except Exception as exc:
+            if len(items) == 1:
+                self.failed.append((objs[0], exc))
+                return
+            half = len(items) // 2
+            self._save(items[:half])
+            self._save(items[half:])
+            return
+        self.saved += len(saved)
+        if self.return_objects:
+            self.results.extend(saved)
+        for (obj, callback), saved_obj in zip(items, saved):
+            if callback is not None:
+                callback(saved_obj)
+
+    def report(self):
+        """One line summary, for the script's log."""
+        message = "Saved %d objects in %d calls" % (self.saved, self.calls)
+        if self.failed:
+            message += ", %d failed: %s" % (len(self.failed),
+                                            self.failed[0][1])
+        return message
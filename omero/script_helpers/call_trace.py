@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2024 University of Muenster. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Trace of the server calls of a script, ranked by call site.
+
+Every call on a watched service (see
+:meth:`omero.script_helpers.instrumentation.Timings.watch`) is recorded
+with its method, a summary of its arguments, its latency and its payload,
+and is charged to the line of the script that made it. Lines inside the
+gateway, the OMERO utilities and this package are skipped, so a query run
+by ``conn.getObject("Well", well_id)`` in a loop shows up as one call site
+with as many calls as there are wells::
+
+    trace = CallTrace()
+    timings = Timings(trace)
+    timings.watch(conn)
+    ...
+    print(trace.report())
+
+Scripts trace their calls if the ``OMERO_SCRIPTS_TRACE`` environment
+variable is set, adding the most expensive call sites to their ``Timings``
+output.
+"""
+
+import os
+import sys
+import threading
+from collections import Counter, deque
+
+import omero
+from omero.rtypes import unwrap
+from omero.script_helpers.lazy import lazy_import
+
+numpy = lazy_import("numpy")
+
+ENV_TRACE = "OMERO_SCRIPTS_TRACE"
+DEFAULT_MAX_RECORDS = 10000
+# frames of these modules are never the call site
+SKIP_MODULES = ("omero.gateway", "omero.util", "omero.clients",
+                "omero.script_helpers.instrumentation",
+                "omero.script_helpers.call_trace", "omero_ext", "Ice",
+                "concurrent.futures", "threading", "contextlib")
+
+
+def summarize(value, width=60):
+    """Short text for an argument of a server call."""
+    if isinstance(value, (bytes, bytearray)):
+        return "<%d bytes>" % len(value)
+    if isinstance(value, numpy.ndarray):
+        return "<array %s %s>" % ("x".join(map(str, value.shape)),
+                                  value.dtype)
+    if isinstance(value, omero.sys.Parameters):
+        return "params(%s)" % ", ".join(sorted(value.map or {}))
+    if isinstance(value, (list, tuple)) and len(value) > 3:
+        return "[%d items]" % len(value)
+    if isinstance(value, omero.model.IObject):
+        name = value.__class__.__name__
+        if name.endswith("I"):
+            name = name[:-1]
+        return "%s:%s" % (name, unwrap(value.id))
+    text = repr(unwrap(value))
+    if len(text) > width:
+        text = text[:width - 3] + "..."
+    return text
+
+
+class CallSite(object):
+    """Totals of the calls made from one line."""
+
+    def __init__(self, site):
+        self.site = site
+        self.calls = 0
+        self.seconds = 0.0
+        self.nbytes = 0
+        self.methods = Counter()
+
+    def as_dict(self):
+        return {'site': self.site, 'calls': self.calls,
+                'seconds': round(self.seconds, 4), 'bytes': self.nbytes,
+                'methods': dict(self.methods)}
+
+
+class CallTrace(object):
+    """
+    Records of the server calls and their totals per call site.
+
+    :param skip:            More module names whose frames are skipped
+                            when looking for the call site
+    :param max_records:     Most recent calls to keep
+    """
+
+    def __init__(self, skip=(), max_records=DEFAULT_MAX_RECORDS):
+        self.skip = SKIP_MODULES + tuple(skip)
+        self.records = deque(maxlen=max_records)
+        self.sites = {}
+        self._lock = threading.Lock()
+
+    def skipped(self, module):
+        """Whether module is, or is inside, one of the skipped modules."""
+        return any(module == m or module.startswith(m + ".")
+                   for m in self.skip)
+
+    def call_site(self):
+        """'file:line function' of the innermost frame not skipped."""
+        frame = sys._getframe(1)
+        while frame is not None:
+            module = frame.f_globals.get("__name__", "")
+            if not self.skipped(module):
+                code = frame.f_code
+                return "%s:%d %s" % (os.path.basename(code.co_filename),
+                                     frame.f_lineno, code.co_name)
+            frame = frame.f_back
+        return "?"
+
+    def record(self, key, args, seconds, nbytes):
+        """Record a call of method key (``"<service>.<method>"``)."""
+        site = self.call_site()
+        record = {'method': key, 'site': site,
+                  'args': [summarize(a) for a in args],
+                  'seconds': round(seconds, 4), 'bytes': nbytes}
+        with self._lock:
+            self.records.append(record)
+            totals = self.sites.get(site)
+            if totals is None:
+                totals = self.sites[site] = CallSite(site)
+            totals.calls += 1
+            totals.seconds += seconds
+            totals.nbytes += nbytes
+            totals.methods[key] += 1
+
+    def ranked(self, top=10):
+        """The top call sites by total latency, then by number of calls."""
+        with self._lock:
+            sites = list(self.sites.values())
+        sites.sort(key=lambda s: (-s.seconds, -s.calls))
+        return sites[:top]
+
+    def report(self, top=10):
+        """Text listing of the most expensive call sites."""
+        lines = ["Most expensive call sites:"]
+        for s in self.ranked(top):
+            methods = ", ".join("%s x%d" % kv
+                                for kv in s.methods.most_common(3))
+            lines.append("  %s: %d calls, %.3f s, %d bytes (%s)" % (
+                s.site, s.calls, s.seconds, s.nbytes, methods))
+        return "\n".join(lines)
+
+    def as_dict(self, top=10):
+        with self._lock:
+            records = list(self.records)
+        return {'call_sites': [s.as_dict() for s in self.ranked(top)],
+                'calls': records}
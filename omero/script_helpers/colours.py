@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2024 University of Muenster. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Colours offered by the figure and movie scripts, by name.
+
+The same maps as ``omero.util.script_utils.COLOURS`` and ``EXTRA_COLOURS``,
+which the scripts need to list their parameters. Importing script_utils
+for them would import NumPy and PIL whenever the server parses a script.
+"""
+
+# name: (r, g, b, a)
+COLOURS = {
+    'Red': (255, 0, 0, 255),
+    'Green': (0, 255, 0, 255),
+    'Blue': (0, 0, 255, 255),
+    'Yellow': (255, 255, 0, 255),
+    'White': (255, 255, 255, 255), }
+
+EXTRA_COLOURS = {
+    'Violet': (238, 133, 238, 255),
+    'Indigo': (79, 6, 132, 255),
+    'Black': (0, 0, 0, 255),
+    'Orange': (254, 200, 6, 255),
+    'Gray': (130, 130, 130, 255), }
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2024 University of Muenster. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Resolve a Project/Dataset/Screen/Plate/Well/Image selection to its Images
+with a single HQL projection.
+
+Walking ``listChildren()`` costs a round-trip per container level, and on
+plates one per Well. :func:`resolve_images` instead returns the Image and
+Pixels IDs, names and parent Dataset/Well of the whole selection as one
+:class:`ImageSelection`::
+
+    selection = resolve_images(conn, "Plate", [plate_id],
+                               name_filter=params.get("Filter_Names"))
+    for image in selection.load_images(conn):
+        ...
+"""
+
+from collections import OrderedDict
+
+import omero
+from omero.rtypes import rstring, unwrap
+from omero.script_helpers.lazy import lazy_import
+
+numpy = lazy_import("numpy")
+
+DATASET_COLUMNS = ("image.id", "pixels.id", "image.name", "dataset.id")
+WELL_COLUMNS = ("image.id", "pixels.id", "image.name", "well.id",
+                "well.row", "well.column", "plate.id",
+                "plate.rowNamingConvention", "plate.columnNamingConvention")
+IMAGE_COLUMNS = ("image.id", "pixels.id", "image.name")
+
+_IMAGE_JOIN = "join dlink.child image join image.pixels pixels"
+_WELL_JOIN = ("left outer join well.wellSamples ws "
+              "left outer join ws.image image "
+              "left outer join image.pixels pixels")
+
+# data type -> (selected columns, from clause, id to filter on)
+QUERIES = {
+    "Project": (DATASET_COLUMNS,
+                "from ProjectDatasetLink plink join plink.child dataset "
+                "join dataset.imageLinks dlink " + _IMAGE_JOIN,
+                "plink.parent.id"),
+    "Dataset": (DATASET_COLUMNS,
+                "from DatasetImageLink dlink join dlink.parent dataset "
+                + _IMAGE_JOIN,
+                "dataset.id"),
+    "Screen": (WELL_COLUMNS,
+               "from ScreenPlateLink slink join slink.child plate "
+               "join plate.wells well " + _WELL_JOIN,
+               "slink.parent.id"),
+    "Plate": (WELL_COLUMNS,
+              "from Well well join well.plate plate " + _WELL_JOIN,
+              "plate.id"),
+    "Well": (WELL_COLUMNS,
+             "from Well well join well.plate plate " + _WELL_JOIN,
+             "well.id"),
+    "Image": (IMAGE_COLUMNS,
+              "from Image image join image.pixels pixels",
+              "image.id"),
+}
+
+
+def grid_label(index, convention):
+    """
+    Label of a 0-based Plate row or column, e.g. 'A', 'AA' or '12', the
+    same way the gateway's PlateWrapper labels them.
+    """
+    if convention and convention.lower() == "number":
+        return str(index + 1)
+    label = chr(ord('A') + index % 26)
+    index = index // 26
+    while index > 0:
+        index -= 1
+        label = chr(ord('A') + index % 26) + label
+        index = index // 26
+    return label
+
+
+def build_query(data_type, name_filter=None):
+    """
+    Return the HQL projection and its column names for data_type. The
+    query takes the container IDs as ``:ids`` and, if name_filter is
+    given, the Image name pattern as ``:filter``.
+    """
+    if data_type not in QUERIES:
+        raise ValueError("Cannot resolve Images of %s" % data_type)
+    columns, from_clause, id_column = QUERIES[data_type]
+    query = "select %s %s where %s in (:ids)" % (
+        ", ".join(columns), from_clause, id_column)
+    if name_filter:
+        query += " and image.name like :filter escape '!'"
+    return query + " order by image.id", columns
+
+
+def _like_pattern(text):
+    """Match text anywhere in the name, like str.find(text) >= 0."""
+    for char in ("!", "%", "_"):
+        text = text.replace(char, "!" + char)
+    return "%" + text + "%"
+
+
+class ImageSelection(object):
+    """
+    The Images of a selection, one row per Image and parent.
+
+    Images linked to several Datasets of a Project, or placed in several
+    Wells, appear once per parent, and empty Wells appear once with no
+    Image. IDs are int64 arrays, with -1 where there is no value or the
+    column does not apply (e.g. ``well_ids`` of a Dataset selection).
+    """
+
+    def __init__(self, data_type, rows=(), columns=IMAGE_COLUMNS):
+        self.data_type = data_type
+        index = dict((c, i) for i, c in enumerate(columns))
+
+        def ids(column):
+            if column not in index:
+                return numpy.full(len(rows), -1, dtype=numpy.int64)
+            values = [r[index[column]] for r in rows]
+            return numpy.array([-1 if v is None else v for v in values],
+                               dtype=numpy.int64).reshape(-1)
+
+        self.image_ids = ids("image.id")
+        self.pixels_ids = ids("pixels.id")
+        self.dataset_ids = ids("dataset.id")
+        self.well_ids = ids("well.id")
+        self.well_rows = ids("well.row")
+        self.well_columns = ids("well.column")
+        self.plate_ids = ids("plate.id")
+        self.parent_ids = self.well_ids if "well.id" in index \
+            else self.dataset_ids
+        self.names = [r[index["image.name"]] for r in rows]
+        self.well_labels = [None] * len(rows)
+        if "well.id" in index:
+            row_names = index["plate.rowNamingConvention"]
+            col_names = index["plate.columnNamingConvention"]
+            self.well_labels = [
+                grid_label(r[index["well.row"]], r[row_names] or "letter") +
+                grid_label(r[index["well.column"]], r[col_names] or "number")
+                for r in rows]
+
+    def __len__(self):
+        return len(self.image_ids)
+
+    def unique_image_ids(self):
+        """Image IDs in selection order, without repeats."""
+        return [i for i in OrderedDict.fromkeys(self.image_ids.tolist())
+                if i >= 0]
+
+    def images_by_parent(self):
+        """
+        OrderedDict of parent (Dataset or Well) ID -> list of Image IDs.
+        For an Image selection everything is under the key -1.
+        """
+        grouped = OrderedDict()
+        for parent_id, image_id in zip(self.parent_ids.tolist(),
+                                       self.image_ids.tolist()):
+            images = grouped.setdefault(parent_id, [])
+            if image_id >= 0:
+                images.append(image_id)
+        return grouped
+
+    def wells_by_label(self):
+        """
+        OrderedDict of Well label (e.g. 'B3') -> Well ID. Labels are only
+        unique within one Plate.
+        """
+        wells = OrderedDict()
+        for label, well_id in zip(self.well_labels, self.well_ids.tolist()):
+            if label is not None:
+                wells.setdefault(label, well_id)
+        return wells
+
+    def load_images(self, conn):
+        """
+        The ImageWrappers of the selection, loaded with one query and
+        returned in selection order without repeats.
+        """
+        ids = self.unique_image_ids()
+        if not ids:
+            return []
+        by_id = dict((i.id, i) for i in conn.getObjects("Image", ids))
+        return [by_id[i] for i in ids if i in by_id]
+
+    def load_wells(self, conn):
+        """The WellWrappers of a Screen/Plate/Well selection, in one query."""
+        ids = [i for i in OrderedDict.fromkeys(self.well_ids.tolist())
+               if i >= 0]
+        if not ids:
+            return []
+        by_id = dict((w.id, w) for w in conn.getObjects("Well", ids))
+        return [by_id[i] for i in ids if i in by_id]
+
+
+def resolve_images(conn, data_type, ids, name_filter=None):
+    """
+    Find the Images in the data_type containers with the given IDs.
+
+    :param conn:        The BlitzGateway connection
+    :param data_type:   'Project', 'Dataset', 'Screen', 'Plate', 'Well'
+                        or 'Image'
+    :param ids:         Container (or Image) IDs
+    :param name_filter: Only keep Images whose name contains this text
+    :return:            :class:`ImageSelection`
+    """
+    ids = [int(i) for i in ids]
+    query, columns = build_query(data_type, name_filter)
+    if not ids:
+        return ImageSelection(data_type, [], columns)
+    params = omero.sys.ParametersI()
+    params.addIds(ids)
+    if name_filter:
+        params.add("filter", rstring(_like_pattern(name_filter)))
+    rows = conn.getQueryService().projection(query, params, conn.SERVICE_OPTS)
+    return ImageSelection(data_type, [unwrap(r) for r in rows], columns)
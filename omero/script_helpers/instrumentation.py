@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2024 University of Muenster. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Per-phase timings, server round-trips and peak memory of a script run.
+
+A script names its phases, and :meth:`Timings.watch` counts the calls made
+on the services the gateway hands out and the pixel and file bytes they
+move. The summary is returned to the client as the ``Timings`` output::
+
+    timings = get_timings()
+    watch_calls(conn)
+    with timings.phase("render"):
+        plane = re.renderCompressed(plane_def)
+    with timings.phase("write"):
+        save(plane)
+    timings.attach_json(conn, parent)
+    timings.set_output(client)
+
+Phases may nest and may run in several threads. Time spent in a nested
+phase is also counted in the enclosing one.
+
+Server calls are only counted if the ``OMERO_SCRIPTS_COUNT_CALLS`` or the
+``OMERO_SCRIPTS_TRACE`` environment variable is set; with the latter, each
+call is also traced to the line of the script that made it, see
+:mod:`omero.script_helpers.call_trace`.
+
+If the ``OMERO_SCRIPTS_TIMINGS_JSON`` environment variable is set,
+:meth:`Timings.attach_json` links the timings to the parent object as a
+JSON file, for comparing runs.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+from omero.constants.namespaces import NSCREATED
+from omero.script_helpers.call_trace import CallTrace, ENV_TRACE
+from omero.script_helpers.lazy import lazy_import
+from omero.rtypes import rstring
+
+try:
+    import resource
+except ImportError:     # not on Windows
+    resource = None
+
+numpy = lazy_import("numpy")
+script_utils = lazy_import("omero.util.script_utils")
+
+ENV_CALLS = "OMERO_SCRIPTS_COUNT_CALLS"
+ENV_JSON = "OMERO_SCRIPTS_TIMINGS_JSON"
+NAMESPACE = NSCREATED + "/omero/script_helpers/instrumentation"
+SERVICE_SUFFIXES = ("Service", "Store", "Engine")
+
+
+def peak_memory():
+    """Peak resident memory of this process in bytes, or None."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def nbytes(value):
+    """Size of the pixel or file data in value, 0 for anything else."""
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, numpy.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(nbytes(v) for v in value.values())
+    return 0
+
+
+class CountingService(object):
+    """
+    Passes all calls on to a service of the gateway and counts them on a
+    :class:`Timings` under ``"<service>.<method>"``, with their latency
+    and the bytes sent in the arguments and received in the result.
+
+    Only the gateway's service wrappers are wrapped, never the Ice session
+    or proxies, so nothing that Ice is handed is a Python wrapper.
+    """
+
+    def __init__(self, service, name, timings):
+        self._service = service
+        self._name = name
+        self._timings = timings
+
+    def __str__(self):
+        return str(self._service)
+
+    def __getattr__(self, attr):
+        value = getattr(self._service, attr)
+        if not callable(value) or attr.startswith("_"):
+            return value
+        key = "%s.%s" % (self._name, attr)
+
+        def call(*args, **kwargs):
+            args = tuple(unwrap_service(a) for a in args)
+            started = time.time()
+            result = value(*args, **kwargs)
+            seconds = time.time() - started
+            up = sum(nbytes(a) for a in args)
+            self._timings.count_call(key, nbytes(result), up, seconds, args)
+            return result
+        return call
+
+
+def unwrap_service(value):
+    """The service that value counts the calls on, else value."""
+    if isinstance(value, CountingService):
+        return value._service
+    return value
+
+
+def service_methods(conn):
+    """
+    Names of the methods of conn that return a service, e.g.
+    getQueryService and createRawPixelsStore.
+    """
+    return [name for name in dir(type(conn))
+            if name.startswith(("get", "create"))
+            and name.endswith(SERVICE_SUFFIXES)
+            and callable(getattr(type(conn), name))]
+
+
+class Timings(object):
+    """
+    Wall-clock time per named phase, counters, and the calls and bytes of
+    watched connections.
+
+    :param trace:       A :class:`CallTrace` to record each call in
+    """
+
+    def __init__(self, trace=None):
+        self.start = time.time()
+        self.trace = trace
+        self.phases = OrderedDict()     # name -> [seconds, entries]
+        self.counters = Counter()
+        self.calls = Counter()
+        self.call_seconds = Counter()
+        self.bytes_down = 0
+        self.bytes_up = 0
+        self.watching = False
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        """Add the time spent in a with block to phase name."""
+        started = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - started
+            with self._lock:
+                entry = self.phases.setdefault(name, [0.0, 0])
+                entry[0] += elapsed
+                entry[1] += 1
+
+    def count(self, name, n=1):
+        """Add n to counter name, e.g. the number of planes saved."""
+        with self._lock:
+            self.counters[name] += n
+
+    def count_call(self, key, down=0, up=0, seconds=0.0, args=()):
+        """Record a server call, the bytes it moved and its latency."""
+        with self._lock:
+            self.calls[key] += 1
+            self.call_seconds[key] += seconds
+            self.bytes_down += down
+            self.bytes_up += up
+        if self.trace is not None:
+            self.trace.record(key, args, seconds, down + up)
+
+    def watch(self, conn):
+        """
+        Count the calls on the services that conn hands out from now on,
+        and the stateful services it creates. Services taken from
+        ``conn.c.sf`` directly are not counted.
+        """
+        if getattr(conn, "_counting_timings", None) is self:
+            return
+        conn._counting_timings = self
+        self.watching = True
+        for name in service_methods(conn):
+            setattr(conn, name, self._counting(getattr(conn, name), name))
+
+    def _counting(self, method, name):
+        """method, returning services that count their calls."""
+        service = name[len("get"):] if name.startswith("get") \
+            else name[len("create"):]
+        creates = name.startswith("create")
+
+        def counting(*args, **kwargs):
+            started = time.time()
+            result = method(*args, **kwargs)
+            if creates:
+                # a stateful service is a round-trip to create
+                self.count_call("ServiceFactory." + name,
+                                seconds=time.time() - started)
+            if result is None:
+                return result
+            return CountingService(result, service, self)
+        return counting
+
+    def as_dict(self):
+        """The timings as a dict that can be saved as JSON."""
+        with self._lock:
+            data = {
+                'seconds': round(time.time() - self.start, 3),
+                'phases': OrderedDict(
+                    (name, {'seconds': round(entry[0], 3),
+                            'count': entry[1]})
+                    for name, entry in self.phases.items()),
+                'counters': dict(self.counters),
+                'calls': sum(self.calls.values()),
+                'calls_by_method': dict(self.calls.most_common()),
+                'bytes_down': self.bytes_down,
+                'bytes_up': self.bytes_up,
+                'peak_memory': peak_memory()}
+        if self.trace is not None:
+            data['trace'] = self.trace.as_dict()
+        return data
+
+    def summary(self, top=5):
+        """Text summary for the script's output, with the top calls."""
+        data = self.as_dict()
+        total = data['seconds'] or 1e-9
+        lines = ["Total: %.2f s" % data['seconds']]
+        for name, entry in data['phases'].items():
+            lines.append("  %s: %.2f s (%.0f%%, %d times)" % (
+                name, entry['seconds'], 100.0 * entry['seconds'] / total,
+                entry['count']))
+        for name, n in sorted(data['counters'].items()):
+            lines.append("%s: %d" % (name, n))
+        if self.watching:
+            lines.append("Server calls: %d, %.1f MB down, %.1f MB up" % (
+                data['calls'], data['bytes_down'] / (1024.0 * 1024),
+                data['bytes_up'] / (1024.0 * 1024)))
+            for key, n in self.calls.most_common(top):
+                lines.append("  %s: %d in %.2f s" % (
+                    key, n, self.call_seconds[key]))
+        if data['peak_memory'] is not None:
+            lines.append("Peak memory: %.1f MB" % (
+                data['peak_memory'] / (1024.0 * 1024)))
+        if self.trace is not None:
+            lines.append(self.trace.report(top))
+        return "\n".join(lines)
+
+    def set_output(self, client):
+        """Set the summary as the ``Timings`` output of the script."""
+        client.setOutput("Timings", rstring(self.summary()))
+
+    def attach_json(self, conn, parent):
+        """
+        If the OMERO_SCRIPTS_TIMINGS_JSON environment variable is set, link
+        the timings so far as a JSON file to parent.
+
+        :return:        The file annotation, or None
+        """
+        if not os.environ.get(ENV_JSON) or parent is None:
+            return None
+        file_name = "timings.json"
+        with open(file_name, "w") as f:
+            json.dump(self.as_dict(), f, indent=2)
+        try:
+            file_annotation, _ = script_utils.create_link_file_annotation(
+                conn, file_name, parent, output="Timings",
+                namespace=NAMESPACE, mimetype="application/json")
+        finally:
+            os.remove(file_name)
+        return file_annotation
+
+
+_timings = None
+
+
+def get_timings():
+    """
+    The timings of everything in this process, tracing calls if the
+    OMERO_SCRIPTS_TRACE environment variable is set.
+    """
+    global _timings
+    if _timings is None:
+        _timings = Timings(CallTrace() if os.environ.get(ENV_TRACE) else None)
+    return _timings
+
+
+def watch_calls(conn):
+    """
+    Count the server calls of conn on the timings of this process, if the
+    OMERO_SCRIPTS_COUNT_CALLS or OMERO_SCRIPTS_TRACE environment variable
+    is set.
+    """
+    if os.environ.get(ENV_CALLS) or os.environ.get(ENV_TRACE):
+        get_timings().watch(conn)
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2024 University of Muenster. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Journal of the work a batch script has finished, to resume after a failure.
+
+A script records each unit of work, e.g. an image ID, a well or a CSV row,
+as soon as it is done. When a run fails, e.g. because the session dropped,
+running the script again with the same parameters and
+``Resume_From_Journal`` skips the units already done::
+
+    journal = open_journal(conn, "Batch_Image_Export", script_params)
+    for image in images:
+        if journal.done(image.id):
+            continue
+        export(image)
+        journal.record(image.id)
+    journal.finish()
+
+Journals are local state files, one line of JSON per unit, in a directory
+per script, user and parameters under ``OMERO_SCRIPTS_JOURNAL_DIR`` (default
+``omero_script_journals`` in the temporary directory). The directory can
+also hold files the script must keep between runs, e.g. exported planes.
+A run without ``Resume_From_Journal`` starts a new journal, and
+:meth:`Journal.finish` removes it once the run completes. Journals left by
+failed runs are removed after ``OMERO_SCRIPTS_JOURNAL_DAYS`` (default 7)
+days.
+
+A run holds a lock file on its journal until it closes it. A second run
+with the same parameters while the first is still going, e.g. a double
+submit, neither resumes nor removes that journal: it gets a journal of its
+own in a new directory, which it does not share.
+"""
+
+import errno
+import hashlib
+import json
+import os
+import shutil
+import socket
+import tempfile
+import time
+import weakref
+
+ENV_JOURNAL_DIR = "OMERO_SCRIPTS_JOURNAL_DIR"
+ENV_JOURNAL_DAYS = "OMERO_SCRIPTS_JOURNAL_DAYS"
+DEFAULT_DAYS = 7
+RESUME_PARAM = "Resume_From_Journal"
+JOURNAL_FILE = "journal.jsonl"
+LOCK_SUFFIX = ".lock"
+
+# the journals open in this process
+_open = weakref.WeakSet()
+
+
+def journal_root():
+    """The directory that holds the journals."""
+    return os.environ.get(ENV_JOURNAL_DIR) or os.path.join(
+        tempfile.gettempdir(), "omero_script_journals")
+
+
+def prune_journals(root, days=None):
+    """Remove the journals in root not written to for days."""
+    if days is None:
+        days = float(os.environ.get(ENV_JOURNAL_DAYS, DEFAULT_DAYS))
+    if not os.path.isdir(root):
+        return
+    oldest = time.time() - days * 24 * 3600
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        try:
+            if name.endswith(LOCK_SUFFIX):
+                if os.path.getmtime(path) < oldest:
+                    os.remove(path)
+            elif os.path.getmtime(os.path.join(path, JOURNAL_FILE)) < oldest:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass
+
+
+def _owner_alive(lock):
+    """False if the process that wrote lock is known to have ended."""
+    try:
+        with open(lock) as f:
+            host, pid = f.read().split()
+        pid = int(pid)
+    except (OSError, ValueError):
+        # being written, or not ours to judge
+        return True
+    if host != socket.gethostname() or os.name != "posix":
+        return True
+    try:
+        os.kill(pid, 0)
+    except OSError as exc:
+        return exc.errno == errno.EPERM
+    return True
+
+
+def acquire_lock(lock):
+    """
+    Create the lock file lock for this process, taking over a lock left by
+    a process that ended. False if another process holds it.
+    """
+    for _ in range(2):
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST or _owner_alive(lock):
+                return False
+            try:
+                os.remove(lock)
+            except OSError:
+                pass
+            continue
+        with os.fdopen(fd, "w") as f:
+            f.write("%s %d" % (socket.gethostname(), os.getpid()))
+        return True
+    return False
+
+
+def open_journal(conn, name, script_params, directory=None):
+    """
+    The journal of script name, run by the current user with
+    script_params, resumed if script_params['Resume_From_Journal'] is set.
+    """
+    params = dict((k, v) for k, v in script_params.items()
+                  if k != RESUME_PARAM)
+    return Journal(name, [conn.getUserId(), params],
+                   resume=bool(script_params.get(RESUME_PARAM)),
+                   directory=directory)
+
+
+def close_journals():
+    """
+    Close the journals still open in this process, e.g. those of runs that
+    failed, so that a later run in the same process can resume them.
+    """
+    for journal in list(_open):
+        journal.close()
+
+
+def _unit_key(unit):
+    # tuples and lists are the same unit once written as JSON
+    return json.dumps(unit, sort_keys=True, default=str)
+
+
+class Journal(object):
+    """
+    The units of work done by a run, with a value for each.
+
+    :param name:        Name of the script
+    :param key:         JSON-able parameters that identify the run
+    :param resume:      If True, continue the journal of a previous run
+                        with the same key. Otherwise start a new one
+    :param directory:   Where to keep journals. Default from the
+                        OMERO_SCRIPTS_JOURNAL_DIR environment variable
+
+    If another run holds the journal of key, the journal is kept in a new
+    directory instead and ``shared`` is False.
+    """
+
+    def __init__(self, name, key, resume=False, directory=None):
+        root = directory or journal_root()
+        prune_journals(root)
+        if not os.path.isdir(root):
+            os.makedirs(root)
+        digest = hashlib.sha1(_unit_key(key).encode("utf-8")).hexdigest()
+        base = "%s-%s" % (name, digest[:16])
+        self._lock = os.path.join(root, base + LOCK_SUFFIX)
+        self.shared = acquire_lock(self._lock)
+        if self.shared:
+            self.directory = os.path.join(root, base)
+        else:
+            self._lock = None
+            self.directory = tempfile.mkdtemp(prefix=base + "-", dir=root)
+        self.path = os.path.join(self.directory, JOURNAL_FILE)
+        self._units = {}
+        self.resumed = self.shared and resume and os.path.exists(self.path)
+        if self.resumed:
+            self._load()
+        else:
+            shutil.rmtree(self.directory, ignore_errors=True)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self._file = open(self.path, "a")
+        _open.add(self)
+
+    def __len__(self):
+        return len(self._units)
+
+    def _load(self):
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the last line of a run that was killed mid-write
+                    continue
+                self._units[_unit_key(entry["unit"])] = entry["value"]
+
+    def done(self, unit):
+        """True if unit was recorded, by this run or a resumed one."""
+        return _unit_key(unit) in self._units
+
+    def get(self, unit, default=None):
+        """The value recorded for unit."""
+        return self._units.get(_unit_key(unit), default)
+
+    def values(self):
+        """The values of all the units recorded."""
+        return list(self._units.values())
+
+    def record(self, unit, value=True):
+        """Record unit as done, with a JSON-able value."""
+        self._units[_unit_key(unit)] = value
+        self._file.write(json.dumps({"unit": unit, "value": value},
+                                    default=str) + "\n")
+        self._file.flush()
+
+    def close(self):
+        """Close the journal, keeping it to resume from."""
+        if not self._file.closed:
+            self._file.close()
+        self._release()
+
+    def _release(self):
+        _open.discard(self)
+        if self._lock is not None:
+            try:
+                os.remove(self._lock)
+            except OSError:
+                pass
+            self._lock = None
+
+    def finish(self):
+        """Close and remove the journal, once the run has completed."""
+        if not self._file.closed:
+            self._file.close()
+        # removed before the lock, so no other run sees it half gone
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self._release()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2024 University of Muenster. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Imports modules when a script first uses them, not when it is parsed.
+
+The server runs each script up to ``scripts.client(...)`` whenever it lists
+the script's parameters, e.g. to fill the script menu of the web client.
+Modules such as NumPy, PIL or ``omero.util.script_utils`` (which imports
+both) take longer to import than the rest of the script takes to parse.
+:func:`lazy_import` returns a stand-in for a module that imports it on the
+first attribute access, so it can replace a top-level import::
+
+    numpy = lazy_import("numpy")
+    script_utils = lazy_import("omero.util.script_utils")
+    Image = lazy_import("PIL.Image")
+
+    def run_script():
+        ...
+        plane = numpy.zeros((size_y, size_x))   # numpy is imported here
+
+Names imported with ``from module import name`` are used as
+``module.name`` instead. ``test/benchmark/startup.py`` reports the time to
+parse each script and the heavy modules it still imports.
+"""
+
+import importlib
+import sys
+import threading
+import types
+
+_lock = threading.Lock()
+
+
+class LazyModule(types.ModuleType):
+    """
+    A module that is imported on first use.
+
+    :param name:        The full name of the module, e.g. 'PIL.Image'
+    """
+
+    def __init__(self, name):
+        super(LazyModule, self).__init__(name)
+        self.__dict__["_module"] = None
+
+    def _load(self):
+        module = self.__dict__["_module"]
+        if module is None:
+            with _lock:
+                module = self.__dict__["_module"]
+                if module is None:
+                    module = importlib.import_module(self.__name__)
+                    self.__dict__["_module"] = module
+        return module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._load(), name, value)
+
+    def __delattr__(self, name):
+        delattr(self._load(), name)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        if self.__dict__["_module"] is None:
+            return "<lazy module %r>" % self.__name__
+        return repr(self.__dict__["_module"])
+
+
+def lazy_import(name):
+    """The module name, imported when one of its attributes is used."""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return LazyModule(name)
@@ -0,0 +1,405 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2024 University of Muenster. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Renders raw planes with NumPy instead of on the server.
+
+A script that renders the same plane several times, e.g. each split
+channel and then the merged image, makes one server render per panel.
+:class:`LocalRenderingEngine` reads the saved rendering settings in one
+query, downloads each raw plane once and renders every panel from it. It
+stands in for the calls of a RenderingEngine that the scripts use, so a
+rendering job runs unchanged on either::
+
+    def render_row(re, pixels_id):
+        with local_engine(conn, re) as engine:
+            return render_panels(engine, pixels_id)
+
+    with RenderingEnginePool(conn) as pool:
+        rows = pool.map(render_row, pixel_ids)
+
+Channel windows, colours and alpha, the greyscale and RGB models, reverse
+intensity and the maximum, mean and sum projections are rendered like the
+server does. Settings that are not (lookup tables, non-linear families,
+noise reduction, other codomain maps) and planes too big to download in one
+piece leave the server engine in place.
+
+Set the ``OMERO_SCRIPTS_LOCAL_RENDER`` environment variable to ``0`` to
+always render on the server.
+"""
+
+import io
+import os
+from contextlib import contextmanager
+
+import omero
+from omero.rtypes import rlong, unwrap
+from omero.script_helpers.lazy import lazy_import
+from omero.script_helpers.projection import project, z_indexes
+
+numpy = lazy_import("numpy")
+Image = lazy_import("PIL.Image")
+
+ENV_LOCAL_RENDER = "OMERO_SCRIPTS_LOCAL_RENDER"
+PIXEL_TYPES = {"int8": "i1", "uint8": "u1", "int16": "i2", "uint16": "u2",
+               "int32": "i4", "uint32": "u4", "float": "f4", "double": "f8"}
+
+RENDERING_DEF_QUERY = (
+    "select r from RenderingDef r join fetch r.pixels as p "
+    "join fetch p.pixelsType join fetch r.model "
+    "join fetch r.quantization join fetch r.waveRendering as w "
+    "join fetch w.family left outer join fetch w.spatialDomainEnhancement "
+    "where r.id = :id")
+
+
+def local_rendering():
+    """True unless local rendering is turned off in the environment."""
+    return os.environ.get(ENV_LOCAL_RENDER, "1") not in ("0", "false", "")
+
+
+def get_rendering_def_id(re, pixels_id):
+    """Job returning the ID of the rendering def the engine has loaded."""
+    return re.getRenderingDefId()
+
+
+class ChannelRendering(object):
+    """
+    Rendering settings of one channel.
+
+    :param start:       Start of the channel window
+    :param end:         End of the channel window
+    :param rgba:        (red, green, blue, alpha), 0-255
+    :param active:      If the channel is rendered
+    :param reverse:     Reverse intensity codomain map
+    :param unsupported: Reasons the channel can't be rendered locally
+    """
+
+    def __init__(self, start, end, rgba, active=True, reverse=False,
+                 unsupported=()):
+        self.start = float(start)
+        self.end = float(end)
+        self.rgba = tuple(rgba)
+        self.active = active
+        self.reverse = reverse
+        self.unsupported = list(unsupported)
+
+    @classmethod
+    def from_binding(cls, binding):
+        """Settings of a loaded ChannelBinding."""
+        unsupported = []
+        family = unwrap(binding.getFamily().getValue())
+        coefficient = unwrap(binding.getCoefficient())
+        if family != "linear" and not (family == "polynomial" and
+                                       coefficient == 1):
+            unsupported.append("%s family" % family)
+        if unwrap(binding.getNoiseReduction()):
+            unsupported.append("noise reduction")
+        if unwrap(binding.getLookupTable()):
+            unsupported.append("lookup table")
+        reverse = False
+        for ctx in binding.copySpatialDomainEnhancement():
+            if type(ctx).__name__.startswith("ReverseIntensityContext"):
+                reverse = reverse or bool(unwrap(ctx.getReverse()))
+            else:
+                unsupported.append(type(ctx).__name__)
+        rgba = [unwrap(getattr(binding, "get" + band)())
+                for band in ("Red", "Green", "Blue", "Alpha")]
+        return cls(unwrap(binding.getInputStart()),
+                   unwrap(binding.getInputEnd()), rgba,
+                   unwrap(binding.getActive()), reverse, unsupported)
+
+    def copy(self):
+        return ChannelRendering(self.start, self.end, self.rgba, self.active,
+                                self.reverse, self.unsupported)
+
+    def quantize(self, plane):
+        """Map the channel window of plane to uint8 values."""
+        span = max(self.end - self.start, 1e-9)
+        norm = numpy.clip((plane.astype(numpy.float64) - self.start) / span,
+                          0, 1)
+        values = numpy.floor(norm * 255 + 0.5).astype(numpy.uint8)
+        if self.reverse:
+            values = 255 - values
+        return values
+
+
+class RenderSettings(object):
+    """
+    Rendering settings of an image: its channels and rendering model.
+
+    :param channels:    List of ChannelRendering, one per channel
+    :param model:       'rgb' or 'greyscale'
+    :param pixels:      The Pixels, with pixelsType loaded
+    """
+
+    def __init__(self, channels, model="rgb", default_z=0, default_t=0,
+                 pixels=None, unsupported=()):
+        self.channels = channels
+        self.model = model
+        self.default_z = default_z
+        self.default_t = default_t
+        self.pixels = pixels
+        self.unsupported = list(unsupported)
+
+    @classmethod
+    def from_rendering_def(cls, rdef, max_plane_size):
+        """
+        Settings of a RenderingDef loaded with RENDERING_DEF_QUERY.
+
+        :param max_plane_size:  (width, height) of the biggest plane the
+                                server returns with getPlane,
+                                conn.getMaxPlaneSize()
+        """
+        unsupported = []
+        quantum = rdef.getQuantization()
+        if (unwrap(quantum.getCdStart()), unwrap(quantum.getCdEnd())) != \
+                (0, 255):
+            unsupported.append("codomain not 0-255")
+        pixels = rdef.getPixels()
+        if unwrap(pixels.getPixelsType().getValue()) not in PIXEL_TYPES:
+            unsupported.append("pixels type")
+        max_width, max_height = max_plane_size
+        if unwrap(pixels.getSizeX()) > max_width or \
+                unwrap(pixels.getSizeY()) > max_height:
+            unsupported.append("plane too big")
+        channels = [ChannelRendering.from_binding(b)
+                    for b in rdef.copyWaveRendering()]
+        return cls(channels, unwrap(rdef.getModel().getValue()),
+                   unwrap(rdef.getDefaultZ()), unwrap(rdef.getDefaultT()),
+                   pixels, unsupported)
+
+    @property
+    def supported(self):
+        """True if all channels can be rendered locally."""
+        return not (self.unsupported or
+                    any(ch.unsupported for ch in self.channels))
+
+    def copy(self):
+        return RenderSettings([ch.copy() for ch in self.channels],
+                              self.model, self.default_z, self.default_t,
+                              self.pixels, self.unsupported)
+
+    def active_channels(self):
+        """Indexes of the channels that are rendered."""
+        active = [c for c, ch in enumerate(self.channels) if ch.active]
+        if self.model == "greyscale":
+            # the server renders the first active channel only
+            return active[:1]
+        return active
+
+    def render(self, planes, shape):
+        """
+        Render planes, a dict of {channel index: 2D array} with at least
+        the active channels, to an RGB uint8 array of shape (height, width).
+        """
+        active = self.active_channels()
+        if self.model == "greyscale" and active:
+            values = self.channels[active[0]].quantize(planes[active[0]])
+            return numpy.dstack([values] * 3)
+        out = numpy.zeros(tuple(shape) + (3,), dtype=numpy.uint32)
+        for c in active:
+            ch = self.channels[c]
+            values = ch.quantize(planes[c]).astype(numpy.uint32)
+            alpha = ch.rgba[3]
+            for band in range(3):
+                if ch.rgba[band]:
+                    out[..., band] += values * (ch.rgba[band] * alpha) // 65025
+        return numpy.minimum(out, 255).astype(numpy.uint8)
+
+
+def load_settings(conn, rdef_id):
+    """
+    RenderSettings of a rendering def, or None if it can't be rendered
+    locally.
+    """
+    params = omero.sys.ParametersI()
+    params.add("id", rlong(rdef_id))
+    rdef = conn.getQueryService().findByQuery(
+        RENDERING_DEF_QUERY, params, conn.SERVICE_OPTS)
+    if rdef is None:
+        return None
+    settings = RenderSettings.from_rendering_def(
+        rdef, conn.getMaxPlaneSize())
+    if not settings.supported:
+        return None
+    return settings
+
+
+class LocalRenderingEngine(object):
+    """
+    Renders from raw planes with the calls of a RenderingEngine that the
+    scripts use. The raw planes of the last Z, T (or projection) and region
+    rendered are kept, so that the panels of one plane download it once.
+
+    :param conn:        The BlitzGateway connection
+    :param settings:    The saved RenderSettings of the image
+    """
+
+    def __init__(self, conn, settings):
+        self._conn = conn
+        self._saved = settings
+        self._settings = settings.copy()
+        pixels = settings.pixels
+        self._pixels_id = unwrap(pixels.getId())
+        self._shape = (unwrap(pixels.getSizeY()), unwrap(pixels.getSizeX()))
+        self._dtype = numpy.dtype(PIXEL_TYPES[unwrap(
+            pixels.getPixelsType().getValue())])
+        self._store = None
+        self._key = None
+        self._planes = {}
+        self.downloads = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._store is not None:
+            self._store.close()
+            self._store = None
+        self._planes = {}
+
+    # -- RenderingEngine calls ------------------------------------------
+
+    def load(self, ctx=None):
+        """Discard changes, back to the saved settings."""
+        self._settings = self._saved.copy()
+
+    def getPixels(self, ctx=None):
+        return self._settings.pixels
+
+    def getDefaultZ(self, ctx=None):
+        return self._settings.default_z
+
+    def getDefaultT(self, ctx=None):
+        return self._settings.default_t
+
+    def isActive(self, c, ctx=None):
+        return self._settings.channels[c].active
+
+    def setActive(self, c, active, ctx=None):
+        self._settings.channels[c].active = bool(active)
+
+    def getRGBA(self, c, ctx=None):
+        return list(self._settings.channels[c].rgba)
+
+    def setRGBA(self, c, red, green, blue, alpha, ctx=None):
+        self._settings.channels[c].rgba = (red, green, blue, alpha)
+
+    def getChannelWindowStart(self, c, ctx=None):
+        return self._settings.channels[c].start
+
+    def getChannelWindowEnd(self, c, ctx=None):
+        return self._settings.channels[c].end
+
+    def setChannelWindow(self, c, start, end, ctx=None):
+        self._settings.channels[c].start = float(start)
+        self._settings.channels[c].end = float(end)
+
+    def setModel(self, model, ctx=None):
+        self._settings.model = unwrap(model.getValue())
+
+    def renderCompressed(self, plane_def, ctx=None):
+        """The plane rendered as PPM, a lossless stand-in for JPEG."""
+        region = getattr(plane_def, "region", None)
+        if region is not None:
+            region = (region.x, region.y, region.width, region.height)
+        return self._encode(self.render(plane_def.z, plane_def.t, region))
+
+    def renderProjectedCompressed(self, algorithm, t, stepping, start, end,
+                                  ctx=None):
+        """The projection rendered as PPM."""
+        return self._encode(self.render_projection(
+            algorithm, t, stepping, start, end))
+
+    # -- arrays ---------------------------------------------------------
+
+    def render(self, z, t, region=None):
+        """Render plane z, t, or a region (x, y, w, h) of it, to RGB."""
+        shape = self._shape if region is None else (region[3], region[2])
+        return self._render((z, t, region), shape,
+                            lambda c: self._download(z, c, t, region))
+
+    def render_projection(self, algorithm, t, stepping, start, end,
+                          region=None):
+        """
+        Render the projection of Z start to end, or of a region
+        (x, y, w, h) of it, to RGB.
+        """
+        zs = z_indexes(start, end, stepping)
+        key = (str(algorithm), t, start, end, stepping, region)
+        shape = self._shape if region is None else (region[3], region[2])
+        return self._render(key, shape, lambda c: project(
+            (self._download(z, c, t, region) for z in zs), algorithm,
+            self._dtype))
+
+    def contains(self, region):
+        """True if region (x, y, w, h) is inside the image."""
+        x, y, w, h = region
+        return (x >= 0 and y >= 0 and x + w <= self._shape[1] and
+                y + h <= self._shape[0])
+
+    def _render(self, key, shape, get_plane):
+        if key != self._key:
+            self._key = key
+            self._planes = {}
+        for c in self._settings.active_channels():
+            if c not in self._planes:
+                self._planes[c] = get_plane(c)
+        return self._settings.render(self._planes, shape)
+
+    def _download(self, z, c, t, region=None):
+        if self._store is None:
+            self._store = self._conn.createRawPixelsStore()
+            self._store.setPixelsId(self._pixels_id, True)
+        if region is None:
+            data = self._store.getPlane(z, c, t)
+            shape = self._shape
+        else:
+            x, y, w, h = region
+            data = self._store.getTile(z, c, t, x, y, w, h)
+            shape = (h, w)
+        self.downloads += 1
+        plane = numpy.frombuffer(data, self._dtype.newbyteorder(">"))
+        return plane.reshape(shape).astype(self._dtype)
+
+    def _encode(self, rgb):
+        out = io.BytesIO()
+        # uncompressed: it is decoded again straight away
+        Image.fromarray(rgb, "RGB").save(out, "PPM")
+        return out.getvalue()
+
+
+@contextmanager
+def local_engine(conn, re):
+    """
+    Context manager giving a LocalRenderingEngine with the settings re has
+    loaded, or re itself if they can't be rendered locally.
+    """
+    settings = None
+    if local_rendering():
+        settings = load_settings(conn, re.getRenderingDefId())
+    if settings is None:
+        yield re
+        return
+    with LocalRenderingEngine(conn, settings) as engine:
+        yield engine
@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2024 University of Muenster. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Disk cache of rendered panels, shared by the figure scripts.
+
+Figures are often made again and again with only their labels or spacing
+changed, and each run renders every panel again. :class:`PanelCache` keeps
+the JPEGs returned by ``renderCompressed`` and ``renderProjectedCompressed``
+on disk. :meth:`PanelCache.engine` wraps a rendering engine, set up for an
+image, so that panels already rendered with the same settings are read
+from the cache::
+
+    panels = PanelCache(conn)
+
+    def render_row(re, pixels_id):
+        re = panels.engine(re)
+        re.setActive(0, True)
+        jpeg = re.renderCompressed(plane_def)   # from disk the next time
+
+A panel is keyed by the user, the pixels, the rendering def ID and its
+update event, the changes made to the settings since they were loaded,
+e.g. active channels, colours, windows and model, and the plane, region
+or projection. Saving new rendering settings changes the update event, so
+panels rendered with the old ones are not used again.
+
+Panels are files under ``OMERO_SCRIPTS_PANEL_CACHE_DIR`` (default
+``omero_panel_cache`` in the temporary directory). Once they take more than
+``OMERO_SCRIPTS_PANEL_CACHE_MB`` (default 512), the least recently used are
+removed. A size of 0 turns the cache off.
+"""
+
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+
+from omero.rtypes import unwrap
+from omero.sys import ParametersI
+
+from omero.script_helpers.lazy import lazy_import
+
+numpy = lazy_import("numpy")
+
+DEFAULT_MAX_MB = 512
+ENV_MAX_MB = "OMERO_SCRIPTS_PANEL_CACHE_MB"
+ENV_CACHE_DIR = "OMERO_SCRIPTS_PANEL_CACHE_DIR"
+
+RENDERING_DEF_QUERY = (
+    "select r.pixels.id, r.details.updateEvent.id from RenderingDef r "
+    "where r.id = :id")
+
+# calls that go back to the saved settings, discarding changes
+RESETS = ("load", "lookupPixels", "lookupRenderingDef", "loadRenderingDef",
+          "setRenderingDefId")
+
+# setters of one channel, whose first argument is the channel index
+CHANNEL_SETTERS = ("setActive", "setRGBA", "setChannelWindow",
+                   "setChannelFamily", "setChannelNoiseReduction",
+                   "setChannelLookupTable", "setChannelCurveCoefficient")
+
+# eviction goes down to this fraction of the limit, so that each new
+# panel does not evict an old one
+EVICT_TO = 0.9
+
+
+def cache_root():
+    """The directory that holds the cached panels."""
+    return os.environ.get(ENV_CACHE_DIR) or os.path.join(
+        tempfile.gettempdir(), "omero_panel_cache")
+
+
+class PanelCache(object):
+    """
+    Rendered panels on disk, evicting the least recently used once they
+    take more than max_bytes.
+
+    :param conn:        The BlitzGateway connection
+    :param directory:   Where to keep panels. Default from the
+                        OMERO_SCRIPTS_PANEL_CACHE_DIR environment variable
+    :param max_bytes:   Size limit. Default from the
+                        OMERO_SCRIPTS_PANEL_CACHE_MB environment variable
+    """
+
+    def __init__(self, conn, directory=None, max_bytes=None):
+        if max_bytes is None:
+            max_bytes = int(float(os.environ.get(ENV_MAX_MB, DEFAULT_MAX_MB))
+                            * 1024 * 1024)
+        self._conn = conn
+        self.directory = directory or cache_root()
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._user_id = None
+        self.nbytes = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def engine(self, re, renderer=None):
+        """
+        A stand-in for the rendering engine re that reads panels from the
+        cache, or re itself if the cache is off.
+
+        :param re:          Rendering engine set up for an image
+        :param renderer:    Engine to render panels that are not cached,
+                            e.g. a LocalRenderingEngine with the settings
+                            of re. Default: re
+        """
+        renderer = re if renderer is None else renderer
+        if not self.enabled:
+            return renderer
+        rdef_id = re.getRenderingDefId()
+        params = ParametersI()
+        params.addId(rdef_id)
+        rows = self._conn.getQueryService().projection(
+            RENDERING_DEF_QUERY, params, self._conn.SERVICE_OPTS)
+        if not rows:
+            return renderer
+        if self._user_id is None:
+            self._user_id = self._conn.getUserId()
+        pixels_id, event_id = [unwrap(v) for v in rows[0]]
+        base = [self._user_id, pixels_id, rdef_id, event_id,
+                type(renderer).__name__]
+        return CachedRenderingEngine(self, renderer, base)
+
+    def _path(self, key, extension):
+        digest = hashlib.sha1(
+            json.dumps(key, default=str).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, "%s.%s" % (digest, extension))
+
+    def get(self, key, loader, extension="jpg"):
+        """
+        The bytes cached under key, calling loader() to make them on a
+        miss.
+        """
+        data = self.lookup(key, extension)
+        if data is None:
+            data = loader()
+            self.store(key, data, extension)
+        return data
+
+    def lookup(self, key, extension="jpg"):
+        """The bytes cached under key, or None."""
+        path = self._path(key, extension)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path, None)
+        except (IOError, OSError):
+            data = None
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return data
+
+    def store(self, key, data, extension="jpg"):
+        """Cache data under key."""
+        self.put(self._path(key, extension), data)
+
+    def put(self, path, data):
+        """Write data to path, then evict panels to stay within the limit."""
+        if not data or len(data) > self.max_bytes:
+            return
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                # made by another thread or process
+                pass
+        # written under another name first, so readers never see half
+        tmp = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            if self.nbytes is None:
+                self.nbytes = self._scan_size()
+            else:
+                self.nbytes += len(data)
+            if self.nbytes > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".tmp"):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self):
+        # other processes share the directory: count again before evicting
+        entries = sorted(self._entries())
+        self.nbytes = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.nbytes <= self.max_bytes * EVICT_TO:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.nbytes -= size
+            self.evictions += 1
+
+    def clear(self):
+        """Remove all cached panels. Statistics are kept."""
+        with self._lock:
+            if os.path.isdir(self.directory):
+                for _, _, path in self._entries():
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+            self.nbytes = 0
+
+    def stats(self):
+        """Dict of hits, misses and evictions."""
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
+
+    def report(self):
+        """One line summary of the statistics, for the script's log."""
+        lookups = self.hits + self.misses
+        ratio = 100.0 * self.hits / lookups if lookups else 0
+        return ("Panel cache: %d hits, %d misses (%.0f%% hit rate), "
+                "%d evictions" % (self.hits, self.misses, ratio,
+                                  self.evictions))
+
+
+class CachedRenderingEngine(object):
+    """
+    A rendering engine that records the changes made to its settings and
+    reads the panels they render from a PanelCache. Other calls go to the
+    engine it wraps.
+
+    :param cache:       The PanelCache
+    :param renderer:    The engine to render with
+    :param base:        JSON-able key of the image and its saved settings
+    """
+
+    def __init__(self, cache, renderer, base):
+        self._cache = cache
+        self._renderer = renderer
+        self._base = base
+        self._changes = {}
+
+    def __getattr__(self, name):
+        attr = getattr(self._renderer, name)
+        if not callable(attr):
+            return attr
+        if name == "render_projection":
+            # a LocalRenderingEngine's projection of a region, as an array
+            def render_projection(*args):
+                def render():
+                    data = io.BytesIO()
+                    numpy.save(data, attr(*args))
+                    return data.getvalue()
+                array = self._cache.get(
+                    self._key(name, str(args[0]), *args[1:]), render, "npy")
+                return numpy.load(io.BytesIO(array))
+            return render_projection
+        if name in RESETS:
+            def reset(*args, **kwargs):
+                self._changes = {}
+                return attr(*args, **kwargs)
+            return reset
+        if name.startswith("set"):
+            def change(*args, **kwargs):
+                # the call context is not a setting
+                values = [a for a in args if not isinstance(a, dict)]
+                key = name
+                if name in CHANNEL_SETTERS:
+                    key = "%s:%s" % (name, values[0])
+                self._changes[key] = values
+                return attr(*args, **kwargs)
+            return change
+        return attr
+
+    def _key(self, *panel):
+        return self._base + [sorted(self._changes.items()), list(panel)]
+
+    def renderCompressed(self, plane_def, ctx=None):
+        region = getattr(plane_def, "region", None)
+        if region is not None:
+            region = [region.x, region.y, region.width, region.height]
+        key = self._key("plane", plane_def.z, plane_def.t, region,
+                        getattr(plane_def, "slice", None),
+                        getattr(plane_def, "stride", None))
+        args = (plane_def,) if ctx is None else (plane_def, ctx)
+        return self._cache.get(
+            key, lambda: self._renderer.renderCompressed(*args))
+
+    def renderProjectedCompressed(self, algorithm, t, stepping, start, end,
+                                  ctx=None):
+        key = self._key("projection", str(algorithm), t, stepping, start,
+                        end)
+        args = (algorithm, t, stepping, start, end)
+        if ctx is not None:
+            args += (ctx,)
+        return self._cache.get(
+            key, lambda: self._renderer.renderProjectedCompressed(*args))
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2024 University of Muenster. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Process-local LRU cache of pixel planes and tiles with a memory budget.
+
+Entries are numpy arrays keyed by ``(pixels id, z, c, t, region)``, where
+region is ``None`` for a whole plane or an ``(x, y, width, height)``
+tuple. :class:`CachedPixels` puts the cache in front of a PixelsWrapper::
+
+    bounds = bounds_by_plane([(z, t, points)], line_width, size_x, size_y)
+    pixels = CachedPixels(image.getPrimaryPixels(), bounds=bounds)
+    tile = pixels.getTile(z, c, t, (x, y, 64, 64))
+    print(get_cache().report())
+
+The budget defaults to 256 MB and can be set with the
+``OMERO_SCRIPTS_CACHE_MB`` environment variable.
+"""
+
+import os
+from collections import OrderedDict
+
+from omero.script_helpers.lazy import lazy_import
+
+numpy = lazy_import("numpy")
+
+DEFAULT_MAX_MB = 256
+ENV_MAX_MB = "OMERO_SCRIPTS_CACHE_MB"
+
+
+class PlaneCache(object):
+    """
+    LRU cache of numpy arrays, evicting the least recently used entries
+    once the total size exceeds max_bytes. Arrays bigger than the whole
+    budget are passed through without being cached.
+    """
+
+    def __init__(self, max_bytes=None):
+        if max_bytes is None:
+            max_bytes = int(float(os.environ.get(ENV_MAX_MB, DEFAULT_MAX_MB))
+                            * 1024 * 1024)
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, loader):
+        """
+        Return the array cached under key, calling loader() to fetch it
+        on a miss. The cached array is read-only.
+        """
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+        self.misses += 1
+        return self.put(key, loader())
+
+    def put(self, key, array):
+        """Cache array under key, evicting older entries to make room."""
+        array = numpy.asarray(array)
+        if array.nbytes > self.max_bytes:
+            return array
+        if key in self._entries:
+            self.nbytes -= self._entries.pop(key).nbytes
+        array.setflags(write=False)
+        self._entries[key] = array
+        self.nbytes += array.nbytes
+        while self.nbytes > self.max_bytes:
+            _, old = self._entries.popitem(last=False)
+            self.nbytes -= old.nbytes
+            self.evictions += 1
+        return array
+
+    def clear(self):
+        """Drop all entries. Statistics are kept."""
+        self._entries.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        """Dict of hits, misses, evictions, entries and bytes."""
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'entries': len(self._entries),
+                'bytes': self.nbytes}
+
+    def report(self):
+        """One line summary of the statistics, for the script's log."""
+        lookups = self.hits + self.misses
+        ratio = 100.0 * self.hits / lookups if lookups else 0
+        return ("Plane cache: %d hits, %d misses (%.0f%% hit rate), "
+                "%d evictions, %.1f MB in %d entries" % (
+                    self.hits, self.misses, ratio, self.evictions,
+                    self.nbytes / (1024.0 * 1024), len(self._entries)))
+
+
+_cache = None
+
+
+def get_cache():
+    """The cache shared by everything in this process."""
+    global _cache
+    if _cache is None:
+        _cache = PlaneCache()
+    return _cache
+
+
+def contains(outer, inner):
+    """True if region inner (x, y, w, h) lies within region outer."""
+    ox, oy, ow, oh = outer
+    x, y, w, h = inner
+    return ox <= x and oy <= y and x + w <= ox + ow and y + h <= oy + oh
+
+
+def crop(array, outer, inner):
+    """Copy of region inner out of array, which holds region outer."""
+    ox, oy = outer[0], outer[1]
+    x, y, w, h = inner
+    return numpy.array(array[y - oy:y - oy + h, x - ox:x - ox + w])
+
+
+class CachedPixels(object):
+    """
+    Wraps a PixelsWrapper so that getPlane(s)/getTile(s) go through a
+    :class:`PlaneCache`. Everything else is passed to the wrapped object.
+
+    bounds maps (z, t) to a region (x, y, width, height), e.g. from
+    :func:`bounds_by_plane`. Tiles inside the region of their plane are
+    cut from one cached fetch of that region per Z/C/T, so several lines
+    or shapes in the same area cost a single read. Returned arrays are
+    copies that the caller may modify.
+    """
+
+    def __init__(self, pixels, cache=None, bounds=None):
+        self._pixels = pixels
+        self._cache = cache if cache is not None else get_cache()
+        self._bounds = bounds or {}
+
+    def __getattr__(self, name):
+        return getattr(self._pixels, name)
+
+    @property
+    def cache(self):
+        return self._cache
+
+    def _key(self, z, c, t, region):
+        return (self._pixels.getId(), z, c, t, region)
+
+    def _load(self, z, c, t, region):
+        return self._pixels.getTile(z, c, t, region)
+
+    def getPlane(self, theZ=0, theC=0, theT=0):
+        key = self._key(theZ, theC, theT, None)
+        return numpy.array(self._cache.get(
+            key, lambda: self._pixels.getPlane(theZ, theC, theT)))
+
+    def getPlanes(self, zctList):
+        for z, c, t in zctList:
+            yield self.getPlane(z, c, t)
+
+    def getTile(self, theZ=0, theC=0, theT=0, tile=None):
+        if tile is None:
+            return self.getPlane(theZ, theC, theT)
+        tile = tuple(int(v) for v in tile)
+        plane_key = self._key(theZ, theC, theT, None)
+        if plane_key in self._cache:
+            size = (0, 0, self._pixels.getSizeX(), self._pixels.getSizeY())
+            return crop(self._cache.get(plane_key, None), size, tile)
+        bounds = self._bounds.get((theZ, theT))
+        if bounds is not None and contains(bounds, tile):
+            outer = self._cache.get(
+                self._key(theZ, theC, theT, bounds),
+                lambda: self._load(theZ, theC, theT, bounds))
+            return crop(outer, bounds, tile)
+        return numpy.array(self._cache.get(
+            self._key(theZ, theC, theT, tile),
+            lambda: self._load(theZ, theC, theT, tile)))
+
+    def getTiles(self, zctTileList):
+        for z, c, t, tile in zctTileList:
+            yield self.getTile(z, c, t, tile)
+
+
+def bounds_by_plane(shapes, margin, size_x, size_y, max_size=None):
+    """
+    Regions covering the shapes on each plane, for :class:`CachedPixels`.
+
+    :param shapes:      List of (z, t, points) with points [(x, y), ...]
+    :param margin:      Pixels to add on each side, e.g. the line width
+    :param max_size:    (width, height) the server will return in one
+                        read. Planes whose region is bigger are left out.
+    :return:            Dict of (z, t) -> (x, y, width, height)
+    """
+    corners = {}
+    for z, t, points in shapes:
+        xs = [p[0] for p in points]
+        ys = [p[1] for p in points]
+        box = corners.setdefault((z, t), [min(xs), min(ys), max(xs),
+                                          max(ys)])
+        box[:] = [min(box[0], min(xs)), min(box[1], min(ys)),
+                  max(box[2], max(xs)), max(box[3], max(ys))]
+    bounds = {}
+    for plane, (x1, y1, x2, y2) in corners.items():
+        x1 = max(0, int(x1 - margin))
+        y1 = max(0, int(y1 - margin))
+        x2 = min(size_x, int(x2 + margin) + 1)
+        y2 = min(size_y, int(y2 + margin) + 1)
+        if x2 <= x1 or y2 <= y1:
+            continue
+        if max_size is not None and (x2 - x1 > max_size[0] or
+                                     y2 - y1 > max_size[1]):
+            continue
+        bounds[plane] = (x1, y1, x2 - x1, y2 - y1)
+    return bounds
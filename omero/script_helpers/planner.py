@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2024 University of Muenster. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Plans the planes, bytes, memory and files of a script before it runs.
+
+Scripts that read or write whole planes only find out that an image is too
+big when the server refuses it or the script runs out of memory. A
+:class:`Plan` adds up, from the image dimensions and pixel type, what each
+image will cost, and :func:`choose_mode` picks how to process it within
+the memory budget::
+
+    plan = Plan()
+    for image in images:
+        plane = size_x * size_y * bytes_per_pixel(pixels_type)
+        mode = choose_mode(plane * planes, plane)
+        plan.add(image.getName(), mode, planes=planes,
+                 bytes_down=plane * planes, memory=plane)
+    if script_params.get(DRY_RUN_PARAM):
+        return None, plan.report()
+
+The modes are :data:`IN_MEMORY`, when all the planes of an image fit in
+the budget, :data:`STREAMING`, one plane at a time, and :data:`TILED`, one
+tile at a time, for planes that do not fit. What each mode means is up to
+the script. The budget defaults to 1024 MB and can be set with the
+``OMERO_SCRIPTS_MEMORY_MB`` environment variable.
+"""
+
+import os
+
+from omero.script_helpers import prefetch, render_pool, uploader
+from omero.script_helpers.local_render import PIXEL_TYPES
+
+DEFAULT_MEMORY_MB = 1024
+ENV_MEMORY_MB = "OMERO_SCRIPTS_MEMORY_MB"
+DRY_RUN_PARAM = "Dry_Run"
+
+IN_MEMORY = "in-memory"
+STREAMING = "streaming"
+TILED = "tiled"
+MODES = (IN_MEMORY, STREAMING, TILED)
+
+# pixel types that cannot be rendered locally, and so are not in
+# PIXEL_TYPES
+OTHER_PIXEL_BYTES = {"bit": 1, "complex": 8, "double-complex": 16}
+
+MB = 1024.0 * 1024
+
+
+def memory_budget(budget_mb=None):
+    """The memory budget in bytes, by default from the environment."""
+    if budget_mb is None:
+        budget_mb = float(os.environ.get(ENV_MEMORY_MB, DEFAULT_MEMORY_MB))
+    return int(budget_mb * MB)
+
+
+def bytes_per_pixel(pixels_type):
+    """Bytes per pixel of an OMERO pixels type, e.g. 2 for 'uint16'."""
+    if pixels_type in PIXEL_TYPES:
+        return int(PIXEL_TYPES[pixels_type][1:])
+    return OTHER_PIXEL_BYTES[pixels_type]
+
+
+def tile_count(size_x, size_y, tile_width, tile_height):
+    """Number of tiles of tile_width by tile_height to cover a plane."""
+    return (-(-size_x // tile_width)) * (-(-size_y // tile_height))
+
+
+def pipeline_planes():
+    """
+    Planes held at once by prefetch() feeding create_image_from_numpy_seq:
+    the queue, the plane being made and those waiting to upload.
+    """
+    depth = int(os.environ.get(prefetch.ENV_DEPTH, prefetch.DEFAULT_DEPTH))
+    workers = int(os.environ.get(uploader.ENV_WORKERS,
+                                 uploader.DEFAULT_WORKERS))
+    return depth + 1 + 2 * max(1, workers)
+
+
+def pool_planes():
+    """
+    Rendered planes held at once by RenderingEnginePool.imap(): those
+    queued and the one the script is saving.
+    """
+    workers = int(os.environ.get(render_pool.ENV_WORKERS,
+                                 render_pool.DEFAULT_WORKERS))
+    return 2 * max(1, workers) + 1
+
+
+def choose_mode(in_memory_bytes, streaming_bytes, budget=None):
+    """
+    IN_MEMORY if in_memory_bytes fit in the budget, else STREAMING if
+    streaming_bytes do, else TILED.
+
+    :param in_memory_bytes:     Memory to process in memory, or None if
+                                the script cannot
+    :param streaming_bytes:     Memory to process one plane at a time
+    :param budget:              Bytes. Default: :func:`memory_budget`
+    """
+    if budget is None:
+        budget = memory_budget()
+    if in_memory_bytes is not None and in_memory_bytes <= budget:
+        return IN_MEMORY
+    if streaming_bytes <= budget:
+        return STREAMING
+    return TILED
+
+
+class Plan(object):
+    """
+    The planes, tiles, bytes, memory and files of the steps of a run.
+
+    :param budget:          Memory budget in bytes. Default:
+                            :func:`memory_budget`
+    :param concurrency:     Number of steps run at the same time, e.g.
+                            by worker processes
+    """
+
+    def __init__(self, budget=None, concurrency=1):
+        self.budget = memory_budget() if budget is None else budget
+        self.concurrency = concurrency
+        self.steps = []
+        self.skipped = []
+
+    def add(self, name, mode, planes=0, tiles=0, bytes_down=0, bytes_up=0,
+            memory=0, files=0, images=0):
+        """
+        Add a step, e.g. an image, run in mode.
+
+        :param memory:      Peak bytes held while the step runs
+        :param files:       Files the step writes
+        :param images:      Images the step creates
+        :return:            mode
+        """
+        if mode not in MODES:
+            raise ValueError("Unknown mode: %s" % mode)
+        self.steps.append(dict(
+            name=name, mode=mode, planes=planes, tiles=tiles,
+            bytes_down=bytes_down, bytes_up=bytes_up, memory=memory,
+            files=files, images=images))
+        return mode
+
+    def skip(self, name, reason):
+        """Record a step that will not run, and why."""
+        self.skipped.append((name, reason))
+
+    def total(self, key):
+        """The sum of key, e.g. 'bytes_down', over all steps."""
+        return sum(step[key] for step in self.steps)
+
+    @property
+    def peak_memory(self):
+        """Bytes held by the largest steps that run at the same time."""
+        memory = sorted((step["memory"] for step in self.steps),
+                        reverse=True)
+        return sum(memory[:self.concurrency])
+
+    @property
+    def over_budget(self):
+        """True if the peak memory is over the budget."""
+        return self.peak_memory > self.budget
+
+    def as_dict(self):
+        """The totals, modes and skipped steps, JSON-able."""
+        totals = dict((key, self.total(key)) for key in (
+            "planes", "tiles", "bytes_down", "bytes_up", "files", "images"))
+        totals["peak_memory"] = self.peak_memory
+        totals["budget"] = self.budget
+        totals["modes"] = dict((mode, sum(1 for s in self.steps
+                                          if s["mode"] == mode))
+                               for mode in MODES)
+        totals["skipped"] = [list(s) for s in self.skipped]
+        return totals
+
+    def report(self):
+        """A short summary, for the script's message or log."""
+        data = self.as_dict()
+        modes = ", ".join("%d %s" % (n, mode)
+                          for mode, n in sorted(data["modes"].items()) if n)
+        lines = ["Plan: %d step(s)%s" % (
+            len(self.steps), " (%s)" % modes if modes else "")]
+        lines.append("Planes: %d, tiles: %d" % (data["planes"],
+                                                data["tiles"]))
+        lines.append("Download: %.1f MB, upload: %.1f MB" % (
+            data["bytes_down"] / MB, data["bytes_up"] / MB))
+        lines.append("Peak memory: %.1f MB of %.1f MB budget" % (
+            data["peak_memory"] / MB, self.budget / MB))
+        if data["files"]:
+            lines.append("Files: %d" % data["files"])
+        if data["images"]:
+            lines.append("New images: %d" % data["images"])
+        for name, reason in self.skipped:
+            lines.append("Skipped %s: %s" % (name, reason))
+        return "\n".join(lines)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2024 University of Muenster. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Runs a plane generator ahead of its consumer on a background thread.
+
+Scripts create images with ``createImageFromNumpySeq`` from a generator
+that downloads and processes each plane. The upload of a plane and the
+download of the next then wait for each other. :func:`prefetch` runs the
+generator on its own thread, up to ``depth`` planes ahead, so that both
+overlap::
+
+    conn.createImageFromNumpySeq(prefetch(plane_gen()), name, ...)
+
+An exception raised by the generator is raised again by the consumer's
+``next()``. At most ``depth`` planes wait in the queue, plus the one the
+generator is making. The depth defaults to 2 and can be set with the
+``OMERO_SCRIPTS_PREFETCH_DEPTH`` environment variable. A depth of 0 runs
+the generator on the calling thread, as without prefetching.
+"""
+
+import os
+import queue
+import threading
+
+DEFAULT_DEPTH = 2
+ENV_DEPTH = "OMERO_SCRIPTS_PREFETCH_DEPTH"
+
+# polling interval of the producer while the queue is full, to notice that
+# the consumer has stopped
+_POLL = 0.1
+
+
+def prefetch(iterable, depth=None):
+    """
+    Iterate over iterable on a background thread, depth items ahead.
+
+    :param iterable:    E.g. a generator of planes
+    :param depth:       Items to read ahead. Default from the
+                        OMERO_SCRIPTS_PREFETCH_DEPTH environment variable,
+                        else 2
+    :return:            An iterator over the same items, in order
+    """
+    if depth is None:
+        depth = int(os.environ.get(ENV_DEPTH, DEFAULT_DEPTH))
+    if depth < 1:
+        return iter(iterable)
+    return Prefetcher(iterable, depth)
+
+
+class Prefetcher(object):
+    """
+    Iterator over the items of iterable, read ahead by a daemon thread.
+    Close it, or exhaust it, to stop the thread.
+
+    :param iterable:    The items to read
+    :param depth:       Size of the queue between the thread and consumer
+    """
+
+    _DONE = object()
+
+    def __init__(self, iterable, depth=DEFAULT_DEPTH):
+        self.depth = max(1, depth)
+        self._queue = queue.Queue(self.depth)
+        self._stop = threading.Event()
+        self._finished = False
+        self._thread = threading.Thread(target=self._produce,
+                                        args=(iterable,),
+                                        name="prefetch")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._finished:
+            raise StopIteration
+        item, error = self._queue.get()
+        if item is self._DONE:
+            self._finished = True
+            self._thread.join()
+            if error is not None:
+                raise error
+            raise StopIteration
+        return item
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _put(self, item, error=None):
+        """Queue item, unless the consumer stops first."""
+        while not self._stop.is_set():
+            try:
+                self._queue.put((item, error), timeout=_POLL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self, iterable):
+        error = None
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if not self._put(item):
+                    break
+        except Exception as e:
+            error = e
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+        self._put(self._DONE, error)
+
+    def close(self):
+        """Stop reading ahead and drop the items read so far."""
+        if self._finished:
+            return
+        self._finished = True
+        self._stop.set()
+        self._thread.join()
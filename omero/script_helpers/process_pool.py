@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2024 University of Muenster. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Processes the images of a script in several worker processes.
+
+Scripts that create a new image from each selected image spend their time
+in Python, one image after the other. :func:`map_images` calls a function
+for each image ID in a pool of worker processes, each of which joins the
+session of the script in its group, and returns the results in the order
+of the IDs::
+
+    def process_image(conn, image_id, script_params):
+        ...
+        return new_image.getId(), log_lines
+
+    results = map_images(conn, process_image, image_ids, script_params)
+
+The function must be defined at the top level of the script, and its
+arguments and results must be picklable: return IDs, not wrappers, and let
+the script load the objects it outputs. Workers are started with 'spawn',
+so that they do not inherit the Ice threads of the script.
+
+The number of processes defaults to 4 and can be set with the
+``OMERO_SCRIPTS_IMAGE_WORKERS`` environment variable. With 1, or with a
+single image, the images are processed in the script's own process with
+its connection.
+"""
+
+import atexit
+import os
+
+DEFAULT_WORKERS = 4
+ENV_WORKERS = "OMERO_SCRIPTS_IMAGE_WORKERS"
+
+# the connection of a worker process
+_conn = None
+
+
+def image_workers(count, workers=None):
+    """Number of processes to use for count images."""
+    if workers is None:
+        workers = int(os.environ.get(ENV_WORKERS, DEFAULT_WORKERS))
+    return max(1, min(workers, count, os.cpu_count() or 1))
+
+
+def join_session(properties, session_id):
+    """
+    A BlitzGateway joined to a session, for a worker process. The session
+    is not closed when the worker exits.
+
+    :param properties:      The Ice properties of the script's client
+    :param session_id:      UUID of the session to join
+    """
+    import omero
+    from omero.gateway import BlitzGateway
+
+    client = omero.client(pmap=properties)
+    client.joinSession(session_id).detachOnDestroy()
+    atexit.register(client.closeSession)
+    return BlitzGateway(client_obj=client)
+
+
+def worker_args(conn):
+    """
+    What a worker needs to join the session of conn: its Ice properties,
+    the session ID and the group its calls run in, or None.
+    """
+    return (conn.c.getPropertyMap(), conn.c.getSessionId(),
+            conn.SERVICE_OPTS.getOmeroGroup())
+
+
+def _init_worker(properties, session_id, group=None):
+    global _conn
+    _conn = join_session(properties, session_id)
+    if group is not None:
+        _conn.SERVICE_OPTS.setOmeroGroup(group)
+
+
+def _call(func, image_id, args):
+    return func(_conn, image_id, *args)
+
+
+def map_images(conn, func, image_ids, *args, **kwargs):
+    """
+    [func(conn, image_id, *args) for image_id in image_ids], computed in
+    worker processes that each join the session of conn.
+
+    :param workers:     Number of processes (keyword only). Default from
+                        the OMERO_SCRIPTS_IMAGE_WORKERS environment
+                        variable, else 4
+    :param progress:    A :class:`~omero.script_helpers.progress.Progress`
+                        to update as each image is done (keyword only)
+    :return:            The results, in the order of image_ids. The first
+                        exception raised by func is raised again
+    """
+    image_ids = list(image_ids)
+    workers = image_workers(len(image_ids), kwargs.pop("workers", None))
+    progress = kwargs.pop("progress", None)
+    if kwargs:
+        raise TypeError("Unexpected arguments: %s" % ", ".join(kwargs))
+    if workers == 1:
+        results = []
+        for image_id in image_ids:
+            results.append(func(conn, image_id, *args))
+            if progress is not None:
+                progress.update()
+        return results
+
+    # multiprocessing imports subprocess and more: only when needed
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    with ProcessPoolExecutor(workers, multiprocessing.get_context("spawn"),
+                             _init_worker, worker_args(conn)) as pool:
+        futures = [pool.submit(_call, func, image_id, args)
+                   for image_id in image_ids]
+        if progress is not None:
+            for _ in as_completed(futures):
+                progress.update()
+        return [f.result() for f in futures]
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2024 University of Muenster. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Progress, throughput and time left of a long script run.
+
+A script counts the items it finishes, and the bytes they moved if it
+knows them. At most every ``OMERO_SCRIPTS_PROGRESS_INTERVAL`` seconds
+(default 10) a line goes to stdout, which the script processor keeps as
+the script's ``stdout`` output::
+
+    progress = Progress(len(images), "images")
+    for image in images:
+        export(image)
+        progress.update(nbytes=size_of(image))
+    message += " " + progress.finish()
+
+prints lines such as::
+
+    Progress: 120/480 images (25%), 2.0 images/s, 3.1 MB/s, ETA 0:03:00
+
+and :meth:`Progress.finish` prints and returns a summary for the
+``Message`` output, e.g. ``480 images in 0:04:00 (2.0 images/s,
+3.1 MB/s).`` MB/s is left out if no bytes were counted, and the ETA if
+the total is not known.
+"""
+
+import datetime
+import os
+import threading
+import time
+
+DEFAULT_INTERVAL = 10
+ENV_INTERVAL = "OMERO_SCRIPTS_PROGRESS_INTERVAL"
+
+
+def format_seconds(seconds):
+    """3725.2 -> '1:02:05'."""
+    return str(datetime.timedelta(seconds=int(round(seconds))))
+
+
+class Progress(object):
+    """
+    Counts finished items and bytes, and prints a progress line at most
+    every interval seconds. Updates may come from several threads.
+
+    :param total:       Number of items to do, or None if not known.
+                        More can be added with :meth:`add_total`
+    :param label:       Name of the items, e.g. 'images'
+    :param interval:    Seconds between lines. Default from the
+                        OMERO_SCRIPTS_PROGRESS_INTERVAL environment
+                        variable, else 10. 0 prints every update
+    :param out:         Callable that writes a line. Default: print
+    :param clock:       Callable returning the time in seconds
+    """
+
+    def __init__(self, total=None, label="items", interval=None, out=None,
+                 clock=time.time):
+        if interval is None:
+            interval = float(os.environ.get(ENV_INTERVAL, DEFAULT_INTERVAL))
+        self.total = total
+        self.label = label
+        self.interval = interval
+        self._out = out or print
+        self._clock = clock
+        self.start = clock()
+        self.done = 0
+        self.nbytes = 0
+        self.lines = 0
+        self._last = self.start
+        self._lock = threading.Lock()
+
+    def add_total(self, n):
+        """Add n items to do."""
+        with self._lock:
+            self.total = (self.total or 0) + n
+
+    def update(self, n=1, nbytes=0):
+        """
+        Count n more items done and nbytes moved, and print a line if the
+        last was interval seconds ago.
+        """
+        with self._lock:
+            self.done += n
+            self.nbytes += nbytes
+            now = self._clock()
+            if now - self._last < self.interval:
+                return
+            self._last = now
+            self.lines += 1
+            line = self.line(now)
+        self._out(line)
+
+    def rates(self, now=None):
+        """(seconds so far, items per second, bytes per second)."""
+        if now is None:
+            now = self._clock()
+        seconds = max(now - self.start, 1e-9)
+        return seconds, self.done / seconds, self.nbytes / seconds
+
+    def _throughput(self, items_per_second, bytes_per_second):
+        text = "%.1f %s/s" % (items_per_second, self.label)
+        if self.nbytes:
+            text += ", %.1f MB/s" % (bytes_per_second / (1024.0 * 1024))
+        return text
+
+    def line(self, now=None):
+        """The progress line, e.g. '12/48 images (25%), 0.5 images/s...'."""
+        seconds, items_per_second, bytes_per_second = self.rates(now)
+        if self.total:
+            text = "%d/%d %s (%.0f%%)" % (self.done, self.total, self.label,
+                                          100.0 * self.done / self.total)
+        else:
+            text = "%d %s" % (self.done, self.label)
+        text += ", " + self._throughput(items_per_second, bytes_per_second)
+        if self.total and items_per_second > 0:
+            left = max(self.total - self.done, 0) / items_per_second
+            text += ", ETA %s" % format_seconds(left)
+        return "Progress: " + text
+
+    def summary(self):
+        """'48 images in 0:01:02 (0.8 images/s, 2.1 MB/s).'"""
+        seconds, items_per_second, bytes_per_second = self.rates()
+        return "%d %s in %s (%s)." % (
+            self.done, self.label, format_seconds(seconds),
+            self._throughput(items_per_second, bytes_per_second))
+
+    def finish(self):
+        """Print and return the summary."""
+        summary = self.summary()
+        self._out("Done: " + summary)
+        return summary
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2024 University of Muenster. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Maximum, mean and sum Z-projections, streamed one plane at a time.
+
+Planes are added to an accumulator as they are read, so a projection
+holds one plane and the accumulator in memory, not the Z-stack::
+
+    projector = Projector("mean")
+    for z in z_indexes(z_start, z_end, step):
+        projector.add(get_plane(z, c, t))
+    projection = projector.result()
+
+Projections keep the type of their planes, like the server's: the mean is
+truncated and the sum clipped to the range of the type. This works for
+raw planes and for rendered uint8 RGB planes alike.
+"""
+
+from omero.script_helpers.lazy import lazy_import
+
+numpy = lazy_import("numpy")
+
+ALGORITHMS = ("max", "mean", "sum")
+
+
+def algorithm_name(algorithm):
+    """
+    'max', 'mean' or 'sum' for a ProjectionType, e.g. MAXIMUMINTENSITY,
+    or a name such as 'Max projection'.
+    """
+    name = str(algorithm).lower()
+    for short in ALGORITHMS:
+        if name.startswith(short):
+            return short
+    raise ValueError("Unknown projection: %s" % algorithm)
+
+
+def z_indexes(start, end, step=1):
+    """The Z indexes from start to end, both included, every step."""
+    if end < start:
+        start, end = end, start
+    return range(start, end + 1, max(1, int(step)))
+
+
+class Projector(object):
+    """
+    Accumulates planes into a projection.
+
+    :param algorithm:   'max', 'mean', 'sum' or a ProjectionType
+    :param dtype:       Type of the projection. Default: that of the first
+                        plane
+    """
+
+    def __init__(self, algorithm, dtype=None):
+        self.algorithm = algorithm_name(algorithm)
+        self.dtype = dtype is not None and numpy.dtype(dtype) or None
+        self.count = 0
+        self._acc = None
+
+    def add(self, plane):
+        """Add one plane to the projection."""
+        if self._acc is None:
+            if self.dtype is None:
+                self.dtype = plane.dtype
+            if self.algorithm == "max":
+                self._acc = numpy.array(plane, dtype=self.dtype)
+            else:
+                self._acc = plane.astype(numpy.float64)
+        elif self.algorithm == "max":
+            numpy.maximum(self._acc, plane, out=self._acc)
+        else:
+            self._acc += plane
+        self.count += 1
+
+    def result(self):
+        """The projection of the planes added so far."""
+        if self._acc is None:
+            raise ValueError("No planes to project")
+        if self.algorithm == "max":
+            return self._acc.copy()
+        if self.algorithm == "mean":
+            return (self._acc / self.count).astype(self.dtype)
+        if self.dtype.kind == 'f':
+            limits = numpy.finfo(self.dtype)
+        else:
+            limits = numpy.iinfo(self.dtype)
+        return numpy.clip(self._acc, limits.min, limits.max) \
+            .astype(self.dtype)
+
+
+def project(planes, algorithm, dtype=None):
+    """Projection of planes, an iterable of 2D (or RGB) arrays."""
+    projector = Projector(algorithm, dtype)
+    for plane in planes:
+        projector.add(plane)
+    return projector.result()
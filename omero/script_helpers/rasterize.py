@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2024 University of Muenster. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+The pixels of shapes, as NumPy masks, and their intensities.
+
+``getShapeStatsRestricted`` makes the server read the pixels of every
+shape on every plane. :func:`rasterize` turns a shape of a
+:class:`~omero.script_helpers.shape_index.ShapeIndex` into a boolean mask
+over a box of the plane, so that the script can read the region once and
+measure all its shapes locally::
+
+    box = shape_box(shapes, i, size_x, size_y)
+    mask = masks.mask(shapes, i, box)       # a MaskCache
+    stats = shape_stats(shape_id, channels, [region[c] for c in channels],
+                        mask)
+
+Pixel (X, Y) belongs to a shape if the point (X, Y) is inside it, as the
+server decides: rectangles and masks from x to x + width (exclusive),
+ellipses and polygons strictly inside, with the even-odd rule. Lines and
+polylines cover the pixels they pass through and points their pixel.
+Labels have no pixels.
+
+Shapes are measured locally only with ``OMERO_SCRIPTS_LOCAL_STATS=1``: the
+numbers have not yet been compared with those of a real server, so by
+default the server measures them. stdDev is the population standard
+deviation, see :func:`shape_stats`. The :class:`MaskCache` keeps masks
+within ``OMERO_SCRIPTS_MASK_CACHE_MB`` (default 64).
+"""
+
+import math
+import os
+
+from omero.rtypes import unwrap
+from omero.sys import ParametersI
+
+from omero.script_helpers.lazy import lazy_import
+from omero.script_helpers.plane_cache import PlaneCache
+from omero.script_helpers.shape_index import ID_BATCH, SHAPE_TYPES
+
+numpy = lazy_import("numpy")
+
+ENV_LOCAL_STATS = "OMERO_SCRIPTS_LOCAL_STATS"
+DEFAULT_MASK_CACHE_MB = 64
+ENV_MASK_CACHE_MB = "OMERO_SCRIPTS_MASK_CACHE_MB"
+
+MASK_QUERY = "select s from Mask s where s.id in (:ids)"
+
+RECTANGLE, ELLIPSE, LINE, POINT, POLYGON, POLYLINE, LABEL, MASK = range(
+    len(SHAPE_TYPES))
+
+
+def local_stats():
+    """True if local shape statistics are turned on."""
+    return os.environ.get(ENV_LOCAL_STATS, "0") not in ("0", "false", "")
+
+
+def shape_box(shapes, i, size_x=None, size_y=None):
+    """
+    The box (x, y, width, height) of the pixels of shape i, within the
+    plane if size_x and size_y are given. Width or height is 0 if the
+    shape is outside the plane.
+    """
+    x, y, width, height = shapes.shapes[["x", "y", "width", "height"]][i] \
+        .tolist()
+    x1, y1 = int(math.floor(x)), int(math.floor(y))
+    x2, y2 = int(math.floor(x + width)) + 1, int(math.floor(y + height)) + 1
+    if size_x is not None:
+        x1, x2 = max(0, x1), min(size_x, x2)
+    if size_y is not None:
+        y1, y2 = max(0, y1), min(size_y, y2)
+    return (x1, y1, max(0, x2 - x1), max(0, y2 - y1))
+
+
+def union_box(boxes):
+    """The box (x, y, width, height) around boxes, ignoring empty ones."""
+    boxes = [b for b in boxes if b[2] and b[3]]
+    if not boxes:
+        return (0, 0, 0, 0)
+    x1 = min(b[0] for b in boxes)
+    y1 = min(b[1] for b in boxes)
+    x2 = max(b[0] + b[2] for b in boxes)
+    y2 = max(b[1] + b[3] for b in boxes)
+    return (x1, y1, x2 - x1, y2 - y1)
+
+
+def load_mask_bytes(conn, shape_ids):
+    """Dict of Mask ID: its bytes, for shape_ids."""
+    mask_bytes = {}
+    shape_ids = list(shape_ids)
+    query_service = conn.getQueryService()
+    for start in range(0, len(shape_ids), ID_BATCH):
+        params = ParametersI()
+        params.addIds(shape_ids[start:start + ID_BATCH])
+        for mask in query_service.findAllByQuery(
+                MASK_QUERY, params, conn.SERVICE_OPTS):
+            mask_bytes[unwrap(mask.id)] = mask.getBytes()
+    return mask_bytes
+
+
+def _grid(box):
+    x, y, width, height = box
+    return (numpy.arange(x, x + width, dtype=float)[numpy.newaxis, :],
+            numpy.arange(y, y + height, dtype=float)[:, numpy.newaxis])
+
+
+def _rectangle(row, box):
+    xs, ys = _grid(box)
+    return ((xs >= row["x"]) & (xs < row["x"] + row["width"]) &
+            (ys >= row["y"]) & (ys < row["y"] + row["height"]))
+
+
+def _ellipse(row, box):
+    radius_x, radius_y = row["width"] / 2, row["height"] / 2
+    if radius_x <= 0 or radius_y <= 0:
+        return numpy.zeros((box[3], box[2]), bool)
+    xs, ys = _grid(box)
+    dx = (xs - (row["x"] + radius_x)) / radius_x
+    dy = (ys - (row["y"] + radius_y)) / radius_y
+    return dx * dx + dy * dy < 1
+
+
+def _polygon(points, box):
+    """Even-odd rule, for all the rows and edges of the box at once."""
+    x, y, width, height = box
+    if len(points) < 3:
+        return numpy.zeros((height, width), bool)
+    x1, y1 = points[:, 0], points[:, 1]
+    x2, y2 = numpy.roll(x1, -1), numpy.roll(y1, -1)
+    ys = numpy.arange(y, y + height, dtype=float)[:, numpy.newaxis]
+    # rows crossed by each edge, lower end in and upper end out
+    crosses = (y1 > ys) != (y2 > ys)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        at = x1 + (ys - y1) * (x2 - x1) / (y2 - y1)
+    rows, edges = numpy.nonzero(crosses)
+    # pixels left of a crossing are crossed once more
+    ends = numpy.clip(numpy.ceil(at[rows, edges]) - x, 0, width)
+    counts = numpy.zeros((height, width + 1), "i4")
+    numpy.add.at(counts, (rows, numpy.zeros_like(rows)), 1)
+    numpy.add.at(counts, (rows, ends.astype("i8")), -1)
+    return numpy.cumsum(counts, axis=1)[:, :width] % 2 == 1
+
+
+def _path(points, box):
+    """The pixels along the segments between points."""
+    x, y, width, height = box
+    mask = numpy.zeros((height, width), bool)
+    if len(points) == 0:
+        return mask
+    if len(points) == 1:
+        samples = points
+    else:
+        starts, steps = points[:-1], points[1:] - points[:-1]
+        counts = numpy.ceil(numpy.abs(steps).max(axis=1)).astype("i8") + 1
+        segment = numpy.repeat(numpy.arange(len(steps)), counts)
+        first = numpy.cumsum(counts) - counts
+        fraction = (numpy.arange(counts.sum()) - first[segment]) / \
+            numpy.maximum(counts - 1, 1)[segment]
+        samples = starts[segment] + fraction[:, numpy.newaxis] * \
+            steps[segment]
+    columns = numpy.floor(samples[:, 0]).astype("i8") - x
+    rows = numpy.floor(samples[:, 1]).astype("i8") - y
+    inside = (columns >= 0) & (columns < width) & (rows >= 0) & \
+        (rows < height)
+    mask[rows[inside], columns[inside]] = True
+    return mask
+
+
+def _mask(row, box, data):
+    """The bits of a Mask, one per pixel from its x, y, row by row."""
+    x, y, width, height = box
+    mask = numpy.zeros((height, width), bool)
+    mask_width, mask_height = int(row["width"]), int(row["height"])
+    if not data or mask_width <= 0 or mask_height <= 0:
+        return mask
+    bits = numpy.unpackbits(numpy.frombuffer(data, "u1"))
+    bits = bits[:mask_width * mask_height]
+    if bits.size < mask_width * mask_height:
+        return mask
+    bits = bits.reshape(mask_height, mask_width).astype(bool)
+    mask_x, mask_y = int(round(row["x"])), int(round(row["y"]))
+    x1, y1 = max(x, mask_x), max(y, mask_y)
+    x2 = min(x + width, mask_x + mask_width)
+    y2 = min(y + height, mask_y + mask_height)
+    if x2 > x1 and y2 > y1:
+        mask[y1 - y:y2 - y, x1 - x:x2 - x] = \
+            bits[y1 - mask_y:y2 - mask_y, x1 - mask_x:x2 - mask_x]
+    return mask
+
+
+def rasterize(shapes, i, box, mask_bytes=None):
+    """
+    Boolean (height, width) array of the pixels of shape i in box.
+
+    :param shapes:      The ShapeIndex
+    :param box:         (x, y, width, height) of the array in the plane
+    :param mask_bytes:  Dict of Mask ID: bytes, from
+                        :func:`load_mask_bytes`. Masks without are empty
+    """
+    box = tuple(int(v) for v in box)
+    row = shapes.shapes[i]
+    shape_type = int(row["type"])
+    if shape_type == RECTANGLE:
+        return _rectangle(row, box)
+    if shape_type == ELLIPSE:
+        return _ellipse(row, box)
+    if shape_type == POLYGON:
+        return _polygon(shapes.points[
+            row["offset"]:row["offset"] + row["count"]], box)
+    if shape_type in (LINE, POLYLINE, POINT):
+        return _path(shapes.points[
+            row["offset"]:row["offset"] + row["count"]], box)
+    if shape_type == MASK:
+        return _mask(row, box, (mask_bytes or {}).get(int(row["id"])))
+    return numpy.zeros((box[3], box[2]), bool)
+
+
+def label_image(shapes, box, labels=None, mask_bytes=None, dtype="i4"):
+    """
+    Array over box with the label of the shape at each pixel, 0 for none.
+    Later shapes are drawn over earlier ones.
+
+    :param labels:  The label of each shape. Default: 1, 2, ...
+    """
+    box = tuple(int(v) for v in box)
+    if labels is None:
+        labels = range(1, len(shapes) + 1)
+    image = numpy.zeros((box[3], box[2]), dtype)
+    for i, label in enumerate(labels):
+        image[rasterize(shapes, i, box, mask_bytes)] = label
+    return image
+
+
+class ShapeStats(object):
+    """The fields of omero.api.ShapeStats, measured locally."""
+
+    def __init__(self, shape_id, channels):
+        self.shapeId = shape_id
+        self.channelIds = list(channels)
+        self.pointsCount = []
+        self.min = []
+        self.max = []
+        self.sum = []
+        self.mean = []
+        self.stdDev = []
+
+
+def shape_stats(shape_id, channels, planes, mask):
+    """
+    The ShapeStats of the pixels of mask in each of planes, the regions
+    of channels under the mask.
+
+    The mask holds the pixels whose point (X, Y) is inside the shape, see
+    :func:`rasterize`. stdDev is the population standard deviation, over
+    the pointsCount pixels (ddof=0). A shape without pixels has 0 for all
+    its values.
+    """
+    stats = ShapeStats(shape_id, channels)
+    for plane in planes:
+        values = numpy.asarray(plane, numpy.float64)[mask]
+        stats.pointsCount.append(int(values.size))
+        stats.min.append(float(values.min()) if values.size else 0.0)
+        stats.max.append(float(values.max()) if values.size else 0.0)
+        stats.sum.append(float(values.sum()))
+        stats.mean.append(float(values.mean()) if values.size else 0.0)
+        stats.stdDev.append(float(values.std()) if values.size else 0.0)
+    return stats
+
+
+class MaskCache(PlaneCache):
+    """
+    LRU cache of the masks of shapes, keyed by shape ID and box, within
+    max_bytes.
+    """
+
+    def __init__(self, max_bytes=None):
+        if max_bytes is None:
+            max_bytes = int(float(os.environ.get(
+                ENV_MASK_CACHE_MB, DEFAULT_MASK_CACHE_MB)) * 1024 * 1024)
+        super(MaskCache, self).__init__(max_bytes)
+
+    def mask(self, shapes, i, box, mask_bytes=None):
+        """The read-only mask of shape i in box, see :func:`rasterize`."""
+        box = tuple(int(v) for v in box)
+        return self.get((int(shapes.shapes["id"][i]), box),
+                        lambda: rasterize(shapes, i, box, mask_bytes))
+
+    def report(self):
+        return super(MaskCache, self).report().replace(
+            "Plane cache", "Mask cache", 1)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2024 University of Muenster. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Pool of rendering engines that render concurrently.
+
+Rendering is dominated by round-trips to the server, so a figure of many
+images renders faster with several engines at work. Each worker thread owns
+one engine. A job is a function called with an engine that is already set
+up (``lookupPixels``, ``lookupRenderingDef`` and ``load``) for the job's
+pixels ID, starting from the saved rendering settings::
+
+    def render_row(re, pixels_id, t):
+        re.setActive(0, True)
+        return re.renderCompressed(plane_def)
+
+    with RenderingEnginePool(conn) as pool:
+        jpegs = pool.map(render_row, pixel_ids, t_indexes)
+
+``map`` and ``imap`` return the results in the order of their arguments.
+Jobs must not share mutable state, and should collect their log lines and
+return them rather than writing to the script's log, which would
+interleave.
+
+The number of engines defaults to 4 and can be set with the
+``OMERO_SCRIPTS_RENDER_WORKERS`` environment variable.
+"""
+
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from omero.rtypes import unwrap
+
+DEFAULT_WORKERS = 4
+ENV_WORKERS = "OMERO_SCRIPTS_RENDER_WORKERS"
+
+
+def prepare_engine(re, pixels_id, ctx=None):
+    """
+    Set up a rendering engine for pixels_id with its saved settings,
+    creating default settings if there are none.
+    """
+    re.lookupPixels(pixels_id, ctx)
+    if not re.lookupRenderingDef(pixels_id, ctx):
+        re.resetDefaultSettings(True, ctx)
+        if not re.lookupRenderingDef(pixels_id, ctx):
+            raise Exception("Failed to lookup Rendering Def")
+    re.load(ctx)
+
+
+def get_channel_colours(re, pixels_id, indexes):
+    """
+    Job returning {index: (r, g, b, a)} of the saved colours of the
+    channels in indexes that the image has.
+    """
+    size_c = re.getPixels().getSizeC().getValue()
+    return dict((i, tuple(re.getRGBA(i))) for i in indexes if i < size_c)
+
+
+def get_rendering_models(re, pixels_id):
+    """Job returning {name: model} of the available rendering models."""
+    return dict((unwrap(m.getValue()), m) for m in re.getAvailableModels())
+
+
+class RenderingEnginePool(object):
+    """
+    :param conn:            The BlitzGateway connection
+    :param workers:         Number of engines. Default from the
+                            OMERO_SCRIPTS_RENDER_WORKERS environment
+                            variable, else 4
+    :param compression:     JPEG compression level to set on each engine
+    :param ctx:             Call context, e.g. conn.SERVICE_OPTS
+    """
+
+    def __init__(self, conn, workers=None, compression=None, ctx=None):
+        if workers is None:
+            workers = int(os.environ.get(ENV_WORKERS, DEFAULT_WORKERS))
+        self._conn = conn
+        self.workers = max(1, workers)
+        self.compression = compression
+        self.ctx = ctx
+        self._local = threading.local()
+        self._engines = []
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _engine(self, pixels_id):
+        """The calling thread's engine, set up for pixels_id."""
+        state = getattr(self._local, "state", None)
+        if state is None:
+            re = self._conn.createRenderingEngine()
+            with self._lock:
+                self._engines.append(re)
+            state = self._local.state = [re, None]
+        re = state[0]
+        if state[1] == pixels_id:
+            # discard changes made by the previous job
+            re.load(self.ctx)
+        else:
+            prepare_engine(re, pixels_id, self.ctx)
+            if self.compression is not None and state[1] is None:
+                re.setCompressionLevel(float(self.compression), self.ctx)
+            state[1] = pixels_id
+        return re
+
+    def _run(self, func, pixels_id, args):
+        return func(self._engine(pixels_id), pixels_id, *args)
+
+    def submit(self, func, pixels_id, *args):
+        """
+        Run func(re, pixels_id, *args) on an engine set up for pixels_id.
+
+        :return:        A concurrent.futures.Future of the result
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.workers)
+        return self._executor.submit(self._run, func, pixels_id, args)
+
+    def imap(self, func, pixel_ids, *iterables):
+        """
+        Generator running func(re, pixels_id, *items) for each pixels ID
+        and the matching items of iterables, yielding the results in order.
+        At most twice as many jobs as there are engines are queued ahead of
+        the consumer, so results that are saved as they arrive are not all
+        held in memory.
+        """
+        if iterables:
+            jobs = zip(pixel_ids, zip(*iterables))
+        else:
+            jobs = ((pixels_id, ()) for pixels_id in pixel_ids)
+        pending = deque()
+        for pixels_id, items in jobs:
+            pending.append(self.submit(func, pixels_id, *items))
+            if len(pending) >= 2 * self.workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def map(self, func, pixel_ids, *iterables):
+        """
+        Like :meth:`imap`, but returns the list of all results. Re-raises
+        the first error.
+        """
+        return list(self.imap(func, pixel_ids, *iterables))
+
+    def close(self):
+        """Wait for running jobs, then close all engines."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        for re in self._engines:
+            try:
+                re.close()
+            except Exception:
+                pass
+        self._engines = []
+        self._local = threading.local()
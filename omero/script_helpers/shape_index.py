@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2024 University of Muenster. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+The shapes of the ROIs of many images, as NumPy arrays.
+
+Scripts that read ROIs call ``findByImage`` for every image, which loads
+every ROI with all its shapes, and then unwrap each field of each shape.
+:meth:`ShapeIndex.load` reads the shapes of all the images with one
+projection query per shape type (and per 1000 images), into a structured
+array with a row per shape, sorted by image, ROI and shape ID::
+
+    index = ShapeIndex.load(conn, image_ids, types=("Rectangle",))
+    for image_id in image_ids:
+        rectangles = index.for_image(image_id)
+        widths = rectangles.shapes["width"]
+
+The columns are the shape, ROI and image IDs, the shape type (an index in
+:data:`SHAPE_TYPES`), Z, T and C (:data:`UNSET` when not set), the bounding
+box and where the points of the shape are in :attr:`ShapeIndex.points`.
+Lines, polylines and polygons keep their vertices there; points, labels
+and ellipses their position or centre. :meth:`ShapeIndex.lengths` and
+:meth:`ShapeIndex.areas` measure all the shapes at once.
+"""
+
+import math
+import re
+
+from omero.rtypes import unwrap
+from omero.sys import ParametersI
+
+from omero.script_helpers.lazy import lazy_import
+
+numpy = lazy_import("numpy")
+
+SHAPE_TYPES = ("Rectangle", "Ellipse", "Line", "Point", "Polygon",
+               "Polyline", "Label", "Mask")
+
+# the columns of each type, after those common to all shapes
+TYPE_COLUMNS = {
+    "Rectangle": ("x", "y", "width", "height"),
+    "Ellipse": ("x", "y", "radiusX", "radiusY"),
+    "Line": ("x1", "y1", "x2", "y2"),
+    "Point": ("x", "y"),
+    "Polygon": ("points",),
+    "Polyline": ("points",),
+    "Label": ("x", "y"),
+    "Mask": ("x", "y", "width", "height"),
+}
+
+SHAPE_QUERY = (
+    "select s.id, r.id, r.image.id, s.theZ, s.theT, s.theC, s.textValue, "
+    "%s from %s s join s.roi r where r.image.id in (:ids)")
+
+SHAPE_FIELDS = [("id", "i8"), ("roi", "i8"), ("image", "i8"),
+                ("type", "u1"), ("z", "i4"), ("t", "i4"), ("c", "i4"),
+                ("x", "f8"), ("y", "f8"), ("width", "f8"),
+                ("height", "f8"), ("offset", "i8"), ("count", "i4")]
+
+# Z, T or C of a shape on all planes
+UNSET = -1
+
+# image IDs per query
+ID_BATCH = 1000
+
+# points strings of OMERO.insight: 'points[x,y, x,y] points1[...] ...'
+INSIGHT_POINT_LIST_RE = re.compile(r'points\[([^\]]+)\]')
+
+
+def parse_points(points):
+    """
+    List of (x, y) of a points string, 'x,y x,y ...', or None if it is
+    not valid.
+    """
+    match = INSIGHT_POINT_LIST_RE.search(points)
+    if match is not None:
+        points = match.group(1)
+    try:
+        coords = [[float(x.strip(", ")) for x in coord.split(",", 1)]
+                  for coord in points.strip(" ").split(" ")]
+    except ValueError:
+        return None
+    if any(len(coord) != 2 for coord in coords):
+        return None
+    return coords
+
+
+def format_number(value):
+    """value as in a points string: '10' for 10.0, else repr()."""
+    if value == int(value):
+        return "%d" % value
+    return repr(value)
+
+
+def _shape_row(shape_type, values):
+    """The bounding box and points of a shape from its TYPE_COLUMNS."""
+    if shape_type in ("Rectangle", "Mask"):
+        return values, []
+    if shape_type == "Ellipse":
+        x, y, radius_x, radius_y = values
+        return ((x - radius_x, y - radius_y, 2 * radius_x, 2 * radius_y),
+                [(x, y)])
+    if shape_type in ("Point", "Label"):
+        return (values[0], values[1], 0, 0), [tuple(values)]
+    if shape_type == "Line":
+        points = [tuple(values[:2]), tuple(values[2:])]
+    else:
+        points = parse_points(values[0] or "") or []
+    if not points:
+        return (0, 0, 0, 0), points
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+    return ((min(xs), min(ys), max(xs) - min(xs), max(ys) - min(ys)),
+            points)
+
+
+class ShapeIndex(object):
+    """
+    Shapes as a structured array of SHAPE_FIELDS, their points and text.
+
+    :param shapes:  One row per shape
+    :param points:  (n, 2) array of the points of all shapes; those of a
+                    shape start at its 'offset' and there are 'count'
+    :param text:    The text of each shape, or None
+    """
+
+    def __init__(self, shapes=None, points=None, text=None):
+        if shapes is None:
+            shapes = numpy.zeros(0, SHAPE_FIELDS)
+        if points is None:
+            points = numpy.zeros((0, 2))
+        self.shapes = shapes
+        self.points = points
+        self.text = list(text) if text is not None else [None] * len(shapes)
+
+    @classmethod
+    def load(cls, conn, image_ids, types=SHAPE_TYPES):
+        """
+        The shapes of types of the ROIs on image_ids.
+
+        :param types:   Names from SHAPE_TYPES
+        """
+        rows = []
+        points = []
+        text = []
+        query_service = conn.getQueryService()
+        image_ids = list(image_ids)
+        for shape_type in types:
+            columns = ", ".join("s.%s" % c for c in TYPE_COLUMNS[shape_type])
+            query = SHAPE_QUERY % (columns, shape_type)
+            type_index = SHAPE_TYPES.index(shape_type)
+            for start in range(0, len(image_ids), ID_BATCH):
+                params = ParametersI()
+                params.addIds(image_ids[start:start + ID_BATCH])
+                for row in query_service.projection(
+                        query, params, conn.SERVICE_OPTS):
+                    row = [unwrap(v) for v in row]
+                    box, shape_points = _shape_row(shape_type, row[7:])
+                    rows.append(tuple(row[:3]) + (type_index,) + tuple(
+                        UNSET if v is None else v for v in row[3:6]) +
+                        tuple(box) + (len(points), len(shape_points)))
+                    points.extend(shape_points)
+                    text.append(row[6])
+        index = cls(numpy.array(rows, SHAPE_FIELDS),
+                    numpy.array(points, float).reshape(-1, 2), text)
+        shapes = index.shapes
+        return index.select(numpy.lexsort(
+            (shapes["id"], shapes["roi"], shapes["image"])))
+
+    def __len__(self):
+        return len(self.shapes)
+
+    @property
+    def type_names(self):
+        """The type of each shape, e.g. 'Rectangle'."""
+        return [SHAPE_TYPES[t] for t in self.shapes["type"].tolist()]
+
+    def is_type(self, *types):
+        """Boolean array of the shapes of any of types."""
+        return numpy.isin(self.shapes["type"],
+                          [SHAPE_TYPES.index(t) for t in types])
+
+    def select(self, which):
+        """
+        A ShapeIndex of some of the shapes, in their order in which.
+
+        :param which:   Boolean array, or array of indexes
+        """
+        which = numpy.asarray(which)
+        if which.dtype == bool:
+            which = numpy.flatnonzero(which)
+        else:
+            which = which.astype("i8")
+        shapes = self.shapes[which]
+        counts = shapes["count"].astype("i8")
+        offsets = numpy.cumsum(counts) - counts
+        points = self.points[numpy.repeat(shapes["offset"] - offsets, counts)
+                             + numpy.arange(counts.sum())]
+        shapes["offset"] = offsets
+        return ShapeIndex(shapes, points,
+                          [self.text[i] for i in which.tolist()])
+
+    def for_image(self, image_id):
+        """The shapes on an image."""
+        return self.select(self.shapes["image"] == image_id)
+
+    def of_type(self, *types):
+        """The shapes of any of types."""
+        return self.select(self.is_type(*types))
+
+    def column(self, name):
+        """A column as a list of Python values, e.g. 'id'."""
+        return self.shapes[name].tolist()
+
+    def rois(self):
+        """Lists of the indexes of the shapes of each ROI, in order."""
+        rois = self.shapes["roi"]
+        starts = numpy.flatnonzero(numpy.r_[True, rois[1:] != rois[:-1]])
+        bounds = numpy.r_[starts, len(rois)].tolist() if len(rois) else [0]
+        return [list(range(a, b)) for a, b in zip(bounds[:-1], bounds[1:])]
+
+    def shape_points(self, i):
+        """List of the (x, y) points of shape i."""
+        offset, count = self.shapes[["offset", "count"]][i].tolist()
+        return [tuple(p) for p in self.points[offset:offset + count].tolist()]
+
+    def points_string(self, i):
+        """The points of shape i as 'x,y x,y ...'."""
+        return " ".join("%s,%s" % (format_number(x), format_number(y))
+                        for x, y in self.shape_points(i))
+
+    def _owners(self):
+        # the index of the shape of each point
+        return numpy.repeat(numpy.arange(len(self)), self.shapes["count"])
+
+    def lengths(self, pixel_size_x=None, pixel_size_y=None):
+        """
+        The lengths of lines and polylines, NaN for other shapes and for
+        polylines without valid points.
+        """
+        owners = self._owners()
+        steps = self.points[:-1] - self.points[1:]
+        dx, dy = steps[:, 0], steps[:, 1]
+        if pixel_size_x is not None:
+            dx = dx * pixel_size_x
+        if pixel_size_y is not None:
+            dy = dy * pixel_size_y
+        within = owners[:-1] == owners[1:]
+        lengths = numpy.bincount(owners[:-1][within],
+                                 numpy.sqrt(dx * dx + dy * dy)[within],
+                                 minlength=len(self)).astype(float)
+        lengths[~self.is_type("Line", "Polyline") |
+                (self.shapes["count"] == 0)] = numpy.nan
+        return lengths
+
+    def areas(self):
+        """
+        The areas of rectangles, masks, ellipses and polygons, in pixels,
+        NaN for other shapes and for polygons without valid points.
+        """
+        shapes = self.shapes
+        areas = numpy.full(len(self), numpy.nan)
+        boxes = self.is_type("Rectangle", "Mask")
+        areas[boxes] = shapes["width"][boxes] * shapes["height"][boxes]
+        ellipses = self.is_type("Ellipse")
+        areas[ellipses] = (math.pi * (shapes["width"][ellipses] / 2) *
+                           (shapes["height"][ellipses] / 2))
+        # the shoelace formula, each point with the next one of its polygon
+        owners = self._owners()
+        following = numpy.arange(1, len(self.points) + 1)
+        ends = shapes["offset"] + shapes["count"] - 1
+        has_points = shapes["count"] > 0
+        following[ends[has_points]] = shapes["offset"][has_points]
+        x, y = self.points[:, 0], self.points[:, 1]
+        if len(self.points):
+            cross = x * y[following] - x[following] * y
+        else:
+            cross = numpy.zeros(0)
+        totals = numpy.bincount(owners, cross,
+                                minlength=len(self)).astype(float)
+        polygons = self.is_type("Polygon") & has_points
+        areas[polygons] = numpy.abs(0.5 * totals[polygons])
+        return areas
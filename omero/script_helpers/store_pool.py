@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2024 University of Muenster. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Pool of open RawPixelsStore services, already bound to a pixels ID.
+
+``setPixelsId`` initialises the store on the server, which costs far more
+than reading a small plane. Borrowing from the pool binds each store once
+per pixels ID and keeps it open for the next plane of the same image::
+
+    with RawPixelsStorePool(conn) as pool:
+        for pixels_id, z, c, t in planes:
+            with pool.store(pixels_id) as rps:
+                data = rps.getPlane(z, c, t)
+
+Stores are closed when the pool is closed, or when more than ``max_open``
+are idle.
+"""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+DEFAULT_MAX_OPEN = 4
+
+
+class RawPixelsStorePool(object):
+    """
+    Idle stores are kept per pixels ID. Borrowing a pixels ID with no
+    idle store opens a new one while fewer than max_open are idle, and
+    otherwise re-binds the least recently used idle store.
+
+    :param conn:            The BlitzGateway connection
+    :param max_open:        Idle stores to keep open
+    :param bypass_original_file:    Passed to setPixelsId
+    """
+
+    def __init__(self, conn, max_open=DEFAULT_MAX_OPEN,
+                 bypass_original_file=True):
+        self._conn = conn
+        self.max_open = max_open
+        self.bypass_original_file = bypass_original_file
+        self._idle = OrderedDict()     # (pixels id, n) -> store
+        self._bound = {}               # id(store) -> pixels id
+        self.created = 0
+        self.binds = 0
+        self.reused = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _bind(self, store, pixels_id):
+        store.setPixelsId(pixels_id, self.bypass_original_file)
+        self._bound[id(store)] = pixels_id
+        self.binds += 1
+        return store
+
+    def borrow(self, pixels_id):
+        """Return a store bound to pixels_id. Give it back when done."""
+        for key in self._idle:
+            if key[0] == pixels_id:
+                self.reused += 1
+                return self._idle.pop(key)
+        if self._idle and len(self._idle) >= self.max_open:
+            _, store = self._idle.popitem(last=False)
+            self._bound.pop(id(store), None)
+        else:
+            store = self._conn.createRawPixelsStore()
+            self.created += 1
+        return self._bind(store, pixels_id)
+
+    def give_back(self, store):
+        """Return a borrowed store to the pool, to be reused."""
+        pixels_id = self._bound[id(store)]
+        n = 0
+        while (pixels_id, n) in self._idle:
+            n += 1
+        self._idle[(pixels_id, n)] = store
+        while len(self._idle) > self.max_open:
+            _, old = self._idle.popitem(last=False)
+            self._close(old)
+
+    @contextmanager
+    def store(self, pixels_id):
+        """Borrow a store for the duration of a with block."""
+        store = self.borrow(pixels_id)
+        try:
+            yield store
+        finally:
+            self.give_back(store)
+
+    def _close(self, store):
+        self._bound.pop(id(store), None)
+        try:
+            store.close()
+        except Exception:
+            pass
+
+    def close(self):
+        """Close all idle stores."""
+        while self._idle:
+            _, store = self._idle.popitem(last=False)
+            self._close(store)
+
+    def report(self):
+        """One line summary, for the script's log."""
+        return ("Pixels store pool: %d stores opened, %d binds, "
+                "%d reuses" % (self.created, self.binds, self.reused))
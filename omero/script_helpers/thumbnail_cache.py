@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2024 University of Muenster. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Disk cache of thumbnails, for figures of many images.
+
+Thumbnail_Figure asks the thumbnail store for the thumbnails of every image
+on every run. :class:`ThumbnailCache` stands in for the thumbnail store: it
+looks up the last change of the rendering settings of all the images in a
+few queries, reads the thumbnails that are still current from disk and
+asks the server only for the others, in batches::
+
+    thumbnails = ThumbnailCache(conn)
+    thumbnail_map = thumbnails.getThumbnailByLongestSideSet(
+        rint(96), pixel_ids)
+
+A thumbnail is keyed by the user, the pixels, its size and the update event
+of the rendering settings of the pixels, so saving new settings fetches it
+again. The thumbnails are kept with the panels of the figure scripts, in
+``OMERO_SCRIPTS_PANEL_CACHE_DIR`` and within ``OMERO_SCRIPTS_PANEL_CACHE_MB``
+(see :mod:`omero.script_helpers.panel_cache`).
+"""
+
+from omero.rtypes import rint, unwrap
+from omero.sys import ParametersI
+
+from omero.script_helpers.panel_cache import PanelCache
+
+# pixels IDs per query, and thumbnails per call to the thumbnail store
+QUERY_BATCH = 1000
+THUMBNAIL_BATCH = 50
+
+SETTINGS_EVENT_QUERY = (
+    "select r.pixels.id, max(r.details.updateEvent.id) from RenderingDef r "
+    "where r.pixels.id in (:ids) group by r.pixels.id")
+
+
+def batches(ids, size):
+    """ids in lists of at most size."""
+    ids = list(ids)
+    return [ids[i:i + size] for i in range(0, len(ids), size)]
+
+
+class ThumbnailCache(object):
+    """
+    A thumbnail store that reads the thumbnails it fetched before from
+    disk, unless the rendering settings changed since.
+
+    :param conn:        The BlitzGateway connection
+    :param store:       Thumbnail store for missing thumbnails. Default: one
+                        created on the first miss
+    :param files:       The PanelCache that keeps the thumbnails. Default:
+                        one in the default directory and size
+    """
+
+    def __init__(self, conn, store=None, files=None):
+        self._conn = conn
+        self._store = store
+        self.files = PanelCache(conn) if files is None else files
+        self._events = {}
+        self._user_id = None
+        self.fetched = 0
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = self._conn.createThumbnailStore()
+        return self._store
+
+    def settings_events(self, pixel_ids):
+        """
+        Dict of pixels ID: update event of its rendering settings, for the
+        pixel_ids not looked up before. Pixels without settings map to None.
+        Nothing is looked up if the cache is off.
+        """
+        if not self.files.enabled:
+            return {}
+        missing = [pid for pid in set(pixel_ids) if pid not in self._events]
+        query_service = self._conn.getQueryService()
+        for batch in batches(missing, QUERY_BATCH):
+            params = ParametersI()
+            params.addIds(batch)
+            self._events.update(dict.fromkeys(batch))
+            for row in query_service.projection(
+                    SETTINGS_EVENT_QUERY, params, self._conn.SERVICE_OPTS):
+                pixels_id, event_id = [unwrap(v) for v in row]
+                self._events[pixels_id] = event_id
+        return dict((pid, self._events[pid]) for pid in set(pixel_ids))
+
+    def getThumbnailByLongestSideSet(self, size, pixel_ids, ctx=None):
+        """
+        Dict of pixels ID: JPEG thumbnail, as the thumbnail store returns.
+
+        :param size:        Length of the longest side, as an rint
+        :param pixel_ids:   The pixels IDs
+        """
+        length = unwrap(size)
+        if not self.files.enabled:
+            return self._fetch(length, pixel_ids)
+        if self._user_id is None:
+            self._user_id = self._conn.getUserId()
+        events = self.settings_events(pixel_ids)
+        keys = dict((pid, ["thumbnail", self._user_id, pid, length,
+                           events[pid]]) for pid in pixel_ids)
+        thumbnails = {}
+        missing = []
+        for pid in pixel_ids:
+            data = self.files.lookup(keys[pid])
+            if data is None:
+                missing.append(pid)
+            else:
+                thumbnails[pid] = data
+        fetched = self._fetch(length, missing)
+        for pid, data in fetched.items():
+            if pid in keys:
+                self.files.store(keys[pid], data)
+        thumbnails.update(fetched)
+        return thumbnails
+
+    def _fetch(self, length, pixel_ids):
+        thumbnails = {}
+        for batch in batches(pixel_ids, THUMBNAIL_BATCH):
+            thumbnails.update(self.store.getThumbnailByLongestSideSet(
+                rint(length), batch, self._conn.SERVICE_OPTS))
+            self.fetched += len(batch)
+        return thumbnails
+
+    def report(self):
+        """One line summary, for the script's log."""
+        return "Thumbnails: %d fetched, %d from the cache" % (
+            self.fetched, self.files.hits)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2024 University of Muenster. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Reads images tile by tile, at any resolution level.
+
+Big images, whose planes are too large for ``getPlane``, are stored as
+pyramids of tiles. :class:`TileReader` walks an image in the tile size the
+server prefers and reads any region from the tiles that cover it, so a
+script holds one tile, or one region, in memory at a time::
+
+    with TileReader(conn, image.getPrimaryPixels()) as reader:
+        for tile in reader.tiles():
+            data = reader.read(z, c, t, tile)
+
+Level 0 is the full resolution and each level after it is about half the
+size of the one before. :func:`level_for_size` picks the most detailed
+level that fits a pixel budget, e.g. ``getDownloadAsMaxSizeSetting``.
+"""
+
+from omero.rtypes import unwrap
+from omero.script_helpers.lazy import lazy_import
+
+numpy = lazy_import("numpy")
+
+
+def tile_grid(size_x, size_y, tile_width, tile_height, x0=0, y0=0):
+    """
+    The (x, y, w, h) of the tiles that cover a size_x by size_y region at
+    (x0, y0), row by row. Tiles at the right and bottom edges are cropped
+    to the region.
+    """
+    for y in range(0, size_y, tile_height):
+        for x in range(0, size_x, tile_width):
+            yield (x0 + x, y0 + y, min(tile_width, size_x - x),
+                   min(tile_height, size_y - y))
+
+
+def level_for_size(sizes, max_pixels):
+    """
+    The index of the first, i.e. most detailed, (size_x, size_y) in sizes
+    with at most max_pixels pixels, or None if there is none.
+    """
+    for level, (size_x, size_y) in enumerate(sizes):
+        if size_x * size_y <= max_pixels:
+            return level
+    return None
+
+
+def resolution_sizes(service):
+    """
+    [(size_x, size_y)] of the resolution levels of a RawPixelsStore or
+    RenderingEngine, from the full resolution down.
+    """
+    return [(d.sizeX, d.sizeY) for d in service.getResolutionDescriptions()]
+
+
+def set_level(service, level):
+    """
+    Set a RawPixelsStore or RenderingEngine to a level counted from the
+    full resolution. The services count the other way.
+    """
+    levels = service.getResolutionLevels()
+    service.setResolutionLevel(levels - 1 - level)
+
+
+class TileReader(object):
+    """
+    Reads the tiles of an image through one RawPixelsStore.
+
+    :param conn:            The BlitzGateway connection
+    :param pixels:          The PixelsWrapper of the image
+    :param level:           Resolution level, 0 is the full resolution
+    :param tile_size:       (width, height) of the tiles to walk. Default:
+                            the tile size of the server
+    """
+
+    def __init__(self, conn, pixels, level=0, tile_size=None):
+        self.pixels_id = pixels.getId()
+        self.dtype = numpy.dtype(pixels.get_numpy_type())
+        self._store = conn.createRawPixelsStore()
+        self._store.setPixelsId(self.pixels_id, False, conn.SERVICE_OPTS)
+        self.levels = self._store.getResolutionLevels()
+        if self.levels > 1:
+            self.sizes = resolution_sizes(self._store)
+        else:
+            self.sizes = [(pixels.getSizeX(), pixels.getSizeY())]
+        self.level = level
+        if level:
+            set_level(self._store, level)
+        self.size_x, self.size_y = self.sizes[level]
+        if tile_size is None:
+            tile_size = [unwrap(s) for s in self._store.getTileSize()]
+        self.tile_width = min(tile_size[0], self.size_x)
+        self.tile_height = min(tile_size[1], self.size_y)
+        self.tiles_read = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._store is not None:
+            self._store.close()
+            self._store = None
+
+    def tiles(self, region=None):
+        """
+        Generator of the (x, y, w, h) of the tiles of the level, or of the
+        part of region (x, y, w, h) inside the image.
+        """
+        if region is None:
+            region = (0, 0, self.size_x, self.size_y)
+        x, y, w, h = self.clip(region)
+        if w == 0 or h == 0:
+            return
+        tw, th = self.tile_width, self.tile_height
+        # keep to the server's tile grid, cropped to the region
+        for ty in range(y - y % th, y + h, th):
+            for tx in range(x - x % tw, x + w, tw):
+                x1, y1 = max(tx, x), max(ty, y)
+                yield (x1, y1, min(tx + tw, x + w) - x1,
+                       min(ty + th, y + h) - y1)
+
+    def clip(self, region):
+        """The part of region (x, y, w, h) inside the image."""
+        x, y, w, h = region
+        x1, y1 = max(0, x), max(0, y)
+        x2, y2 = min(self.size_x, x + w), min(self.size_y, y + h)
+        return (x1, y1, max(0, x2 - x1), max(0, y2 - y1))
+
+    def read(self, z, c, t, tile):
+        """Tile (x, y, w, h) of plane z, c, t as a 2D array."""
+        x, y, w, h = tile
+        data = self._store.getTile(z, c, t, x, y, w, h)
+        self.tiles_read += 1
+        return numpy.frombuffer(data, self.dtype.newbyteorder(">")) \
+            .reshape(h, w).astype(self.dtype)
+
+    def read_region(self, z, c, t, region):
+        """
+        Region (x, y, w, h) of plane z, c, t as a 2D array, read tile by
+        tile. Parts of the region outside the image are 0.
+        """
+        x, y, w, h = region
+        out = numpy.zeros((h, w), self.dtype)
+        for tx, ty, tw, th in self.tiles(region):
+            out[ty - y:ty - y + th, tx - x:tx - x + tw] = \
+                self.read(z, c, t, (tx, ty, tw, th))
+        return out
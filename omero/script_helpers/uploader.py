@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2024 University of Muenster. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Creates images from planes, uploading several planes at a time.
+
+``BlitzGateway.createImageFromNumpySeq`` writes one plane after the other
+through a single RawPixelsStore, so each upload waits for the round-trip of
+the one before. :func:`create_image_from_numpy_seq` takes the same
+arguments, creates the image once and writes the planes through one store
+per worker thread::
+
+    image = create_image_from_numpy_seq(
+        conn, plane_gen(), name, sizeZ=size_z, sizeC=size_c, sizeT=size_t,
+        dataset=dataset)
+
+The channel min/max are accumulated as the planes arrive and saved at the
+end, followed by a single reset of the rendering settings, so that the new
+image renders with windows that match its data.
+
+The number of stores can be set with the ``OMERO_SCRIPTS_UPLOAD_WORKERS``
+environment variable. It defaults to 1, with which the planes are written
+in order on the calling thread: every store that writes to the new pixels
+saves them when it is closed, and several stores on one image have not yet
+been tried against a real server.
+"""
+
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import omero
+from omero.rtypes import rint, rstring, unwrap
+
+from omero.script_helpers.lazy import lazy_import
+from omero.script_helpers.local_render import PIXEL_TYPES
+
+numpy = lazy_import("numpy")
+
+DEFAULT_WORKERS = 1
+ENV_WORKERS = "OMERO_SCRIPTS_UPLOAD_WORKERS"
+
+
+def omero_pixels_type(dtype):
+    """The OMERO pixels type, e.g. 'uint16', of a NumPy dtype."""
+    dtype = numpy.dtype(dtype)
+    for name, code in PIXEL_TYPES.items():
+        if numpy.dtype(code) == dtype:
+            return name
+    raise ValueError("No OMERO pixels type for %s" % dtype)
+
+
+class PlaneUploader(object):
+    """
+    Writes planes of one image through several RawPixelsStores, keeping
+    the min/max of each channel.
+
+    :param conn:            The BlitzGateway connection
+    :param pixels_id:       The pixels to write to
+    :param dtype:           NumPy type of the pixels. Planes of another
+                            type are converted
+    :param workers:         Number of stores. Default from the
+                            OMERO_SCRIPTS_UPLOAD_WORKERS environment
+                            variable, else 1
+    """
+
+    def __init__(self, conn, pixels_id, dtype, workers=None):
+        if workers is None:
+            workers = int(os.environ.get(ENV_WORKERS, DEFAULT_WORKERS))
+        self._conn = conn
+        self.pixels_id = pixels_id
+        self.dtype = numpy.dtype(dtype)
+        self.workers = max(1, workers)
+        self.min_max = {}
+        self.planes = 0
+        self._local = threading.local()
+        self._stores = []
+        self._lock = threading.Lock()
+        self._executor = None
+        # bounds the planes held in memory while they wait for a store
+        self._pending = deque()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _store(self):
+        """The calling thread's store, bound to the pixels."""
+        store = getattr(self._local, "store", None)
+        if store is None:
+            store = self._conn.createRawPixelsStore()
+            store.setPixelsId(self.pixels_id, True, self._conn.SERVICE_OPTS)
+            with self._lock:
+                self._stores.append(store)
+            self._local.store = store
+        return store
+
+    def _write(self, data, z, c, t):
+        self._store().setPlane(data, z, c, t, self._conn.SERVICE_OPTS)
+
+    def write(self, plane, z, c, t):
+        """
+        Queue plane z, c, t for upload. Waits while 2 planes per store are
+        queued, and raises the error of any failed upload.
+        """
+        plane = numpy.asarray(plane)
+        if plane.dtype != self.dtype:
+            plane = plane.astype(self.dtype)
+        low, high = plane.min(), plane.max()
+        if c in self.min_max:
+            low = min(low, self.min_max[c][0])
+            high = max(high, self.min_max[c][1])
+        self.min_max[c] = (low, high)
+        data = plane.astype(self.dtype.newbyteorder(">")).tobytes()
+        self.planes += 1
+        if self.workers == 1:
+            self._write(data, z, c, t)
+            return
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.workers)
+        while len(self._pending) >= 2 * self.workers:
+            self._pending.popleft().result()
+        self._pending.append(self._executor.submit(self._write, data, z, c, t))
+
+    def flush(self):
+        """Wait for the queued planes to be written."""
+        while self._pending:
+            self._pending.popleft().result()
+
+    def save_min_max(self):
+        """Save the min/max of the channels written so far."""
+        pixels_service = self._conn.getPixelsService()
+        for c in sorted(self.min_max):
+            low, high = self.min_max[c]
+            pixels_service.setChannelGlobalMinMax(
+                self.pixels_id, c, float(low), float(high),
+                self._conn.SERVICE_OPTS)
+
+    def close(self):
+        """Wait for the queued planes, then close the stores."""
+        try:
+            self.flush()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+            for store in self._stores:
+                store.close()
+            self._stores = []
+
+
+def create_image_from_numpy_seq(conn, zctPlanes, imageName, sizeZ=1,
+                                sizeC=1, sizeT=1, description=None,
+                                dataset=None, sourceImageId=None,
+                                channelList=None, workers=None):
+    """
+    Create an image from a generator of 2D planes, ordered by Z, then C,
+    then T, like ``BlitzGateway.createImageFromNumpySeq``, uploading the
+    planes concurrently.
+
+    :param zctPlanes:       Iterator of NumPy planes
+    :param sourceImageId:   Copy the channels and metadata of this image
+    :param channelList:     Channel indexes of the source image to copy
+    :param workers:         Number of RawPixelsStores to upload with
+    :return:                The new ImageWrapper
+    """
+    ctx = conn.SERVICE_OPTS
+    pixels_service = conn.getPixelsService()
+    update_service = conn.getUpdateService()
+    planes = iter(zctPlanes)
+    first_plane = numpy.asarray(next(planes))
+    size_y, size_x = first_plane.shape
+
+    if sourceImageId is not None:
+        if channelList is None:
+            channelList = list(range(sizeC))
+        iid = pixels_service.copyAndResizeImage(
+            sourceImageId, rint(size_x), rint(size_y), rint(sizeZ),
+            rint(sizeT), channelList, None, False, ctx)
+        image = conn.getObject("Image", unwrap(iid))
+        dtype = image.getPrimaryPixels().get_numpy_type()
+        image._obj.setName(rstring(imageName))
+        update_service.saveObject(image._obj, ctx)
+    else:
+        dtype = first_plane.dtype
+        query = "from PixelsType as p where p.value='%s'" \
+            % omero_pixels_type(dtype)
+        pixels_type = conn.getQueryService().findByQuery(query, None)
+        iid = pixels_service.createImage(
+            size_x, size_y, sizeZ, sizeT, list(range(sizeC)), pixels_type,
+            imageName, description, ctx)
+        image = conn.getObject("Image", unwrap(iid))
+    image_id = image.getId()
+
+    with PlaneUploader(conn, image.getPixelsId(), dtype, workers) as upload:
+        plane = first_plane
+        for z in range(sizeZ):
+            for c in range(sizeC):
+                for t in range(sizeT):
+                    if plane is None:
+                        plane = next(planes)
+                    upload.write(plane, z, c, t)
+                    plane = None
+    # complete the generator, e.g. to stop a prefetcher
+    next(planes, None)
+    upload.save_min_max()
+    conn.getRenderingSettingsService().resetDefaultsInSet(
+        "Image", [image_id], ctx)
+
+    if dataset:
+        link = omero.model.DatasetImageLinkI()
+        link.parent = omero.model.DatasetI(dataset.getId(), False)
+        link.child = omero.model.ImageI(image_id, False)
+        update_service.saveObject(link, ctx)
+    return conn.getObject("Image", image_id)
@@ -37,9 +37,74 @@ import omero
 from omero.gateway import BlitzGateway
 import omero.scripts as scripts
 from omero.rtypes import rlong, rstring, robject
-import omero.util.script_utils as script_utils
+from omero.model import PixelsI
+from omero.util.tiles import RPSTileLoop, TileLoopIteration
+from omero.script_helpers.lazy import lazy_import
+from omero.script_helpers.tiles import TileReader
+from omero.script_helpers.prefetch import prefetch
+from omero.script_helpers.process_pool import map_images
+from omero.script_helpers.uploader import create_image_from_numpy_seq
 
-from numpy import zeros, hstack, vstack
+numpy = lazy_import("numpy")
+script_utils = lazy_import("omero.util.script_utils")
+
+
+def create_big_image(conn, old_image, name, description, channel_list,
+                     offset_map):
+    """
+    Create a new image from a 'Big' image, tile by tile, applying the
+    offsets to each channel. Planes of big images are too large to read
+    whole, so each tile of the new image is read from the region of the
+    old image it is shifted from.
+
+    @param channel_list:        The channel indexes of the old image
+    @param offset_map:          {channel index: {'x': x, 'y': y, 'z': z}}
+    @return:                    The new ImageWrapper
+    """
+    pixels = old_image.getPrimaryPixels()
+    size_z = old_image.getSizeZ()
+    size_t = old_image.getSizeT()
+    query = "from PixelsType as p where p.value='%s'" \
+        % pixels.getPixelsType().getValue()
+    pixels_type = conn.getQueryService().findByQuery(query, None)
+    pixels_service = conn.getPixelsService()
+    iid = pixels_service.createImage(
+        old_image.getSizeX(), old_image.getSizeY(), size_z, size_t,
+        list(range(len(channel_list))), pixels_type, name, description,
+        conn.SERVICE_OPTS)
+    new_image = conn.getObject("Image", iid.getValue())
+    pid = new_image.getPixelsId()
+
+    ranges = {}
+    with TileReader(conn, pixels) as reader:
+
+        class Iteration(TileLoopIteration):
+
+            def run(self, data, z, c, t, x, y, tile_width, tile_height,
+                    tile_count):
+                old_c = channel_list[c]
+                offsets = offset_map[old_c]
+                old_z = z - offsets['z']
+                if 0 <= old_z < size_z:
+                    tile = reader.read_region(
+                        old_z, old_c, t, (x - offsets['x'], y - offsets['y'],
+                                          tile_width, tile_height))
+                else:
+                    tile = numpy.zeros((tile_height, tile_width),
+                                       reader.dtype)
+                low, high = ranges.get(c, (tile.min(), tile.max()))
+                ranges[c] = (min(low, tile.min()), max(high, tile.max()))
+                data.setTile(
+                    tile.astype(tile.dtype.newbyteorder('>')).tobytes(),
+                    z, c, t, x, y, tile_width, tile_height)
+
+        loop = RPSTileLoop(conn.c.sf, PixelsI(pid, False))
+        loop.forEachTile(reader.tile_width, reader.tile_height, Iteration())
+
+    for c, (low, high) in ranges.items():
+        pixels_service.setChannelGlobalMinMax(
+            pid, c, float(low), float(high), conn.SERVICE_OPTS)
+    return new_image
 
 
 def new_image_with_channel_offsets(conn, image_id, channel_offsets,
@@ -67,12 +132,10 @@ def new_image_with_channel_offsets(conn, image_id, channel_offsets,
     size_x = old_image.getSizeX()
     size_y = old_image.getSizeY()
 
-    # check we're not dealing with Big image.
+    # Big images are read and written tile by tile
     rps = old_image.getPrimaryPixels()._prepareRawPixelsStore()
     big_image = rps.requiresPixelsPyramid()
     rps.close()
-    if big_image:
-        return
 
     # setup the (z,c,t) list of planes we need
     zct_list = []
@@ -102,55 +165,45 @@ def new_image_with_channel_offsets(conn, image_id, channel_offsets,
         # shift x by cropping, creating a new array of columns and stacking
         # horizontally
         if abs(x) > 0:
-            new_cols = zeros((height, abs(x)), data_type)
+            new_cols = numpy.zeros((height, abs(x)), data_type)
             x1 = max(0, 0-x)
             x2 = min(width, width-x)
             crop = plane[0:height, x1:x2]
             if x > 0:
-                plane = hstack((new_cols, crop))
+                plane = numpy.hstack((new_cols, crop))
             else:
-                plane = hstack((crop, new_cols))
+                plane = numpy.hstack((crop, new_cols))
         # shift y by cropping, creating a new array of rows and stacking
         # vertically
         if abs(y) > 0:
-            new_rows = zeros((abs(y), width), data_type)
+            new_rows = numpy.zeros((abs(y), width), data_type)
             y1 = max(0, 0-y)
             y2 = min(height, height-y)
             crop = plane[y1:y2, 0:width]
             if y > 0:
-                plane = vstack((new_rows, crop))
+                plane = numpy.vstack((new_rows, crop))
             else:
-                plane = vstack((crop, new_rows))
+                plane = numpy.vstack((crop, new_rows))
         return plane
 
     def offset_plane_gen():
         pixels = old_image.getPrimaryPixels()
-        dt = None
+        # the datatype comes from the pixels type, not from reading a plane
+        dt = pixels.get_numpy_type()
         # get the planes one at a time - exceptions on getPlane() don't affect
         # subsequent calls (new RawPixelsStore)
         for i in range(len(zct_list)):
             z, c, t = zct_list[i]
             offsets = offset_map[c]
             if z < 0 or z >= size_z:
-                if dt is None:
-                    # if we are on our first plane, we don't know datatype
-                    # yet...
-                    dt = pixels.getPlane(0, 0, 0).dtype
-                    # hack! TODO: add method to pixels to supply dtype
-                plane = zeros((size_y, size_x), dt)
+                plane = numpy.zeros((size_y, size_x), dt)
             else:
                 try:
                     plane = pixels.getPlane(*zct_list[i])
-                    dt = plane.dtype
                 except Exception:
                     # E.g. the Z-index is out of range - Simply supply an
                     # array of zeros.
-                    if dt is None:
-                        # if we are on our first plane, we don't know datatype
-                        # yet...
-                        dt = pixels.getPlane(0, 0, 0).dtype
-                        # hack! TODO: add method to pixels to supply dtype
-                    plane = zeros((size_y, size_x), dt)
+                    plane = numpy.zeros((size_y, size_x), dt)
             yield offset_plane(plane, offsets['x'], offsets['y'])
 
     # create a new image with our generator of numpy planes.
@@ -160,10 +213,15 @@ def new_image_with_channel_offsets(conn, image_id, channel_offsets,
     desc = "Image created from Image ID: %s by applying Channel Offsets:\n" \
         % image_id
     desc += "\n".join(desc_lines)
-    i = conn.createImageFromNumpySeq(
-        offset_plane_gen(), new_image_name,
-        sizeZ=size_z, sizeC=len(offset_map.items()), sizeT=size_t,
-        description=desc, sourceImageId=image_id, channelList=channel_list)
+    if big_image:
+        i = create_big_image(conn, old_image, new_image_name, desc,
+                             channel_list, offset_map)
+    else:
+        i = create_image_from_numpy_seq(
+            conn, prefetch(offset_plane_gen()), new_image_name,
+            sizeZ=size_z, sizeC=len(offset_map.items()), sizeT=size_t,
+            description=desc, sourceImageId=image_id,
+            channelList=channel_list)
 
     # Link image to dataset
     link = None
@@ -176,6 +234,25 @@ def new_image_with_channel_offsets(conn, image_id, channel_offsets,
     return i, link
 
 
+def offset_image(conn, image_id, channel_offsets, dataset_id=None):
+    """
+    new_image_with_channel_offsets() in a worker process of
+    process_images.
+
+    @return:                    The IDs of the new image and of its link to
+                                the dataset, or None
+    """
+    dataset = None
+    if dataset_id is not None:
+        dataset = conn.getObject("Dataset", dataset_id)
+    result = new_image_with_channel_offsets(conn, image_id, channel_offsets,
+                                            dataset)
+    if result is None:
+        return None, None
+    new_img, link = result
+    return new_img.getId(), link is not None and link.id.val or None
+
+
 def process_images(conn, script_params):
     """
     Process the script params to make a list of channel_offsets, then iterate
@@ -226,12 +303,11 @@ def process_images(conn, script_params):
     # need to handle Datasets eventually - Just do images for now
     new_images = []
     links = []
-    for image_id in image_ids:
-        new_img, link = new_image_with_channel_offsets(conn, image_id,
-                                                       channel_offsets,
-                                                       dataset)
-        if new_img is not None:
-            new_images.append(new_img)
+    results = map_images(conn, offset_image, image_ids, channel_offsets,
+                         dataset is not None and dataset.getId() or None)
+    for new_id, link in results:
+        if new_id is not None:
+            new_images.append(conn.getObject("Image", new_id))
             if link is not None:
                 links.append(link)
 
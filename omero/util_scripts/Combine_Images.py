@@ -34,16 +34,32 @@ additional C, T, Z dimensions.
 """
 
 import re
-from numpy import zeros
 
 import omero
 import omero.scripts as scripts
 from omero.gateway import BlitzGateway
 import omero.constants
 from omero.rtypes import rstring, rlong, robject
-import omero.util.script_utils as script_utils
-
-COLOURS = script_utils.COLOURS
+from omero.script_helpers import colours
+from omero.script_helpers.hierarchy import resolve_images
+from omero.script_helpers.lazy import lazy_import
+from omero.script_helpers.local_render import PIXEL_TYPES
+from omero.script_helpers.planner import (DRY_RUN_PARAM, IN_MEMORY, TILED,
+                                          Plan, bytes_per_pixel, choose_mode,
+                                          tile_count)
+from omero.script_helpers.prefetch import DEFAULT_DEPTH, prefetch
+from omero.script_helpers.progress import Progress
+from omero.script_helpers.store_pool import RawPixelsStorePool
+from omero.script_helpers.tiles import tile_grid
+
+numpy = lazy_import("numpy")
+script_utils = lazy_import("omero.util.script_utils")
+
+COLOURS = colours.COLOURS
+
+# copies of a plane held while it is copied: the downloaded bytes, the
+# array and its byte-swapped copy for the upload
+PLANE_COPIES = 3
 
 DEFAULT_T_REGEX = "_T"
 DEFAULT_Z_REGEX = "_Z"
@@ -69,23 +85,56 @@ time_regexes = {
     "None (single time point)": False}
 
 
-def get_plane(raw_pixel_store, pixels, the_z, the_c, the_t):
+def get_plane(store_pool, pixels, the_z, the_c, the_t):
     """
     This method downloads the specified plane of the OMERO image and returns
     it as a numpy array.
 
-    @param session      The OMERO session
-    @param imageId      The ID of the image to download
+    @param store_pool   RawPixelsStorePool to borrow a bound store from
     @param pixels       The pixels object, with pixelsType
-    @param imageName    The name of the image to write. If no path, saved in
-                        the current directory.
+    @param the_z        The Z index of the plane
+    @param the_c        The channel index of the plane
+    @param the_t        The T index of the plane
     """
 
     # get the plane
     pixels_id = pixels.getId().getValue()
-    raw_pixel_store.setPixelsId(pixels_id, True)
-    return script_utils.download_plane(
-        raw_pixel_store, pixels, the_z, the_c, the_t)
+    with store_pool.store(pixels_id) as raw_pixel_store:
+        return script_utils.download_plane(
+            raw_pixel_store, pixels, the_z, the_c, the_t)
+
+
+def get_tile(store_pool, pixels, the_z, the_c, the_t, tile):
+    """
+    This method downloads the (x, y, w, h) tile of the specified plane of
+    the OMERO image and returns it as a numpy array.
+
+    @param store_pool   RawPixelsStorePool to borrow a bound store from
+    @param pixels       The pixels object, with pixelsType
+    @param tile         (x, y, w, h) of the tile
+    """
+
+    x, y, w, h = tile
+    pixels_id = pixels.getId().getValue()
+    pixels_type = pixels.getPixelsType().getValue().getValue()
+    with store_pool.store(pixels_id) as raw_pixel_store:
+        data = raw_pixel_store.getTile(the_z, the_c, the_t, x, y, w, h)
+    dtype = numpy.dtype(PIXEL_TYPES[pixels_type]).newbyteorder('>')
+    return numpy.frombuffer(data, dtype=dtype).reshape(h, w)
+
+
+def get_pixels(query_service, image_ids):
+    """
+    Load the Pixels, with pixelsType, of all images in one query.
+
+    @return             Dict of image ID: Pixels
+    """
+    params = omero.sys.ParametersI()
+    params.addIds(image_ids)
+    query_string = "select p from Pixels p join fetch p.image i join "\
+        "fetch p.pixelsType pt where i.id in (:ids)"
+    pixels_list = query_service.findAllByQuery(query_string, params)
+    return dict((p.getImage().getId().getValue(), p) for p in pixels_list)
 
 
 def manually_assign_images(parameter_map, image_ids, source_z):
@@ -276,11 +325,15 @@ def pick_pixel_sizes(pixel_sizes):
     return pix_size
 
 
-def make_single_image(services, parameter_map, image_ids, dataset, colour_map):
+def make_single_image(services, parameter_map, image_ids, dataset, colour_map,
+                      plan, progress=None):
     """
     This takes the images specified by image_ids, sorts them in to Z,C,T
     dimensions according to parameters in the parameter_map, assembles them
     into a new Image, which is saved in dataset.
+    The new image is added to plan, and only planned for a dry run.
+    Its planes are added to the total of progress, and counted as they are
+    uploaded.
     """
 
     if len(image_ids) == 0:
@@ -289,26 +342,17 @@ def make_single_image(services, parameter_map, image_ids, dataset, colour_map):
     rendering_engine = services["renderingEngine"]
     query_service = services["queryService"]
     pixels_service = services["pixelsService"]
-    raw_pixel_store = services["rawPixelStore"]
+    store_pool = services["rawPixelStorePool"]
     raw_pixel_store_upload = services["rawPixelStoreUpload"]
     update_service = services["updateService"]
     container_service = services["containerService"]
 
-    # Filter images by name if user has specified filter.
+    # image_ids are filtered by name already, see combine_images()
     id_name_map = None
-    if "Filter_Names" in parameter_map:
-        filter_string = parameter_map["Filter_Names"]
-        if len(filter_string) > 0:
-            id_name_map = get_image_names(query_service, image_ids)
-            image_ids = [i for i in image_ids
-                         if id_name_map[i].find(filter_string) > -1]
-
-    image_id = image_ids[0]
 
-    # get pixels, with pixelsType, from the first image
-    query_string = "select p from Pixels p join fetch p.image i join "\
-        "fetch p.pixelsType pt where i.id='%d'" % image_id
-    pixels = query_service.findByQuery(query_string, None)
+    # get pixels, with pixelsType, of all images
+    source_pixels = get_pixels(query_service, image_ids)
+    pixels = source_pixels[image_ids[0]]
     # use the pixels type object we got from the first image.
     pixels_type = pixels.getPixelsType()
 
@@ -335,6 +379,34 @@ def make_single_image(services, parameter_map, image_ids, dataset, colour_map):
         for c, name in enumerate(parameter_map["Channel_Names"]):
             c_names[c] = name
 
+    # copy the planes in memory, reading ahead, one at a time, or tile by
+    # tile if a plane doesn't fit in the memory budget
+    pixels_type_name = pixels_type.getValue().getValue()
+    plane_size = size_x * size_y * bytes_per_pixel(pixels_type_name)
+    streaming = PLANE_COPIES * plane_size
+    mode = choose_mode(streaming * (DEFAULT_DEPTH + 2), streaming,
+                       plan.budget)
+    tiles = [None]
+    plane_tiles = 0
+    memory = streaming * (DEFAULT_DEPTH + 2 if mode == IN_MEMORY else 1)
+    if mode == TILED:
+        with store_pool.store(pixels.getId().getValue()) as store:
+            tile_width, tile_height = store.getTileSize()
+        plane_tiles = tile_count(size_x, size_y, tile_width, tile_height)
+        memory = PLANE_COPIES * tile_width * tile_height * \
+            bytes_per_pixel(pixels_type_name)
+    planes = size_z * size_c * size_t
+    plan.add("images %s" % image_ids, mode, planes=len(image_map),
+             tiles=planes * plane_tiles,
+             bytes_down=len(image_map) * plane_size,
+             bytes_up=planes * plane_size, memory=memory, images=1)
+    if parameter_map.get(DRY_RUN_PARAM):
+        return None, None
+    if mode == TILED:
+        tiles = list(tile_grid(size_x, size_y, tile_width, tile_height))
+    if progress is not None:
+        progress.add_total(planes)
+
     image_name = "combinedImage"
     description = "created from image Ids: %s" % image_ids
 
@@ -348,29 +420,57 @@ def make_single_image(services, parameter_map, image_ids, dataset, colour_map):
     raw_pixel_store_upload.setPixelsId(pixels_id, True)
 
     pixel_sizes = {'x': [], 'y': []}
-    for the_c in range(size_c):
-        min_value = 0
-        max_value = 0
-        for the_z in range(size_z):
+
+    def blocks():
+        """(z, c, t, tile, data) of the new image, tile None for planes."""
+        # Z innermost: consecutive planes come from the same source image
+        for the_c in range(size_c):
             for the_t in range(size_t):
-                if (the_z, the_c, the_t) in image_map:
-                    image_id, plane_z = image_map[(the_z, the_c, the_t)]
-                    query_string = "select p from Pixels p join fetch "\
-                        "p.image i join fetch p.pixelsType pt where "\
-                        "i.id='%d'" % image_id
-                    pixels = query_service.findByQuery(query_string,
-                                                       None)
-                    plane_2d = get_plane(raw_pixel_store, pixels, plane_z,
-                                         0, 0)
-                    # Note pixels sizes (may be None)
-                    pixel_sizes['x'].append(pixels.getPhysicalSizeX())
-                    pixel_sizes['y'].append(pixels.getPhysicalSizeY())
-                else:
-                    plane_2d = zeros((size_y, size_x))
-                script_utils.upload_plane(raw_pixel_store_upload,
-                                          plane_2d, the_z, the_c, the_t)
-                min_value = min(min_value, plane_2d.min())
-                max_value = max(max_value, plane_2d.max())
+                for the_z in range(size_z):
+                    source = image_map.get((the_z, the_c, the_t))
+                    if source is not None:
+                        image_id, plane_z = source
+                        pixels = source_pixels[image_id]
+                        # Note pixels sizes (may be None)
+                        pixel_sizes['x'].append(pixels.getPhysicalSizeX())
+                        pixel_sizes['y'].append(pixels.getPhysicalSizeY())
+                    for tile in tiles:
+                        if tile is None and source is not None:
+                            data = get_plane(store_pool, pixels, plane_z,
+                                             0, 0)
+                        elif tile is None:
+                            data = numpy.zeros((size_y, size_x))
+                        elif source is not None:
+                            data = get_tile(store_pool, pixels, plane_z, 0,
+                                            0, tile)
+                        else:
+                            data = numpy.zeros(
+                                (tile[3], tile[2]),
+                                dtype=PIXEL_TYPES[pixels_type_name])
+                        yield the_z, the_c, the_t, tile, data
+
+    ranges = {}
+    source_blocks = blocks()
+    if mode == IN_MEMORY:
+        source_blocks = prefetch(source_blocks)
+    for the_z, the_c, the_t, tile, data in source_blocks:
+        if tile is None:
+            script_utils.upload_plane(raw_pixel_store_upload,
+                                      data, the_z, the_c, the_t)
+        else:
+            raw_pixel_store_upload.setTile(
+                data.astype(data.dtype.newbyteorder('>')).tobytes(),
+                the_z, the_c, the_t, *tile)
+        min_value, max_value = ranges.get(the_c, (0, 0))
+        ranges[the_c] = (min(min_value, data.min()),
+                         max(max_value, data.max()))
+        if progress is not None:
+            # a plane is done with its last tile
+            progress.update(1 if tile == tiles[-1] else 0,
+                            data.size * bytes_per_pixel(pixels_type_name))
+
+    for the_c in range(size_c):
+        min_value, max_value = ranges.get(the_c, (0, 0))
         pixels_service.setChannelGlobalMinMax(pixels_id, the_c,
                                               float(min_value),
                                               float(max_value))
@@ -427,7 +527,7 @@ def combine_images(conn, parameter_map):
     services["renderingEngine"] = conn.createRenderingEngine()
     services["queryService"] = conn.getQueryService()
     services["pixelsService"] = conn.getPixelsService()
-    services["rawPixelStore"] = conn.c.sf.createRawPixelsStore()
+    services["rawPixelStorePool"] = RawPixelsStorePool(conn)
     services["rawPixelStoreUpload"] = conn.c.sf.createRawPixelsStore()
     services["updateService"] = conn.getUpdateService()
     services["rawFileStore"] = conn.createRawFileStore()
@@ -450,12 +550,23 @@ def combine_images(conn, parameter_map):
     # get the images IDs from list (in order) or dataset (sorted by name)
     output_images = []
     links = []
+    plan = Plan()
+    progress = Progress(label="planes")
 
     data_type = parameter_map["Data_Type"]
+    name_filter = parameter_map.get("Filter_Names")
     if data_type == "Image":
         dataset = None
         objects.sort(key=lambda x: (x.getName()))    # Sort images by name
         image_ids = [image.id for image in objects]
+        if name_filter:
+            matching = set(resolve_images(
+                conn, "Image", image_ids,
+                name_filter=name_filter).unique_image_ids())
+            image_ids = [i for i in image_ids if i in matching]
+            if not image_ids:
+                return None, message + "No image names contain %s." \
+                    % name_filter
         # get dataset from first image
         query_string = "select i from Image i join fetch i.datasetLinks idl"\
             " join fetch idl.parent where i.id in (%s)" % image_ids[0]
@@ -466,32 +577,41 @@ def combine_images(conn, parameter_map):
                 dataset = conn.getObject("Dataset", ds.getId().getValue())
                 break    # only use 1st dataset
         new_img, link = make_single_image(services, parameter_map, image_ids,
-                                          dataset, colour_map)
+                                          dataset, colour_map, plan, progress)
         if new_img:
             output_images.append(new_img)
         if link:
             links.append(link)
     else:
         for dataset in objects:
-            images = list(dataset.listChildren())
-            if not images:
+            # the IDs and names of the images, filtered by name
+            selection = resolve_images(conn, "Dataset", [dataset.getId()],
+                                       name_filter=name_filter)
+            if not len(selection):
                 continue
-            images.sort(key=lambda x: (x.getName()))
-            image_ids = [i.getId() for i in images]
+            names = dict(zip(selection.image_ids.tolist(), selection.names))
+            image_ids = sorted(selection.unique_image_ids(),
+                               key=lambda i: names[i])
             new_img, link = make_single_image(services, parameter_map,
-                                              image_ids, dataset, colour_map)
+                                              image_ids, dataset, colour_map,
+                                              plan, progress)
             if new_img:
                 output_images.append(new_img)
             if link:
                 links.append(link)
 
+    print(plan.report())
+    print(services["rawPixelStorePool"].report())
+
     # try and close any stateful services
-    for s in services:
+    for s in services.values():
         try:
             s.close()
         except Exception:
             pass
 
+    if parameter_map.get(DRY_RUN_PARAM):
+        return None, message + plan.report()
     if output_images:
         if len(output_images) > 1:
             message += "%s new images created" % len(output_images)
@@ -501,7 +621,7 @@ def combine_images(conn, parameter_map):
             message += " but could not be attached"
     else:
         message += "No image created"
-    message += "."
+    message += ". " + progress.finish()
 
     return output_images, message
 
@@ -602,6 +722,11 @@ See http://help.openmicroscopy.org/scripts.html""",
             "Channel_Names", grouping="8",
             description="List of Names for channels in the new image."),
 
+        scripts.Bool(
+            "Dry_Run", grouping="9", default=False,
+            description="Only report the planes, bytes and memory the new"
+            " images need, without making them"),
+
         version="4.2.0",
         authors=["William Moore", "OME Team"],
         institutions=["University of Dundee"],
@@ -36,63 +36,93 @@ from omero.gateway import BlitzGateway
 import omero
 
 from omero.rtypes import rint, rlong, rstring, robject, unwrap
+from omero.script_helpers.batch_writer import BatchWriter
+from omero.script_helpers.hierarchy import resolve_images
+from omero.script_helpers.journal import open_journal
+from omero.script_helpers.progress import Progress
 
 
-def add_images_to_plate(conn, images, plate_id, column, row, remove_from=None):
+def add_images_to_plate(conn, images, plate_id, column, row, remove_from=None,
+                        writer=None, on_done=None):
     """
     Add the Images to a Plate, creating a new well at the specified column and
     row
     NB - This will fail if there is already a well at that point
-    """
-    update_service = conn.getUpdateService()
 
+    If a BatchWriter is given, the well is saved with the writer's next
+    chunk, and the images are removed from the Dataset once it is saved.
+    on_done() is called once the well is saved and the images removed.
+    """
     well = omero.model.WellI()
     well.plate = omero.model.PlateI(plate_id, False)
     well.column = rint(column)
     well.row = rint(row)
 
-    try:
-        for image in images:
-            ws = omero.model.WellSampleI()
-            ws.image = omero.model.ImageI(image.id, False)
-            ws.well = well
-            well.addWellSample(ws)
-        update_service.saveObject(well)
-    except Exception:
-        return False
-
-    # remove from Datast
     for image in images:
-        if remove_from is not None:
-            links = list(image.getParentLinks(remove_from.id))
-            link_ids = [l.id for l in links]
-            conn.deleteObjects('DatasetImageLink', link_ids)
+        ws = omero.model.WellSampleI()
+        ws.image = omero.model.ImageI(image.id, False)
+        ws.well = well
+        well.addWellSample(ws)
+
+    def remove_images(saved_well):
+        # remove from Datast
+        for image in images:
+            if remove_from is not None:
+                links = list(image.getParentLinks(remove_from.id))
+                link_ids = [l.id for l in links]
+                conn.deleteObjects('DatasetImageLink', link_ids)
+        if on_done is not None:
+            on_done()
+
+    if writer is None:
+        with BatchWriter(conn, chunk_size=1) as writer:
+            writer.add(well, remove_images)
+        return not writer.failed
+    writer.add(well, remove_images)
     return True
 
 
-def dataset_to_plate(conn, script_params, dataset_id, screen):
+def dataset_to_plate(conn, script_params, dataset_id, screen, journal=None,
+                     progress=None):
+    """
+    Put the images of a Dataset in a new Plate.
+
+    With a journal, the plate, its images and the wells saved are recorded,
+    and a resumed run continues filling the plate of the failed one. The
+    wells to save are added to the total of progress, and counted as they
+    are saved.
+    """
 
     dataset = conn.getObject("Dataset", dataset_id)
     if dataset is None:
         return
 
     update_service = conn.getUpdateService()
+    started = journal.get(("plate", dataset_id)) if journal else None
 
-    # create Plate
-    plate = omero.model.PlateI()
-    plate.name = omero.rtypes.RStringI(dataset.name)
-    plate.columnNamingConvention = rstring(str(script_params["Column_Names"]))
-    # 'letter' or 'number'
-    plate.rowNamingConvention = rstring(str(script_params["Row_Names"]))
-    plate = update_service.saveAndReturnObject(plate)
-
-    if screen is not None and screen.canLink():
-        link = omero.model.ScreenPlateLinkI()
-        link.parent = omero.model.ScreenI(screen.id, False)
-        link.child = omero.model.PlateI(plate.id.val, False)
-        update_service.saveObject(link)
-    else:
+    if started is not None:
+        plate = conn.getObject("Plate", started["plate"])._obj
+        # linked to the screen by the failed run
         link = None
+        if started["link"] is not None:
+            link = omero.model.ScreenPlateLinkI(started["link"], False)
+    else:
+        # create Plate
+        plate = omero.model.PlateI()
+        plate.name = omero.rtypes.RStringI(dataset.name)
+        plate.columnNamingConvention = rstring(
+            str(script_params["Column_Names"]))
+        # 'letter' or 'number'
+        plate.rowNamingConvention = rstring(str(script_params["Row_Names"]))
+        plate = update_service.saveAndReturnObject(plate)
+
+        if screen is not None and screen.canLink():
+            link = omero.model.ScreenPlateLinkI()
+            link.parent = omero.model.ScreenI(screen.id, False)
+            link.child = omero.model.PlateI(plate.id.val, False)
+            link = update_service.saveAndReturnObject(link)
+        else:
+            link = None
 
     row = 0
     col = 0
@@ -100,13 +130,29 @@ def dataset_to_plate(conn, script_params, dataset_id, screen):
     first_axis_is_row = script_params["First_Axis"] == 'row'
     axis_count = script_params["First_Axis_Count"]
 
-    # sort images by name
-    images = list(dataset.listChildren())
-    dataset_img_count = len(images)
-    if "Filter_Names" in script_params:
-        filter_by = script_params["Filter_Names"]
-        images = [i for i in images if i.getName().find(filter_by) >= 0]
-    images.sort(key=lambda x: x.name.lower())
+    if started is not None:
+        # the images of the failed run, some of which may no longer be
+        # in the dataset
+        images = list(conn.getObjects("Image", started["images"]))
+        images.sort(key=lambda x: started["images"].index(x.id))
+        dataset_img_count = len(images)
+    else:
+        # sort images by name
+        filter_by = script_params.get("Filter_Names")
+        if filter_by:
+            # only load the images whose names match
+            images = resolve_images(conn, "Dataset", [dataset_id],
+                                    name_filter=filter_by).load_images(conn)
+            dataset_img_count = dataset.countChildren()
+        else:
+            images = list(dataset.listChildren())
+            dataset_img_count = len(images)
+        images.sort(key=lambda x: x.name.lower())
+        if journal is not None:
+            journal.record(("plate", dataset_id), {
+                "plate": plate.id.val,
+                "link": link.id.val if link is not None else None,
+                "images": [i.id for i in images]})
 
     # Do we try to remove images from Dataset and Delte Datset when/if empty?
     remove_from = None
@@ -117,13 +163,27 @@ def dataset_to_plate(conn, script_params, dataset_id, screen):
 
     images_per_well = script_params["Images_Per_Well"]
     image_index = 0
+    added_count = 0
 
+    # wells are saved in chunks, not one call per well
+    writer = BatchWriter(conn)
     while image_index < len(images):
 
         well_images = images[image_index: image_index + images_per_well]
-        added_count = add_images_to_plate(conn, well_images,
-                                          plate.getId().getValue(),
-                                          col, row, remove_from)
+        well = ("well", dataset_id, image_index)
+
+        def on_done(well=well):
+            if journal is not None:
+                journal.record(well)
+            if progress is not None:
+                progress.update()
+        if journal is None or not journal.done(well):
+            if progress is not None:
+                progress.add_total(1)
+            added_count = add_images_to_plate(conn, well_images,
+                                              plate.getId().getValue(),
+                                              col, row, remove_from, writer,
+                                              on_done)
         image_index += images_per_well
 
         # update row and column index
@@ -137,6 +197,8 @@ def dataset_to_plate(conn, script_params, dataset_id, screen):
             if col >= axis_count:
                 col = 0
                 row += 1
+    writer.close()
+    print(writer.report())
 
     # if user wanted to delete dataset, AND it's empty we can delete dataset
     delete_dataset = False   # Turning this functionality off for now.
@@ -161,6 +223,7 @@ def datasets_to_plates(conn, script_params):
     dtype = script_params['Data_Type']
     ids = script_params['IDs']
     datasets = list(conn.getObjects(dtype, ids))
+    journal = open_journal(conn, "Dataset_To_Plate", script_params)
 
     def has_images_linked_to_well(dataset):
         params = omero.sys.ParametersI()
@@ -178,7 +241,9 @@ def datasets_to_plates(conn, script_params):
 
     # Exclude datasets containing images already linked to a well
     n_datasets = len(datasets)
-    datasets = [x for x in datasets if not has_images_linked_to_well(x)]
+    # (unless a failed run started to fill a plate from them)
+    datasets = [x for x in datasets if journal.done(("plate", x.getId())) or
+                not has_images_linked_to_well(x)]
     if len(datasets) < n_datasets:
         message += "Excluded %s out of %s dataset(s). " \
             % (n_datasets - len(datasets), n_datasets)
@@ -208,18 +273,25 @@ def datasets_to_plates(conn, script_params):
         except ValueError:
             pass
         # if not, create one
+        # or the one created by the failed run
+        if screen is None and journal.done("screen"):
+            screen = conn.getObject("Screen", journal.get("screen"))
+            newscreen = screen and screen._obj
         if screen is None:
             newscreen = omero.model.ScreenI()
             newscreen.name = rstring(s)
             newscreen = update_service.saveAndReturnObject(newscreen)
             screen = conn.getObject("Screen", newscreen.getId().getValue())
+            journal.record("screen", screen.getId())
 
     plates = []
     links = []
     deletes = []
+    progress = Progress(label="wells")
     for dataset_id in ids:
         plate, link, delete_handle = dataset_to_plate(conn, script_params,
-                                                      dataset_id, screen)
+                                                      dataset_id, screen,
+                                                      journal, progress)
         if plate is not None:
             plates.append(plate)
         if link is not None:
@@ -254,6 +326,8 @@ def datasets_to_plates(conn, script_params):
             message += " but could not be attached."
     else:
         message += "No plate created."
+    message += " " + progress.finish()
+    journal.finish()
     return robj, message
 
 
@@ -324,6 +398,11 @@ See http://help.openmicroscopy.org/scripts.html""",
             description="Remove Images from Dataset as they are added to"
             " Plate"),
 
+        scripts.Bool(
+            "Resume_From_Journal", grouping="8", default=False,
+            description="Continue the Plates of the last run with the same"
+            " parameters, if it failed"),
+
         version="4.3.2",
         authors=["William Moore", "OME Team"],
         institutions=["University of Dundee"],
@@ -37,143 +37,201 @@ import omero
 import omero.scripts as scripts
 from omero.gateway import BlitzGateway
 from omero.rtypes import rstring, rlong, robject, unwrap
-import omero.util.script_utils as script_utils
 from omero.util.tiles import TileLoopIteration, RPSTileLoop
 from omero.model import PixelsI
+from omero.script_helpers.batch_writer import BatchWriter
+from omero.script_helpers.lazy import lazy_import
+from omero.script_helpers.planner import (DRY_RUN_PARAM, STREAMING, TILED,
+                                          Plan, bytes_per_pixel, choose_mode,
+                                          pipeline_planes, tile_count)
+from omero.script_helpers.prefetch import prefetch
+from omero.script_helpers.process_pool import image_workers, map_images
+from omero.script_helpers.progress import Progress
+from omero.script_helpers.shape_index import UNSET, ShapeIndex
+from omero.script_helpers.uploader import create_image_from_numpy_seq
+from omero.script_helpers.tiles import TileReader
 
 import os
 
+script_utils = lazy_import("omero.util.script_utils")
+
 
 def create_image_from_tiles(conn, source, image_name, description,
                             box, tile_size):
+    """
+    Create a new image from the region box of a 'Big' image, tile by tile,
+    so that no plane is held in memory whole. Each tile of the new image is
+    read from the tiles of the source image that cover it.
+
+    @param box:         (x, y, w, h, z1, z2, t1, t2, xy_by_time) of the ROI
+    @param tile_size:   Width and height of the tiles to write
+    @return:            The new ImageWrapper
+    """
 
     pixels_service = conn.getPixelsService()
     query_service = conn.getQueryService()
     xbox, ybox, wbox, hbox, z1box, z2box, t1box, t2box, xy_by_time = box
-    size_x = wbox
-    size_y = hbox
-    size_z = source.getSizeZ()
-    size_t = source.getSizeT()
+    if z1box is None:
+        z1box, z2box = 0, source.getSizeZ() - 1
+    if t1box is None:
+        t1box, t2box = 0, source.getSizeT() - 1
+    size_z = z2box - z1box + 1
+    size_t = t2box - t1box + 1
     size_c = source.getSizeC()
-    tile_width = tile_size
-    tile_height = tile_size
     primary_pixels = source.getPrimaryPixels()
 
-    def create_image():
-        query = "from PixelsType as p where p.value='uint8'"
-        pixels_type = query_service.findByQuery(query, None)
-        channel_list = range(size_c)
-        # bytesPerPixel = pixelsType.bitSize.val / 8
-        iid = pixels_service.createImage(
-            size_x,
-            size_y,
-            size_z,
-            size_t,
-            channel_list,
-            pixels_type,
-            image_name,
-            description,
-            conn.SERVICE_OPTS)
-
-        return conn.getObject("Image", iid)
-
-    # Make a list of all the tiles we're going to need.
-    # This is the SAME ORDER that RPSTileLoop will ask for them.
-    zct_tile_list = []
-    for t in range(0, size_t):
-        for c in range(0, size_c):
-            for z in range(0, size_z):
-                for tile_offset_y in range(
-                        0, ((size_y + tile_height - 1) // tile_height)):
-                    for tile_offset_x in range(
-                            0, ((size_x + tile_width - 1) // tile_width)):
-                        x = tile_offset_x * tile_width
-                        y = tile_offset_y * tile_height
-                        w = tile_width
-                        if (w + x > size_x):
-                            w = size_x - x
-                        h = tile_height
-                        if (h + y > size_y):
-                            h = size_y - y
-                        tile_xywh = (xbox + x, ybox + y, w, h)
-                        zct_tile_list.append((z, c, t, tile_xywh))
-
-    # This is a generator that will return tiles in the sequence above
-    # getTiles() only opens 1 rawPixelsStore for all the tiles
-    # whereas getTile() opens and closes a rawPixelsStore for each tile.
-    tile_gen = primary_pixels.getTiles(zct_tile_list)
-
-    def next_tile():
-        return next(tile_gen)
-
-    class Iteration(TileLoopIteration):
-
-        def run(self, data, z, c, t, x, y, tile_width, tile_height,
-                tile_count):
-            tile2d = next_tile()
-            data.setTile(tile2d, z, c, t, x, y, tile_width, tile_height)
-
-    new_image = create_image()
+    query = "from PixelsType as p where p.value='%s'" \
+        % primary_pixels.getPixelsType().getValue()
+    pixels_type = query_service.findByQuery(query, None)
+    iid = pixels_service.createImage(
+        wbox, hbox, size_z, size_t, list(range(size_c)), pixels_type,
+        image_name, description, conn.SERVICE_OPTS)
+    new_image = conn.getObject("Image", unwrap(iid))
     pid = new_image.getPixelsId()
-    loop = RPSTileLoop(conn.c.sf, PixelsI(pid, False))
-    loop.forEachTile(tile_width, tile_height, Iteration())
 
-    for the_c in range(size_c):
-        pixels_service.setChannelGlobalMinMax(pid, the_c, float(0),
-                                              float(255), conn.SERVICE_OPTS)
+    ranges = {}
+    with TileReader(conn, primary_pixels) as reader:
+
+        class Iteration(TileLoopIteration):
+
+            def run(self, data, z, c, t, x, y, tile_width, tile_height,
+                    tile_count):
+                the_t = t + t1box
+                x0, y0 = xbox, ybox
+                if the_t in xy_by_time:
+                    x0 = xy_by_time[the_t]['x']
+                    y0 = xy_by_time[the_t]['y']
+                tile = reader.read_region(
+                    z + z1box, c, the_t,
+                    (x0 + x, y0 + y, tile_width, tile_height))
+                low, high = ranges.get(c, (tile.min(), tile.max()))
+                ranges[c] = (min(low, tile.min()), max(high, tile.max()))
+                data.setTile(
+                    tile.astype(tile.dtype.newbyteorder('>')).tobytes(),
+                    z, c, t, x, y, tile_width, tile_height)
+
+        loop = RPSTileLoop(conn.c.sf, PixelsI(pid, False))
+        loop.forEachTile(tile_size, tile_size, Iteration())
+
+    for the_c, (low, high) in ranges.items():
+        pixels_service.setChannelGlobalMinMax(pid, the_c, float(low),
+                                              float(high), conn.SERVICE_OPTS)
 
     return new_image
 
 
-def get_rectangles(conn, image_id):
+def get_rectangles(conn, image_id, rectangles=None):
     """
     Returns a list of (x, y, width, height, zStart, zStop, tStart, tStop)
     of each rectange ROI in the image
-    """
 
-    rois = []
+    @param rectangles:  ShapeIndex of the rectangles of the image, e.g. of
+                        all the images processed. Default: loaded
+    """
 
-    roi_service = conn.getRoiService()
-    result = roi_service.findByImage(image_id, None)
+    if rectangles is None:
+        rectangles = ShapeIndex.load(conn, [image_id], ("Rectangle",))
+    rectangles = rectangles.for_image(image_id).of_type("Rectangle")
+    boxes = [[int(v) for v in box] for box in
+             rectangles.shapes[["x", "y", "width", "height"]].tolist()]
+    z_indexes = rectangles.column("z")
+    t_indexes = rectangles.column("t")
 
-    for roi in result.rois:
-        width = None
-        z_indexes = []
-        t_indexes = []
+    rois = []
+    for shapes in rectangles.rois():
+        # check t range and z range for every rectangle
+        # t and z (and c) for shape is optional
+        # https://www.openmicroscopy.org/site/support/omero5.2/developers/Model/EveryObject.html#shape
+        roi_z = [z_indexes[i] for i in shapes if z_indexes[i] != UNSET]
+        roi_t = [t_indexes[i] for i in shapes if t_indexes[i] != UNSET]
+        # get width, height for first rect only
+        width, height = boxes[shapes[0]][2:]
         # note x and y for every T, to track moving object
         xy_by_time = {}
-        for shape in roi.copyShapes():
-            if type(shape) == omero.model.RectangleI:
-                # check t range and z range for every rectangle
-                # t and z (and c) for shape is optional
-                # https://www.openmicroscopy.org/site/support/omero5.2/developers/Model/EveryObject.html#shape
-                the_t = unwrap(shape.getTheT())
-                the_z = unwrap(shape.getTheZ())
-                if the_t is not None:
-                    t_indexes.append(the_t)
-                if the_z is not None:
-                    z_indexes.append(the_z)
-
-                if width is None:   # get width, height for first rect only
-                    width = int(shape.getWidth().getValue())
-                    height = int(shape.getHeight().getValue())
-                x = int(shape.getX().getValue())
-                y = int(shape.getY().getValue())
-                if the_t is not None:
-                    xy_by_time[the_t] = {'x': x, 'y': y}
-        # if we have found any rectangles at all for this ROI...
-        if width is not None:
-            t_start = min(t_indexes) if t_indexes else None
-            t_end = max(t_indexes) if t_indexes else None
-            z_start = min(z_indexes) if z_indexes else None
-            z_end = max(z_indexes) if z_indexes else None
-            rois.append((x, y, width, height, z_start, z_end,
-                         t_start, t_end, xy_by_time))
+        for i in shapes:
+            x, y = boxes[i][:2]
+            if t_indexes[i] != UNSET:
+                xy_by_time[t_indexes[i]] = {'x': x, 'y': y}
+        t_start = min(roi_t) if roi_t else None
+        t_end = max(roi_t) if roi_t else None
+        z_start = min(roi_z) if roi_z else None
+        z_end = max(roi_z) if roi_z else None
+        rois.append((x, y, width, height, z_start, z_end,
+                     t_start, t_end, xy_by_time))
 
     return rois
 
 
-def process_image(conn, image_id, parameter_map):
+def plan_rois(conn, image, parameter_map, plan, rectangles=None):
+    """
+    Lists the rectangles of the image, cropped to the image, and adds the
+    new images made from them to plan. Each new image is copied plane by
+    plane unless a plane is over the server's maximum plane size or the
+    memory budget of a worker, then tile by tile.
+
+    @param rectangles:  ShapeIndex of the rectangles, as for
+                        get_rectangles()
+    @return:    The rectangles, as from get_rectangles(), and the mode
+                (STREAMING or TILED) to copy each one with
+    """
+    rois = get_rectangles(conn, image.getId(), rectangles)
+
+    img_w = image.getSizeX()
+    img_h = image.getSizeY()
+
+    for index, roi in enumerate(rois):
+        x, y, w, h, z1, z2, t1, t2, xy_by_time = roi
+        # Bounding box
+        x_max = max(x, 0)
+        y_max = max(y, 0)
+        x2_max = min(x + w, img_w)
+        y2_max = min(y + h, img_h)
+
+        w_max = x2_max - x_max
+        h_max = y2_max - y_max
+        if (x, y, w, h) != (x_max, y_max, w_max, h_max):
+            rois[index] = (x_max, y_max, w_max, h_max, z1, z2, t1, t2,
+                           xy_by_time)
+
+    name = "image %s" % image.getId()
+    pixel_size = bytes_per_pixel(image.getPixelsType())
+    if parameter_map['Make_Image_Stack']:
+        if rois:
+            plane = rois[0][2] * rois[0][3] * pixel_size
+            plan.add(name, STREAMING, planes=len(rois),
+                     bytes_down=len(rois) * plane,
+                     bytes_up=len(rois) * plane,
+                     memory=pipeline_planes() * plane, images=1)
+        return rois, [STREAMING] * len(rois)
+
+    big_image_size = conn.getMaxPlaneSize()
+    big_image_pixel_count = big_image_size[0] * big_image_size[1]
+    tile_size = parameter_map['Tile_Size']
+    budget = plan.budget // plan.concurrency
+    modes = []
+    for index, roi in enumerate(rois):
+        x, y, w, h, z1, z2, t1, t2, xy_by_time = roi
+        size_z = image.getSizeZ() if z1 is None else z2 - z1 + 1
+        size_t = image.getSizeT() if t1 is None else t2 - t1 + 1
+        planes = size_z * image.getSizeC() * size_t
+        plane = w * h * pixel_size
+        memory = pipeline_planes() * plane
+        mode = choose_mode(None, memory, budget)
+        if h * w >= big_image_pixel_count:
+            mode = TILED
+        tiles = 0
+        if mode == TILED:
+            tiles = planes * tile_count(w, h, tile_size, tile_size)
+            # a tile and the source tiles it is read from
+            memory = 2 * tile_size * tile_size * pixel_size
+        plan.add("%s ROI %d" % (name, index), mode, planes=planes,
+                 tiles=tiles, bytes_down=planes * plane,
+                 bytes_up=planes * plane, memory=memory, images=1)
+        modes.append(mode)
+    return rois, modes
+
+
+def process_image(conn, image_id, parameter_map, workers=1):
     """
     Process an image.
     If imageStack is True, we make a Z-stack using one tile from each ROI
@@ -200,25 +258,14 @@ def process_image(conn, image_id, parameter_map):
 
     pixels = image.getPrimaryPixels()
 
+    plan = Plan(concurrency=workers)
     # x, y, w, h, zStart, zEnd, tStart, tEnd
-    rois = get_rectangles(conn, image_id)
+    rois, modes = plan_rois(conn, image, parameter_map, plan)
+    print(plan.report())
 
     img_w = image.getSizeX()
     img_h = image.getSizeY()
 
-    for index, roi in enumerate(rois):
-        x, y, w, h, z1, z2, t1, t2, xy_by_time = roi
-        # Bounding box
-        x_max = max(x, 0)
-        y_max = max(y, 0)
-        x2_max = min(x + w, img_w)
-        y2_max = min(y + h, img_h)
-
-        w_max = x2_max - x_max
-        h_max = y2_max - y_max
-        if (x, y, w, h) != (x_max, y_max, w_max, h_max):
-            rois[index] = (x_max, y_max, w_max, h_max, z1, z2, t1, t2)
-
     if len(rois) == 0:
         return
 
@@ -251,8 +298,8 @@ def process_image(conn, image_id, parameter_map):
         description = "Image from ROIS on parent Image:\n  Name: %s\n"\
             "  Image ID: %d" % (image_name, image_id)
 
-        image = conn.createImageFromNumpySeq(
-            tile_gen(), new_image_name,
+        image = create_image_from_numpy_seq(
+            conn, prefetch(tile_gen()), new_image_name,
             sizeZ=len(rois), sizeC=1, sizeT=1, description=description,
             dataset=None)
 
@@ -271,8 +318,6 @@ def process_image(conn, image_id, parameter_map):
     else:
         images = []
         iids = []
-        big_image_size = conn.getMaxPlaneSize()
-        big_image_pixel_count = big_image_size[0] * big_image_size[1]
 
         for index, roi in enumerate(rois):
             new_name = "%s_%0d" % (image_name, index)
@@ -293,7 +338,7 @@ def process_image(conn, image_id, parameter_map):
             description = "Created from image:"\
                 " \n  Name: %s\n  Image ID: %d"\
                 " \n x: %d y: %d" % (image_name, image_id, x, y)
-            if (h * w < big_image_pixel_count):
+            if modes[index] != TILED:
                 # need a tile generator to get all the planes within the ROI
                 size_z = z2-z1 + 1
                 size_t = t2-t1 + 1
@@ -313,8 +358,8 @@ def process_image(conn, image_id, parameter_map):
                     for i, t in enumerate(pixels.getTiles(zct_tile_list)):
                         yield t
 
-                new_img = conn.createImageFromNumpySeq(
-                    tile_gen(), new_name,
+                new_img = create_image_from_numpy_seq(
+                    conn, prefetch(tile_gen()), new_name,
                     sizeZ=size_z, sizeC=size_c, sizeT=size_t,
                     description=description, sourceImageId=image_id)
             else:
@@ -352,13 +397,15 @@ def process_image(conn, image_id, parameter_map):
             link = None
         else:
             link = []
-            for iid in iids:
-                ds_link = omero.model.DatasetImageLinkI()
-                ds_link.parent = omero.model.DatasetI(
-                    parent_dataset.id.val, False)
-                ds_link.child = omero.model.ImageI(iid, False)
-                update_service.saveObject(ds_link)
-                link.append(ds_link)
+            with BatchWriter(conn) as writer:
+                for iid in iids:
+                    ds_link = omero.model.DatasetImageLinkI()
+                    ds_link.parent = omero.model.DatasetI(
+                        parent_dataset.id.val, False)
+                    ds_link.child = omero.model.ImageI(iid, False)
+                    writer.add(ds_link)
+                    link.append(ds_link)
+            print(writer.report())
             if parent_project and parent_project.canLink():
                 # and put it in the   current project
                 project_link = omero.model.ProjectDatasetLinkI()
@@ -373,6 +420,28 @@ def process_image(conn, image_id, parameter_map):
         return images, dataset, link
 
 
+def process_image_ids(conn, image_id, parameter_map, workers=1):
+    """
+    process_image() in a worker process of make_images_from_rois, one of
+    workers.
+
+    @return:    IDs of the new images, ID of the new dataset or None, and
+                the number of images linked to a dataset
+    """
+    result = process_image(conn, image_id, parameter_map, workers)
+    if result is None:
+        return [], None, 0
+    new_image, new_dataset, link = result
+    if not isinstance(new_image, list):
+        new_image = [new_image]
+    if link is None:
+        link = []
+    elif not isinstance(link, list):
+        link = [link]
+    dataset_id = new_dataset.id.val if new_dataset is not None else None
+    return [i.getId() for i in new_image], dataset_id, len(link)
+
+
 def make_images_from_rois(conn, parameter_map):
     """
     Processes the list of Image_IDs, either making a new image-stack or a new
@@ -399,29 +468,33 @@ def make_images_from_rois(conn, parameter_map):
             images += ds.listChildren()
 
     # Check for rectangular ROIs and filter images list
-    images = [image for image in images if image.getROICount("Rectangle") > 0]
+    rectangles = ShapeIndex.load(conn, [image.getId() for image in images],
+                                 ("Rectangle",))
+    with_rectangles = set(rectangles.column("image"))
+    images = [image for image in images if image.getId() in with_rectangles]
     if not images:
         message += "No rectangle ROI found."
         return None, message
 
     image_ids = [i.getId() for i in images]
+    workers = image_workers(len(image_ids))
+    if parameter_map.get(DRY_RUN_PARAM):
+        plan = Plan(concurrency=workers)
+        for image in images:
+            plan_rois(conn, image, parameter_map, plan, rectangles)
+        return None, message + plan.report()
+
     new_images = []
     new_datasets = []
-    links = []
-    for iid in image_ids:
-        new_image, new_dataset, link = process_image(conn, iid, parameter_map)
-        if new_image is not None:
-            if isinstance(new_image, list):
-                new_images.extend(new_image)
-            else:
-                new_images.append(new_image)
+    links = 0
+    progress = Progress(len(image_ids), "images")
+    for new_ids, new_dataset, linked in map_images(
+            conn, process_image_ids, image_ids, parameter_map, workers,
+            workers=workers, progress=progress):
+        new_images.extend(new_ids)
         if new_dataset is not None:
             new_datasets.append(new_dataset)
-        if link is not None:
-            if isinstance(link, list):
-                links.extend(link)
-            else:
-                links.append(link)
+        links += linked
 
     if new_images:
         if len(new_images) > 1:
@@ -437,11 +510,13 @@ def make_images_from_rois(conn, parameter_map):
         else:
             message += " and a new dataset"
 
-    if not links or not len(links) == len(new_images):
+    if not links or not links == len(new_images):
         message += " but some images could not be attached"
-    message += "."
+    message += ". " + progress.finish()
 
-    robj = (len(new_images) > 0) and new_images[0]._obj or None
+    robj = None
+    if new_images:
+        robj = conn.getObject("Image", new_images[0])._obj
     return robj, message
 
 
@@ -490,6 +565,11 @@ images using the specified tile size.
             description="If the new image is large and tiled, "
             "create tiles of this width & height", default=1024),
 
+        scripts.Bool(
+            "Dry_Run", grouping="6", default=False,
+            description="Only report the planes, bytes and memory the new"
+            " images need, without making them"),
+
         version="5.3.0",
         authors=["William Moore", "OME Team"],
         institutions=["University of Dundee"],
@@ -39,6 +39,9 @@ import omero
 import re   # for sorting of list of images
 
 from omero.rtypes import rint, rlong, rstring, robject, unwrap
+from omero.script_helpers.batch_writer import BatchWriter
+from omero.script_helpers.hierarchy import resolve_images
+from omero.script_helpers.progress import Progress
 
 
 def run_script():
@@ -134,25 +137,33 @@ See http://help.openmicroscopy.org/scripts.html""",
     finally:
         client.closeSession()
 
-def add_images_to_plate(conn, images, plate_id, column, row, remove_from=None):
+def get_well_positions(plate):
+    """
+    The (row, column) of the wells in the plate, loaded once, rather than
+    listing all the wells again for every new one
+    """
+    return set((well.row, well.column) for well in plate.listChildren())
+
+
+def add_images_to_plate(conn, images, plate_id, column, row, remove_from=None,
+                        existing=None, writer=None, on_done=None):
     """
     Add the Images to a Plate, creating a new well at the specified column and
     row
-    NB - This will fail if there is already a well at that point
+    NB - Nothing is added if there is already a well at that point
+
+    existing is the set of (row, column) of the wells in the plate, from
+    get_well_positions(), and the new well is added to it. If a BatchWriter
+    is given, the well is saved with the writer's next chunk, and the images
+    are removed from the Dataset once it is saved.
+    on_done() is called once the well is saved and the images removed.
     """
     print(f"initialize new well {row}-{column} in plate {plate_id}.")
-    update_service = conn.getUpdateService()
-    alphabet = list("ABCDEFGHIJKLMNOPQRSTUVWXYZ")
-    plate = conn.getObject("Plate",plate_id)
-    wellList=[]
-    # create a list of existing wells in the plate
-    for well in plate.listChildren():
-        wellList.append(str(well.getWellPos()))
-    print("created Well-List")
+    if existing is None:
+        existing = get_well_positions(conn.getObject("Plate", plate_id))
     # check if a well already exists at this position
-    newWellPos = str(alphabet[row])+str(column+1)
-    if newWellPos in wellList:
-        print(newWellPos+" exists already in the Well-List")
+    if (row, column) in existing:
+        print(f"Well {row}-{column} exists already in the plate")
         return False
 
     # if not, create one new well and a wellsample for each image
@@ -164,28 +175,33 @@ def add_images_to_plate(conn, images, plate_id, column, row, remove_from=None):
         print(f"Successfully created well {well.row.getValue()}-{well.column.getValue()}.")
     except Exception:
         return False
-    try:
-        for image in images:
-            ws = omero.model.WellSampleI()
-            ws.image = omero.model.ImageI(image.id, False)
-            ws.well = well
-            well.addWellSample(ws)
-        update_service.saveObject(well)
-        print(f"Successfully added images to the well {newWellPos}\n---------------")
-
-    except Exception:
-        return False
-
-    # remove from Datast
     for image in images:
-        if remove_from is not None:
-            links = list(image.getParentLinks(remove_from.id))
-            link_ids = [l.id for l in links]
-            conn.deleteObjects('DatasetImageLink', link_ids)
+        ws = omero.model.WellSampleI()
+        ws.image = omero.model.ImageI(image.id, False)
+        ws.well = well
+        well.addWellSample(ws)
+    existing.add((row, column))
+
+    def remove_images(saved_well):
+        print(f"Successfully added images to the well {row}-{column}")
+        # remove from Datast
+        for image in images:
+            if remove_from is not None:
+                links = list(image.getParentLinks(remove_from.id))
+                link_ids = [l.id for l in links]
+                conn.deleteObjects('DatasetImageLink', link_ids)
+        if on_done is not None:
+            on_done()
+
+    if writer is None:
+        with BatchWriter(conn, chunk_size=1) as writer:
+            writer.add(well, remove_images)
+        return not writer.failed
+    writer.add(well, remove_images)
     return True
 
 
-def dataset_to_plate(conn, script_params, dataset_id, screen):
+def dataset_to_plate(conn, script_params, dataset_id, screen, progress=None):
     dataset = conn.getObject("Dataset", dataset_id)
     if dataset is None:
         return
@@ -224,11 +240,15 @@ def dataset_to_plate(conn, script_params, dataset_id, screen):
     # axis_count = script_params["First_Axis_Count"]
 
     # sort images by name
-    images = list(dataset.listChildren())
-    dataset_img_count = len(images)
-    if "Filter_Names" in script_params:
-        filter_by = script_params["Filter_Names"]
-        images = [i for i in images if i.getName().find(filter_by) >= 0]
+    filter_by = script_params.get("Filter_Names")
+    if filter_by:
+        # only load the images whose names match
+        images = resolve_images(conn, "Dataset", [dataset_id],
+                                name_filter=filter_by).load_images(conn)
+        dataset_img_count = dataset.countChildren()
+    else:
+        images = list(dataset.listChildren())
+        dataset_img_count = len(images)
 
 
     # new sorting of the image list, according to natural language
@@ -256,16 +276,32 @@ def dataset_to_plate(conn, script_params, dataset_id, screen):
     # All images are looped through and then each single well is generated
     # by the add_images_to_plate()
 
+    # the wells already in the plate, and the new wells saved in chunks
+    existing = get_well_positions(plate)
+    writer = BatchWriter(conn)
     while image_index < len(images):
         well_images = images[image_index: image_index + images_per_well]
-        rowName = re.split('--', well_images[0].name)[0][0]
-        row = alphabet.index(rowName)
-        col = int(re.split('--', well_images[0].name)[0][1:]) - 1
+        wellName = re.split('--', well_images[0].name)[0]
+        # rows after Z (1536-well plates) are AA, AB, ...
+        rowName = re.match('[A-Z]+', wellName).group()
+        row = -1
+        for letter in rowName:
+            row = (row + 1) * len(alphabet) + alphabet.index(letter)
+        col = int(wellName[len(rowName):]) - 1
+        on_done = None
+        if progress is not None:
+            progress.add_total(1)
+            on_done = progress.update
         added_count = add_images_to_plate(conn, well_images,
                                           plate.getId(),
-                                          col, row, remove_from)
+                                          col, row, remove_from,
+                                          existing, writer, on_done)
+        if not added_count and progress is not None:
+            # there is a well at this position already
+            progress.add_total(-1)
         image_index += images_per_well
-
+    writer.close()
+    print(writer.report())
 
 
     # if user wanted to delete dataset, AND it's empty we can delete dataset
@@ -353,9 +389,12 @@ def datasets_to_plates(conn, script_params):
     plates = []
     links = []
     deletes = []
+    # the wells saved, over all the datasets
+    progress = Progress(label="wells")
     for dataset_id in ids:
         plate, link, delete_handle = dataset_to_plate(conn, script_params,
-                                                      dataset_id, screen)
+                                                      dataset_id, screen,
+                                                      progress)
         if plate is not None:
             plates.append(plate)
             #writing the first newly created plate into the script parameters so
@@ -393,6 +432,7 @@ def datasets_to_plates(conn, script_params):
         #     message += " but could not be attached."
     else:
         message += "No plate created."
+    message += " " + progress.finish()
     return robj, message
 
 if __name__ == "__main__":
@@ -6,6 +6,7 @@ from omero.gateway import BlitzGateway
 import omero
 import re
 from omero.rtypes import rstring, rlong, rtime
+from omero.script_helpers.hierarchy import resolve_images
 
 # main and only function
 def generate_namelist(conn, script_params):
@@ -21,28 +22,18 @@ def generate_namelist(conn, script_params):
     objectCounter=0
     names=[]    # will contain the image names to be printed
 
-    # loop through all objects and get the names from the .listChildren()
-    # of the respective object hierarchy
+    # loop through all objects and get the image names of each object
+    # with a single query instead of walking the hierarchy
     for obj in objects:
 
-        if obj_type=='Dataset':
-            print("Image names for Dataset %s:"%(str(obj.getName())))
-            images=list(obj.listChildren())
-            for image in images:
-                name = image.getName()
-                image_id  = image.getId()
-                names.append([name,image_id])
-                imageCounter=imageCounter+1
-
-        if obj_type=='Plate':
-            print("Image names for Plate %s:" % (str(obj.getName())))
-            for well in obj.listChildren():
-                for wellsample in well.listChildren():
-                    img = wellsample.getImage()
-                    name = img.getName()
-                    image_id = image.getId()
-                    names.append([name, image_id])
-                    imageCounter = imageCounter + 1
+        print("Image names for %s %s:" % (obj_type, str(obj.getName())))
+        selection = resolve_images(conn, obj_type, [obj.getId()])
+        for name, image_id in zip(selection.names,
+                                  selection.image_ids.tolist()):
+            if image_id < 0:
+                continue    # empty well
+            names.append([name, image_id])
+            imageCounter = imageCounter + 1
 
         # a bit convoluted function to sort the names list naturally
         # which is needed for the .csv generation
@@ -13,10 +13,13 @@ All images are linked to a new Dataset and - if desired - the link to the origin
 import omero.scripts as scripts
 from omero.gateway import BlitzGateway
 import omero
-import ezomero as ez
 import re   # for sorting of list of images
 
 from omero.rtypes import rint, rlong, rstring, robject, unwrap
+from omero.script_helpers.hierarchy import resolve_images
+from omero.script_helpers.lazy import lazy_import
+
+ez = lazy_import("ezomero")
 
 
 def plate_to_dataset (conn, script_params):
@@ -27,13 +30,9 @@ def plate_to_dataset (conn, script_params):
        message = "No plate with this id found"
        return message
 
-    # loop through the plate/well/wellsample and generate a list of all images (ids)
-    image_list = []
-    for well in plate.listChildren():
-        for wellsample in well.listChildren():
-            image = wellsample.getImage()
-            image_list.append(image)
-    image_ids= [i.getId() for i in image_list]
+    # get the ids of all images in the plate with a single query
+    # instead of looping through the plate/well/wellsample
+    image_ids = resolve_images(conn, "Plate", [id]).unique_image_ids()
 
     # create a new Dataset
     if "Dataset_name" in script_params and len(script_params["Dataset_name"]) > 0:
@@ -46,7 +45,7 @@ def plate_to_dataset (conn, script_params):
     # link the images to the new Dataset
     ez.link_images_to_dataset(conn, image_ids, dataset_id)
 
-    message = "Linked %d image(s) to the new Dataset %s" % (len(image_list),dataset_name)
+    message = "Linked %d image(s) to the new Dataset %s" % (len(image_ids),dataset_name)
 
 
     return new_obj, message
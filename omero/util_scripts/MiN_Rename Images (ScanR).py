@@ -3,7 +3,6 @@
 
 import omero.scripts as scripts
 from omero.gateway import BlitzGateway
-import ezomero as ezom
 import omero
 import re
 import os
@@ -11,6 +10,10 @@ import time
 
 
 from omero.rtypes import rstring, rlong, rtime
+from omero.script_helpers.lazy import lazy_import
+
+ezom = lazy_import("ezomero")
+
 
 def rename_images(conn, script_params):
 
@@ -24,47 +24,16 @@ from omero.gateway import BlitzGateway
 from omero.rtypes import rstring, rlong
 import omero.scripts as scripts
 from omero.model.enums import UnitsLength
+from omero.script_helpers.hierarchy import resolve_images
+from omero.script_helpers.batch_writer import BatchWriter
 
 def get_images(conn, script_params):
     # returns a list of images
-    data_type = script_params["Data_Type"]
-    ids = script_params["IDs"]
-    images = []
-
-    if data_type=="Project":
-        projects = conn.getObjects("Project",ids)
-        for project in projects:
-            for dataset in project.listChildren():
-                for image in dataset.listChildren():
-                    images.append(image)
-
-    if data_type=="Dataset":
-        datasets = conn.getObjects("Dataset",ids)
-        for dataset in datasets:
-            for image in datasets.listChildren():
-                images.append(image)
-
-    if data_type=="Screen":
-        screens = conn.getObjects("Screen",ids)
-        for screen in screens:
-            for plate in screen.listChildren():
-                    for well in plate.listChildren():
-                        for ws in well.listChildren():
-                            image = ws.getImage()
-                            images.append(image)
-
-    if data_type=="Plate":
-        plates = conn.getObjects("Plate",ids)
-        for plate in plates:
-            for well in plate.listChildren():
-                for ws in well.listChildren():
-                    image = ws.getImage()
-                    images.append(image)
-
-    if data_type=="Image":
-        images = conn.getObjects("Image",ids)
-
-    return images
+    # all containers are resolved to their images with a single query
+    # instead of walking project/dataset or screen/plate/well/wellsample
+    selection = resolve_images(conn, script_params["Data_Type"],
+                               script_params["IDs"])
+    return selection.load_images(conn)
 
 def get_unit(script_params):
     # creates the correct Unit from a string
@@ -86,18 +55,19 @@ def get_unit(script_params):
 def set_pixel_value(conn, script_params):
     images = list(get_images(conn, script_params))
     numberOfImages = len(images)
-    counter = 0
-    for image in images:
-        unit = get_unit(script_params)
-        size = script_params["Pixel_Size"]
-        pixelSize = omero.model.LengthI(size, unit)
-        pixels = image.getPrimaryPixels()._obj
-        pixels.setPhysicalSizeX(pixelSize)
-        pixels.setPhysicalSizeY(pixelSize)
-        conn.getUpdateService().saveObject(pixels)
-        counter += 1
-
-    
+    # the pixels are saved in chunks, not one call per image
+    with BatchWriter(conn) as writer:
+        for image in images:
+            unit = get_unit(script_params)
+            size = script_params["Pixel_Size"]
+            pixelSize = omero.model.LengthI(size, unit)
+            pixels = image.getPrimaryPixels()._obj
+            pixels.setPhysicalSizeX(pixelSize)
+            pixels.setPhysicalSizeY(pixelSize)
+            writer.add(pixels)
+    print(writer.report())
+    counter = writer.saved
+
     return numberOfImages, counter
 
 
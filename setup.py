@@ -84,6 +84,7 @@ setup(
         'omero.export_scripts',
         'omero.figure_scripts',
         'omero.import_scripts',
+        'omero.script_helpers',
         'omero.util_scripts'],
     description="OMERO scripts",
     long_description=read('README.rst'),
@@ -110,4 +111,10 @@ setup(
     cmdclass={'test': PyTest},
     python_requires='>=3',
     tests_require=['pytest'],
+    extras_require={'yaml': ['PyYAML']},
+    entry_points={
+        'console_scripts': [
+            'omero-scripts-batch = omero.script_helpers.batch_runner:main',
+        ],
+    },
 )
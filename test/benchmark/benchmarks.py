@@ -0,0 +1,393 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2024 University of Muenster. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Offline benchmarks of the scripts against the in-memory fake server.
+
+Each benchmark populates a :class:`fake_gateway.FakeServer` for a given data
+size, then calls the script's main function (not ``run_script()``) with a
+:class:`fake_gateway.FakeGateway`. Setup is neither timed nor counted.
+
+Usage::
+
+    python test/benchmark/benchmarks.py
+    python test/benchmark/benchmarks.py --size small --size large \\
+        --only batch_image_export --json results.json
+    python test/benchmark/benchmarks.py --only batch_roi_export --trace
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+import fake_gateway as fake  # noqa: E402
+from omero.script_helpers.call_trace import CallTrace  # noqa: E402
+from omero.script_helpers.instrumentation import Timings  # noqa: E402
+
+SCRIPTS = os.path.join(HERE, "..", "..", "omero")
+
+# Data sizes. images: images per run; wells: images turned into wells by
+# datasets_to_plates; rois: ROIs per image.
+SIZES = OrderedDict([
+    ("small", dict(images=2, size_xy=128, size_z=3, size_c=2, size_t=3,
+                   wells=8, rois=2)),
+    ("medium", dict(images=6, size_xy=512, size_z=5, size_c=3, size_t=5,
+                    wells=48, rois=4)),
+    ("large", dict(images=12, size_xy=1024, size_z=8, size_c=3, size_t=8,
+                   wells=192, rois=8)),
+])
+
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(name, script_path):
+    """
+    Register a benchmark. The decorated function is called with
+    (server, script_module, size) and returns a callable taking the
+    connection, which runs the script.
+    """
+    def register(func):
+        BENCHMARKS[name] = (script_path, func)
+        return func
+    return register
+
+
+_modules = {}
+
+
+def load_script(script_path):
+    """Import a script by path (several have spaces in their names)."""
+    if script_path not in _modules:
+        path = os.path.join(SCRIPTS, script_path)
+        name = "bench_" + os.path.splitext(
+            os.path.basename(path))[0].replace(" ", "_").replace("(", "") \
+            .replace(")", "")
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _modules[script_path] = module
+    return _modules[script_path]
+
+
+class BenchmarkResult(object):
+
+    def __init__(self, name, size, seconds, log, error=None, trace=None):
+        self.name = name
+        self.size = size
+        self.seconds = seconds
+        self.calls = log.total
+        self.bytes_down = log.bytes_down
+        self.bytes_up = log.bytes_up
+        self.rows = log.rows
+        self.by_call = dict(log.calls)
+        self.error = error
+        self.trace = trace
+
+    def top_calls(self, n=3):
+        ranked = sorted(self.by_call.items(), key=lambda kv: -kv[1])
+        return ranked[:n]
+
+    def as_dict(self):
+        return {'name': self.name, 'size': self.size,
+                'seconds': self.seconds, 'calls': self.calls,
+                'bytes_down': self.bytes_down, 'bytes_up': self.bytes_up,
+                'rows': self.rows, 'by_call': self.by_call,
+                'error': self.error}
+
+
+def run_benchmark(name, size_name, latency=0, trace=False):
+    """
+    Run one benchmark in a scratch directory and return its result.
+    latency is added to every server call, in seconds. If trace is True,
+    the result's trace ranks the call sites of the script.
+    """
+    script_path, setup = BENCHMARKS[name]
+    size = SIZES[size_name]
+    script = load_script(script_path)
+    server = fake.FakeServer(latency)
+    conn = fake.FakeGateway(server)
+    run = setup(server, script, size)
+    call_trace = None
+    if trace:
+        call_trace = CallTrace(skip=("fake_gateway",))
+        Timings(call_trace).watch(conn)
+    server.log.reset()
+    cwd = os.getcwd()
+    scratch = tempfile.mkdtemp(prefix="omero-bench-")
+    error = None
+    try:
+        os.chdir(scratch)
+        start = time.perf_counter()
+        try:
+            run(conn)
+        except SystemExit as exc:
+            error = "SystemExit(%s)" % exc.code
+        seconds = time.perf_counter() - start
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(scratch, ignore_errors=True)
+    return BenchmarkResult(name, size_name, seconds, server.log, error,
+                           call_trace)
+
+
+# ---------------------------------------------------------------------------
+# Population helpers
+# ---------------------------------------------------------------------------
+
+def populate_images(server, size, dataset_id=None, name="image"):
+    return [server.add_image(
+        "%s_%02d.tif" % (name, i), size['size_xy'], size['size_xy'],
+        size['size_z'], size['size_c'], size['size_t'],
+        dataset_id=dataset_id, physical_size=0.5)
+        for i in range(size['images'])]
+
+
+def line_rois(server, image_id, size):
+    xy = size['size_xy']
+    for r in range(size['rois']):
+        y = (r + 1) * xy // (size['rois'] + 1)
+        server.add_roi(image_id, [fake.line(5, y, xy - 5, y + 3, z=0)])
+    points = [(5, 5), (xy // 2, xy // 3), (xy - 5, xy // 2)]
+    server.add_roi(image_id, [fake.polyline(points, z=0)])
+
+
+# ---------------------------------------------------------------------------
+# Benchmarks
+# ---------------------------------------------------------------------------
+
+@benchmark("batch_image_export", "export_scripts/Batch_Image_Export.py")
+def bench_batch_image_export(server, script, size):
+    ids = populate_images(server, size)
+    params = {
+        "Data_Type": "Image", "IDs": ids,
+        "Export_Individual_Channels": True,
+        "Individual_Channels_Grey": False,
+        "Export_Merged_Image": True,
+        "Choose_Z_Section": "ALL Z planes",
+        "Choose_T_Section": "Default-T (last-viewed)",
+        "Zoom": "100%", "Format": "PNG",
+        "Folder_Name": "Batch_Image_Export"}
+    return lambda conn: script.batch_image_export(conn, params)
+
+
+@benchmark("batch_roi_export", "export_scripts/Batch_ROI_Export.py")
+def bench_batch_roi_export(server, script, size):
+    plate_id = server.add_plate("roi_export")
+    xy = size['size_xy']
+    for i in range(size['wells']):
+        iid = server.add_image("well_%03d.tif" % i, xy, xy,
+                               physical_size=0.5)
+        server.add_roi(iid, [fake.rectangle(2, 2, xy // 4, xy // 4)])
+        server.add_roi(iid, [fake.line(5, 5, xy - 5, xy // 2)])
+        server.add_well(plate_id, i // 12, i % 12, [iid])
+    params = {"Data_Type": "Plate", "IDs": [plate_id], "Channels": [1],
+              "Export_All_Planes": False, "Include_Points_Coords": False,
+              "File_Name": "Batch_ROI_Export"}
+    return lambda conn: script.batch_roi_export(conn, params)
+
+
+@benchmark("make_images_from_rois", "util_scripts/Images_From_ROIs.py")
+def bench_make_images_from_rois(server, script, size):
+    did = server.add_dataset("rois")
+    ids = populate_images(server, size, dataset_id=did)
+    xy = size['size_xy']
+    for iid in ids:
+        for r in range(size['rois']):
+            offset = r * xy // (2 * size['rois'])
+            server.add_roi(iid, [fake.rectangle(offset, offset, xy // 2,
+                                                xy // 2)])
+    params = {"Data_Type": "Image", "IDs": ids,
+              "Container_Name": "From_ROIs", "Make_Image_Stack": False,
+              "Tile_Size": 1024}
+    return lambda conn: script.make_images_from_rois(conn, params)
+
+
+@benchmark("datasets_to_plates", "util_scripts/Dataset_To_Plate.py")
+def bench_datasets_to_plates(server, script, size):
+    did = server.add_dataset("plate_source")
+    for i in range(size['wells']):
+        server.add_image("well_%03d.tif" % i, 16, 16, dataset_id=did)
+    params = {"Data_Type": "Dataset", "IDs": [did],
+              "First_Axis": "column", "First_Axis_Count": 12,
+              "Column_Names": "number", "Row_Names": "letter",
+              "Images_Per_Well": 1, "Screen": "bench_screen",
+              "Remove_From_Dataset": True}
+    return lambda conn: script.datasets_to_plates(conn, params)
+
+
+@benchmark("keyval_from_csv", "annotation_scripts/KeyVal_from_csv.py")
+def bench_keyval_from_csv(server, script, size):
+    did = server.add_dataset("kv")
+    rows = ["image,condition,dose,replicate"]
+    for i in range(size['wells']):
+        name = "kv_%03d.tif" % i
+        server.add_image(name, 16, 16, dataset_id=did)
+        rows.append("%s,cond%d,%d,%d" % (name, i % 4, i * 10, i % 3))
+    server.add_file_annotation("Dataset", did, "metadata.csv",
+                               "\n".join(rows) + "\n", mimetype="text/csv")
+    params = {"Data_Type": "Dataset", "IDs": [did]}
+    return lambda conn: script.keyval_from_csv(conn, params)
+
+
+@benchmark("set_pixelsize_plate", "util_scripts/MiN_Set_Pixelsize.py")
+def bench_set_pixelsize_plate(server, script, size):
+    plate_id = server.add_plate("pixelsize")
+    for i in range(size['wells']):
+        ids = [server.add_image("well_%03d_%d.tif" % (i, f), 16, 16)
+               for f in range(2)]
+        server.add_well(plate_id, i // 12, i % 12, ids)
+    params = {"Data_Type": "Plate", "IDs": [plate_id], "Pixel_Size": 0.65,
+              "Unit": "MICROMETER"}
+    return lambda conn: script.set_pixel_value(conn, params)
+
+
+@benchmark("combine_images", "util_scripts/Combine_Images.py")
+def bench_combine_images(server, script, size):
+    did = server.add_dataset("combine")
+    for c in range(size['size_c']):
+        for t in range(size['size_t']):
+            server.add_image("cell_C%d_T%d.tif" % (c, t), size['size_xy'],
+                             size['size_xy'], size['size_z'],
+                             dataset_id=did)
+    params = {"Data_Type": "Dataset", "IDs": [did],
+              "Channel_Name_Pattern": "_C", "Time_Name_Pattern": "_T",
+              "Z_Name_Pattern": "None (single z section)"}
+    return lambda conn: script.combine_images(conn, params)
+
+
+@benchmark("write_movie", "export_scripts/Make_Movie.py")
+def bench_write_movie(server, script, size):
+    iid = server.add_image("movie.tif", size['size_xy'], size['size_xy'],
+                           size['size_z'], size['size_c'],
+                           size['size_t'] * 2, physical_size=0.5)
+    params = {"Data_Type": "Image", "IDs": [iid], "RenderingDef_ID": -1,
+              "Z_Start": 0, "Z_End": 0, "T_Start": 0,
+              "T_End": size['size_t'] * 2 - 1, "Show_Time": True,
+              "Show_Plane_Info": True, "FPS": 2, "Scalebar": 10,
+              "Format": "MPEG", "Overlay_Colour": "White",
+              "Canvas_Colour": "Black", "Min_Width": -1,
+              "Min_Height": -1, "Intro_Duration": 3, "Ending_Duration": 3,
+              "Do_Link": True}
+    return lambda conn: script.write_movie(params, conn)
+
+
+@benchmark("split_view_figure", "figure_scripts/Split_View_Figure.py")
+def bench_split_view_figure(server, script, size):
+    # the panels only: the labels need PIL's pre-10 font API
+    ids = populate_images(server, size, name="split")
+    pixel_ids = [server.get("Image", iid).getPrimaryPixels().id.val
+                 for iid in ids]
+    channels = list(range(size['size_c']))
+    names = dict((c, "ch%d" % c) for c in channels)
+    return lambda conn: script.get_split_view(
+        conn, pixel_ids, 0, size['size_z'] - 1, channels, names, True,
+        channels, {}, 128, 128)
+
+
+@benchmark("kymograph", "analysis_scripts/Kymograph.py")
+def bench_kymograph(server, script, size):
+    did = server.add_dataset("kymo")
+    ids = populate_images(server, size, dataset_id=did, name="kymo")
+    for iid in ids:
+        line_rois(server, iid, size)
+    params = {"Data_Type": "Image", "IDs": ids, "Line_Width": 4,
+              "Use_All_Timepoints": True}
+    return lambda conn: script.process_images(conn, params)
+
+
+@benchmark("plot_profile", "analysis_scripts/Plot_Profile.py")
+def bench_plot_profile(server, script, size):
+    ids = populate_images(server, size, name="profile")
+    for iid in ids:
+        line_rois(server, iid, size)
+    params = {"Data_Type": "Image", "IDs": ids, "Line_Width": 2,
+              "Sum_or_Average": "Average"}
+    return lambda conn: script.process_images(conn, params)
+
+
+# ---------------------------------------------------------------------------
+# Reporting
+# ---------------------------------------------------------------------------
+
+def human_bytes(n):
+    if n < 1024:
+        return "%d B" % n
+    for unit in ("kB", "MB"):
+        n /= 1024.0
+        if n < 1024:
+            return "%.1f %s" % (n, unit)
+    return "%.1f GB" % (n / 1024.0)
+
+
+def format_table(results):
+    header = "%-24s %-7s %9s %8s %8s %11s %11s  %s" % (
+        "benchmark", "size", "seconds", "calls", "rows", "down", "up",
+        "top calls")
+    lines = [header, "-" * len(header)]
+    for r in results:
+        top = ", ".join("%s=%d" % kv for kv in r.top_calls())
+        if r.error:
+            top = "%s [%s]" % (top, r.error)
+        lines.append("%-24s %-7s %9.3f %8d %8d %11s %11s  %s" % (
+            r.name, r.size, r.seconds, r.calls, r.rows,
+            human_bytes(r.bytes_down), human_bytes(r.bytes_up), top))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--size", action="append", choices=list(SIZES),
+                        help="data size(s) to run (default: all)")
+    parser.add_argument("--only", action="append", choices=list(BENCHMARKS),
+                        help="benchmark(s) to run (default: all)")
+    parser.add_argument("--latency", type=float, default=0,
+                        help="milliseconds added to every server call")
+    parser.add_argument("--trace", action="store_true",
+                        help="list the most expensive call sites")
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args(argv)
+
+    results = []
+    for name in args.only or BENCHMARKS:
+        for size in args.size or SIZES:
+            results.append(run_benchmark(name, size,
+                                         args.latency / 1000.0, args.trace))
+            print(format_table(results[-1:]).splitlines()[-1])
+            if results[-1].trace is not None:
+                print(results[-1].trace.report())
+    print("")
+    print(format_table(results))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([r.as_dict() for r in results], f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,2574 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2024 University of Muenster. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+In-memory stand-in for an OMERO server and the Blitz Gateway.
+
+Lets the scripts run offline against synthetic data so that their cost can
+be measured without a server. The model objects handed to the scripts are
+real ``omero.model`` objects; the services (Query, Update, Roi, Pixels,
+RenderingEngine, RawPixelsStore, RawFileStore, Thumbnail) are fakes that
+keep everything in memory and record every call in a :class:`CallLog`, so a
+benchmark can report the number of server round-trips and the number of
+pixel and file bytes moved in each direction.
+
+Only what the scripts in this repository use is implemented. Unknown HQL
+raises ``omero.QueryException`` instead of silently returning nothing, so a
+script that starts issuing a new query fails loudly until a handler is added
+with :meth:`FakeServer.add_query_handler`.
+"""
+
+import datetime
+import itertools
+import os
+import re
+import threading
+import time
+from collections import Counter
+from io import BytesIO
+
+import numpy
+
+import omero
+import omero.gateway
+from omero.gateway import (AnnotationWrapper, BlitzObjectWrapper,
+                           ColorHolder, OriginalFileWrapper)
+from omero.gateway.utils import ServiceOptsDict
+from omero.rtypes import rbool, rdouble, rint, rlong, rstring, unwrap
+
+MICROMETER = getattr(omero.model.enums.UnitsLength, "MICROMETER")
+
+# largest plane the fake serves without a pyramid, as on a default server
+MAX_PLANE_SIZE = (3192, 3192)
+# tile edge used for pyramidal images
+PYRAMID_TILE = 512
+
+OMERO_NUMPY_TYPES = {
+    'int8': 'int8', 'uint8': 'uint8', 'int16': 'int16',
+    'uint16': 'uint16', 'int32': 'int32', 'uint32': 'uint32',
+    'float': 'float32', 'double': 'float64'}
+NUMPY_OMERO_TYPES = dict((v, k) for k, v in OMERO_NUMPY_TYPES.items())
+
+# the fake server lives in this process, so the scripts cannot spread their
+# images over worker processes that join its session
+os.environ.setdefault("OMERO_SCRIPTS_IMAGE_WORKERS", "1")
+# panels cached on disk by an earlier run would hide the rendering that
+# the benchmarks measure
+os.environ.setdefault("OMERO_SCRIPTS_PANEL_CACHE_MB", "0")
+
+
+class CallLog(object):
+    """
+    Counts calls made on the fake services and the bytes they moved.
+
+    Keys are ``"<service>.<method>"``, e.g. ``"query.findAllByQuery"``.
+    ``bytes_down`` is pixel, rendered and file data sent to the client,
+    ``bytes_up`` is pixel and file data sent to the server. ``rows`` is
+    the number of objects the queries and loading calls returned. ``latency``
+    is slept on every call, to measure scripts that overlap round-trips.
+    """
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.calls = Counter()
+        self.bytes_down = 0
+        self.bytes_up = 0
+        self.rows = 0
+
+    def record(self, service, method, down=0, up=0, rows=0):
+        with self._lock:
+            self.calls["%s.%s" % (service, method)] += 1
+            self.bytes_down += down
+            self.bytes_up += up
+            self.rows += rows
+        if self.latency:
+            time.sleep(self.latency)
+
+    @property
+    def total(self):
+        return sum(self.calls.values())
+
+    def count(self, prefix):
+        """Number of calls whose key starts with prefix."""
+        return sum(n for k, n in self.calls.items() if k.startswith(prefix))
+
+    def snapshot(self):
+        return {'calls': self.total,
+                'bytes_down': self.bytes_down,
+                'bytes_up': self.bytes_up,
+                'rows': self.rows,
+                'by_call': dict(self.calls)}
+
+
+def synthetic_plane(size_x, size_y, dtype, seed, z, c, t):
+    """
+    Deterministic test pattern for one plane: gradients that depend on z and
+    c, a checkerboard that moves with t, scaled to a 12-bit range (or 8-bit
+    for byte images).
+    """
+    yy, xx = numpy.ogrid[0:size_y, 0:size_x]
+    plane = (xx * (c + 1) + yy * (z + 1) + seed * 97 +
+             ((xx // 16 + yy // 16 + t) % 4) * 150)
+    dtype = numpy.dtype(dtype)
+    top = 255 if dtype.itemsize == 1 else 4095
+    return (plane % (top + 1)).astype(dtype)
+
+
+def _omero_error(message):
+    return omero.QueryException(None, None, message)
+
+
+def _param(params, name, default=None):
+    """Unwrap one named value from omero.sys.Parameters (or None)."""
+    if params is None or params.map is None or name not in params.map:
+        return default
+    return unwrap(params.map[name])
+
+
+def _class_name(obj):
+    """'DatasetImageLinkI' -> 'DatasetImageLink'."""
+    name = obj.__class__.__name__
+    return name[:-1] if name.endswith("I") else name
+
+
+def _ids(obj_or_id):
+    if hasattr(obj_or_id, 'id'):
+        return unwrap(obj_or_id.id)
+    return obj_or_id
+
+
+def _hex_to_rgba(color):
+    color = color.lstrip('#')
+    if len(color) == 6:
+        color += "FF"
+    return tuple(int(color[i:i + 2], 16) for i in range(0, 8, 2))
+
+
+class ChannelSettings(object):
+    """Rendering settings for one channel, as held by a rendering def."""
+
+    def __init__(self, label, rgba, start, end, active=True,
+                 family='linear'):
+        self.label = label
+        self.rgba = tuple(rgba)
+        self.start = float(start)
+        self.end = float(end)
+        self.active = active
+        # not applied by the fake renderer
+        self.family = family
+
+    def copy(self):
+        return ChannelSettings(self.label, self.rgba, self.start, self.end,
+                               self.active, self.family)
+
+    def as_model(self):
+        binding = omero.model.ChannelBindingI()
+        binding.inputStart = rdouble(self.start)
+        binding.inputEnd = rdouble(self.end)
+        binding.red, binding.green, binding.blue, binding.alpha = \
+            [rint(v) for v in self.rgba]
+        binding.active = rbool(self.active)
+        family = omero.model.FamilyI()
+        family.value = rstring(self.family)
+        binding.family = family
+        binding.coefficient = rdouble(1.0)
+        binding.noiseReduction = rbool(False)
+        return binding
+
+
+class RenderingDef(object):
+    """Minimal rendering def: channel settings, model and default Z/T."""
+
+    def __init__(self, rdef_id, channels, default_z=0, default_t=0):
+        self.id = rdef_id
+        self.channels = channels
+        self.model = 'rgb'
+        self.default_z = default_z
+        self.default_t = default_t
+        # bumped on every save, stands in for the update event
+        self.version = 1
+
+    def copy(self):
+        rdef = RenderingDef(self.id, [c.copy() for c in self.channels],
+                            self.default_z, self.default_t)
+        rdef.model = self.model
+        rdef.version = self.version
+        return rdef
+
+    def as_model(self, pixels):
+        """The settings as a loaded omero.model.RenderingDef."""
+        rdef = omero.model.RenderingDefI(self.id, True)
+        rdef.pixels = pixels
+        rdef.defaultZ = rint(self.default_z)
+        rdef.defaultT = rint(self.default_t)
+        model = omero.model.RenderingModelI()
+        model.value = rstring(self.model)
+        rdef.model = model
+        quantum = omero.model.QuantumDefI()
+        quantum.cdStart = rint(0)
+        quantum.cdEnd = rint(255)
+        quantum.bitResolution = rint(255)
+        rdef.quantization = quantum
+        for ch in self.channels:
+            rdef.addChannelBinding(ch.as_model())
+        return rdef
+
+
+DEFAULT_COLORS = [(255, 0, 0, 255), (0, 255, 0, 255), (0, 0, 255, 255),
+                  (255, 0, 255, 255), (0, 255, 255, 255), (255, 255, 0, 255)]
+
+
+class FakeServer(object):
+    """
+    Holds all objects, links, pixel data and rendering settings.
+
+    Populate it with the ``add_*`` methods (which do not count as calls) and
+    hand a :class:`FakeGateway` to the script under test.
+    """
+
+    def __init__(self, latency=0):
+        self.log = CallLog(latency)
+        self._next_id = itertools.count(1)
+        self.objects = {}           # class name -> {id: model object}
+        self._children = {}         # link kind -> {parent id: [link id]}
+        self._parents = {}          # link kind -> {child id: [link id]}
+        self._link_index = {}       # link id -> (kind, parent id, child id)
+        self._plate_wells = {}      # plate id -> [well id]
+        self.pixels = {}            # pixels id -> PixelsI
+        self.planes = {}            # pixels id -> {(z, c, t): ndarray}
+        self.seeds = {}             # pixels id -> synthetic data seed
+        self.rdefs = {}             # pixels id -> RenderingDef
+        self.files = {}             # original file id -> bytes
+        self.rois = {}              # image id -> [RoiI]
+        self.max_plane_size = MAX_PLANE_SIZE
+        self._queries = []
+        self._install_default_queries()
+
+    # -- bookkeeping ---------------------------------------------------
+
+    def new_id(self):
+        return next(self._next_id)
+
+    def store(self, obj):
+        """Give obj an ID if needed and keep it under its class name."""
+        if obj.id is None:
+            obj.setId(rlong(self.new_id()))
+        details = obj.details
+        if details is not None and getattr(details, "owner", None) is None:
+            # owned by the gateway's user, as the server records
+            details.owner = omero.model.ExperimenterI(0, False)
+        cls = _class_name(obj)
+        self.objects.setdefault(cls, {})[obj.id.val] = obj
+        if cls.endswith("Annotation"):
+            self.objects.setdefault("Annotation", {})[obj.id.val] = obj
+        return obj
+
+    def get(self, cls, oid):
+        return self.objects.get(cls, {}).get(oid)
+
+    def find(self, cls, oid):
+        """Look up an object by class name, with or without the I."""
+        if cls not in self.objects and cls.endswith("I"):
+            cls = cls[:-1]
+        obj = self.get(cls, oid)
+        if obj is None and cls == "Shape":
+            for rois in self.rois.values():
+                for roi in rois:
+                    for shape in roi.copyShapes():
+                        if shape.id.val == oid:
+                            return shape
+        return obj
+
+    def add_link(self, kind, parent_id, child_id, link=None):
+        link_id = link.id.val if link is not None else self.new_id()
+        self._children.setdefault(kind, {}).setdefault(
+            parent_id, []).append(link_id)
+        self._parents.setdefault(kind, {}).setdefault(
+            child_id, []).append(link_id)
+        self._link_index[link_id] = (kind, parent_id, child_id)
+        return link_id
+
+    def children(self, kind, parent_id):
+        links = self._children.get(kind, {}).get(parent_id, [])
+        return [self._link_index[link][2] for link in links]
+
+    def parents(self, kind, child_id):
+        links = self._parents.get(kind, {}).get(child_id, [])
+        return [self._link_index[link][1] for link in links]
+
+    def parent_links(self, kind, child_id):
+        return list(self._parents.get(kind, {}).get(child_id, []))
+
+    def link_object(self, link_id):
+        kind = self._link_index[link_id][0]
+        return self.get("%sLink" % kind, link_id)
+
+    def remove_link(self, link_id):
+        if link_id not in self._link_index:
+            return
+        kind, parent_id, child_id = self._link_index.pop(link_id)
+        self._children[kind][parent_id].remove(link_id)
+        self._parents[kind][child_id].remove(link_id)
+        self.objects.get("%sLink" % kind, {}).pop(link_id, None)
+
+    def delete(self, cls, oid):
+        """Delete an object together with the links that point at it."""
+        if cls.endswith("Link"):
+            self.remove_link(oid)
+            return
+        for kind in list(self._parents):
+            if kind.endswith("Annotation") and cls.endswith("Annotation"):
+                for link_id in list(self._parents[kind].get(oid, [])):
+                    self.remove_link(link_id)
+        obj = self.objects.get(cls, {}).pop(oid, None)
+        if obj is None and cls == "Annotation":
+            for name, objs in self.objects.items():
+                if name.endswith("Annotation") and oid in objs:
+                    objs.pop(oid)
+        self.objects.get("Annotation", {}).pop(oid, None)
+
+    def wells(self, plate_id):
+        return [self.get("Well", w) for w in self._plate_wells.get(plate_id,
+                                                                   [])]
+
+    # -- populating ----------------------------------------------------
+
+    def add_project(self, name):
+        project = omero.model.ProjectI()
+        project.name = rstring(name)
+        return self.store(project).id.val
+
+    def add_dataset(self, name, project_id=None):
+        dataset = omero.model.DatasetI()
+        dataset.name = rstring(name)
+        did = self.store(dataset).id.val
+        if project_id is not None:
+            self._save_link("ProjectDataset", project_id, did)
+        return did
+
+    def add_screen(self, name):
+        screen = omero.model.ScreenI()
+        screen.name = rstring(name)
+        return self.store(screen).id.val
+
+    def add_plate(self, name, screen_id=None):
+        plate = omero.model.PlateI()
+        plate.name = rstring(name)
+        plate.columnNamingConvention = rstring("number")
+        plate.rowNamingConvention = rstring("letter")
+        pid = self.store(plate).id.val
+        if screen_id is not None:
+            self._save_link("ScreenPlate", screen_id, pid)
+        return pid
+
+    def add_well(self, plate_id, row, column, image_ids=()):
+        well = omero.model.WellI()
+        well.plate = omero.model.PlateI(plate_id, False)
+        well.row = rint(row)
+        well.column = rint(column)
+        for iid in image_ids:
+            ws = omero.model.WellSampleI()
+            ws.image = omero.model.ImageI(iid, False)
+            ws.well = well
+            well.addWellSample(ws)
+        return self._save_well(well).id.val
+
+    def add_image(self, name, size_x=64, size_y=64, size_z=1, size_c=1,
+                  size_t=1, pixels_type='uint16', dataset_id=None,
+                  physical_size=None, channel_names=None, description=None):
+        """Create an Image backed by synthetic pixel data."""
+        image = omero.model.ImageI()
+        image.name = rstring(name)
+        if description is not None:
+            image.description = rstring(description)
+        self.store(image)
+        pixels = omero.model.PixelsI()
+        pixels.sizeX = rint(size_x)
+        pixels.sizeY = rint(size_y)
+        pixels.sizeZ = rint(size_z)
+        pixels.sizeC = rint(size_c)
+        pixels.sizeT = rint(size_t)
+        ptype = omero.model.PixelsTypeI()
+        ptype.value = rstring(pixels_type)
+        ptype.bitSize = rint(numpy.dtype(
+            OMERO_NUMPY_TYPES[pixels_type]).itemsize * 8)
+        pixels.pixelsType = ptype
+        if physical_size is not None:
+            pixels.physicalSizeX = omero.model.LengthI(physical_size,
+                                                       MICROMETER)
+            pixels.physicalSizeY = omero.model.LengthI(physical_size,
+                                                       MICROMETER)
+        pixels.image = omero.model.ImageI(image.id.val, False)
+        self.store(pixels)
+        image.addPixels(pixels)
+        pid = pixels.id.val
+        self.pixels[pid] = pixels
+        self.planes[pid] = {}
+        self.seeds[pid] = image.id.val
+        for c in range(size_c):
+            channel = omero.model.ChannelI()
+            lc = omero.model.LogicalChannelI()
+            if channel_names and c < len(channel_names):
+                lc.name = rstring(channel_names[c])
+            self.store(lc)
+            channel.logicalChannel = lc
+            r, g, b, a = DEFAULT_COLORS[c % len(DEFAULT_COLORS)]
+            channel.red, channel.green = rint(r), rint(g)
+            channel.blue, channel.alpha = rint(b), rint(a)
+            channel.pixels = omero.model.PixelsI(pid, False)
+            self.store(channel)
+            pixels.addChannel(channel)
+        self.reset_rdef(pid)
+        if dataset_id is not None:
+            self._save_link("DatasetImage", dataset_id, image.id.val)
+        return image.id.val
+
+    def add_roi(self, image_id, shapes, name=None):
+        roi = omero.model.RoiI()
+        roi.image = omero.model.ImageI(image_id, False)
+        if name is not None:
+            roi.name = rstring(name)
+        self.store(roi)
+        for shape in shapes:
+            self.store(shape)
+            roi.addShape(shape)
+        self.rois.setdefault(image_id, []).append(roi)
+        return roi.id.val
+
+    def add_file_annotation(self, parent_type, parent_id, name, data,
+                            ns=None, mimetype="text/plain"):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        orig = omero.model.OriginalFileI()
+        orig.name = rstring(name)
+        orig.path = rstring("")
+        orig.size = rlong(len(data))
+        orig.mimetype = rstring(mimetype)
+        self.store(orig)
+        self.files[orig.id.val] = data
+        ann = omero.model.FileAnnotationI()
+        ann.file = orig
+        if ns is not None:
+            ann.ns = rstring(ns)
+        self.store(ann)
+        self._save_link("%sAnnotation" % parent_type, parent_id, ann.id.val,
+                        ann)
+        return ann.id.val
+
+    def add_map_annotation(self, parent_type, parent_id, key_values, ns=None):
+        ann = omero.model.MapAnnotationI()
+        ann.setMapValue([omero.model.NamedValue(str(k), str(v))
+                         for k, v in key_values])
+        if ns is not None:
+            ann.ns = rstring(ns)
+        self.store(ann)
+        self._save_link("%sAnnotation" % parent_type, parent_id, ann.id.val,
+                        ann)
+        return ann.id.val
+
+    def _save_link(self, kind, parent_id, child_id, child=None):
+        link = getattr(omero.model, "%sLinkI" % kind)()
+        parent_cls = re.match(r"[A-Z][a-z]*", kind).group(0)
+        link.parent = getattr(omero.model, "%sI" % parent_cls)(parent_id,
+                                                               False)
+        if child is None:
+            child_cls = kind[len(parent_cls):]
+            child = getattr(omero.model, "%sI" % child_cls)(child_id, False)
+        link.child = child
+        self.store(link)
+        self.add_link(kind, parent_id, child_id, link)
+        return link
+
+    # -- persisting what the scripts save --------------------------------
+
+    def persist(self, obj):
+        """Apply a saveObject() of obj, including new links and wells."""
+        cls = _class_name(obj)
+        if cls == "Well":
+            return self._save_well(obj)
+        if cls.endswith("Link"):
+            for end in (obj.parent, obj.child):
+                if end is not None and end.id is None:
+                    self.persist(end)
+            new = obj.id is None
+            self.store(obj)
+            if new:
+                kind = cls[:-len("Link")]
+                self.add_link(kind, obj.parent.id.val, obj.child.id.val, obj)
+            return obj
+        if cls == "Pixels" and obj.id is not None:
+            stored = self.pixels.get(obj.id.val)
+            if stored is not None and stored is not obj:
+                for attr in ("physicalSizeX", "physicalSizeY",
+                             "physicalSizeZ", "timeIncrement"):
+                    value = getattr(obj, "_%s" % attr, None)
+                    if value is not None:
+                        setattr(stored, "_%s" % attr, value)
+                return stored
+        if cls == "FileAnnotation" and obj.file is not None and \
+                obj.file.id is None:
+            self.persist(obj.file)
+        if obj.id is not None:
+            stored = self.find(cls, obj.id.val)
+            if stored is not None and stored is not obj and obj.isLoaded():
+                self.objects[cls][obj.id.val] = obj
+                if cls.endswith("Annotation"):
+                    self.objects["Annotation"][obj.id.val] = obj
+            if cls == "Channel":
+                self._channel_color_changed(obj)
+        return self.store(obj)
+
+    def _channel_color_changed(self, channel):
+        pixels = self.pixels.get(unwrap(channel.pixels.id)) \
+            if channel.pixels is not None else None
+        if pixels is None:
+            return
+        for c, ch in enumerate(pixels.copyChannels()):
+            if ch.id.val == channel.id.val and ch is not channel:
+                pixels.setChannel(c, channel)
+
+    def _save_well(self, well):
+        new = well.id is None
+        self.store(well)
+        if new:
+            plate_id = well.plate.id.val
+            self._plate_wells.setdefault(plate_id, []).append(well.id.val)
+        for ws in well.copyWellSamples():
+            self.store(ws)
+        return well
+
+    # -- pixel data ----------------------------------------------------
+
+    def numpy_type(self, pixels_id):
+        ptype = self.pixels[pixels_id].pixelsType.value.val
+        return OMERO_NUMPY_TYPES[ptype]
+
+    def plane(self, pixels_id, z, c, t):
+        """Full plane as a native-endian ndarray."""
+        stored = self.planes[pixels_id].get((z, c, t))
+        if stored is not None:
+            return stored
+        pixels = self.pixels[pixels_id]
+        size_x, size_y = pixels.sizeX.val, pixels.sizeY.val
+        seed = self.seeds.get(pixels_id)
+        if seed is None:
+            # created by a script but never written
+            return numpy.zeros((size_y, size_x),
+                               dtype=self.numpy_type(pixels_id))
+        return synthetic_plane(size_x, size_y, self.numpy_type(pixels_id),
+                               seed, z, c, t)
+
+    def tile(self, pixels_id, z, c, t, x, y, w, h, level=0):
+        """
+        Region of a plane. level counts down from full resolution, so
+        level=1 is the 2x downsampled pyramid level.
+        """
+        step = 2 ** level
+        plane = self.plane(pixels_id, z, c, t)
+        if step > 1:
+            plane = plane[::step, ::step]
+        return plane[y:y + h, x:x + w]
+
+    def set_tile(self, pixels_id, z, c, t, x, y, data):
+        pixels = self.pixels[pixels_id]
+        key = (z, c, t)
+        if key not in self.planes[pixels_id]:
+            self.planes[pixels_id][key] = numpy.zeros(
+                (pixels.sizeY.val, pixels.sizeX.val),
+                dtype=self.numpy_type(pixels_id))
+        h, w = data.shape
+        self.planes[pixels_id][key][y:y + h, x:x + w] = data
+
+    def requires_pyramid(self, pixels_id):
+        pixels = self.pixels[pixels_id]
+        max_w, max_h = self.max_plane_size
+        return pixels.sizeX.val * pixels.sizeY.val > max_w * max_h
+
+    def resolution_levels(self, pixels_id):
+        if not self.requires_pyramid(pixels_id):
+            return 1
+        pixels = self.pixels[pixels_id]
+        size = max(pixels.sizeX.val, pixels.sizeY.val)
+        levels = 1
+        while size > PYRAMID_TILE:
+            size = (size + 1) // 2
+            levels += 1
+        return levels
+
+    def resolution_descriptions(self, pixels_id):
+        pixels = self.pixels[pixels_id]
+        descriptions = []
+        for level in range(self.resolution_levels(pixels_id)):
+            step = 2 ** level
+            d = omero.api.ResolutionDescription()
+            d.sizeX = (pixels.sizeX.val + step - 1) // step
+            d.sizeY = (pixels.sizeY.val + step - 1) // step
+            descriptions.append(d)
+        return descriptions
+
+    def tile_size(self, pixels_id):
+        pixels = self.pixels[pixels_id]
+        if self.requires_pyramid(pixels_id):
+            return [PYRAMID_TILE, PYRAMID_TILE]
+        size_x = pixels.sizeX.val
+        rows = max(1, min(pixels.sizeY.val, 1048576 // max(1, size_x)))
+        return [size_x, rows]
+
+    # -- rendering -----------------------------------------------------
+
+    def reset_rdef(self, pixels_id):
+        pixels = self.pixels[pixels_id]
+        dtype = numpy.dtype(self.numpy_type(pixels_id))
+        top = 255 if dtype.itemsize == 1 else 4095
+        channels = []
+        for c, ch in enumerate(pixels.copyChannels()):
+            label = unwrap(ch.logicalChannel.name) \
+                if ch.logicalChannel is not None else None
+            if label is None:
+                label = str(c)
+            rgba = (unwrap(ch.red), unwrap(ch.green), unwrap(ch.blue),
+                    unwrap(ch.alpha))
+            if None in rgba:
+                rgba = DEFAULT_COLORS[c % len(DEFAULT_COLORS)]
+            channels.append(ChannelSettings(label, rgba, 0, top))
+        old = self.rdefs.get(pixels_id)
+        rdef = RenderingDef(old.id if old else self.new_id(), channels,
+                            pixels.sizeZ.val // 2, 0)
+        if old is not None:
+            rdef.version = old.version + 1
+        self.rdefs[pixels_id] = rdef
+        return rdef
+
+    def render(self, pixels_id, rdef, z, t, region=None, level=0,
+               projection=None):
+        """
+        Render one plane (or a Z-projection) to an RGB uint8 array using
+        the given settings. projection is (algorithm, start, end, step).
+        """
+        pixels = self.pixels[pixels_id]
+        if region is None:
+            x, y = 0, 0
+            w, h = pixels.sizeX.val, pixels.sizeY.val
+        else:
+            x, y, w, h = region
+        # like the server: quantize each channel window to 0-255, then
+        # add up the colours scaled by alpha. Greyscale renders the first
+        # active channel only.
+        active = [c for c, ch in enumerate(rdef.channels) if ch.active]
+        if rdef.model == 'greyscale':
+            active = active[:1]
+        out = numpy.zeros((h, w, 3), dtype=numpy.int64)
+        for c in active:
+            ch = rdef.channels[c]
+            if projection is None:
+                data = self.tile(pixels_id, z, c, t, x, y, w, h, level)
+            else:
+                algorithm, start, end, step = projection
+                stack = [self.tile(pixels_id, zz, c, t, x, y, w, h, level)
+                         for zz in range(start, end + 1, step)]
+                # projections keep the pixels type
+                dtype = numpy.dtype(self.numpy_type(pixels_id))
+                if algorithm == 'meanintensity':
+                    data = numpy.mean(stack, axis=0).astype(dtype)
+                elif algorithm == 'sumintensity':
+                    data = numpy.sum(stack, axis=0, dtype=numpy.float64)
+                    limits = (numpy.finfo if dtype.kind == 'f'
+                              else numpy.iinfo)(dtype)
+                    data = numpy.clip(data, limits.min, limits.max)
+                else:
+                    data = numpy.max(stack, axis=0)
+            span = max(ch.end - ch.start, 1e-9)
+            norm = numpy.clip((data.astype(numpy.float64) - ch.start) / span,
+                              0, 1)
+            value = numpy.floor(norm * 255 + 0.5).astype(numpy.int64)
+            hh, ww = value.shape
+            if rdef.model == 'greyscale':
+                out[:hh, :ww] += value[..., None]
+                continue
+            for i in range(3):
+                out[:hh, :ww, i] += value * (ch.rgba[i] * ch.rgba[3]) // 65025
+        return numpy.clip(out, 0, 255).astype(numpy.uint8)
+
+    # -- queries -------------------------------------------------------
+
+    def add_query_handler(self, pattern, handler):
+        """
+        Register handler(server, params, match) for HQL matching pattern.
+        Whitespace in the query is collapsed before matching. Newer
+        handlers take precedence.
+        """
+        self._queries.insert(0, (re.compile(pattern, re.I | re.S), handler))
+
+    def run_query(self, query, params):
+        query = " ".join(query.split())
+        for pattern, handler in self._queries:
+            match = pattern.search(query)
+            if match:
+                return handler(self, params, match)
+        raise _omero_error("Fake server has no handler for: %s" % query)
+
+    def _hierarchy_rows(self, params, m):
+        """Answer the image projections of omero.script_helpers.hierarchy."""
+        columns = [c.strip() for c in m.group(1).split(",")]
+        source, id_column = m.group(2), m.group(3)
+        ids = _param(params, "ids") or []
+        wells, images = [], []
+        if source == "Image":
+            images = [(iid, {}) for iid in ids if self.get("Image", iid)]
+        elif source in ("ProjectDatasetLink", "DatasetImageLink"):
+            datasets = ids
+            if source == "ProjectDatasetLink":
+                datasets = [d for p in ids
+                            for d in self.children("ProjectDataset", p)]
+            images = [(iid, {"dataset.id": did}) for did in datasets
+                      for iid in self.children("DatasetImage", did)]
+        elif source == "Well" and id_column == "well.id":
+            wells = [self.get("Well", w) for w in ids]
+        else:
+            plates = ids
+            if source == "ScreenPlateLink":
+                plates = [p for s in ids
+                          for p in self.children("ScreenPlate", s)]
+            wells = [w for p in plates for w in self.wells(p)]
+        for well in wells:
+            plate = self.get("Plate", well.plate.id.val)
+            info = {"well.id": well.id.val, "well.row": well.row.val,
+                    "well.column": well.column.val,
+                    "plate.id": plate.id.val,
+                    "plate.rowNamingConvention": unwrap(
+                        plate.rowNamingConvention),
+                    "plate.columnNamingConvention": unwrap(
+                        plate.columnNamingConvention)}
+            samples = well.copyWellSamples()
+            if not samples and not m.group(4):
+                images.append((None, info))
+            images.extend((ws.image.id.val, info) for ws in samples)
+
+        like = None
+        if m.group(4):
+            pattern = _param(params, "filter")
+            like = re.compile("^%s$" % re.sub(
+                r"!(.)|(%)|(_)|([^!%_]+)",
+                lambda g: re.escape(g.group(1)) if g.group(1) else
+                ".*" if g.group(2) else "." if g.group(3) else
+                re.escape(g.group(4)), pattern), re.S)
+        rows = []
+        for iid, info in images:
+            values = dict(info)
+            if iid is not None:
+                image = self.get("Image", iid)
+                name = image.name.val
+                if like is not None and not like.match(name):
+                    continue
+                values.update({"image.id": iid, "image.name": name,
+                               "pixels.id":
+                               image.getPrimaryPixels().id.val})
+            rows.append(values)
+        rows.sort(key=lambda r: (r.get("image.id") is None,
+                                 r.get("image.id")))
+        wrap = {str: rstring, int: rlong}
+        return [[wrap[type(r[c])](r[c]) if r.get(c) is not None else None
+                 for c in columns] for r in rows]
+
+    def _install_default_queries(self):
+        def pixels_type(server, params, m):
+            ptype = omero.model.PixelsTypeI()
+            ptype.value = rstring(m.group(1))
+            return [ptype]
+
+        def plane_info(server, params, m):
+            return []
+
+        def count_wells_with_images(server, params, m):
+            ids = set(_param(params, "ids") or [])
+            n = 0
+            for wells in server._plate_wells.values():
+                for wid in wells:
+                    well = server.get("Well", wid)
+                    if any(ws.image.id.val in ids
+                           for ws in well.copyWellSamples()):
+                        n += 1
+            return [[rlong(n)]]
+
+        def pixels_by_image(server, params, m):
+            ids = [int(m.group(1))] if m.group(1) else _param(params, "ids")
+            return [server.get("Image", iid).getPrimaryPixels()
+                    for iid in ids or []]
+
+        def images_by_id(server, params, m):
+            return [server.get("Image", int(iid))
+                    for iid in m.group(1).split(",")]
+
+        def channels_by_id(server, params, m):
+            return [server.find("Channel", cid)
+                    for cid in _param(params, "ids") or []]
+
+        def rendering_def(server, params, m):
+            rdef_id = _param(params, "id")
+            return [rdef.as_model(server.pixels[pid])
+                    for pid, rdef in server.rdefs.items()
+                    if rdef.id == rdef_id]
+
+        def rendering_def_event(server, params, m):
+            # the version of the settings stands in for the update event
+            rdef_id = _param(params, "id")
+            return [[rlong(pid), rlong(rdef.version)]
+                    for pid, rdef in server.rdefs.items()
+                    if rdef.id == rdef_id]
+
+        def settings_events(server, params, m):
+            ids = set(_param(params, "ids") or [])
+            return [[rlong(pid), rlong(rdef.version)]
+                    for pid, rdef in server.rdefs.items() if pid in ids]
+
+        def shapes_by_image(server, params, m):
+            columns = [c.split(".", 1)[1] for c in m.group(1).split(", ")]
+            rows = []
+            for iid in _param(params, "ids") or []:
+                for roi in server.rois.get(iid, []):
+                    for shape in roi.copyShapes():
+                        if _class_name(shape) != m.group(2):
+                            continue
+                        rows.append([shape.id, roi.id, rlong(iid),
+                                     shape.theZ, shape.theT, shape.theC,
+                                     shape.textValue] +
+                                    [getattr(shape, c) for c in columns])
+            return rows
+
+        def masks_by_id(server, params, m):
+            ids = set(_param(params, "ids") or [])
+            return [shape for rois in server.rois.values() for roi in rois
+                    for shape in roi.copyShapes()
+                    if _class_name(shape) == "Mask" and shape.id.val in ids]
+
+        def annotation_links(server, params, m):
+            kind = "%sAnnotation" % m.group(1)
+            ids = set(_param(params, "ids") or [])
+            namespaces = _param(params, "ns")
+            types = m.group(2).split(", ") if m.group(2) else None
+            links = []
+            for link_id, (k, pid, aid) in list(server._link_index.items()):
+                if k != kind or pid not in ids:
+                    continue
+                ann = server.get("Annotation", aid)
+                if ann is None or (types and _class_name(ann) not in types):
+                    continue
+                if namespaces is not None and unwrap(ann.ns) not in \
+                        namespaces:
+                    continue
+                link = getattr(omero.model, "%sLinkI" % kind)(link_id)
+                link.parent = server.link_object(link_id).parent
+                link.child = ann
+                links.append(link)
+            return links
+
+        def file_annotations(server, params, m):
+            anns = []
+            for aid in _param(params, "ids") or []:
+                ann = server.get("FileAnnotation", aid)
+                if ann is not None:
+                    ann.file = server.get("OriginalFile", ann.file.id.val)
+                    anns.append(ann)
+            return anns
+
+        def well_grid(server, params, m):
+            wells = server.wells(_param(params, "id"))
+            if not wells:
+                return [[None, None]]
+            return [[rint(max(w.row.val for w in wells)),
+                     rint(max(w.column.val for w in wells))]]
+
+        self.add_query_handler(
+            r"^select (image\.id, .*?) from (\w+) .* where ([\w.]+) in "
+            r"\(:ids\)( and image\.name like :filter)?",
+            FakeServer._hierarchy_rows)
+        self.add_query_handler(
+            r"from PixelsType as p where p.value='(\w+)'", pixels_type)
+        self.add_query_handler(r"^from PlaneInfo", plane_info)
+        self.add_query_handler(
+            r"^select count\(well\) from Well .* where img.id in \(:ids\)",
+            count_wells_with_images)
+        self.add_query_handler(
+            r"^select max\(row\), max\(column\) from Well", well_grid)
+        self.add_query_handler(
+            r"^select p from Pixels p join fetch p.image i .*where "
+            r"i.id(?:='(\d+)'| in \(:ids\))", pixels_by_image)
+        self.add_query_handler(
+            r"^select i from Image i where i.id in \(([\d, ]+)\)$",
+            images_by_id)
+        self.add_query_handler(
+            r"^select c from Channel c where c.id in \(:ids\)$",
+            channels_by_id)
+        self.add_query_handler(
+            r"^select r from RenderingDef r .* where r.id = :id$",
+            rendering_def)
+        self.add_query_handler(
+            r"^select r.pixels.id, r.details.updateEvent.id from "
+            r"RenderingDef r where r.id = :id$", rendering_def_event)
+        self.add_query_handler(
+            r"^select r.pixels.id, max\(r.details.updateEvent.id\) from "
+            r"RenderingDef r where r.pixels.id in \(:ids\)", settings_events)
+        self.add_query_handler(
+            r"^select s.id, r.id, r.image.id, s.theZ, s.theT, s.theC, "
+            r"s.textValue, (.+) from (\w+) s join s.roi r where "
+            r"r.image.id in \(:ids\)$", shapes_by_image)
+        self.add_query_handler(
+            r"^select s from Mask s where s.id in \(:ids\)$", masks_by_id)
+        self.add_query_handler(
+            r"^select link from (\w+)AnnotationLink link join fetch "
+            r"link.child a where link.parent.id in \(:ids\)"
+            r"(?: and a.ns in \(:ns\))?(?: and a.class in \(([\w, ]+)\))?$",
+            annotation_links)
+        self.add_query_handler(
+            r"^select a from FileAnnotation a join fetch a.file where "
+            r"a.id in \(:ids\)$", file_annotations)
+
+
+# ---------------------------------------------------------------------------
+# Services
+# ---------------------------------------------------------------------------
+
+class _Service(object):
+    """Base for fake stateless and stateful services."""
+
+    NAME = "service"
+
+    def __init__(self, server):
+        self._server = server
+
+    def _call(self, method, down=0, up=0, rows=0):
+        self._server.log.record(self.NAME, method, down, up, rows)
+
+    def close(self, ctx=None):
+        self._call("close")
+
+
+class FakeQueryService(_Service):
+
+    NAME = "query"
+
+    def get(self, cls, oid, ctx=None):
+        self._call("get")
+        obj = self._server.find(cls, oid)
+        if obj is None:
+            raise omero.ValidationException(
+                None, None, "No %s with id %s" % (cls, oid))
+        return obj
+
+    def find(self, cls, oid, ctx=None):
+        self._call("find")
+        return self._server.find(cls, oid)
+
+    def findByQuery(self, query, params, ctx=None):
+        self._call("findByQuery")
+        result = self._server.run_query(query, params)
+        return result[0] if result else None
+
+    def findAllByQuery(self, query, params, ctx=None):
+        result = list(self._server.run_query(query, params))
+        self._call("findAllByQuery", rows=len(result))
+        return result
+
+    def projection(self, query, params, ctx=None):
+        result = list(self._server.run_query(query, params))
+        self._call("projection", rows=len(result))
+        return result
+
+
+class FakeUpdateService(_Service):
+
+    NAME = "update"
+
+    def saveObject(self, obj, ctx=None):
+        self._call("saveObject")
+        self._server.persist(obj)
+
+    def saveAndReturnObject(self, obj, ctx=None):
+        self._call("saveAndReturnObject")
+        return self._server.persist(obj)
+
+    def saveArray(self, objs, ctx=None):
+        self._call("saveArray")
+        for obj in objs:
+            self._server.persist(obj)
+
+    def saveAndReturnArray(self, objs, ctx=None):
+        self._call("saveAndReturnArray")
+        return [self._server.persist(obj) for obj in objs]
+
+    def saveAndReturnIds(self, objs, ctx=None):
+        self._call("saveAndReturnIds")
+        return [self._server.persist(obj).id.val for obj in objs]
+
+    def deleteObject(self, obj, ctx=None):
+        self._call("deleteObject")
+        self._server.delete(_class_name(obj), obj.id.val)
+
+
+class FakeRoiService(_Service):
+
+    NAME = "roi"
+
+    def findByImage(self, image_id, options, ctx=None):
+        self._call("findByImage")
+        result = omero.api.RoiResult()
+        result.rois = list(self._server.rois.get(image_id, []))
+        return result
+
+    def getShapeStatsRestricted(self, shape_ids, z, t, channels, ctx=None):
+        """Mean/min/max/sum over each shape's bounding box."""
+        self._call("getShapeStatsRestricted")
+        stats = []
+        for sid in shape_ids:
+            shape = self._server.find("Shape", sid)
+            pixels_id, box = self._shape_box(shape)
+            s = omero.api.ShapeStats()
+            s.shapeId = sid
+            s.channelIds = list(channels)
+            s.pointsCount, s.min, s.max, s.sum = [], [], [], []
+            s.mean, s.stdDev = [], []
+            for c in channels:
+                data = self._server.tile(pixels_id, z, c, t, *box)
+                data = data.astype(numpy.float64)
+                s.pointsCount.append(int(data.size))
+                s.min.append(float(data.min()) if data.size else 0.0)
+                s.max.append(float(data.max()) if data.size else 0.0)
+                s.sum.append(float(data.sum()))
+                s.mean.append(float(data.mean()) if data.size else 0.0)
+                s.stdDev.append(float(data.std()) if data.size else 0.0)
+            stats.append(s)
+        return stats
+
+    def _shape_box(self, shape):
+        image_id = None
+        for iid, rois in self._server.rois.items():
+            for roi in rois:
+                if any(s.id.val == shape.id.val for s in roi.copyShapes()):
+                    image_id = iid
+        image = self._server.get("Image", image_id)
+        pixels_id = image.getPrimaryPixels().id.val
+        name = _class_name(shape)
+        if name == "Rectangle":
+            x, y = shape.x.val, shape.y.val
+            w, h = shape.width.val, shape.height.val
+        elif name == "Ellipse":
+            x, y = shape.x.val - shape.radiusX.val, \
+                shape.y.val - shape.radiusY.val
+            w, h = 2 * shape.radiusX.val, 2 * shape.radiusY.val
+        elif name == "Line":
+            x, y = min(shape.x1.val, shape.x2.val), \
+                min(shape.y1.val, shape.y2.val)
+            w = abs(shape.x2.val - shape.x1.val) + 1
+            h = abs(shape.y2.val - shape.y1.val) + 1
+        elif name == "Point":
+            x, y, w, h = shape.x.val, shape.y.val, 1, 1
+        elif name in ("Polygon", "Polyline"):
+            pts = [tuple(float(v) for v in p.split(","))
+                   for p in shape.points.val.split()]
+            xs = [p[0] for p in pts]
+            ys = [p[1] for p in pts]
+            x, y = min(xs), min(ys)
+            w, h = max(xs) - x + 1, max(ys) - y + 1
+        else:
+            x, y, w, h = 0, 0, 1, 1
+        x, y = max(0, int(x)), max(0, int(y))
+        return pixels_id, (x, y, max(1, int(w)), max(1, int(h)))
+
+
+class FakePixelsService(_Service):
+
+    NAME = "pixels"
+
+    def retrievePixDescription(self, pixels_id, ctx=None):
+        self._call("retrievePixDescription")
+        return self._server.pixels[pixels_id]
+
+    def createImage(self, size_x, size_y, size_z, size_t, channel_list,
+                    pixels_type, name, description, ctx=None):
+        self._call("createImage")
+        iid = self._server.add_image(
+            name, size_x, size_y, size_z, len(channel_list), size_t,
+            pixels_type.value.val, description=description)
+        self._forget_seed(iid)
+        return rlong(iid)
+
+    def copyAndResizeImage(self, image_id, size_x, size_y, size_z, size_t,
+                           channel_list, name, copy_stats, ctx=None):
+        self._call("copyAndResizeImage")
+        source = self._server.get("Image", image_id)
+        src_pixels = source.getPrimaryPixels()
+        names = []
+        for c in channel_list:
+            lc = src_pixels.getChannel(c).logicalChannel
+            names.append(unwrap(lc.name) if lc is not None else None)
+        iid = self._server.add_image(
+            name or source.name.val, unwrap(size_x), unwrap(size_y),
+            unwrap(size_z), len(channel_list), unwrap(size_t),
+            src_pixels.pixelsType.value.val, channel_names=names)
+        self._forget_seed(iid)
+        return rlong(iid)
+
+    def setChannelGlobalMinMax(self, pixels_id, c, vmin, vmax, ctx=None):
+        self._call("setChannelGlobalMinMax")
+
+    def _forget_seed(self, image_id):
+        image = self._server.get("Image", image_id)
+        self._server.seeds.pop(image.getPrimaryPixels().id.val, None)
+
+
+class FakeContainerService(_Service):
+
+    NAME = "container"
+
+    def getImages(self, cls, ids, options, ctx=None):
+        self._call("getImages")
+        return [self._server.get("Image", i) for i in ids]
+
+
+class FakeRenderingSettingsService(_Service):
+
+    NAME = "rendering_settings"
+
+    def applySettingsToSet(self, from_id, to_type, to_ids, ctx=None):
+        self._call("applySettingsToSet")
+        source = self._server.rdefs[from_id]
+        for iid in to_ids:
+            pid = self._server.get("Image", iid).getPrimaryPixels().id.val
+            rdef = source.copy()
+            rdef.id = self._server.rdefs[pid].id
+            self._server.rdefs[pid] = rdef
+        return {True: list(to_ids), False: []}
+
+    def resetDefaultsInSet(self, to_type, ids, ctx=None):
+        self._call("resetDefaultsInSet")
+        for oid in ids:
+            pid = oid
+            if to_type == "Image":
+                pid = self._server.get("Image", oid).getPrimaryPixels().id.val
+            self._server.reset_rdef(pid)
+        return list(ids)
+
+
+class FakeRawPixelsStore(_Service):
+
+    NAME = "rps"
+
+    def __init__(self, server):
+        super(FakeRawPixelsStore, self).__init__(server)
+        self._pid = None
+        self._level = 0
+
+    def setPixelsId(self, pixels_id, bypass_original_file=True, ctx=None):
+        self._call("setPixelsId")
+        self._pid = pixels_id
+        self._level = self._server.resolution_levels(pixels_id) - 1
+
+    def getPixelsId(self, ctx=None):
+        return self._pid
+
+    def _encode(self, data):
+        dtype = numpy.dtype(self._server.numpy_type(self._pid))
+        return data.astype(dtype.newbyteorder('>')).tobytes()
+
+    def _decode(self, buf, shape):
+        if isinstance(buf, numpy.ndarray):
+            return buf.reshape(shape)
+        dtype = numpy.dtype(self._server.numpy_type(self._pid))
+        return numpy.frombuffer(
+            buf, dtype=dtype.newbyteorder('>')).astype(dtype).reshape(shape)
+
+    def _full_level(self):
+        return self._server.resolution_levels(self._pid) - 1
+
+    def getPlane(self, z, c, t, ctx=None):
+        data = self._encode(self._server.plane(self._pid, z, c, t))
+        self._call("getPlane", down=len(data))
+        return data
+
+    def getTile(self, z, c, t, x, y, w, h, ctx=None):
+        level = self._full_level() - self._level
+        data = self._encode(
+            self._server.tile(self._pid, z, c, t, x, y, w, h, level))
+        self._call("getTile", down=len(data))
+        return data
+
+    def getStack(self, c, t, ctx=None):
+        size_z = self._server.pixels[self._pid].sizeZ.val
+        data = b"".join(self._encode(self._server.plane(self._pid, z, c, t))
+                        for z in range(size_z))
+        self._call("getStack", down=len(data))
+        return data
+
+    def setPlane(self, buf, z, c, t, ctx=None):
+        pixels = self._server.pixels[self._pid]
+        shape = (pixels.sizeY.val, pixels.sizeX.val)
+        self._call("setPlane", up=len(buf))
+        self._server.set_tile(self._pid, z, c, t, 0, 0,
+                              self._decode(buf, shape))
+
+    def setTile(self, buf, z, c, t, x, y, w, h, ctx=None):
+        data = self._decode(buf, (h, w))
+        self._call("setTile", up=data.nbytes)
+        self._server.set_tile(self._pid, z, c, t, x, y, data)
+
+    def getTileSize(self, ctx=None):
+        self._call("getTileSize")
+        return self._server.tile_size(self._pid)
+
+    def requiresPixelsPyramid(self, ctx=None):
+        self._call("requiresPixelsPyramid")
+        return self._server.requires_pyramid(self._pid)
+
+    def getResolutionLevels(self, ctx=None):
+        self._call("getResolutionLevels")
+        return self._server.resolution_levels(self._pid)
+
+    def getResolutionLevel(self, ctx=None):
+        self._call("getResolutionLevel")
+        return self._level
+
+    def setResolutionLevel(self, level, ctx=None):
+        self._call("setResolutionLevel")
+        self._level = level
+
+    def getResolutionDescriptions(self, ctx=None):
+        self._call("getResolutionDescriptions")
+        return self._server.resolution_descriptions(self._pid)
+
+    def save(self, ctx=None):
+        self._call("save")
+        return self._server.pixels[self._pid]
+
+
+class FakeRawFileStore(_Service):
+
+    NAME = "rfs"
+
+    def __init__(self, server):
+        super(FakeRawFileStore, self).__init__(server)
+        self._fid = None
+
+    def setFileId(self, file_id, ctx=None):
+        self._call("setFileId")
+        self._fid = unwrap(file_id)
+        self._server.files.setdefault(self._fid, b"")
+
+    def size(self, ctx=None):
+        self._call("size")
+        return len(self._server.files[self._fid])
+
+    def read(self, position, length, ctx=None):
+        data = self._server.files[self._fid][position:position + length]
+        self._call("read", down=len(data))
+        return data
+
+    def write(self, buf, position, length, ctx=None):
+        self._call("write", up=len(buf))
+        old = self._server.files[self._fid]
+        self._server.files[self._fid] = \
+            old[:position] + bytes(buf[:length]) + old[position + length:]
+
+    def save(self, ctx=None):
+        self._call("save")
+        orig = self._server.get("OriginalFile", self._fid)
+        orig.size = rlong(len(self._server.files[self._fid]))
+        return orig
+
+
+class FakeThumbnailStore(_Service):
+
+    NAME = "thumbs"
+
+    def __init__(self, server):
+        super(FakeThumbnailStore, self).__init__(server)
+        self._pid = None
+
+    def setPixelsId(self, pixels_id, ctx=None):
+        self._call("setPixelsId")
+        self._pid = pixels_id
+        return True
+
+    def setRenderingDefId(self, rdef_id, ctx=None):
+        self._call("setRenderingDefId")
+
+    def _thumbnail(self, pixels_id, size):
+        pixels = self._server.pixels[pixels_id]
+        size_x, size_y = pixels.sizeX.val, pixels.sizeY.val
+        rdef = self._server.rdefs[pixels_id]
+        level = 0
+        while max(size_x, size_y) // (2 ** (level + 1)) >= size:
+            level += 1
+        rgb = self._server.render(pixels_id, rdef, rdef.default_z,
+                                  rdef.default_t, level=level,
+                                  region=(0, 0, size_x // 2 ** level,
+                                          size_y // 2 ** level))
+        return _encode_image(rgb, "JPEG", size=size)
+
+    def getThumbnailByLongestSide(self, size, ctx=None):
+        data = self._thumbnail(self._pid, unwrap(size) or 96)
+        self._call("getThumbnailByLongestSide", down=len(data))
+        return data
+
+    def getThumbnail(self, size_x, size_y, ctx=None):
+        data = self._thumbnail(self._pid, max(unwrap(size_x), unwrap(size_y)))
+        self._call("getThumbnail", down=len(data))
+        return data
+
+    def getThumbnailByLongestSideSet(self, size, pixels_ids, ctx=None):
+        result = dict((pid, self._thumbnail(pid, unwrap(size) or 96))
+                      for pid in pixels_ids)
+        self._call("getThumbnailByLongestSideSet",
+                   down=sum(len(v) for v in result.values()))
+        return result
+
+    def getThumbnailSet(self, size_x, size_y, pixels_ids, ctx=None):
+        size = max(unwrap(size_x), unwrap(size_y))
+        result = dict((pid, self._thumbnail(pid, size)) for pid in pixels_ids)
+        self._call("getThumbnailSet",
+                   down=sum(len(v) for v in result.values()))
+        return result
+
+
+def _encode_image(rgb, fmt="JPEG", size=None):
+    from PIL import Image
+    pil = Image.fromarray(rgb, "RGB")
+    if size is not None:
+        pil.thumbnail((size, size))
+    out = BytesIO()
+    pil.save(out, fmt, quality=90)
+    return out.getvalue()
+
+
+class _Model(object):
+    """Rendering model enum stand-in with getValue()."""
+
+    def __init__(self, value):
+        self.value = rstring(value)
+
+    def getValue(self):
+        return self.value
+
+
+class FakeRenderingEngine(_Service):
+
+    NAME = "re"
+
+    def __init__(self, server):
+        super(FakeRenderingEngine, self).__init__(server)
+        self._pid = None
+        self._rdef = None
+        self._level = 0
+        self._compression = 0.9
+
+    def lookupPixels(self, pixels_id, ctx=None):
+        self._call("lookupPixels")
+        self._pid = pixels_id
+
+    def lookupRenderingDef(self, pixels_id, ctx=None):
+        self._call("lookupRenderingDef")
+        return pixels_id in self._server.rdefs
+
+    def loadRenderingDef(self, rdef_id, ctx=None):
+        self._call("loadRenderingDef")
+
+    def resetDefaultSettings(self, save=True, ctx=None):
+        self._call("resetDefaultSettings")
+        self._rdef = self._server.reset_rdef(self._pid).copy()
+
+    def resetDefaults(self, ctx=None):
+        self._call("resetDefaults")
+        self._server.reset_rdef(self._pid)
+
+    def load(self, ctx=None):
+        self._call("load")
+        self._rdef = self._server.rdefs[self._pid].copy()
+        self._level = self._server.resolution_levels(self._pid) - 1
+
+    def getRenderingDefId(self, ctx=None):
+        self._call("getRenderingDefId")
+        return self._rdef.id
+
+    def getPixels(self, ctx=None):
+        self._call("getPixels")
+        return self._server.pixels[self._pid]
+
+    def setCompressionLevel(self, level, ctx=None):
+        self._call("setCompressionLevel")
+        self._compression = level
+
+    def getCompressionLevel(self, ctx=None):
+        self._call("getCompressionLevel")
+        return self._compression
+
+    def setActive(self, c, active, ctx=None):
+        self._call("setActive")
+        self._rdef.channels[c].active = bool(active)
+
+    def isActive(self, c, ctx=None):
+        self._call("isActive")
+        return self._rdef.channels[c].active
+
+    def setChannelWindow(self, c, start, end, ctx=None):
+        self._call("setChannelWindow")
+        self._rdef.channels[c].start = float(start)
+        self._rdef.channels[c].end = float(end)
+
+    def getChannelWindowStart(self, c, ctx=None):
+        self._call("getChannelWindowStart")
+        return self._rdef.channels[c].start
+
+    def getChannelWindowEnd(self, c, ctx=None):
+        self._call("getChannelWindowEnd")
+        return self._rdef.channels[c].end
+
+    def setRGBA(self, c, r, g, b, a, ctx=None):
+        self._call("setRGBA")
+        self._rdef.channels[c].rgba = (r, g, b, a)
+
+    def getRGBA(self, c, ctx=None):
+        self._call("getRGBA")
+        return list(self._rdef.channels[c].rgba)
+
+    def setChannelLookupTable(self, c, lut, ctx=None):
+        self._call("setChannelLookupTable")
+
+    def getChannelLookupTable(self, c, ctx=None):
+        self._call("getChannelLookupTable")
+        return None
+
+    def getChannelFamily(self, c, ctx=None):
+        self._call("getChannelFamily")
+        return _Model(self._rdef.channels[c].family)
+
+    def getChannelCurveCoefficient(self, c, ctx=None):
+        self._call("getChannelCurveCoefficient")
+        return 1.0
+
+    def getChannelNoiseReduction(self, c, ctx=None):
+        self._call("getChannelNoiseReduction")
+        return False
+
+    def getCodomainMapContext(self, c, ctx=None):
+        self._call("getCodomainMapContext")
+        return []
+
+    def getAvailableModels(self, ctx=None):
+        self._call("getAvailableModels")
+        return [_Model('rgb'), _Model('greyscale')]
+
+    def getModel(self, ctx=None):
+        self._call("getModel")
+        return _Model(self._rdef.model)
+
+    def setModel(self, model, ctx=None):
+        self._call("setModel")
+        self._rdef.model = unwrap(model.getValue())
+
+    def getDefaultZ(self, ctx=None):
+        self._call("getDefaultZ")
+        return self._rdef.default_z
+
+    def getDefaultT(self, ctx=None):
+        self._call("getDefaultT")
+        return self._rdef.default_t
+
+    def setDefaultZ(self, z, ctx=None):
+        self._call("setDefaultZ")
+        self._rdef.default_z = z
+
+    def setDefaultT(self, t, ctx=None):
+        self._call("setDefaultT")
+        self._rdef.default_t = t
+
+    def saveCurrentSettings(self, ctx=None):
+        self._call("saveCurrentSettings")
+        self._rdef.version += 1
+        self._server.rdefs[self._pid] = self._rdef.copy()
+
+    def requiresPixelsPyramid(self, ctx=None):
+        self._call("requiresPixelsPyramid")
+        return self._server.requires_pyramid(self._pid)
+
+    def getResolutionLevels(self, ctx=None):
+        self._call("getResolutionLevels")
+        return self._server.resolution_levels(self._pid)
+
+    def getResolutionLevel(self, ctx=None):
+        self._call("getResolutionLevel")
+        return self._level
+
+    def setResolutionLevel(self, level, ctx=None):
+        self._call("setResolutionLevel")
+        self._level = level
+
+    def getTileSize(self, ctx=None):
+        self._call("getTileSize")
+        return self._server.tile_size(self._pid)
+
+    def getResolutionDescriptions(self, ctx=None):
+        self._call("getResolutionDescriptions")
+        return self._server.resolution_descriptions(self._pid)
+
+    def _region(self, plane_def):
+        region = getattr(plane_def, "region", None)
+        if region is None:
+            return None
+        return (region.x, region.y, region.width, region.height)
+
+    def _down_level(self):
+        return self._server.resolution_levels(self._pid) - 1 - self._level
+
+    def renderCompressed(self, plane_def, ctx=None):
+        rgb = self._server.render(self._pid, self._rdef, plane_def.z,
+                                  plane_def.t, self._region(plane_def),
+                                  self._down_level())
+        data = _encode_image(rgb)
+        self._call("renderCompressed", down=len(data))
+        return data
+
+    def renderProjectedCompressed(self, algorithm, t, stepping, start, end,
+                                  ctx=None):
+        name = getattr(algorithm, "name", str(algorithm)).lower()
+        name = name.replace("_", "")
+        rgb = self._server.render(self._pid, self._rdef, start, t,
+                                  projection=(name, start, end,
+                                              max(1, stepping)))
+        data = _encode_image(rgb)
+        self._call("renderProjectedCompressed", down=len(data))
+        return data
+
+    def renderAsPackedInt(self, plane_def, ctx=None):
+        rgb = self._server.render(self._pid, self._rdef, plane_def.z,
+                                  plane_def.t, self._region(plane_def))
+        packed = (rgb[..., 0].astype(numpy.int64) << 16 |
+                  rgb[..., 1].astype(numpy.int64) << 8 | rgb[..., 2])
+        self._call("renderAsPackedInt", down=packed.size * 4)
+        return packed.ravel().tolist()
+
+
+class FakeHandle(object):
+    """Command handle that has already completed."""
+
+    def __init__(self, server):
+        self._server = server
+
+    def getResponse(self):
+        return omero.cmd.OK()
+
+    def close(self):
+        self._server.log.record("cmd", "close")
+
+
+class FakeSession(object):
+    """Stand-in for the Ice ServiceFactory at ``conn.c.sf``."""
+
+    def __init__(self, server):
+        self._server = server
+
+    def getQueryService(self):
+        return FakeQueryService(self._server)
+
+    def getUpdateService(self):
+        return FakeUpdateService(self._server)
+
+    def getRoiService(self):
+        return FakeRoiService(self._server)
+
+    def getPixelsService(self):
+        return FakePixelsService(self._server)
+
+    def getContainerService(self):
+        return FakeContainerService(self._server)
+
+    def getRenderingSettingsService(self):
+        return FakeRenderingSettingsService(self._server)
+
+    def createRawPixelsStore(self):
+        self._server.log.record("session", "createRawPixelsStore")
+        return FakeRawPixelsStore(self._server)
+
+    def createRawFileStore(self):
+        self._server.log.record("session", "createRawFileStore")
+        return FakeRawFileStore(self._server)
+
+    def createRenderingEngine(self):
+        self._server.log.record("session", "createRenderingEngine")
+        return FakeRenderingEngine(self._server)
+
+    def createThumbnailStore(self):
+        self._server.log.record("session", "createThumbnailStore")
+        return FakeThumbnailStore(self._server)
+
+    def submit(self, command, ctx=None):
+        """Run Delete2 commands immediately; other commands are no-ops."""
+        self._server.log.record("session", "submit")
+        targets = getattr(command, "targetObjects", None) or {}
+        for cls, ids in targets.items():
+            for oid in ids:
+                self._server.delete(cls, unwrap(oid))
+        return FakeHandle(self._server)
+
+
+class FakeClient(object):
+    """Stand-in for ``omero.client`` at ``conn.c``."""
+
+    def __init__(self, server):
+        self._server = server
+        self.sf = FakeSession(server)
+
+    def waitOnCmd(self, handle, loops=10, ms=500, failonerror=True,
+                  failontimeout=False, closehandle=False):
+        self._server.log.record("cmd", "waitOnCmd")
+        if closehandle:
+            handle.close()
+        return handle.getResponse()
+
+    def getSessionId(self):
+        return "fake-session"
+
+    def getPropertyMap(self):
+        return {"omero.host": "fake"}
+
+
+# ---------------------------------------------------------------------------
+# Wrappers
+# ---------------------------------------------------------------------------
+
+class FakeObjectWrapper(object):
+    """
+    Gateway-style wrapper around a server-side model object. Attribute
+    access falls back to the unwrapped field, as on BlitzObjectWrapper.
+    """
+
+    OMERO_CLASS = None
+    LINK_CHILD = None      # e.g. "Image" for Dataset
+
+    def __init__(self, conn, obj):
+        self._conn = conn
+        self._obj = obj
+        self._server = conn.server
+
+    def __getattr__(self, attr):
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        obj = self.__dict__.get("_obj")
+        if obj is not None and hasattr(obj, "_%s" % attr):
+            return unwrap(getattr(obj, attr))
+        raise AttributeError(attr)
+
+    def __eq__(self, other):
+        return (isinstance(other, FakeObjectWrapper) and
+                other.OMERO_CLASS == self.OMERO_CLASS and
+                other.getId() == self.getId())
+
+    def __hash__(self):
+        return hash((self.OMERO_CLASS, self.getId()))
+
+    @property
+    def id(self):
+        return self.getId()
+
+    def getId(self):
+        return unwrap(self._obj.id)
+
+    def getName(self):
+        return unwrap(self._obj.getName()) \
+            if hasattr(self._obj, "getName") else None
+
+    def getDescription(self):
+        return unwrap(getattr(self._obj, "description", None)) or ""
+
+    def creationEventDate(self):
+        # objects are created in the order of their IDs
+        return datetime.datetime.fromtimestamp(self.getId())
+
+    def canLink(self):
+        return True
+
+    def canAnnotate(self):
+        return True
+
+    def canEdit(self):
+        return True
+
+    def save(self):
+        self._obj = self._conn.getUpdateService().saveAndReturnObject(
+            self._obj, self._conn.SERVICE_OPTS)
+
+    def _query(self, rows=0):
+        # one round-trip, as for the gateway's own loading queries
+        self._server.log.record("query", "findAllByQuery", rows=rows)
+
+    def listChildren(self, **kwargs):
+        wrapper = WRAPPERS[self.LINK_CHILD]
+        kind = "%s%s" % (self.OMERO_CLASS, self.LINK_CHILD)
+        children = [wrapper(self._conn, self._server.get(self.LINK_CHILD, cid))
+                    for cid in self._server.children(kind, self.getId())]
+        self._query(len(children))
+        return children
+
+    def countChildren(self):
+        self._query()
+        kind = "%s%s" % (self.OMERO_CLASS, self.LINK_CHILD)
+        return len(self._server.children(kind, self.getId()))
+
+    def _parent_kind(self):
+        return None, None
+
+    def listParents(self, withlinks=False):
+        parent_cls, kind = self._parent_kind()
+        if parent_cls is None:
+            return []
+        self._query()
+        wrapper = WRAPPERS[parent_cls]
+        return [wrapper(self._conn, self._server.get(parent_cls, pid))
+                for pid in self._server.parents(kind, self.getId())]
+
+    def getParent(self, withlinks=False):
+        parents = self.listParents()
+        return parents[0] if parents else None
+
+    def getParentLinks(self, pids=None):
+        parent_cls, kind = self._parent_kind()
+        self._query()
+        if pids is not None and not isinstance(pids, (list, tuple)):
+            pids = [pids]
+        links = []
+        for link_id in self._server.parent_links(kind, self.getId()):
+            link = self._server.link_object(link_id)
+            if pids is None or link.parent.id.val in pids:
+                links.append(FakeObjectWrapper(self._conn, link))
+        return links
+
+    def listAnnotations(self, ns=None):
+        self._query()
+        kind = "%sAnnotation" % self.OMERO_CLASS
+        anns = []
+        for aid in self._server.children(kind, self.getId()):
+            ann = self._server.get("Annotation", aid)
+            if ann is None:
+                continue
+            if ns is not None and unwrap(ann.ns) != ns:
+                continue
+            anns.append(AnnotationWrapper._wrap(self._conn, ann))
+        return anns
+
+    def getAnnotation(self, ns=None):
+        anns = self.listAnnotations(ns)
+        return anns[0] if anns else None
+
+    def linkAnnotation(self, ann, sameOwner=False):
+        update = self._conn.getUpdateService()
+        if ann._obj.id is None:
+            ann._obj = update.saveAndReturnObject(ann._obj)
+        link = getattr(omero.model, "%sAnnotationLinkI" % self.OMERO_CLASS)()
+        link.parent = self._obj.__class__(self.getId(), False)
+        link.child = ann._obj.__class__(ann._obj.id.val, False)
+        update.saveObject(link)
+        return ann
+
+
+class FakeProjectWrapper(FakeObjectWrapper):
+    OMERO_CLASS = "Project"
+    LINK_CHILD = "Dataset"
+
+
+class FakeDatasetWrapper(FakeObjectWrapper):
+    OMERO_CLASS = "Dataset"
+    LINK_CHILD = "Image"
+
+    def _parent_kind(self):
+        return "Project", "ProjectDataset"
+
+
+class FakeScreenWrapper(FakeObjectWrapper):
+    OMERO_CLASS = "Screen"
+    LINK_CHILD = "Plate"
+
+
+class FakePlateWrapper(FakeObjectWrapper):
+    OMERO_CLASS = "Plate"
+
+    def _parent_kind(self):
+        return "Screen", "ScreenPlate"
+
+    def listChildren(self, **kwargs):
+        # wells are fetched together with their samples and images
+        wells = [FakeWellWrapper(self._conn, w)
+                 for w in self._server.wells(self.getId())]
+        self._query(len(wells))
+        return wells
+
+    def countChildren(self):
+        return len(self.listChildren())
+
+    def getGridSize(self):
+        self._server.log.record("query", "projection")
+        wells = self._server.wells(self.getId())
+        if not wells:
+            return {'rows': 0, 'columns': 0}
+        return {'rows': max(w.row.val for w in wells) + 1,
+                'columns': max(w.column.val for w in wells) + 1}
+
+    def getNumberOfFields(self):
+        self._server.log.record("query", "projection")
+        counts = [len(w.copyWellSamples())
+                  for w in self._server.wells(self.getId())]
+        return (0, max(counts) - 1) if counts else (0, 0)
+
+
+class FakeWellWrapper(FakeObjectWrapper):
+    OMERO_CLASS = "Well"
+
+    def listParents(self, withlinks=False):
+        self._query()
+        plate = self._server.get("Plate", self._obj.plate.id.val)
+        return [FakePlateWrapper(self._conn, plate)]
+
+    def getWellPos(self):
+        row = self._obj.row.val
+        return "%s%d" % (chr(ord('A') + row), self._obj.column.val + 1)
+
+    def getRow(self):
+        return self._obj.row.val
+
+    def getColumn(self):
+        return self._obj.column.val
+
+    def listChildren(self, **kwargs):
+        return [FakeWellSampleWrapper(self._conn, ws)
+                for ws in self._obj.copyWellSamples()]
+
+    def countWellSample(self):
+        return len(self._obj.copyWellSamples())
+
+    def getWellSample(self, index=0):
+        samples = self.listChildren()
+        return samples[index] if index < len(samples) else None
+
+    def getImage(self, index=0):
+        ws = self.getWellSample(index)
+        return ws.getImage() if ws is not None else None
+
+
+class FakeWellSampleWrapper(FakeObjectWrapper):
+    OMERO_CLASS = "WellSample"
+
+    def getImage(self):
+        image = self._server.get("Image", self._obj.image.id.val)
+        return FakeImageWrapper(self._conn, image)
+
+    def image(self):
+        return self.getImage()
+
+
+class _PixelsType(object):
+
+    def __init__(self, value):
+        self.value = value
+
+    def getValue(self):
+        return self.value
+
+
+class FakePixelsWrapper(FakeObjectWrapper):
+    OMERO_CLASS = "Pixels"
+
+    def getSizeX(self):
+        return self._obj.sizeX.val
+
+    def getSizeY(self):
+        return self._obj.sizeY.val
+
+    def getSizeZ(self):
+        return self._obj.sizeZ.val
+
+    def getSizeC(self):
+        return self._obj.sizeC.val
+
+    def getSizeT(self):
+        return self._obj.sizeT.val
+
+    def getPixelsType(self):
+        return _PixelsType(self._obj.pixelsType.value.val)
+
+    def get_numpy_type(self):
+        return numpy.dtype(OMERO_NUMPY_TYPES[
+            self._obj.pixelsType.value.val]).type
+
+    def getPhysicalSizeX(self):
+        return self._obj.physicalSizeX
+
+    def getPhysicalSizeY(self):
+        return self._obj.physicalSizeY
+
+    def getPhysicalSizeZ(self):
+        return self._obj.physicalSizeZ
+
+    @property
+    def physicalSizeX(self):
+        size = self._obj.physicalSizeX
+        return size.getValue() if size is not None else None
+
+    @property
+    def physicalSizeY(self):
+        size = self._obj.physicalSizeY
+        return size.getValue() if size is not None else None
+
+    @property
+    def timeIncrement(self):
+        inc = self._obj.timeIncrement
+        return inc.getValue() if inc is not None else None
+
+    def getImage(self):
+        return FakeImageWrapper(
+            self._conn, self._server.get("Image", self._obj.image.id.val))
+
+    def copyPlaneInfo(self, theC=None, theT=None, theZ=None):
+        self._query()
+        return []
+
+    def _prepareRawPixelsStore(self):
+        rps = self._conn.c.sf.createRawPixelsStore()
+        rps.setPixelsId(self.getId(), True, self._conn.SERVICE_OPTS)
+        return rps
+
+    def getTiles(self, zctTileList):
+        """One store for all tiles, as PixelsWrapper.getTiles()."""
+        rps = self._prepareRawPixelsStore()
+        dtype = numpy.dtype(self._server.numpy_type(self.getId()))
+        big = dtype.newbyteorder('>')
+        size_x, size_y = self.getSizeX(), self.getSizeY()
+        try:
+            for z, c, t, tile in zctTileList:
+                if tile is None:
+                    raw = rps.getPlane(z, c, t)
+                    shape = (size_y, size_x)
+                else:
+                    x, y, w, h = tile
+                    raw = rps.getTile(z, c, t, x, y, w, h)
+                    shape = (h, w)
+                yield numpy.frombuffer(raw, dtype=big).astype(
+                    dtype).reshape(shape)
+        finally:
+            rps.close()
+
+    def getPlanes(self, zctList):
+        return self.getTiles([(z, c, t, None) for z, c, t in zctList])
+
+    def getPlane(self, theZ=0, theC=0, theT=0):
+        return next(self.getPlanes([(theZ, theC, theT)]))
+
+    def getTile(self, theZ=0, theC=0, theT=0, tile=None):
+        return next(self.getTiles([(theZ, theC, theT, tile)]))
+
+
+class _LogicalChannel(FakeObjectWrapper):
+    OMERO_CLASS = "LogicalChannel"
+
+    def setName(self, name):
+        self._obj.name = rstring(name)
+
+
+class FakeChannelWrapper(FakeObjectWrapper):
+    OMERO_CLASS = "Channel"
+
+    def __init__(self, conn, obj, index, settings):
+        super(FakeChannelWrapper, self).__init__(conn, obj)
+        self._index = index
+        self._settings = settings
+
+    def getLabel(self):
+        lc = self._obj.logicalChannel
+        name = unwrap(lc.name) if lc is not None else None
+        return name if name is not None else self._settings.label
+
+    getName = getLabel
+
+    def getColor(self):
+        return ColorHolder.fromRGBA(*self._settings.rgba)
+
+    def getWindowStart(self):
+        return self._settings.start
+
+    def getWindowEnd(self):
+        return self._settings.end
+
+    def getWindowMin(self):
+        return 0
+
+    def getWindowMax(self):
+        return self._settings.end
+
+    def isActive(self):
+        return self._settings.active
+
+    def getEmissionWave(self):
+        return None
+
+    def getLogicalChannel(self):
+        return _LogicalChannel(self._conn, self._obj.logicalChannel)
+
+
+class FakeImageWrapper(FakeObjectWrapper):
+    """ImageWrapper stand-in with server-side rendering."""
+
+    OMERO_CLASS = "Image"
+
+    PROJECTIONS = {'normal': None, 'intmax': 'maximumintensity',
+                   'intmean': 'meanintensity', 'intsum': 'sumintensity'}
+
+    def __init__(self, conn, obj):
+        super(FakeImageWrapper, self).__init__(conn, obj)
+        self._re = None
+        self._pd = 'normal'
+        self._pr = None
+
+    def _parent_kind(self):
+        return "Dataset", "DatasetImage"
+
+    def getPrimaryPixels(self):
+        return FakePixelsWrapper(self._conn, self._obj.getPrimaryPixels())
+
+    def getPixelsId(self):
+        return self._obj.getPrimaryPixels().id.val
+
+    def _pixels(self):
+        return self._obj.getPrimaryPixels()
+
+    def getSizeX(self):
+        return self._pixels().sizeX.val
+
+    def getSizeY(self):
+        return self._pixels().sizeY.val
+
+    def getSizeZ(self):
+        return self._pixels().sizeZ.val
+
+    def getSizeC(self):
+        return self._pixels().sizeC.val
+
+    def getSizeT(self):
+        return self._pixels().sizeT.val
+
+    def getPixelSizeX(self, units=None):
+        return self._pixel_size(self._pixels().physicalSizeX, units)
+
+    def getPixelSizeY(self, units=None):
+        return self._pixel_size(self._pixels().physicalSizeY, units)
+
+    def _pixel_size(self, size, units):
+        """As ImageWrapper: a float, or a Length if units are given."""
+        if size is None or units is None:
+            return size.getValue() if size is not None else None
+        if units is True or units == size.getUnit():
+            return size
+        return omero.model.LengthI(size, units)
+
+    def getPixelsType(self):
+        return self._pixels().pixelsType.value.val
+
+    def getROICount(self, shapeType=None, filterByCurrentUser=False):
+        self._server.log.record("query", "projection")
+        if isinstance(shapeType, str):
+            shapeType = [shapeType]
+        n = 0
+        for roi in self._server.rois.get(self.getId(), []):
+            kinds = set(_class_name(s) for s in roi.copyShapes())
+            if shapeType is None or kinds.intersection(shapeType):
+                n += 1
+        return n
+
+    def requiresPixelsPyramid(self):
+        return self._prepareRE().requiresPixelsPyramid()
+
+    # -- rendering -------------------------------------------------------
+
+    def _prepareRE(self, rdid=None):
+        re = self._conn.createRenderingEngine()
+        pid = self.getPixelsId()
+        re.lookupPixels(pid, self._conn.SERVICE_OPTS)
+        if not re.lookupRenderingDef(pid, self._conn.SERVICE_OPTS):
+            re.resetDefaultSettings(True, self._conn.SERVICE_OPTS)
+            re.lookupRenderingDef(pid, self._conn.SERVICE_OPTS)
+        if rdid is not None:
+            re.loadRenderingDef(rdid, self._conn.SERVICE_OPTS)
+        re.load(self._conn.SERVICE_OPTS)
+        re.setCompressionLevel(0.9, self._conn.SERVICE_OPTS)
+        return re
+
+    def _prepareRenderingEngine(self, rdid=None):
+        if self._re is None:
+            self._re = self._prepareRE(rdid=rdid)
+        return self._re is not None
+
+    def getRenderingDefId(self):
+        self._prepareRenderingEngine()
+        return self._re.getRenderingDefId()
+
+    def getChannels(self, noRE=False):
+        if noRE:
+            self._query()
+            settings = self._server.rdefs[self.getPixelsId()].channels
+        else:
+            self._prepareRenderingEngine()
+            settings = self._re._rdef.channels
+            for c in range(len(settings)):
+                self._re.isActive(c)
+        return [FakeChannelWrapper(self._conn, ch, c, settings[c])
+                for c, ch in enumerate(self._pixels().copyChannels())]
+
+    def getChannelLabels(self):
+        return [c.getLabel() for c in self.getChannels()]
+
+    def getDefaultZ(self):
+        self._prepareRenderingEngine()
+        return self._re.getDefaultZ()
+
+    def getDefaultT(self):
+        self._prepareRenderingEngine()
+        return self._re.getDefaultT()
+
+    def setActiveChannels(self, channels, windows=None, colors=None,
+                          invertMaps=None, reverseMaps=None, noRE=False):
+        """1-based channel indices, as on ImageWrapper."""
+        self._prepareRenderingEngine()
+        for c in range(self.getSizeC()):
+            self._re.setActive(c, (c + 1) in channels)
+        for i, c in enumerate(channels):
+            if c < 0:
+                continue
+            idx = c - 1
+            if windows is not None and i < len(windows) and \
+                    windows[i] is not None and windows[i][0] is not None:
+                self._re.setChannelWindow(idx, float(windows[i][0]),
+                                          float(windows[i][1]))
+            if colors is not None and i < len(colors) and colors[i]:
+                r, g, b, a = _hex_to_rgba(colors[i])
+                self._re.setRGBA(idx, r, g, b, a)
+        return True
+
+    set_active_channels = setActiveChannels
+
+    def setGreyscaleRenderingModel(self):
+        self._prepareRenderingEngine()
+        self._re.setModel(_Model('greyscale'))
+
+    def setColorRenderingModel(self):
+        self._prepareRenderingEngine()
+        self._re.setModel(_Model('rgb'))
+
+    def isGreyscaleRenderingModel(self):
+        self._prepareRenderingEngine()
+        return self._re.getModel().getValue().val == 'greyscale'
+
+    def setProjection(self, proj):
+        self._pd = proj
+
+    def getProjection(self):
+        return self._pd
+
+    def setProjectionRange(self, start, end):
+        self._pr = (start, end)
+
+    def resetRDefs(self):
+        self._conn.getRenderingSettingsService().resetDefaultsInSet(
+            "Pixels", [self.getPixelsId()])
+        self._re = None
+        return True
+
+    def _plane_def(self, z, t, region=None):
+        plane_def = omero.romio.PlaneDef()
+        plane_def.z = int(z)
+        plane_def.t = int(t)
+        if region is not None:
+            r = omero.romio.RegionDef()
+            r.x, r.y, r.width, r.height = [int(v) for v in region]
+            plane_def.region = r
+        return plane_def
+
+    def renderJpeg(self, z=None, t=None, compression=0.9):
+        self._prepareRenderingEngine()
+        if z is None:
+            z = self._re.getDefaultZ()
+        if t is None:
+            t = self._re.getDefaultT()
+        algorithm = self.PROJECTIONS.get(self._pd)
+        if algorithm is not None:
+            start, end = self._pr or (0, self.getSizeZ() - 1)
+            return self._re.renderProjectedCompressed(
+                algorithm, t, 1, start, end, self._conn.SERVICE_OPTS)
+        return self._re.renderCompressed(self._plane_def(z, t),
+                                         self._conn.SERVICE_OPTS)
+
+    def renderImage(self, z, t, compression=0.9):
+        from PIL import Image
+        return Image.open(BytesIO(self.renderJpeg(z, t, compression)))
+
+    def renderJpegRegion(self, z, t, x, y, width, height, level=None,
+                         compression=0.9):
+        self._prepareRenderingEngine()
+        if level is not None:
+            self._re.setResolutionLevel(level)
+        return self._re.renderCompressed(
+            self._plane_def(z, t, (x, y, width, height)),
+            self._conn.SERVICE_OPTS)
+
+    def getThumbnail(self, size=(64, 64), z=None, t=None, direct=True):
+        store = self._conn.createThumbnailStore()
+        store.setPixelsId(self.getPixelsId())
+        if isinstance(size, (list, tuple)) and len(size) == 2:
+            return store.getThumbnail(rint(size[0]), rint(size[1]))
+        size = size[0] if isinstance(size, (list, tuple)) else size
+        return store.getThumbnailByLongestSide(rint(size))
+
+    def exportOmeTiff(self, bufsize=0):
+        """Planes in XYZCT order; stands in for the Exporter service."""
+        rps = self.getPrimaryPixels()._prepareRawPixelsStore()
+        planes = [(z, c, t) for t in range(self.getSizeT())
+                  for c in range(self.getSizeC())
+                  for z in range(self.getSizeZ())]
+
+        def gen():
+            try:
+                for z, c, t in planes:
+                    yield rps.getPlane(z, c, t)
+            finally:
+                rps.close()
+        pixels = self._pixels()
+        size = (len(planes) * pixels.sizeX.val * pixels.sizeY.val *
+                pixels.pixelsType.bitSize.val // 8)
+        return size, gen()
+
+
+WRAPPERS = {
+    "Project": FakeProjectWrapper,
+    "Dataset": FakeDatasetWrapper,
+    "Image": FakeImageWrapper,
+    "Screen": FakeScreenWrapper,
+    "Plate": FakePlateWrapper,
+    "Well": FakeWellWrapper,
+    "Pixels": FakePixelsWrapper,
+}
+
+
+# ---------------------------------------------------------------------------
+# Gateway
+# ---------------------------------------------------------------------------
+
+class FakeGateway(object):
+    """
+    BlitzGateway stand-in. Every ``get*Service()`` returns a fresh proxy
+    whose calls are logged on ``server.log``.
+    """
+
+    def __init__(self, server=None):
+        self.server = server if server is not None else FakeServer()
+        self.c = FakeClient(self.server)
+        self.SERVICE_OPTS = ServiceOptsDict()
+
+    @property
+    def log(self):
+        return self.server.log
+
+    def isConnected(self):
+        return True
+
+    def close(self, hard=True):
+        pass
+
+    def getUserId(self):
+        return 0
+
+    def isAdmin(self):
+        return True
+
+    def getGroupFromContext(self):
+        return None
+
+    def getMaxPlaneSize(self):
+        return self.server.max_plane_size
+
+    def getDownloadAsMaxSizeSetting(self):
+        return 144000000
+
+    # -- services --------------------------------------------------------
+
+    def getQueryService(self):
+        return self.c.sf.getQueryService()
+
+    def getUpdateService(self):
+        return self.c.sf.getUpdateService()
+
+    def getRoiService(self):
+        return self.c.sf.getRoiService()
+
+    def getPixelsService(self):
+        return self.c.sf.getPixelsService()
+
+    def getContainerService(self):
+        return self.c.sf.getContainerService()
+
+    def getRenderingSettingsService(self):
+        return self.c.sf.getRenderingSettingsService()
+
+    def createRawPixelsStore(self):
+        return self.c.sf.createRawPixelsStore()
+
+    def createRawFileStore(self):
+        return self.c.sf.createRawFileStore()
+
+    def createRenderingEngine(self):
+        return self.c.sf.createRenderingEngine()
+
+    def createThumbnailStore(self):
+        return self.c.sf.createThumbnailStore()
+
+    # -- objects ---------------------------------------------------------
+
+    def _wrap(self, obj_type, obj):
+        if obj_type in WRAPPERS:
+            return WRAPPERS[obj_type](self, obj)
+        if obj_type == "OriginalFile":
+            return OriginalFileWrapper(self, obj)
+        if obj_type.endswith("Annotation"):
+            return AnnotationWrapper._wrap(self, obj)
+        return BlitzObjectWrapper(self, obj)
+
+    def getObjects(self, obj_type, ids=None, params=None, attributes=None,
+                   opts=None):
+        objs = self.server.objects.get(obj_type, {})
+        if ids is not None:
+            found = [objs[i] for i in ids if i in objs]
+        else:
+            found = list(objs.values())
+        opts = opts or {}
+        for parent in ("dataset", "project", "screen", "plate"):
+            if parent in opts:
+                kind = "%s%s" % (parent.capitalize(), obj_type)
+                child_ids = set(self.server.children(kind, opts[parent]))
+                found = [o for o in found if o.id.val in child_ids]
+        if attributes:
+            for key, value in attributes.items():
+                found = [o for o in found
+                         if unwrap(getattr(o, key, None)) == value]
+        self.server.log.record("query", "findAllByQuery", rows=len(found))
+        return [self._wrap(obj_type, o) for o in found]
+
+    def getObject(self, obj_type, oid=None, params=None, attributes=None,
+                  opts=None):
+        ids = [int(unwrap(oid))] if oid is not None else None
+        result = self.getObjects(obj_type, ids, params, attributes, opts)
+        return result[0] if result else None
+
+    def getAnnotationLinks(self, parent_type, parent_ids=None, ann_ids=None,
+                           ns=None, params=None):
+        kind = "%sAnnotation" % parent_type
+        links = []
+        for link_id, (k, pid, aid) in list(self.server._link_index.items()):
+            if k != kind:
+                continue
+            if parent_ids is not None and pid not in parent_ids:
+                continue
+            if ann_ids is not None and aid not in ann_ids:
+                continue
+            link = self.server.link_object(link_id)
+            links.append(BlitzObjectWrapper(self, link))
+        self.server.log.record("query", "findAllByQuery", rows=len(links))
+        return links
+
+    def deleteObjects(self, graph_spec, obj_ids, deleteAnns=False,
+                      deleteChildren=False, dryRun=False, wait=False):
+        self.server.log.record("session", "submit")
+        if not dryRun:
+            for oid in obj_ids:
+                self.server.delete(graph_spec.split("/")[-1], oid)
+        return FakeHandle(self.server)
+
+    def createFileAnnfromLocalFile(self, localPath, origFilePathAndName=None,
+                                   mimetype=None, ns=None, desc=None):
+        import os
+        with open(localPath, "rb") as f:
+            data = f.read()
+        name = origFilePathAndName or os.path.basename(localPath)
+        update = self.getUpdateService()
+        orig = omero.model.OriginalFileI()
+        orig.name = rstring(os.path.basename(name))
+        orig.path = rstring(os.path.dirname(name))
+        orig.size = rlong(len(data))
+        orig.mimetype = rstring(mimetype or "application/octet-stream")
+        orig = update.saveAndReturnObject(orig)
+        rfs = self.createRawFileStore()
+        rfs.setFileId(orig.id.val)
+        rfs.write(data, 0, len(data))
+        orig = rfs.save()
+        rfs.close()
+        ann = omero.model.FileAnnotationI()
+        ann.file = omero.model.OriginalFileI(orig.id.val, False)
+        if ns is not None:
+            ann.ns = rstring(ns)
+        if desc is not None:
+            ann.description = rstring(desc)
+        ann = update.saveAndReturnObject(ann)
+        ann.file = orig
+        return AnnotationWrapper._wrap(self, ann)
+
+    def createImageFromNumpySeq(self, zctPlanes, imageName, sizeZ=1, sizeC=1,
+                                sizeT=1, description=None, dataset=None,
+                                sourceImageId=None, channelList=None):
+        """Same service calls as BlitzGateway.createImageFromNumpySeq()."""
+        query = self.getQueryService()
+        pixels_service = self.getPixelsService()
+        rps = self.c.sf.createRawPixelsStore()
+        container = self.getContainerService()
+        update = self.getUpdateService()
+
+        def create_image(first_plane, channel_list):
+            size_y, size_x = first_plane.shape
+            convert = None
+            if sourceImageId is not None:
+                if channel_list is None:
+                    channel_list = list(range(sizeC))
+                iid = pixels_service.copyAndResizeImage(
+                    sourceImageId, rint(size_x), rint(size_y), rint(sizeZ),
+                    rint(sizeT), channel_list, None, False, self.SERVICE_OPTS)
+                img = self.getObject("Image", iid.getValue())
+                ptype = img.getPrimaryPixels().getPixelsType().getValue()
+                if OMERO_NUMPY_TYPES[ptype] != first_plane.dtype.name:
+                    convert = OMERO_NUMPY_TYPES[ptype]
+                img._obj.setName(rstring(imageName))
+                update.saveObject(img._obj, self.SERVICE_OPTS)
+            else:
+                ptype = NUMPY_OMERO_TYPES.get(first_plane.dtype.name,
+                                              first_plane.dtype.name)
+                pixels_type = query.findByQuery(
+                    "from PixelsType as p where p.value='%s'" % ptype, None)
+                iid = pixels_service.createImage(
+                    size_x, size_y, sizeZ, sizeT, list(range(sizeC)),
+                    pixels_type, imageName, description, self.SERVICE_OPTS)
+            image = container.getImages("Image", [iid.getValue()], None,
+                                        self.SERVICE_OPTS)[0]
+            return image, convert
+
+        image = None
+        min_max = []
+        try:
+            for z in range(sizeZ):
+                for c in range(sizeC):
+                    for t in range(sizeT):
+                        plane = next(zctPlanes)
+                        if image is None:
+                            image, convert = create_image(plane, channelList)
+                            pixels_id = image.getPrimaryPixels().id.val
+                            rps.setPixelsId(pixels_id, True,
+                                            self.SERVICE_OPTS)
+                        if convert is not None:
+                            plane = plane.astype(convert)
+                        rps.setPlane(plane.byteswap().tobytes(), z, c, t,
+                                     self.SERVICE_OPTS)
+                        if len(min_max) < c + 1:
+                            min_max.append([plane.min(), plane.max()])
+                        else:
+                            min_max[c][0] = min(min_max[c][0], plane.min())
+                            min_max[c][1] = max(min_max[c][1], plane.max())
+        finally:
+            rps.close(self.SERVICE_OPTS)
+        try:
+            next(zctPlanes)
+        except StopIteration:
+            pass
+        for c, mm in enumerate(min_max):
+            pixels_service.setChannelGlobalMinMax(
+                pixels_id, c, float(mm[0]), float(mm[1]), self.SERVICE_OPTS)
+        if dataset:
+            link = omero.model.DatasetImageLinkI()
+            link.parent = omero.model.DatasetI(dataset.getId(), False)
+            link.child = omero.model.ImageI(image.id.val, False)
+            update.saveObject(link, self.SERVICE_OPTS)
+        return FakeImageWrapper(self, image)
+
+
+# ---------------------------------------------------------------------------
+# Shape helpers for populating ROIs
+# ---------------------------------------------------------------------------
+
+def _zt(shape, z, t):
+    if z is not None:
+        shape.theZ = rint(z)
+    if t is not None:
+        shape.theT = rint(t)
+    return shape
+
+
+def rectangle(x, y, width, height, z=None, t=None):
+    shape = omero.model.RectangleI()
+    shape.x, shape.y = rdouble(x), rdouble(y)
+    shape.width, shape.height = rdouble(width), rdouble(height)
+    return _zt(shape, z, t)
+
+
+def ellipse(x, y, radius_x, radius_y, z=None, t=None):
+    shape = omero.model.EllipseI()
+    shape.x, shape.y = rdouble(x), rdouble(y)
+    shape.radiusX, shape.radiusY = rdouble(radius_x), rdouble(radius_y)
+    return _zt(shape, z, t)
+
+
+def line(x1, y1, x2, y2, z=None, t=None):
+    shape = omero.model.LineI()
+    shape.x1, shape.y1 = rdouble(x1), rdouble(y1)
+    shape.x2, shape.y2 = rdouble(x2), rdouble(y2)
+    return _zt(shape, z, t)
+
+
+def point(x, y, z=None, t=None):
+    shape = omero.model.PointI()
+    shape.x, shape.y = rdouble(x), rdouble(y)
+    return _zt(shape, z, t)
+
+
+def mask(x, y, bits, z=None, t=None):
+    """A Mask at x, y of the 2D boolean array bits."""
+    bits = numpy.asarray(bits, bool)
+    shape = omero.model.MaskI()
+    shape.x, shape.y = rdouble(x), rdouble(y)
+    shape.height, shape.width = [rdouble(v) for v in bits.shape]
+    shape.bytes = numpy.packbits(bits.ravel()).tobytes()
+    return _zt(shape, z, t)
+
+
+def _points(points):
+    return rstring(" ".join("%s,%s" % p for p in points))
+
+
+def polyline(points, z=None, t=None):
+    shape = omero.model.PolylineI()
+    shape.points = _points(points)
+    return _zt(shape, z, t)
+
+
+def polygon(points, z=None, t=None):
+    shape = omero.model.PolygonI()
+    shape.points = _points(points)
+    return _zt(shape, z, t)
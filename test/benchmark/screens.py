@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2024 University of Muenster. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Synthetic high-content screens for the fake server.
+
+Fills a :class:`fake_gateway.FakeServer` with the Datasets that the plate
+scripts turn into Plates, named as the microscopes name their images, and
+with Screens of Plates, of any size up to 1536 wells::
+
+    server = fake.FakeServer()
+    dataset_id = add_plate_dataset(server, "scanr", wells=384, fields=4)
+    screen_id = add_screen(server, plates=2, wells=1536, key_values=True)
+
+Image names, for row 0, column 1 and field 0:
+
+- ``scanr``: ``A2--W00002--P00001--Z00000--T00000--DAPI.tif``, the row as
+  letters (A to AF on 1536-well plates) and the column from 1
+- ``columbus``: ``01002-1-DAPI.tif``, the row in two and the column in three
+  digits from 1, then the field
+
+The wells are filled row by row, in the smallest plate that holds them.
+"""
+
+# rows, columns
+PLATE_FORMATS = ((1, 1), (2, 3), (3, 4), (4, 6), (6, 8), (8, 12), (16, 24),
+                 (32, 48))
+
+NAMINGS = ("scanr", "columbus")
+
+
+def row_letters(row):
+    """0 -> 'A', 25 -> 'Z', 26 -> 'AA', 31 -> 'AF'."""
+    letters = ""
+    row += 1
+    while row:
+        row, rest = divmod(row - 1, 26)
+        letters = chr(ord("A") + rest) + letters
+    return letters
+
+
+def plate_format(wells):
+    """(rows, columns) of the smallest plate with at least wells."""
+    for rows, columns in PLATE_FORMATS:
+        if rows * columns >= wells:
+            return rows, columns
+    raise ValueError("No plate has %d wells" % wells)
+
+
+def well_positions(wells):
+    """(row, column) of wells, filled row by row."""
+    columns = plate_format(wells)[1]
+    return [divmod(i, columns) for i in range(wells)]
+
+
+def image_name(naming, row, column, field=0, channel="DAPI"):
+    """The name of the image of a field of a well, see the module doc."""
+    if naming == "scanr":
+        well = row * 48 + column + 1
+        return "%s%d--W%05d--P%05d--Z00000--T00000--%s.tif" % (
+            row_letters(row), column + 1, well, field + 1, channel)
+    if naming == "columbus":
+        return "%02d%03d-%d-%s.tif" % (row + 1, column + 1, field + 1,
+                                       channel)
+    raise ValueError("Unknown naming: %s" % naming)
+
+
+def add_plate_dataset(server, naming="scanr", wells=96, fields=1,
+                      name="plate_source", size=16):
+    """
+    A Dataset with the images of wells, fields images each.
+
+    :param naming:  'scanr' or 'columbus'
+    :param size:    Width and height of the images
+    :return:        The Dataset ID
+    """
+    dataset_id = server.add_dataset(name)
+    for row, column in well_positions(wells):
+        for field in range(fields):
+            server.add_image(image_name(naming, row, column, field), size,
+                             size, dataset_id=dataset_id)
+    return dataset_id
+
+
+def add_plate(server, name="plate", wells=96, fields=1, naming="scanr",
+              screen_id=None, size=16, key_values=False):
+    """
+    A Plate of wells with fields images each.
+
+    :param key_values:  Give each image a map annotation with its well and
+                        field
+    :return:            The Plate ID
+    """
+    plate_id = server.add_plate(name, screen_id)
+    for row, column in well_positions(wells):
+        image_ids = []
+        for field in range(fields):
+            image_id = server.add_image(
+                image_name(naming, row, column, field), size, size)
+            if key_values:
+                server.add_map_annotation("Image", image_id, [
+                    ("well", "%s%d" % (row_letters(row), column + 1)),
+                    ("field", str(field + 1))])
+            image_ids.append(image_id)
+        server.add_well(plate_id, row, column, image_ids)
+    return plate_id
+
+
+def add_screen(server, plates=1, wells=96, fields=1, naming="scanr",
+               name="screen", size=16, key_values=False):
+    """
+    A Screen of plates, see :func:`add_plate`.
+
+    :return:    The Screen ID
+    """
+    screen_id = server.add_screen(name)
+    for i in range(plates):
+        add_plate(server, "%s_plate_%d" % (name, i + 1), wells, fields,
+                  naming, screen_id, size, key_values)
+    return screen_id
+
+
+def plate_csv(server, plate_id, keys=("condition", "dose")):
+    """
+    Attach a KeyVal_from_csv table to the Plate, a row per image.
+
+    :return:    The CSV text
+    """
+    rows = [",".join(("image",) + tuple(keys))]
+    for well in server.wells(plate_id):
+        for sample in well.copyWellSamples():
+            image = server.get("Image", sample.image.id.val)
+            rows.append(",".join([image.name.val] + [
+                "%s_%d" % (key, image.id.val % 7) for key in keys]))
+    text = "\n".join(rows) + "\n"
+    server.add_file_annotation("Plate", plate_id, "metadata.csv", text,
+                               mimetype="text/csv")
+    return text
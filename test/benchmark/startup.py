@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2024 University of Muenster. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Time to parse each script, as the server does to list its parameters.
+
+Each script is parsed in a fresh interpreter that has already imported the
+OMERO client modules every script needs, so the time is what the script
+itself adds. The heavy modules it imports on the way are listed; they
+should be imported lazily, when the script runs.
+
+Usage::
+
+    python test/benchmark/startup.py
+    python test/benchmark/startup.py --budget 0.25 --json startup.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS = os.path.normpath(os.path.join(HERE, "..", "..", "omero"))
+
+# modules a script should not import before it runs
+HEAVY_MODULES = ("numpy", "PIL", "smtplib", "email", "subprocess",
+                 "ezomero", "pandas", "tables", "omero.util.script_utils",
+                 "omero.util.image_utils", "omero.util.figureUtil",
+                 "omero.util.roi_handling_utils", "omero.util.populate_roi")
+
+DEFAULT_BUDGET = 0.5
+
+# Run in the child. Uses omero.scripts.parse_file when the client provides
+# it, otherwise runs the script as __main__ up to scripts.client(), which
+# is what parse_file does. Scripts that need a server to list their
+# parameters report the error instead.
+CHILD = """
+import json, runpy, sys, time
+import omero, omero.gateway, omero.rtypes, omero.scripts as scripts
+path, heavy = sys.argv[1], tuple(sys.argv[2:])
+before = set(sys.modules)
+start = time.perf_counter()
+error = None
+parse_file = getattr(scripts, "parse_file", None)
+try:
+    if parse_file is not None:
+        parse_file(path)
+    else:
+        class Parsed(Exception):
+            pass
+
+        def client(*args, **kwargs):
+            raise Parsed()
+        scripts.client = client
+        try:
+            runpy.run_path(path, run_name="__main__")
+        except Parsed:
+            pass
+except Exception as e:
+    error = "%s: %s" % (type(e).__name__, e)
+seconds = time.perf_counter() - start
+loaded = sorted(m for m in set(sys.modules) - before
+                if any(m == h or m.startswith(h + ".") for h in heavy))
+print(json.dumps({"seconds": seconds, "heavy": loaded, "error": error}))
+"""
+
+
+def script_paths():
+    """The scripts under omero/, without the helper package."""
+    paths = []
+    for directory in sorted(os.listdir(SCRIPTS)):
+        if directory == "script_helpers":
+            continue
+        folder = os.path.join(SCRIPTS, directory)
+        if not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            if name.endswith(".py") and name != "__init__.py":
+                paths.append(os.path.join(folder, name))
+    return paths
+
+
+def parse_script(path):
+    """
+    Parse the script at path in a fresh interpreter.
+
+    :return:    dict of 'seconds' to parse, the 'heavy' modules imported
+                and the 'error' raised while parsing, if any
+    """
+    output = subprocess.check_output(
+        [sys.executable, "-c", CHILD, path] + list(HEAVY_MODULES),
+        cwd=os.path.dirname(path))
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+
+def heavy_root_modules(modules):
+    """The top-level names of modules, e.g. ['PIL'] for ['PIL.Image']."""
+    roots = []
+    for heavy in HEAVY_MODULES:
+        if any(m == heavy or m.startswith(heavy + ".") for m in modules):
+            roots.append(heavy)
+    return roots
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET,
+                        help="seconds a script may take to parse "
+                        "(default %(default)s)")
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args(argv)
+
+    results = {}
+    print("%-45s %8s  %s" % ("script", "seconds", "heavy imports"))
+    print("-" * 78)
+    for path in script_paths():
+        name = os.path.relpath(path, SCRIPTS)
+        result = parse_script(path)
+        results[name] = result
+        print("%-45s %8.3f  %s" % (name, result["seconds"], ", ".join(
+            heavy_root_modules(result["heavy"])) or "-"))
+        if result["error"]:
+            print("    %s" % result["error"])
+
+    over = [name for name, r in results.items()
+            if r["seconds"] > args.budget or r["heavy"]]
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if over:
+        print("\nOver budget (%ss) or importing heavy modules: %s"
+              % (args.budget, ", ".join(over)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
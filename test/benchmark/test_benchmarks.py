@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2024 University of Muenster. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+   Smoke tests of the in-memory fake server and the benchmark suite.
+"""
+
+import numpy
+import pytest
+
+import omero
+import fake_gateway as fake
+import benchmarks
+
+
+class TestFakeGateway(object):
+
+    def setup_method(self):
+        self.server = fake.FakeServer()
+        self.conn = fake.FakeGateway(self.server)
+
+    def test_get_plane_counts_calls_and_bytes(self):
+        iid = self.server.add_image("a", 32, 16, size_c=2)
+        pixels = self.conn.getObject("Image", iid).getPrimaryPixels()
+        self.server.log.reset()
+        plane = pixels.getPlane(0, 1, 0)
+        assert plane.shape == (16, 32)
+        assert self.server.log.calls["rps.getPlane"] == 1
+        assert self.server.log.calls["session.createRawPixelsStore"] == 1
+        assert self.server.log.bytes_down == 32 * 16 * 2
+        expected = fake.synthetic_plane(32, 16, 'uint16', iid, 0, 1, 0)
+        assert (plane == expected).all()
+
+    def test_create_image_round_trip(self):
+        planes = [numpy.full((8, 8), i, dtype=numpy.uint16)
+                  for i in range(3)]
+        image = self.conn.createImageFromNumpySeq(
+            iter(planes), "new", sizeZ=1, sizeC=3, sizeT=1)
+        assert self.server.log.calls["rps.setPlane"] == 3
+        assert self.server.log.bytes_up == 3 * 8 * 8 * 2
+        pixels = image.getPrimaryPixels()
+        assert pixels.getPlane(0, 2, 0)[0, 0] == 2
+
+    def test_unknown_query_raises(self):
+        with pytest.raises(omero.QueryException):
+            self.conn.getQueryService().findAllByQuery(
+                "select x from Nothing x", None)
+
+
+@pytest.mark.parametrize("name", list(benchmarks.BENCHMARKS))
+def test_benchmark_small(name):
+    pytest.importorskip("PIL")
+    result = benchmarks.run_benchmark(name, "small")
+    assert result.error is None
+    assert result.calls > 0
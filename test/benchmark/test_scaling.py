@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2024 University of Muenster. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+   Scaling tests of the plate scripts on synthetic screens: the server
+   calls and the objects they load may grow with the number of wells, but
+   no faster.
+"""
+
+import contextlib
+import io
+
+import pytest
+
+import benchmarks
+import fake_gateway as fake
+import screens
+
+# well counts the scripts run at
+WELLS = (24, 96)
+
+TO_PLATE = [
+    ("util_scripts/Dataset_To_Plate.py", "scanr"),
+    ("util_scripts/MiN_Dataset to Plate (ScanR).py", "scanr"),
+    ("util_scripts/MiN_Dataset to Plate (Columbus).py", "columbus"),
+]
+
+
+def measure(populate, run, wells):
+    """(calls, rows) of run(conn, populate(server, wells))."""
+    server = fake.FakeServer()
+    conn = fake.FakeGateway(server)
+    setup = populate(server, wells)
+    server.log.reset()
+    with contextlib.redirect_stdout(io.StringIO()):
+        run(conn, setup)
+    return server.log.total, server.log.rows
+
+
+def assert_linear(populate, run):
+    """The calls and rows of run grow at most in proportion to wells."""
+    counts = dict((wells, measure(populate, run, wells)) for wells in WELLS)
+    small, large = WELLS
+    for name, few, many in zip(("calls", "rows"), counts[small],
+                               counts[large]):
+        assert many * small <= few * large, \
+            "%s: %d at %d wells, %d at %d wells" % (name, few, small, many,
+                                                    large)
+
+
+def plate_params(fields, dataset_id):
+    return {"Data_Type": "Dataset", "IDs": [dataset_id],
+            "Images_Per_Well": fields, "First_Axis": "column",
+            "First_Axis_Count": 12, "Column_Names": "number",
+            "Row_Names": "letter", "Screen": "screen",
+            "Remove_From_Dataset": True,
+            "Dataset_integration_into_existing_Plate": 0}
+
+
+class TestScreens(object):
+
+    def test_names(self):
+        assert [screens.row_letters(r) for r in (0, 25, 26, 31)] == \
+            ["A", "Z", "AA", "AF"]
+        assert screens.plate_format(96) == (8, 12)
+        assert screens.plate_format(97) == (16, 24)
+        assert screens.plate_format(1536) == (32, 48)
+        with pytest.raises(ValueError):
+            screens.plate_format(1537)
+        assert screens.image_name("scanr", 31, 47, 2) == \
+            "AF48--W01536--P00003--Z00000--T00000--DAPI.tif"
+        assert screens.image_name("columbus", 0, 1) == "01002-1-DAPI.tif"
+
+    def test_add_screen(self):
+        server = fake.FakeServer()
+        screen_id = screens.add_screen(server, plates=2, wells=30,
+                                       fields=3, key_values=True)
+        plate_ids = server.children("ScreenPlate", screen_id)
+        assert len(plate_ids) == 2
+        wells = server.wells(plate_ids[0])
+        assert len(wells) == 30
+        # filled row by row, in a 48-well plate
+        assert (wells[-1].row.val, wells[-1].column.val) == (3, 5)
+        assert len(wells[0].copyWellSamples()) == 3
+        assert len(server.objects["MapAnnotation"]) == 2 * 30 * 3
+
+        text = screens.plate_csv(server, plate_ids[0])
+        assert len(text.splitlines()) == 1 + 30 * 3
+
+
+class TestScaling(object):
+
+    @pytest.mark.parametrize("script_path, naming", TO_PLATE)
+    def test_dataset_to_plate(self, script_path, naming):
+        script = benchmarks.load_script(script_path)
+
+        def populate(server, wells):
+            return screens.add_plate_dataset(server, naming, wells, fields=2)
+
+        def run(conn, dataset_id):
+            script.datasets_to_plates(conn, plate_params(2, dataset_id))
+
+        assert_linear(populate, run)
+
+    @pytest.mark.parametrize("script_path, naming", TO_PLATE[1:])
+    def test_min_plate_positions(self, script_path, naming):
+        script = benchmarks.load_script(script_path)
+        server = fake.FakeServer()
+        conn = fake.FakeGateway(server)
+        dataset_id = screens.add_plate_dataset(server, naming, 1536)
+        with contextlib.redirect_stdout(io.StringIO()):
+            script.datasets_to_plates(conn, plate_params(1, dataset_id))
+        plate_id = max(server.objects["Plate"])
+        positions = [(w.row.val, w.column.val)
+                     for w in server.wells(plate_id)]
+        assert sorted(positions) == screens.well_positions(1536)
+        # one listing of the new plate's wells, not one per well
+        assert server.log.rows < 2 * 1536 + 10
+
+    def test_move_annotations(self):
+        script = benchmarks.load_script("util_scripts/Move_Annotations.py")
+
+        def populate(server, wells):
+            return screens.add_screen(server, wells=wells, fields=2,
+                                      key_values=True)
+
+        def run(conn, screen_id):
+            script.move_annotations(conn, {
+                "Data_Type": "Screen", "IDs": [screen_id],
+                "Annotation_Type": "All",
+                "Remove_Annotations_From_Images": True})
+
+        assert_linear(populate, run)
+
+    def test_keyval_from_csv(self):
+        script = benchmarks.load_script(
+            "annotation_scripts/KeyVal_from_csv.py")
+
+        def populate(server, wells):
+            screen_id = screens.add_screen(server, plates=2, wells=wells)
+            plate_ids = server.children("ScreenPlate", screen_id)
+            for plate_id in plate_ids:
+                screens.plate_csv(server, plate_id)
+            return plate_ids
+
+        def run(conn, plate_ids):
+            script.keyval_from_csv(conn, {"Data_Type": "Plate",
+                                          "IDs": plate_ids})
+
+        assert_linear(populate, run)
+
+    def test_plate_to_dataset(self):
+        pytest.importorskip("ezomero")
+        script = benchmarks.load_script("util_scripts/MiN_Plate to Dataset.py")
+
+        def populate(server, wells):
+            screen_id = screens.add_screen(server, wells=wells, fields=2)
+            return server.children("ScreenPlate", screen_id)[0]
+
+        def run(conn, plate_id):
+            script.plate_to_dataset(conn, {"Plate_ID": plate_id})
+
+        assert_linear(populate, run)
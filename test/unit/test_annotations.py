@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+   Tests of omero.script_helpers.annotations
+   Copyright 2024 University of Muenster. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+"""
+
+import pytest
+
+import benchmarks
+import fake_gateway as fake
+from omero.script_helpers.annotations import (build_query, load_annotations,
+                                              map_values, of_type)
+
+
+class TestAnnotations(object):
+
+    def setup_method(self):
+        self.server = fake.FakeServer()
+        self.conn = fake.FakeGateway(self.server)
+        self.dataset = self.server.add_dataset("kv")
+        self.images = [self.server.add_image("img_%d.tif" % i, 8, 8,
+                                             dataset_id=self.dataset)
+                       for i in range(3)]
+        first, second, _ = self.images
+        self.server.add_map_annotation("Image", first, [("dose", "1")])
+        self.server.add_map_annotation("Image", first,
+                                       [("dose", "2"), ("cell", "HeLa")],
+                                       ns="other")
+        self.server.add_file_annotation("Image", second, "notes.txt", "x")
+        self.server.add_map_annotation("Image", second, [("dose", "3")])
+
+    def queries(self):
+        return self.server.log.calls.get("query.findAllByQuery", 0)
+
+    def test_load_annotations(self):
+        first, second, third = self.images
+        annotations = load_annotations(self.conn, "Image", self.images)
+        assert list(annotations) == self.images
+        assert [a["type"] for a in annotations[second]] == \
+            ["FileAnnotation", "MapAnnotation"]
+        assert annotations[third] == []
+        assert annotations[second][0]["file_name"] == "notes.txt"
+        assert annotations[first][1]["ns"] == "other"
+        assert annotations[first][1]["values"] == [["dose", "2"],
+                                                   ["cell", "HeLa"]]
+        # the links, and the files
+        assert self.queries() == 2
+
+        assert map_values(annotations[first]) == {"dose": {"1", "2"},
+                                                  "cell": {"HeLa"}}
+        assert len(of_type(annotations[second], "FileAnnotation")) == 1
+
+    def test_filters(self):
+        first, second, _ = self.images
+        maps = load_annotations(self.conn, "Image", self.images,
+                                types=("MapAnnotation",))
+        assert [len(maps[i]) for i in self.images] == [2, 1, 0]
+        other = load_annotations(self.conn, "Image", self.images, ns="other")
+        assert [a["id"] for a in other[first]] == [maps[first][1]["id"]]
+        assert other[second] == []
+        assert self.queries() == 2
+        assert load_annotations(self.conn, "Image", []) == {}
+        assert self.queries() == 2
+        with pytest.raises(ValueError):
+            build_query("Image", types=("Annotation",))
+
+    def test_keyval_scripts(self):
+        rows = ["image,dose"] + ["img_%d.tif,%d" % (i, 10 * i)
+                                 for i in range(3)]
+        self.server.add_file_annotation("Dataset", self.dataset, "kv.csv",
+                                        "\n".join(rows) + "\n")
+        script = benchmarks.load_script(
+            "annotation_scripts/KeyVal_from_csv.py")
+        params = {"Data_Type": "Dataset", "IDs": [self.dataset]}
+        script.keyval_from_csv(self.conn, params)
+        # the Dataset, its files, its Images and their key-values, not a
+        # query per Image
+        assert self.queries() == 5
+
+        dataset = self.conn.getObject("Dataset", self.dataset)
+        assert script.get_original_file(dataset).name.val == "kv.csv"
+        annotations = load_annotations(self.conn, "Image", self.images)
+        assert map_values(annotations[self.images[0]]) == \
+            {"dose": {"0", "1", "2"}, "cell": {"HeLa"}}
+        assert map_values(annotations[self.images[2]]) == {"dose": {"20"}}
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+   Tests of omero.script_helpers.batch_runner
+   Copyright 2024 University of Muenster. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+"""
+
+import json
+import os
+
+import pytest
+
+import fake_gateway as fake
+import screens
+from omero.script_helpers import batch_runner, process_pool
+from omero.script_helpers.batch_runner import parse_jobs, read_jobs, run_jobs
+
+TO_PLATE = "util_scripts/Dataset_To_Plate.py"
+
+
+def plate_job(name, dataset_id, **kwargs):
+    job = {"name": name, "script": TO_PLATE,
+           "function": "datasets_to_plates", "script_defaults": False,
+           "params": {"IDs": [dataset_id], "Images_Per_Well": 2,
+                      "First_Axis": "column", "First_Axis_Count": 12,
+                      "Column_Names": "number", "Row_Names": "letter"}}
+    job.update(kwargs)
+    return job
+
+
+class TestBatchRunner(object):
+
+    def setup_method(self):
+        self.server = fake.FakeServer()
+        self.conn = fake.FakeGateway(self.server)
+        self.lines = []
+
+    def run(self, data, tmp_path):
+        return run_jobs(self.conn, parse_jobs(data), workers=1,
+                        log_dir=str(tmp_path / "logs"),
+                        out=self.lines.append)
+
+    def test_parse_jobs(self, tmp_path):
+        data = {"params": {"Data_Type": "Dataset"},
+                "jobs": [plate_job(None, 1), plate_job("b", 2, after="job-1")]}
+        path = tmp_path / "jobs.json"
+        path.write_text(json.dumps(data))
+        jobs = read_jobs(str(path))
+        assert [j["name"] for j in jobs] == ["job-1", "b"]
+        assert jobs[1]["after"] == ["job-1"]
+        assert jobs[0]["params"]["Data_Type"] == "Dataset"
+
+        with pytest.raises(ValueError):
+            parse_jobs([plate_job("a", 1), plate_job("a", 2)])
+        with pytest.raises(ValueError):
+            parse_jobs([plate_job("a", 1, after=["c"])])
+        with pytest.raises(ValueError):
+            parse_jobs([{"name": "a", "script": TO_PLATE}])
+
+    def test_yaml(self, tmp_path):
+        pytest.importorskip("yaml")
+        path = tmp_path / "jobs.yaml"
+        path.write_text("jobs:\n"
+                        "  - script: %s\n"
+                        "    function: datasets_to_plates\n"
+                        "    params: {IDs: [3, 4]}\n" % TO_PLATE)
+        job, = read_jobs(str(path))
+        assert job["params"] == {"IDs": [3, 4]}
+        assert job["script_defaults"] is True
+
+    def test_run_jobs(self, tmp_path):
+        datasets = [screens.add_plate_dataset(self.server, "scanr", 4, 2)
+                    for _ in range(2)]
+        results = self.run({"params": {"Data_Type": "Dataset"},
+                            "jobs": [plate_job("a", datasets[0]),
+                                     plate_job("b", datasets[1],
+                                               after=["a"])]}, tmp_path)
+        assert [r["name"] for r in results] == ["a", "b"]
+        assert [r["status"] for r in results] == ["ok", "ok"]
+        assert "New plate created" in results[0]["message"]
+        assert len(self.server.objects["Plate"]) == 2
+        assert self.lines[0].startswith("[1/2] a ok in ")
+        # the output of the script goes to its log
+        assert os.path.getsize(results[1]["log"]) > 0
+        json.dumps(results)
+
+    def test_failed_and_skipped(self, tmp_path):
+        cwd = os.getcwd()
+        dataset_id = screens.add_plate_dataset(self.server, "scanr", 4, 2)
+        results = self.run([
+            plate_job("bad", dataset_id, function="no_such_function"),
+            plate_job("after-bad", dataset_id, after=["bad"]),
+            plate_job("x", dataset_id, after=["y"]),
+            plate_job("y", dataset_id, after=["x"]),
+            # no Data_Type, and no defaults to fill it in
+            plate_job("no-type", dataset_id)], tmp_path)
+        by_name = dict((r["name"], r) for r in results)
+        status = dict((name, r["status"]) for name, r in by_name.items())
+        assert status == {"bad": "failed", "after-bad": "skipped",
+                          "x": "skipped", "y": "skipped",
+                          "no-type": "failed"}
+        bad = by_name["bad"]
+        assert bad["error"].startswith("AttributeError")
+        with open(bad["log"]) as f:
+            assert "Traceback" in f.read()
+        assert by_name["no-type"]["error"] == "KeyError: 'Data_Type'"
+        # the jobs ran in their own directories
+        assert os.getcwd() == cwd
+
+    def test_workers_join_in_group(self, monkeypatch):
+        self.conn.SERVICE_OPTS.setOmeroGroup(5)
+        properties, session_id, group = batch_runner.worker_args(self.conn)
+        assert session_id == "fake-session" and group == "5"
+
+        joined = []
+
+        def join_session(properties, session_id):
+            joined.append((properties, session_id))
+            return fake.FakeGateway(self.server)
+
+        # the job workers join as those of map_images do
+        monkeypatch.setattr(process_pool, "join_session", join_session)
+        monkeypatch.setattr(process_pool, "_conn", None)
+        process_pool._init_worker(properties, session_id, group)
+        assert joined == [({"omero.host": "fake"}, "fake-session")]
+        assert process_pool._conn.SERVICE_OPTS.getOmeroGroup() == "5"
+
+    @pytest.mark.parametrize("key, hard", [(None, True), ("uuid", False)])
+    def test_main_closes_own_session(self, tmp_path, monkeypatch, key,
+                                     hard):
+        closed = []
+        self.conn.close = lambda hard=True: closed.append(hard)
+        monkeypatch.setattr(batch_runner, "connect", lambda args: self.conn)
+        dataset_id = screens.add_plate_dataset(self.server, "scanr", 4, 2)
+        path = tmp_path / "jobs.json"
+        path.write_text(json.dumps([plate_job("a", dataset_id)]))
+        argv = [str(path), "--jobs", "1", "--log-dir", str(tmp_path)]
+        if key:
+            argv += ["--key", key]
+        # the job fails without a Data_Type
+        assert batch_runner.main(argv) == 1
+        # a joined session is left open for its owner
+        assert closed == [hard]
+
+    def test_main_reads_jobs(self, tmp_path, capsys):
+        path = tmp_path / "jobs.json"
+        path.write_text(json.dumps([{"name": "a", "script": TO_PLATE}]))
+        with pytest.raises(SystemExit):
+            batch_runner.main([str(path)])
+        assert "Job a has no function" in capsys.readouterr().err
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+   Tests of omero.script_helpers.batch_writer
+   Copyright 2024 University of Muenster. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+"""
+
+import omero
+from omero.rtypes import rstring
+
+import fake_gateway as fake
+from omero.script_helpers.batch_writer import BatchWriter
+
+
+def new_dataset(name):
+    dataset = omero.model.DatasetI()
+    dataset.name = rstring(name)
+    return dataset
+
+
+class TestBatchWriter(object):
+
+    def setup_method(self):
+        self.server = fake.FakeServer()
+        self.conn = fake.FakeGateway(self.server)
+
+    def test_saves_in_chunks(self):
+        saved = []
+        with BatchWriter(self.conn, chunk_size=4) as writer:
+            for i in range(10):
+                writer.add(new_dataset("d%d" % i), saved.append)
+            assert writer.saved == 8            # two full chunks so far
+        assert writer.saved == 10
+        assert self.server.log.calls["update.saveArray"] == 3
+        assert [d.name.val for d in saved] == ["d%d" % i for i in range(10)]
+        assert len(self.server.objects["Dataset"]) == 10
+
+    def test_bisects_failed_chunk(self, monkeypatch):
+        save_array = fake.FakeUpdateService.saveAndReturnArray
+
+        def fail_on_bad(service, objs, ctx=None):
+            if any(o.name.val == "bad" for o in objs):
+                raise omero.ValidationException(None, None, "bad name")
+            return save_array(service, objs, ctx)
+        monkeypatch.setattr(fake.FakeUpdateService, "saveAndReturnArray",
+                            fail_on_bad)
+        names = ["d0", "d1", "bad", "d3", "d4", "d5", "d6", "d7"]
+        with BatchWriter(self.conn, return_objects=True) as writer:
+            for name in names:
+                writer.add(new_dataset(name))
+        assert writer.saved == 7
+        assert [d.name.val for d in writer.results] == \
+            [n for n in names if n != "bad"]
+        assert all(d.id is not None for d in writer.results)
+        (obj, error), = writer.failed
+        assert obj.name.val == "bad"
+        # 8 -> 4 + 4 -> 2 + 2 -> 1 + 1
+        assert writer.calls == 7
+        assert "7 objects in 7 calls, 1 failed" in writer.report()
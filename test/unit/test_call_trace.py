@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+   Tests of omero.script_helpers.call_trace
+   Copyright 2024 University of Muenster. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+"""
+
+import numpy
+
+import omero
+from omero.rtypes import rlong, rstring
+
+import fake_gateway as fake
+from omero.script_helpers.call_trace import CallTrace, summarize
+from omero.script_helpers.instrumentation import Timings
+
+
+def read_planes(conn, pixel_ids):
+    rps = conn.createRawPixelsStore()
+    for pid in pixel_ids:
+        rps.setPixelsId(pid, True)
+        rps.getPlane(0, 0, 0)
+    rps.close()
+
+
+class TestCallTrace(object):
+
+    def test_summarize(self):
+        assert summarize(b"x" * 10) == "<10 bytes>"
+        assert summarize(numpy.zeros((2, 3), numpy.uint8)) == \
+            "<array 2x3 uint8>"
+        assert summarize(omero.model.RoiI(7, False)) == "Roi:7"
+        assert summarize(rstring("a" * 100), 10) == "'aaaaaa..."
+        assert summarize(list(range(10))) == "[10 items]"
+        params = omero.sys.ParametersI()
+        params.add("ids", rlong(1))
+        assert summarize(params) == "params(ids)"
+
+    def test_skipped_modules(self):
+        trace = CallTrace()
+        assert trace.skipped("omero.util")
+        assert trace.skipped("omero.util.script_utils")
+        assert not trace.skipped("omero.util_scripts.Combine_Images")
+        assert not trace.skipped("omero.gateway_extras")
+
+    def test_calls_ranked_by_site(self):
+        server = fake.FakeServer(latency=0.001)
+        conn = fake.FakeGateway(server)
+        pixel_ids = [server.get("Image", server.add_image(
+            "%d.tif" % i, 8, 8)).getPrimaryPixels().id.val
+            for i in range(5)]
+        trace = CallTrace(skip=("fake_gateway",))
+        Timings(trace).watch(conn)
+        read_planes(conn, pixel_ids)
+        conn.getQueryService().find("Image", 1)
+
+        # one site per line: createRawPixelsStore, setPixelsId, getPlane,
+        # close, then find
+        sites = trace.ranked()
+        assert len(sites) == 5
+        assert sites[0].site.startswith("test_call_trace.py:")
+        assert sites[0].site.endswith(" read_planes")
+        assert sites[0].calls == 5
+        plane_site, = [s for s in sites
+                       if s.methods["RawPixelsStore.getPlane"]]
+        assert plane_site.calls == 5
+        assert plane_site.nbytes == 5 * 8 * 8 * 2
+        record = trace.records[2]
+        assert record['method'] == "RawPixelsStore.getPlane"
+        assert record['args'] == ["0", "0", "0"]
+        assert "read_planes" in trace.report()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+   Tests of omero.script_helpers.hierarchy against the in-memory fake server.
+   Copyright 2024 University of Muenster. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+"""
+
+import contextlib
+import io
+
+import pytest
+
+import benchmarks
+import fake_gateway as fake
+import screens
+from omero.script_helpers.hierarchy import (grid_label, resolve_images,
+                                            ImageSelection)
+
+
+class TestHierarchy(object):
+
+    def setup_method(self):
+        self.server = fake.FakeServer()
+        self.conn = fake.FakeGateway(self.server)
+
+    def add_plate(self, rows, columns, fields):
+        plate_id = self.server.add_plate("plate")
+        for row in range(rows):
+            for column in range(columns):
+                ids = [self.server.add_image("%d_%d_%d.tif" % (row, column, f),
+                                             8, 8)
+                       for f in range(fields)]
+                self.server.add_well(plate_id, row, column, ids)
+        return plate_id
+
+    def test_grid_label(self):
+        assert grid_label(0, "letter") == "A"
+        assert grid_label(27, "letter") == "AB"
+        assert grid_label(11, "number") == "12"
+
+    def test_plate_is_one_query(self):
+        plate_id = self.add_plate(4, 6, 3)
+        self.server.log.reset()
+        selection = resolve_images(self.conn, "Plate", [plate_id])
+        assert self.server.log.total == 1
+        assert len(selection) == 4 * 6 * 3
+        assert len(selection.images_by_parent()) == 4 * 6
+        assert list(selection.wells_by_label())[:2] == ["A1", "A2"]
+        assert selection.names[0] == "0_0_0.tif"
+        assert (selection.pixels_ids > 0).all()
+
+    def test_project_with_name_filter(self):
+        project_id = self.server.add_project("p")
+        for d in range(2):
+            dataset_id = self.server.add_dataset("d%d" % d, project_id)
+            for name in ("a_%d.tif", "b_%d.tif", "a%%_%d.tif"):
+                self.server.add_image(name % d, 8, 8, dataset_id=dataset_id)
+        selection = resolve_images(self.conn, "Project", [project_id],
+                                   name_filter="a_")
+        assert sorted(selection.names) == ["a_0.tif", "a_1.tif"]
+        assert len(set(selection.dataset_ids.tolist())) == 2
+        assert (selection.well_ids == -1).all()
+        images = selection.load_images(self.conn)
+        assert [i.getName() for i in images] == selection.names
+
+    @pytest.mark.parametrize("script_path, naming", [
+        ("util_scripts/Dataset_To_Plate.py", "scanr"),
+        ("util_scripts/MiN_Dataset to Plate (ScanR).py", "scanr"),
+        ("util_scripts/MiN_Dataset to Plate (Columbus).py", "columbus")])
+    def test_scripts_filter_names(self, script_path, naming):
+        script = benchmarks.load_script(script_path)
+
+        def rows_loaded(others):
+            server = fake.FakeServer()
+            dataset_id = screens.add_plate_dataset(server, naming, 4)
+            for i in range(others):
+                server.add_image("other_%d.tif" % i, 8, 8,
+                                 dataset_id=dataset_id)
+            server.log.reset()
+            with contextlib.redirect_stdout(io.StringIO()):
+                script.datasets_to_plates(fake.FakeGateway(server), {
+                    "Data_Type": "Dataset", "IDs": [dataset_id],
+                    "Filter_Names": "DAPI", "Images_Per_Well": 1,
+                    "First_Axis": "column", "First_Axis_Count": 12,
+                    "Column_Names": "number", "Row_Names": "letter",
+                    "Dataset_integration_into_existing_Plate": 0})
+            plate_id = max(server.objects["Plate"])
+            assert len(server.wells(plate_id)) == 4
+            return server.log.rows
+
+        # the images that do not match are only listed once, to check that
+        # none of the dataset is in a well yet, not loaded to be filtered
+        assert rows_loaded(20) <= rows_loaded(0) + 20
+
+    def test_combine_images_filter_names(self):
+        script = benchmarks.load_script("util_scripts/Combine_Images.py")
+        dataset_id = self.server.add_dataset("d")
+        for name in ("c0.tif", "c1.tif", "other.tif"):
+            self.server.add_image(name, 8, 8, dataset_id=dataset_id)
+        with contextlib.redirect_stdout(io.StringIO()):
+            images, _ = script.combine_images(self.conn, {
+                "Data_Type": "Dataset", "IDs": [dataset_id],
+                "Filter_Names": "c", "Auto_Define_Dimensions": False,
+                "Manually_Define_Dimensions": True,
+                "Dimension_1": "C", "Dimension_2": "Z", "Dimension_3": "T",
+                "Channel_Names": []})
+        image, = images
+        assert image.getPrimaryPixels().getSizeC().val == 2
+
+    def test_unknown_type(self):
+        with pytest.raises(ValueError):
+            resolve_images(self.conn, "Roi", [1])
+        assert len(ImageSelection("Image")) == 0
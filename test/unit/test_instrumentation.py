@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+   Tests of omero.script_helpers.instrumentation
+   Copyright 2024 University of Muenster. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+"""
+
+import json
+
+import fake_gateway as fake
+from omero.script_helpers import instrumentation
+from omero.script_helpers.call_trace import ENV_TRACE
+from omero.script_helpers.instrumentation import (ENV_CALLS, ENV_JSON,
+                                                  NAMESPACE, CountingService,
+                                                  Timings, watch_calls)
+
+
+class FakeScriptClient(object):
+
+    def __init__(self):
+        self.outputs = {}
+
+    def setOutput(self, key, value):
+        self.outputs[key] = value
+
+
+class TestTimings(object):
+
+    def setup_method(self):
+        self.server = fake.FakeServer()
+        self.conn = fake.FakeGateway(self.server)
+        self.image_id = self.server.add_image("a.tif", 16, 16, size_c=2)
+
+    def test_phases_and_counters(self):
+        timings = Timings()
+        for i in range(3):
+            with timings.phase("render"):
+                with timings.phase("write"):
+                    timings.count("planes")
+        data = timings.as_dict()
+        assert list(data['phases']) == ["write", "render"]
+        assert data['phases']['render']['count'] == 3
+        assert data['counters'] == {'planes': 3}
+        assert "render:" in timings.summary()
+
+    def test_watch_counts_calls_and_bytes(self):
+        session = self.conn.c.sf
+        timings = Timings()
+        timings.watch(self.conn)
+        timings.watch(self.conn)        # only wrapped once
+        # the Ice session is left alone
+        assert self.conn.c.sf is session
+        pixels = self.conn.getObject("Image", self.image_id) \
+            .getPrimaryPixels()
+        self.server.log.reset()
+        rps = self.conn.createRawPixelsStore()
+        rps.setPixelsId(pixels.getId(), True)
+        rps.getPlane(0, 1, 0)
+        rps.close()
+        assert timings.calls["RawPixelsStore.getPlane"] == 1
+        assert timings.calls["ServiceFactory.createRawPixelsStore"] == 1
+        assert timings.bytes_down == self.server.log.bytes_down == 16 * 16 * 2
+
+    def test_watch_unwraps_arguments(self):
+        timings = Timings()
+        timings.watch(self.conn)
+        query = self.conn.getQueryService()
+        assert isinstance(query, CountingService)
+        assert type(query) is CountingService
+        passed = []
+        store = CountingService(self.conn.createRawFileStore(), "Store",
+                                timings)
+        store._service.keep = passed.append
+        store.keep(query)
+        # only the service itself is handed on
+        assert passed == [query._service]
+
+    def test_watch_calls_opt_in(self, monkeypatch):
+        monkeypatch.setattr(instrumentation, "_timings", None)
+        monkeypatch.delenv(ENV_CALLS, raising=False)
+        monkeypatch.delenv(ENV_TRACE, raising=False)
+        watch_calls(self.conn)
+        self.conn.getQueryService().find("Image", self.image_id)
+        timings = instrumentation.get_timings()
+        assert not timings.watching and not timings.calls
+        assert "Server calls" not in timings.summary()
+
+        monkeypatch.setenv(ENV_CALLS, "1")
+        watch_calls(self.conn)
+        self.conn.getQueryService().find("Image", self.image_id)
+        assert timings.calls["QueryService.find"] == 1
+        assert "Server calls: 1" in timings.summary()
+
+    def test_output_and_json(self, monkeypatch, tmpdir):
+        monkeypatch.chdir(tmpdir)
+        timings = Timings()
+        with timings.phase("zip"):
+            pass
+        client = FakeScriptClient()
+        timings.set_output(client)
+        assert "zip:" in client.outputs["Timings"].getValue()
+
+        image = self.conn.getObject("Image", self.image_id)
+        monkeypatch.delenv(ENV_JSON, raising=False)
+        assert timings.attach_json(self.conn, image) is None
+        monkeypatch.setenv(ENV_JSON, "1")
+        timings.attach_json(self.conn, image)
+        ann, = image.listAnnotations(ns=NAMESPACE)
+        rfs = self.conn.createRawFileStore()
+        rfs.setFileId(ann._obj.file.id.val)
+        data = json.loads(rfs.read(0, rfs.size()).decode())
+        assert data['phases']['zip']['count'] == 1
+        assert tmpdir.listdir() == []
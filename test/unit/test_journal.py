@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+   Tests of omero.script_helpers.journal
+   Copyright 2024 University of Muenster. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+"""
+
+import os
+import socket
+import time
+
+import pytest
+
+import omero
+
+import benchmarks
+import fake_gateway as fake
+from omero.script_helpers.journal import (ENV_JOURNAL_DIR, LOCK_SUFFIX,
+                                          Journal, close_journals,
+                                          open_journal, prune_journals)
+
+
+class TestJournal(object):
+
+    @pytest.fixture(autouse=True)
+    def journal_dir(self, tmpdir, monkeypatch):
+        self.root = str(tmpdir)
+        monkeypatch.setenv(ENV_JOURNAL_DIR, self.root)
+
+    def test_resume(self):
+        journal = Journal("script", {"IDs": [1, 2]})
+        journal.record(1, ["a.png"])
+        journal.record((2, "A1"))
+        journal.close()
+        resumed = Journal("script", {"IDs": [1, 2]}, resume=True)
+        assert resumed.resumed and len(resumed) == 2
+        assert resumed.get(1) == ["a.png"]
+        assert resumed.done([2, "A1"])
+        # other parameters, or no resume, start afresh
+        assert not Journal("script", {"IDs": [1]}, resume=True).done(1)
+        assert not Journal("script", {"IDs": [1, 2]}).done(1)
+
+    def test_ignores_torn_line(self):
+        journal = Journal("script", "key")
+        journal.record("done")
+        journal.close()
+        with open(journal.path, "a") as f:
+            f.write('{"unit": "half')
+        resumed = Journal("script", "key", resume=True)
+        assert resumed.done("done") and len(resumed) == 1
+
+    def test_finish_and_prune(self):
+        journal = Journal("script", "key")
+        journal.finish()
+        assert not os.path.exists(journal.directory)
+        old = Journal("script", "old")
+        old.close()
+        stale = time.time() - 8 * 24 * 3600
+        os.utime(old.path, (stale, stale))
+        prune_journals(self.root)
+        assert not os.path.exists(old.directory)
+
+    def test_second_run_gets_own_directory(self):
+        first = Journal("script", "key")
+        first.record(1)
+        second = Journal("script", "key", resume=True)
+        assert first.shared and not second.shared
+        assert not second.resumed and second.directory != first.directory
+        second.record(2)
+        second.finish()
+        # the first run's journal is left alone
+        assert os.path.exists(first.path) and first.done(1)
+        first.close()
+        resumed = Journal("script", "key", resume=True)
+        assert resumed.shared and resumed.resumed and resumed.done(1)
+        resumed.finish()
+        assert os.listdir(self.root) == []
+
+    def test_takes_over_stale_lock(self):
+        journal = Journal("script", "key")
+        journal.record(1)
+        journal.close()
+        # a lock left by a process that ended
+        lock = journal.directory + LOCK_SUFFIX
+        with open(lock, "w") as f:
+            f.write("%s %d" % (socket.gethostname(), 2 ** 22 + 1))
+        resumed = Journal("script", "key", resume=True)
+        assert resumed.shared and resumed.done(1)
+        # a failed run that never closed its journal
+        close_journals()
+        assert Journal("script", "key", resume=True).resumed
+
+    def test_dataset_to_plate_resumes(self, monkeypatch):
+        server = fake.FakeServer()
+        conn = fake.FakeGateway(server)
+        script = benchmarks.load_script("util_scripts/Dataset_To_Plate.py")
+        did = server.add_dataset("plate")
+        for i in range(6):
+            server.add_image("img_%d.tif" % i, 8, 8, dataset_id=did)
+        params = {"Data_Type": "Dataset", "IDs": [did],
+                  "First_Axis": "column", "First_Axis_Count": 3,
+                  "Column_Names": "number", "Row_Names": "letter",
+                  "Images_Per_Well": 1, "Screen": "screen",
+                  "Remove_From_Dataset": True}
+
+        # the session drops after saving 2 wells
+        add_images = script.add_images_to_plate
+        calls = []
+
+        def failing(*args):
+            calls.append(args)
+            if len(calls) > 2:
+                args[6].close()
+                raise Exception("session dropped")
+            return add_images(*args)
+        monkeypatch.setattr(script, "add_images_to_plate", failing)
+        with pytest.raises(Exception):
+            script.datasets_to_plates(conn, params)
+        # as when the script process ends
+        close_journals()
+        monkeypatch.setattr(script, "add_images_to_plate", add_images)
+        assert len(server.objects.get("Well", {})) == 2
+
+        params["Resume_From_Journal"] = True
+        to_plate = script.dataset_to_plate
+        done = []
+
+        def recording(*args):
+            done.append(to_plate(*args))
+            return done[-1]
+        monkeypatch.setattr(script, "dataset_to_plate", recording)
+        script.datasets_to_plates(conn, params)
+        assert len(server.objects["Screen"]) == 1
+        # the link saved by the failed run
+        (_, link, _), = done
+        assert isinstance(link, omero.model.ScreenPlateLinkI)
+        assert link.id.val in server.objects["ScreenPlateLink"]
+        assert len(server.objects["Plate"]) == 1
+        wells = server.objects["Well"].values()
+        assert sorted((w.row.val, w.column.val) for w in wells) == \
+            [(r, c) for r in range(2) for c in range(3)]
+        assert not os.listdir(self.root)
+        journal = open_journal(conn, "Dataset_To_Plate", params)
+        assert not journal.resumed
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+   Tests of omero.script_helpers.lazy
+   Copyright 2024 University of Muenster. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+"""
+
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import startup
+from omero.script_helpers.lazy import LazyModule, lazy_import
+
+
+class TestLazy(object):
+
+    def test_imports_on_first_use(self, monkeypatch):
+        monkeypatch.delitem(sys.modules, "colorsys", raising=False)
+        colorsys = lazy_import("colorsys")
+        assert isinstance(colorsys, LazyModule)
+        assert "colorsys" not in sys.modules
+        assert colorsys.rgb_to_hsv(1, 0, 0) == (0, 1, 1)
+        assert "colorsys" in sys.modules
+
+    def test_imported_module_returned(self):
+        assert lazy_import("os") is os
+
+    def test_scripts_parse_without_heavy_imports(self):
+        paths = startup.script_paths()
+        with ThreadPoolExecutor(4) as pool:
+            results = list(pool.map(startup.parse_script, paths))
+        heavy = dict((os.path.relpath(path, startup.SCRIPTS), r["heavy"])
+                     for path, r in zip(paths, results) if r["heavy"])
+        assert heavy == {}
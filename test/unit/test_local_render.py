@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+   Tests of omero.script_helpers.local_render
+   Copyright 2024 University of Muenster. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+"""
+
+import io
+
+import numpy
+from PIL import Image
+
+import omero
+from omero.constants.projection import ProjectionType
+
+import fake_gateway as fake
+from omero.script_helpers.local_render import (ENV_LOCAL_RENDER,
+                                               LocalRenderingEngine,
+                                               local_engine)
+from omero.script_helpers.render_pool import prepare_engine
+
+
+def plane_def(z, t=0):
+    pd = omero.romio.PlaneDef()
+    pd.z = z
+    pd.t = t
+    return pd
+
+
+def unpack(packed, shape):
+    packed = numpy.array(packed).reshape(shape)
+    return numpy.dstack([(packed >> 16) & 255, (packed >> 8) & 255,
+                         packed & 255]).astype(numpy.uint8)
+
+
+class TestLocalRender(object):
+
+    def setup_method(self):
+        self.server = fake.FakeServer()
+        self.conn = fake.FakeGateway(self.server)
+        image_id = self.server.add_image("a.tif", 40, 30, size_z=4,
+                                         size_c=3)
+        self.pixels_id = self.server.get("Image", image_id) \
+            .getPrimaryPixels().id.val
+        self.re = self.conn.createRenderingEngine()
+        prepare_engine(self.re, self.pixels_id)
+
+    def test_matches_server_rendering(self):
+        with local_engine(self.conn, self.re) as engine:
+            assert isinstance(engine, LocalRenderingEngine)
+            for re in (self.re, engine):
+                re.setRGBA(1, 200, 100, 50, 128)
+            for model in ("rgb", "greyscale"):
+                for re in (self.re, engine):
+                    re.setModel(fake._Model(model))
+                    re.setActive(0, model == "rgb")
+                rendered = Image.open(io.BytesIO(
+                    engine.renderCompressed(plane_def(1))))
+                expected = unpack(self.re.renderAsPackedInt(plane_def(1)),
+                                  (30, 40))
+                assert (numpy.asarray(rendered) == expected).all()
+            for algorithm in ("maximumintensity", "meanintensity",
+                              "sumintensity"):
+                projection = engine.render_projection(
+                    algorithm.upper(), 0, 1, 0, 3)
+                expected = self.server.render(
+                    self.pixels_id, self.re._rdef, 0, 0,
+                    projection=(algorithm, 0, 3, 1))
+                assert (projection == expected).all()
+
+    def test_panels_share_downloads(self):
+        with local_engine(self.conn, self.re) as engine:
+            self.server.log.reset()
+            engine.renderProjectedCompressed(
+                ProjectionType.MAXIMUMINTENSITY, 0, 1, 0, 3)
+            for c in range(3):
+                engine.load()
+                for i in range(3):
+                    engine.setActive(i, i == c)
+                engine.renderProjectedCompressed(
+                    ProjectionType.MAXIMUMINTENSITY, 0, 1, 0, 3)
+            assert engine.downloads == 3 * 4
+            assert self.server.log.calls["rps.getPlane"] == 3 * 4
+
+    def test_falls_back_to_server(self, monkeypatch):
+        monkeypatch.setenv(ENV_LOCAL_RENDER, "0")
+        with local_engine(self.conn, self.re) as engine:
+            assert engine is self.re
+        monkeypatch.delenv(ENV_LOCAL_RENDER)
+        self.server.rdefs[self.pixels_id].channels[2].family = "logarithmic"
+        with local_engine(self.conn, self.re) as engine:
+            assert engine is self.re
+        self.server.rdefs[self.pixels_id].channels[2].family = "linear"
+        # planes over omero.pixeldata.max_plane_* are rendered on the server
+        self.server.max_plane_size = (32, 32)
+        with local_engine(self.conn, self.re) as engine:
+            assert engine is self.re
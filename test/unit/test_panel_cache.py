@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+   Tests of omero.script_helpers.panel_cache
+   Copyright 2024 University of Muenster. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+"""
+
+import os
+
+import omero
+from omero.constants.projection import ProjectionType
+
+import benchmarks
+import fake_gateway as fake
+from omero.script_helpers.local_render import local_engine
+from omero.script_helpers.panel_cache import (ENV_CACHE_DIR, ENV_MAX_MB,
+                                              PanelCache)
+from omero.script_helpers.render_pool import prepare_engine
+
+
+def plane_def(z, t=0):
+    pd = omero.romio.PlaneDef()
+    pd.z = z
+    pd.t = t
+    return pd
+
+
+class TestPanelCache(object):
+
+    def setup_method(self):
+        self.server = fake.FakeServer()
+        self.conn = fake.FakeGateway(self.server)
+        self.image_id = self.server.add_image("a.tif", 40, 30, size_z=4,
+                                              size_c=3)
+        self.pixels_id = self.server.get("Image", self.image_id) \
+            .getPrimaryPixels().id.val
+        self.re = self.conn.createRenderingEngine()
+        prepare_engine(self.re, self.pixels_id)
+
+    def test_settings_change_the_key(self, tmpdir):
+        cache = PanelCache(self.conn, str(tmpdir), 1024 * 1024)
+        re = cache.engine(self.re)
+        re.setActive(0, False)
+        first = re.renderCompressed(plane_def(1))
+        self.server.log.reset()
+        # the same panel of a new engine with the same settings
+        re = cache.engine(self.re)
+        re.setActive(0, False)
+        assert re.renderCompressed(plane_def(1)) == first
+        assert not self.server.log.calls.get("re.renderCompressed")
+        assert cache.stats() == {'hits': 1, 'misses': 1, 'evictions': 0}
+
+        # another channel, plane or projection is another panel
+        re.setActive(1, False)
+        re.renderCompressed(plane_def(1))
+        re.renderCompressed(plane_def(2))
+        re.renderProjectedCompressed(
+            ProjectionType.MAXIMUMINTENSITY, 0, 1, 0, 3)
+        # loading the saved settings forgets the changes
+        re.load()
+        re.setActive(0, False)
+        assert re.renderCompressed(plane_def(1)) == first
+        assert cache.stats()['misses'] == 4
+
+        # saving new settings changes the update event
+        self.re.saveCurrentSettings()
+        re = cache.engine(self.re)
+        re.setActive(0, False)
+        re.renderCompressed(plane_def(1))
+        assert cache.stats()['misses'] == 5
+
+    def test_local_projections(self, tmpdir):
+        cache = PanelCache(self.conn, str(tmpdir), 1024 * 1024)
+        with local_engine(self.conn, self.re) as engine:
+            re = cache.engine(self.re, engine)
+            first = re.render_projection("MAXIMUMINTENSITY", 0, 1, 0, 3,
+                                         (4, 4, 10, 10))
+            again = re.render_projection("MAXIMUMINTENSITY", 0, 1, 0, 3,
+                                         (4, 4, 10, 10))
+        assert first.shape == (10, 10, 3) and (first == again).all()
+        assert cache.hits == 1
+
+    def test_evicts_least_recently_used(self, tmpdir):
+        cache = PanelCache(self.conn, str(tmpdir), 0)
+        assert not cache.enabled and cache.engine(self.re) is self.re
+
+        cache = PanelCache(self.conn, str(tmpdir), 250)
+        for i in range(4):
+            cache.get(["panel", i], lambda: b"x" * 100)
+            os.utime(cache._path(["panel", i], "jpg"), (i, i))
+        # within 90% of the limit: the two oldest are removed
+        assert cache.evictions == 2 and len(os.listdir(str(tmpdir))) == 2
+        cache.get(["panel", 3], lambda: b"")
+        assert cache.hits == 1
+        cache.clear()
+        assert not os.listdir(str(tmpdir))
+
+    def test_second_figure_is_cached(self, tmpdir, monkeypatch):
+        monkeypatch.setenv(ENV_CACHE_DIR, str(tmpdir))
+        monkeypatch.setenv(ENV_MAX_MB, "16")
+        script = benchmarks.load_script(
+            "figure_scripts/Split_View_Figure.py")
+        names = dict((c, "ch%d" % c) for c in range(3))
+
+        def figure():
+            self.server.log.reset()
+            script.get_split_view(
+                self.conn, [self.pixels_id], 0, 3, [0, 1, 2], names, True,
+                [0, 1, 2], {}, 64, 64)
+            return self.server.log.calls
+
+        assert figure().get("rps.getPlane")
+        calls = figure()
+        assert not calls.get("rps.getPlane")
+        assert not calls.get("re.renderCompressed")
+        assert not calls.get("re.renderProjectedCompressed")
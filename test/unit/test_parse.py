@@ -22,6 +22,8 @@ class TestParse(object):
 
     def test_parse_all_official_scripts(self):
         for script in SCRIPTS.walk("*.py"):
+            if script.parent.name == "script_helpers":
+                continue    # library modules shared by the scripts
             try:
                 parse_file(str(script))
             except Exception as e:
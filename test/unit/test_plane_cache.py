@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+   Tests of omero.script_helpers.plane_cache
+   Copyright 2024 University of Muenster. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+"""
+
+import numpy
+
+import fake_gateway as fake
+from omero.script_helpers.plane_cache import (PlaneCache, CachedPixels,
+                                              bounds_by_plane)
+
+
+class TestPlaneCache(object):
+
+    def test_lru_eviction_within_budget(self):
+        cache = PlaneCache(max_bytes=3 * 100)
+        for i in range(3):
+            cache.get(i, lambda: numpy.zeros(100, numpy.uint8))
+        cache.get(0, None)                  # 0 is now most recently used
+        cache.get(3, lambda: numpy.zeros(100, numpy.uint8))
+        assert 1 not in cache and 0 in cache
+        assert cache.nbytes == 300
+        assert cache.stats() == {'hits': 1, 'misses': 4, 'evictions': 1,
+                                 'entries': 3, 'bytes': 300}
+
+    def test_oversized_is_not_cached(self):
+        cache = PlaneCache(max_bytes=10)
+        array = cache.get("big", lambda: numpy.zeros(11, numpy.uint8))
+        assert array.shape == (11,)
+        assert len(cache) == 0
+
+    def test_tiles_cut_from_bounds(self):
+        server = fake.FakeServer()
+        conn = fake.FakeGateway(server)
+        iid = server.add_image("lines", 64, 64, size_c=2)
+        pixels = conn.getObject("Image", iid).getPrimaryPixels()
+        bounds = bounds_by_plane([(0, 0, [(10, 10), (30, 20)]),
+                                  (0, 0, [(20, 40), (40, 40)])], 2, 64, 64)
+        assert bounds == {(0, 0): (8, 8, 35, 35)}
+        cached = CachedPixels(pixels, PlaneCache(), bounds)
+        server.log.reset()
+        for c in range(2):
+            for tile in [(10, 10, 20, 10), (20, 38, 20, 4)]:
+                data = cached.getTile(0, c, 0, tile)
+                assert (data == pixels.getTile(0, c, 0, tile)).all()
+        # two reads through the cache (one per channel), four direct
+        assert server.log.calls["rps.getTile"] == 2 + 4
+        assert cached.cache.hits == 2
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+   Tests of omero.script_helpers.planner
+   Copyright 2024 University of Muenster. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+"""
+
+import os
+
+import pytest
+
+import benchmarks
+import fake_gateway as fake
+from omero.script_helpers.journal import ENV_JOURNAL_DIR
+from omero.script_helpers.planner import (ENV_MEMORY_MB, IN_MEMORY, MB,
+                                          STREAMING, TILED, Plan,
+                                          bytes_per_pixel, choose_mode,
+                                          memory_budget, tile_count)
+
+
+class TestPlanner(object):
+
+    def test_choose_mode(self, monkeypatch):
+        monkeypatch.setenv(ENV_MEMORY_MB, "2")
+        assert memory_budget() == 2 * MB
+        assert choose_mode(MB, MB / 2) == IN_MEMORY
+        assert choose_mode(4 * MB, MB) == STREAMING
+        assert choose_mode(None, MB, budget=MB) == STREAMING
+        assert choose_mode(4 * MB, 3 * MB) == TILED
+        assert bytes_per_pixel("uint16") == 2
+        assert bytes_per_pixel("double") == 8
+        assert bytes_per_pixel("bit") == 1
+        assert tile_count(1100, 700, 512, 512) == 6
+
+    def test_plan(self):
+        plan = Plan(budget=1000, concurrency=2)
+        plan.add("a", STREAMING, planes=4, bytes_down=400, memory=300,
+                 files=4)
+        plan.add("b", TILED, planes=2, tiles=8, bytes_up=200, memory=500)
+        plan.add("c", IN_MEMORY, memory=100)
+        plan.skip("d", "too big")
+        with pytest.raises(ValueError):
+            plan.add("e", "unknown")
+        assert plan.total("planes") == 6
+        # the two largest steps run at once
+        assert plan.peak_memory == 800 and not plan.over_budget
+        data = plan.as_dict()
+        assert data["modes"] == {IN_MEMORY: 1, STREAMING: 1, TILED: 1}
+        assert data["skipped"] == [["d", "too big"]]
+        report = plan.report()
+        assert "Planes: 6, tiles: 8" in report
+        assert "Files: 4" in report and "Skipped d: too big" in report
+
+    def test_dry_runs_change_nothing(self, tmpdir, monkeypatch):
+        monkeypatch.setenv(ENV_JOURNAL_DIR, str(tmpdir))
+        server = fake.FakeServer()
+        conn = fake.FakeGateway(server)
+        did = server.add_dataset("dry")
+        iid = server.add_image("img_C0.tif", 64, 48, size_z=3, size_c=2,
+                               dataset_id=did)
+        server.add_roi(iid, [fake.rectangle(4, 4, 16, 16)])
+        before = dict((k, len(v)) for k, v in server.objects.items())
+
+        export = benchmarks.load_script("export_scripts/Batch_Image_Export.py")
+        params = {"Data_Type": "Image", "IDs": [iid],
+                  "Export_Individual_Channels": True,
+                  "Individual_Channels_Grey": False,
+                  "Export_Merged_Image": True,
+                  "Choose_Z_Section": "ALL Z planes",
+                  "Choose_T_Section": "Default-T (last-viewed)",
+                  "Zoom": "100%", "Format": "PNG",
+                  "Folder_Name": "Batch_Image_Export", "Dry_Run": True}
+        result, message = export.batch_image_export(conn, params)
+        assert result is None and "Files: 9" in message
+        assert not os.listdir(str(tmpdir))
+
+        rois = benchmarks.load_script("util_scripts/Images_From_ROIs.py")
+        result, message = rois.make_images_from_rois(conn, {
+            "Data_Type": "Image", "IDs": [iid], "Make_Image_Stack": False,
+            "Tile_Size": 1024, "Dry_Run": True})
+        assert result is None and "Planes: 6" in message
+
+        combine = benchmarks.load_script("util_scripts/Combine_Images.py")
+        result, message = combine.combine_images(conn, {
+            "Data_Type": "Dataset", "IDs": [did], "Dry_Run": True,
+            "Channel_Name_Pattern": "_C",
+            "Time_Name_Pattern": "None (single time point)",
+            "Z_Name_Pattern": "None (single z section)"})
+        assert result is None and "New images: 1" in message
+        assert dict((k, len(v)) for k, v in server.objects.items()) == \
+            before
+
+    def test_combine_copies_tiles_over_budget(self, monkeypatch):
+        monkeypatch.setenv(ENV_MEMORY_MB, "2")
+        server = fake.FakeServer()
+        server.max_plane_size = (256, 256)
+        conn = fake.FakeGateway(server)
+        did = server.add_dataset("combine")
+        sources = [server.add_image("cell_C%d.tif" % c, 1100, 700,
+                                    dataset_id=did) for c in range(2)]
+        combine = benchmarks.load_script("util_scripts/Combine_Images.py")
+        params = {"Data_Type": "Dataset", "IDs": [did],
+                  "Channel_Name_Pattern": "_C",
+                  "Time_Name_Pattern": "None (single time point)",
+                  "Z_Name_Pattern": "None (single z section)"}
+        _, message = combine.combine_images(conn, dict(params, Dry_Run=True))
+        # 2 planes of 3 x 2 tiles
+        assert "Planes: 2, tiles: 12" in message
+        images, message = combine.combine_images(conn, params)
+        assert len(images) == 1
+        assert server.log.calls["rps.setTile"] == 2 * 6
+        assert not server.log.calls.get("rps.setPlane")
+        new_pid = images[0].getPrimaryPixels().getId().getValue()
+        for c, iid in enumerate(sources):
+            source_pid = conn.getObject("Image", iid).getPixelsId()
+            assert (server.plane(new_pid, 0, c, 0) ==
+                    server.plane(source_pid, 0, 0, 0)).all()
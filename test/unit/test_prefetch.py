@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+   Tests of omero.script_helpers.prefetch
+   Copyright 2024 University of Muenster. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+"""
+
+import threading
+import time
+
+import pytest
+
+from omero.script_helpers.prefetch import ENV_DEPTH, Prefetcher, prefetch
+
+
+class TestPrefetch(object):
+
+    def test_order(self):
+        assert list(prefetch(iter(range(20)), depth=3)) == list(range(20))
+        assert list(prefetch([], depth=1)) == []
+
+    def test_reads_ahead_within_depth(self):
+        made = []
+
+        def planes():
+            for i in range(10):
+                made.append(i)
+                yield i
+
+        items = prefetch(planes(), depth=2)
+        assert next(items) == 0
+        time.sleep(0.2)
+        # 2 in the queue and one waiting to be queued
+        assert len(made) == 4
+        assert list(items) == list(range(1, 10))
+
+    def test_overlaps_producer_and_consumer(self):
+        def planes():
+            for i in range(5):
+                time.sleep(0.05)
+                yield i
+
+        start = time.time()
+        for plane in prefetch(planes(), depth=2):
+            time.sleep(0.05)
+        assert time.time() - start < 0.4
+
+    def test_errors_raised_in_order(self):
+        def planes():
+            yield 1
+            raise ValueError("missing plane")
+
+        items = prefetch(planes(), depth=4)
+        assert next(items) == 1
+        with pytest.raises(ValueError):
+            next(items)
+        with pytest.raises(StopIteration):
+            next(items)
+
+    def test_close_stops_generator(self):
+        closed = threading.Event()
+
+        def planes():
+            try:
+                while True:
+                    yield 0
+            finally:
+                closed.set()
+
+        with Prefetcher(planes(), depth=1) as items:
+            next(items)
+        assert closed.is_set()
+
+    def test_depth_zero_is_synchronous(self, monkeypatch):
+        monkeypatch.setenv(ENV_DEPTH, "0")
+        items = prefetch(iter([1, 2]))
+        assert not isinstance(items, Prefetcher)
+        assert list(items) == [1, 2]
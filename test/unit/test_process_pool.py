@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+   Tests of omero.script_helpers.process_pool
+   Copyright 2024 University of Muenster. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+"""
+
+import contextlib
+import io
+import multiprocessing
+import os
+import pickle
+import sys
+
+import pytest
+
+import benchmarks
+import fake_gateway as fake
+from omero.script_helpers import process_pool
+from omero.script_helpers.process_pool import (ENV_WORKERS, image_workers,
+                                               map_images)
+
+# the fake server the workers join, copied into them when they fork
+_server = None
+
+# (script, function that makes the images, params) of each script that
+# processes its images in worker processes
+SCRIPTS = [
+    ("figure_scripts/Transform.py", "transformImages",
+     {"Data_Type": "Image", "Transforms": ["Rotate_Left"]}),
+    ("util_scripts/Channel_Offsets.py", "process_images",
+     {"Data_Type": "Image", "Channel_1": True, "Channel_2": True,
+      "Channel_3": False, "Channel_4": False, "Channel1_X_shift": 1}),
+    ("util_scripts/Images_From_ROIs.py", None, None),
+    ("analysis_scripts/Kymograph.py", None, None),
+    ("analysis_scripts/Plot_Profile.py", None, None),
+]
+
+
+def image_name(conn, image_id, suffix):
+    return conn.getObject("Image", image_id).getName() + suffix
+
+
+def name_and_pid(conn, image_id):
+    if image_id < 0:
+        raise ValueError("no image %d" % image_id)
+    return conn.getObject("Image", image_id).getName(), os.getpid()
+
+
+def group_of(conn, image_id):
+    return conn.SERVICE_OPTS.getOmeroGroup()
+
+
+def join_fake_session(properties, session_id):
+    assert session_id == "fake-session"
+    return fake.FakeGateway(_server)
+
+
+class TestProcessPool(object):
+
+    def test_image_workers(self, monkeypatch):
+        cpus = os.cpu_count() or 1
+        assert image_workers(1, 8) == 1
+        assert image_workers(100, 2) == min(2, cpus)
+        assert image_workers(0, 4) == 1
+        monkeypatch.setenv(ENV_WORKERS, "3")
+        assert image_workers(100) == min(3, cpus)
+
+    def test_inline_in_order(self):
+        server = fake.FakeServer()
+        conn = fake.FakeGateway(server)
+        ids = [server.add_image("img_%d" % i, 4, 4) for i in range(5)]
+        assert map_images(conn, image_name, reversed(ids), "!") == \
+            ["img_%d!" % i for i in reversed(range(5))]
+        with pytest.raises(TypeError):
+            map_images(conn, image_name, ids, "!", worker=2)
+
+    def test_worker_processes(self, monkeypatch):
+        # the workers must see the stubbed join_session, so they fork
+        # instead of being spawned
+        if "fork" not in multiprocessing.get_all_start_methods():
+            pytest.skip("needs fork")
+        fork = multiprocessing.get_context("fork")
+        monkeypatch.setattr(multiprocessing, "get_context",
+                            lambda method=None: fork)
+        monkeypatch.setattr(process_pool, "join_session", join_fake_session)
+        monkeypatch.setattr(process_pool.os, "cpu_count", lambda: 4)
+        global _server
+        _server = fake.FakeServer()
+        conn = fake.FakeGateway(_server)
+        ids = [_server.add_image("img_%d" % i, 4, 4) for i in range(6)]
+
+        results = map_images(conn, name_and_pid, ids, workers=2)
+        assert [name for name, _ in results] == \
+            ["img_%d" % i for i in range(6)]
+        pids = set(pid for _, pid in results)
+        assert os.getpid() not in pids and 1 <= len(pids) <= 2
+        with pytest.raises(ValueError):
+            map_images(conn, name_and_pid, ids + [-1], workers=2)
+
+        # the workers make their calls in the group of the script
+        assert map_images(conn, group_of, ids, workers=2) == [None] * 6
+        conn.SERVICE_OPTS.setOmeroGroup(5)
+        assert map_images(conn, group_of, ids, workers=2) == ["5"] * 6
+
+    @pytest.mark.parametrize("script_path, function, params", SCRIPTS)
+    def test_scripts_pickle_for_spawn(self, monkeypatch, tmp_path,
+                                      script_path, function, params):
+        """
+        What each script sends to its workers, and what they return,
+        pickles as it must for spawned processes.
+        """
+        # the scripts write their files to the working directory
+        monkeypatch.chdir(tmp_path)
+        script = benchmarks.load_script(script_path)
+        # as under the script processor, the script's module is importable
+        monkeypatch.setitem(sys.modules, script.__name__, script)
+        calls = []
+
+        def checked_map_images(conn, func, image_ids, *args, **kwargs):
+            # a top level function, which spawned workers can import
+            assert func.__qualname__ == func.__name__
+            assert getattr(script, func.__name__) is func
+            pickle.loads(pickle.dumps((func, list(image_ids), args)))
+            results = map_images(conn, func, image_ids, *args, workers=1)
+            pickle.loads(pickle.dumps(results))
+            calls.append(func.__name__)
+            return results
+
+        monkeypatch.setattr(script, "map_images", checked_map_images)
+        server = fake.FakeServer()
+        conn = fake.FakeGateway(server)
+        with contextlib.redirect_stdout(io.StringIO()):
+            if function is None:
+                name = [n for n, (path, _) in benchmarks.BENCHMARKS.items()
+                        if path == script_path][0]
+                run = benchmarks.BENCHMARKS[name][1](
+                    server, script, benchmarks.SIZES["small"])
+                run(conn)
+            else:
+                image_id = server.add_image("img.tif", 16, 16, size_c=2)
+                getattr(script, function)(conn, dict(params, IDs=[image_id]))
+        assert calls
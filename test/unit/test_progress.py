@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+   Tests of omero.script_helpers.progress
+   Copyright 2024 University of Muenster. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+"""
+
+import benchmarks
+import fake_gateway as fake
+from omero.script_helpers.process_pool import map_images
+from omero.script_helpers.progress import Progress, format_seconds
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def double(conn, image_id):
+    return image_id * 2
+
+
+class TestProgress(object):
+
+    def setup_method(self):
+        self.clock = Clock()
+        self.lines = []
+        self.progress = Progress(40, "images", interval=10,
+                                 out=self.lines.append, clock=self.clock)
+
+    def test_lines(self):
+        progress = self.progress
+        for _ in range(4):
+            self.clock.now += 2
+            progress.update(nbytes=3 * 1024 * 1024)
+        # not before 10 seconds
+        assert self.lines == []
+        self.clock.now += 2
+        progress.update(nbytes=3 * 1024 * 1024)
+        assert self.lines == ["Progress: 5/40 images (12%), 0.5 images/s, "
+                              "1.5 MB/s, ETA 0:01:10"]
+        self.clock.now += 5
+        progress.update()
+        assert len(self.lines) == 1 and progress.done == 6
+
+        assert progress.finish() == \
+            "6 images in 0:00:15 (0.4 images/s, 1.0 MB/s)."
+        assert self.lines[-1].startswith("Done: 6 images")
+        assert format_seconds(3725.2) == "1:02:05"
+
+    def test_unknown_total(self):
+        progress = Progress(label="wells", interval=0, out=self.lines.append,
+                            clock=self.clock)
+        self.clock.now += 4
+        progress.update(2)
+        assert self.lines == ["Progress: 2 wells, 0.5 wells/s"]
+        progress.add_total(8)
+        self.clock.now += 4
+        progress.update(2)
+        assert self.lines[-1] == \
+            "Progress: 4/8 wells (50%), 0.5 wells/s, ETA 0:00:08"
+
+    def test_map_images(self):
+        server = fake.FakeServer()
+        conn = fake.FakeGateway(server)
+        progress = Progress(3, interval=0, out=self.lines.append,
+                            clock=self.clock)
+        assert map_images(conn, double, [1, 2, 3], workers=1,
+                          progress=progress) == [2, 4, 6]
+        assert progress.done == 3 and len(self.lines) == 3
+
+    def test_script_message(self):
+        script_path, setup = benchmarks.BENCHMARKS["combine_images"]
+        server = fake.FakeServer()
+        conn = fake.FakeGateway(server)
+        run = setup(server, benchmarks.load_script(script_path),
+                    benchmarks.SIZES["small"])
+        images, message = run(conn)
+        assert images
+        # the planes of the new image, and the bytes uploaded
+        assert " planes in 0:00:" in message and "MB/s" in message
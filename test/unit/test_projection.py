@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+   Tests of omero.script_helpers.projection
+   Copyright 2024 University of Muenster. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+"""
+
+import numpy
+import pytest
+
+from omero.constants.projection import ProjectionType
+from omero.script_helpers.projection import (Projector, algorithm_name,
+                                             project, z_indexes)
+
+
+def stack(dtype, size_z=5):
+    rng = numpy.random.RandomState(1)
+    return [rng.randint(0, 200, (4, 6)).astype(dtype) for z in range(size_z)]
+
+
+class TestProjection(object):
+
+    def test_algorithm_names(self):
+        assert algorithm_name(ProjectionType.MAXIMUMINTENSITY) == "max"
+        assert algorithm_name("Mean projection") == "mean"
+        assert algorithm_name("sumintensity") == "sum"
+        with pytest.raises(ValueError):
+            algorithm_name("median")
+
+    def test_z_indexes(self):
+        assert list(z_indexes(1, 6, 2)) == [1, 3, 5]
+        assert list(z_indexes(4, 2)) == [2, 3, 4]
+        assert list(z_indexes(3, 3)) == [3]
+
+    def test_matches_numpy(self):
+        planes = stack(numpy.uint16)
+        expected = numpy.array(planes)
+        assert (project(planes, "max") == expected.max(axis=0)).all()
+        mean = project(planes, "mean")
+        assert mean.dtype == numpy.uint16
+        assert (mean == expected.mean(axis=0).astype(numpy.uint16)).all()
+        assert (project(planes, "sum") == expected.sum(axis=0)).all()
+
+    def test_sum_clipped_to_type(self):
+        rgb = [numpy.full((2, 2, 3), 100, numpy.uint8)] * 3
+        projection = project(iter(rgb), "sum")
+        assert projection.dtype == numpy.uint8
+        assert (projection == 255).all()
+
+    def test_streams_planes(self):
+        projector = Projector("max")
+        for plane in stack(numpy.uint8):
+            projector.add(plane)
+            plane[:] = 0            # not kept by the projector
+        assert projector.count == 5
+        assert projector.result().max() > 0
+        with pytest.raises(ValueError):
+            Projector("sum").result()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+   Tests of omero.script_helpers.rasterize
+   Copyright 2024 University of Muenster. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+"""
+
+import numpy
+
+import benchmarks
+import fake_gateway as fake
+from omero.script_helpers.rasterize import (
+    ENV_LOCAL_STATS, MaskCache, label_image, load_mask_bytes, local_stats,
+    rasterize, shape_box, union_box)
+from omero.script_helpers.shape_index import ShapeIndex
+
+
+def inside_polygon(points, x, y):
+    # the even-odd rule of java.awt.Polygon, one point at a time
+    inside = False
+    for (x1, y1), (x2, y2) in zip(points, points[1:] + points[:1]):
+        if (y1 > y) != (y2 > y) and \
+                x < x1 + (y - y1) * (x2 - x1) / float(y2 - y1):
+            inside = not inside
+    return inside
+
+
+class TestRasterize(object):
+
+    def setup_method(self):
+        self.server = fake.FakeServer()
+        self.conn = fake.FakeGateway(self.server)
+        self.image = self.server.add_image("a.tif", 128, 128, size_z=3,
+                                           size_c=2)
+        self.bits = numpy.zeros((4, 5), bool)
+        self.bits[1:3, 2:] = True
+        self.triangle = [(3, 2), (60, 20), (15, 70)]
+        self.server.add_roi(self.image, [
+            fake.rectangle(10.5, 20, 30, 12, z=0),
+            fake.ellipse(50, 50, 10, 6, z=1),
+            fake.polygon([(10, 10), (91, 10), (91, 91), (10, 91)]),
+            fake.polygon(self.triangle),
+            fake.line(0, 0, 9, 3),
+            fake.point(7.5, 8.2),
+            fake.mask(100, 110, self.bits)])
+        self.shapes = ShapeIndex.load(self.conn, [self.image])
+
+    def test_rasterize(self):
+        shapes = self.shapes
+        assert shapes.type_names == ["Rectangle", "Ellipse", "Polygon",
+                                     "Polygon", "Line", "Point", "Mask"]
+        box = shape_box(shapes, 0)
+        assert box == (10, 20, 31, 13)
+        rectangle = rasterize(shapes, 0, box)
+        assert rectangle.sum() == 30 * 12 and not rectangle[:, 0].any()
+
+        ellipse = rasterize(shapes, 1, shape_box(shapes, 1))
+        xs, ys = numpy.meshgrid(numpy.arange(40, 61), numpy.arange(44, 57))
+        assert (ellipse == (((xs - 50) / 10.0) ** 2 +
+                            ((ys - 50) / 6.0) ** 2 < 1)).all()
+        assert (ellipse == ellipse[::-1, ::-1]).all()
+
+        # the count the server gives for the square
+        assert rasterize(shapes, 2, (0, 0, 128, 128)).sum() == 81 * 81
+        triangle = rasterize(shapes, 3, (0, 0, 64, 72))
+        expected = [[inside_polygon(self.triangle, x, y) for x in range(64)]
+                    for y in range(72)]
+        assert (triangle == numpy.array(expected)).all()
+
+        line = rasterize(shapes, 4, shape_box(shapes, 4))
+        assert line.shape == (4, 10) and line[0, 0] and line[3, 9]
+        assert line.sum(axis=0).min() == 1
+        point = rasterize(shapes, 5, (6, 6, 4, 4))
+        assert numpy.flatnonzero(point).tolist() == [2 * 4 + 1]
+
+        mask_bytes = load_mask_bytes(self.conn, shapes.column("id")[6:])
+        mask = rasterize(shapes, 6, (98, 110, 8, 4), mask_bytes)
+        assert (mask[:, 2:7] == self.bits).all() and mask.sum() == 6
+        assert not rasterize(shapes, 6, (98, 110, 8, 4)).any()
+        # clipped to the plane
+        assert shape_box(shapes, 6, 103, 112) == (100, 110, 3, 2)
+
+    def test_label_image(self):
+        shapes = self.shapes.select([2, 1])
+        labels = label_image(shapes, (0, 0, 128, 128))
+        assert labels.dtype == numpy.int32
+        assert labels[50, 50] == 2 and labels[20, 20] == 1
+        assert labels[100, 100] == 0
+        assert (labels == 2).sum() == rasterize(shapes, 1,
+                                                (0, 0, 128, 128)).sum()
+        assert union_box([(1, 2, 3, 4), (0, 5, 2, 2), (9, 9, 0, 0)]) == \
+            (0, 2, 4, 5)
+
+    def test_mask_cache(self):
+        cache = MaskCache(max_bytes=500)
+        box = shape_box(self.shapes, 0)
+        first = cache.mask(self.shapes, 0, box)
+        assert cache.mask(self.shapes, 0, box) is first
+        assert not first.flags.writeable
+        cache.mask(self.shapes, 0, (0, 0, 20, 20))
+        assert cache.stats()["evictions"] == 1
+        assert cache.report().startswith("Mask cache: 1 hits, 2 misses")
+
+    def test_roi_export_local_stats(self, monkeypatch):
+        # opt-in until checked against a server
+        monkeypatch.delenv(ENV_LOCAL_STATS, raising=False)
+        assert not local_stats()
+        monkeypatch.setenv(ENV_LOCAL_STATS, "1")
+        script = benchmarks.load_script("export_scripts/Batch_ROI_Export.py")
+        image = self.conn.getObject("Image", self.image)
+        params = {"Channels": [1, 2], "Export_All_Planes": True}
+        shapes = self.shapes.of_type("Rectangle")
+        masks = MaskCache()
+        rows = script.get_export_data(self.conn, params, image,
+                                      shapes=shapes, masks=masks)
+        assert not self.server.log.calls.get("roi.getShapeStatsRestricted")
+        assert masks.stats()["misses"] == 1
+        # the ellipse, with a row per channel
+        ellipse = script.get_export_data(
+            self.conn, params, image, shapes=self.shapes.of_type("Ellipse"),
+            masks=masks)
+        assert [row["points"] for row in ellipse] == [181, 181]
+        assert ellipse[0]["points"] == rasterize(
+            self.shapes, 1, shape_box(self.shapes, 1)).sum()
+
+        monkeypatch.setenv("OMERO_SCRIPTS_LOCAL_STATS", "0")
+        # the server measures the bounding box: a rectangle at x = 11
+        self.server.rois[self.image][0].copyShapes()[0].x = \
+            fake.rdouble(11)
+        server_rows = script.get_export_data(self.conn, params, image,
+                                             shapes=shapes)
+        assert self.server.log.calls["roi.getShapeStatsRestricted"] == 1
+        keys = ("points", "min", "max", "sum", "mean", "std_dev")
+        assert [[row[k] for k in keys] for row in rows] == \
+            [[row[k] for k in keys] for row in server_rows]
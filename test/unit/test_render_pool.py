@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+   Tests of omero.script_helpers.render_pool
+   Copyright 2024 University of Muenster. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+"""
+
+import threading
+
+import omero
+import pytest
+
+import fake_gateway as fake
+from omero.script_helpers.render_pool import (RenderingEnginePool,
+                                              get_channel_colours)
+
+
+def render(re, pixels_id, z):
+    re.setActive(0, False)       # discarded before the next job
+    plane_def = omero.romio.PlaneDef()
+    plane_def.z = z
+    plane_def.t = 0
+    jpeg = re.renderCompressed(plane_def)
+    return (pixels_id, z, re.isActive(0), threading.current_thread().name,
+            len(jpeg))
+
+
+class TestRenderPool(object):
+
+    def setup_method(self):
+        self.server = fake.FakeServer()
+        self.conn = fake.FakeGateway(self.server)
+        self.pixel_ids = [
+            self.conn.getObject("Image", self.server.add_image(
+                "%d.tif" % i, 8, 8, size_z=4, size_c=2)).getPrimaryPixels()
+            .getId() for i in range(5)]
+
+    def test_results_in_order(self):
+        pids = [pid for pid in self.pixel_ids for z in range(4)]
+        zs = [z for pid in self.pixel_ids for z in range(4)]
+        with RenderingEnginePool(self.conn, workers=3) as pool:
+            results = pool.map(render, pids, zs)
+        assert [r[:2] for r in results] == list(zip(pids, zs))
+        assert not any(r[2] for r in results)
+        assert len(set(r[3] for r in results)) <= 3
+        assert all(r[4] for r in results)
+        calls = self.server.log.calls
+        engines = calls["session.createRenderingEngine"]
+        assert engines == len(set(r[3] for r in results)) <= 3
+        assert calls["re.close"] == engines
+        # every job starts from freshly loaded settings
+        assert calls["re.load"] == len(results)
+
+    def test_settings_reset_between_jobs(self):
+        with RenderingEnginePool(self.conn, workers=1) as pool:
+            first = pool.submit(render, self.pixel_ids[0], 0).result()
+            active = pool.submit(
+                lambda re, pid: re.isActive(0), self.pixel_ids[0]).result()
+        assert first[2] is False and active is True
+        assert self.server.log.calls["re.lookupPixels"] == 1
+
+    def test_channel_colours_and_errors(self):
+        with RenderingEnginePool(self.conn, workers=2) as pool:
+            colours = pool.submit(get_channel_colours, self.pixel_ids[0],
+                                  [0, 1, 5]).result()
+            assert sorted(colours) == [0, 1]
+            with pytest.raises(ZeroDivisionError):
+                pool.map(lambda re, pid: 1 // 0, self.pixel_ids)
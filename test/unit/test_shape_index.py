@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+   Tests of omero.script_helpers.shape_index
+   Copyright 2024 University of Muenster. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+"""
+
+import math
+
+import numpy
+from omero.rtypes import rstring
+
+import benchmarks
+import fake_gateway as fake
+from omero.script_helpers.shape_index import (UNSET, ShapeIndex,
+                                              parse_points)
+
+
+class TestShapeIndex(object):
+
+    def setup_method(self):
+        self.server = fake.FakeServer()
+        self.conn = fake.FakeGateway(self.server)
+        self.first = self.server.add_image("a.tif", 64, 64, size_z=2)
+        self.second = self.server.add_image("b.tif", 64, 64)
+        self.server.add_roi(self.second, [
+            fake.ellipse(20, 20, 5, 3), fake.point(7, 8, t=1)])
+        self.server.add_roi(self.first, [
+            fake.polygon([(10, 10), (40, 10), (40, 40), (10, 40)]),
+            fake.rectangle(3, 4, 10, 12, z=1)])
+        self.server.add_roi(self.first, [
+            fake.line(1, 2, 4, 6, z=0), fake.polyline([(0, 0), (3, 4),
+                                                       (3, 8)])])
+
+    def test_load(self):
+        index = ShapeIndex.load(self.conn, [self.first, self.second])
+        assert len(index) == 6
+        # sorted by image, ROI and shape
+        assert index.column("image") == [self.first] * 4 + [self.second] * 2
+        assert index.type_names == ["Polygon", "Rectangle", "Line",
+                                    "Polyline", "Ellipse", "Point"]
+        assert index.column("z") == [UNSET, 1, 0, UNSET, UNSET, UNSET]
+        assert index.rois() == [[0, 1], [2, 3], [4, 5]]
+        assert index.shapes[["x", "y", "width", "height"]].tolist()[4] == \
+            (15, 17, 10, 6)
+        assert index.shape_points(3) == [(0, 0), (3, 4), (3, 8)]
+        assert index.points_string(0) == "10,10 40,10 40,40 10,40"
+        assert self.server.log.calls["query.projection"] == 8
+        assert not self.server.log.calls.get("roi.findByImage")
+
+        lengths = index.lengths(pixel_size_x=2)
+        assert lengths[2] == math.sqrt(6 * 6 + 4 * 4)
+        assert lengths[3] == math.sqrt(6 * 6 + 4 * 4) + 4
+        assert numpy.isnan(lengths[[0, 1, 4, 5]]).all()
+        areas = index.areas()
+        assert areas[:2].tolist() == [900, 120]
+        assert areas[4] == math.pi * 5 * 3
+        assert numpy.isnan(areas[[2, 3, 5]]).all()
+
+    def test_select(self):
+        index = ShapeIndex.load(self.conn, [self.first, self.second])
+        lines = index.for_image(self.first).of_type("Line", "Polyline")
+        assert lines.type_names == ["Line", "Polyline"]
+        assert lines.column("offset") == [0, 2]
+        assert lines.shape_points(1) == [(0, 0), (3, 4), (3, 8)]
+        assert len(index.for_image(0)) == 0
+        assert len(index.select([]).areas()) == 0
+        empty = ShapeIndex.load(self.conn, [])
+        assert len(empty) == 0 and empty.rois() == []
+
+    def test_parse_points(self):
+        assert parse_points("points[1,2, 3,4] points1[1,2, 3,4]") == \
+            [[1, 2], [3, 4]]
+        assert parse_points("10,10, 91,10") == [[10, 10], [91, 10]]
+        assert parse_points("1,2 3") is None
+        assert parse_points("") is None
+
+    def test_roi_export_stats_per_plane(self, monkeypatch):
+        monkeypatch.setenv("OMERO_SCRIPTS_LOCAL_STATS", "0")
+        polygon = fake.polygon([(1, 1), (9, 1), (9, 9)])
+        polygon.textValue = rstring("cell, 1")
+        self.server.add_roi(self.first, [polygon])
+        script = benchmarks.load_script("export_scripts/Batch_ROI_Export.py")
+        params = {"Channels": [1], "Export_All_Planes": True}
+        image = self.conn.getObject("Image", self.first)
+        rows = script.get_export_data(self.conn, params, image)
+        # a row per plane for the shapes without Z
+        assert len(rows) == 2 + 1 + 1 + 2 + 2
+        assert self.server.log.calls["roi.getShapeStatsRestricted"] == 2
+        last = rows[-1]
+        assert last["text"] == '"cell. 1"' and last["area"] == 32
+        assert last["points"] == 9 * 9 and last["z"] == 2
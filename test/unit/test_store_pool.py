@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+   Tests of omero.script_helpers.store_pool
+   Copyright 2024 University of Muenster. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+"""
+
+import fake_gateway as fake
+from omero.script_helpers.store_pool import RawPixelsStorePool
+
+
+class TestStorePool(object):
+
+    def setup_method(self):
+        self.server = fake.FakeServer()
+        self.conn = fake.FakeGateway(self.server)
+        self.pixels_ids = [
+            self.conn.getObject("Image", self.server.add_image(
+                "%d.tif" % i, 8, 8, size_z=3)).getPrimaryPixels().getId()
+            for i in range(3)]
+
+    def test_bound_once_per_image(self):
+        pool = RawPixelsStorePool(self.conn)
+        self.server.log.reset()
+        for pid in self.pixels_ids:
+            for z in range(3):
+                with pool.store(pid) as rps:
+                    assert rps.getPixelsId() == pid
+                    rps.getPlane(z, 0, 0)
+        assert self.server.log.calls["rps.setPixelsId"] == 3
+        assert (pool.created, pool.binds, pool.reused) == (3, 3, 6)
+        pool.close()
+        assert self.server.log.calls["rps.close"] == 3
+
+    def test_idle_stores_are_rebound(self):
+        with RawPixelsStorePool(self.conn, max_open=1) as pool:
+            a = pool.borrow(self.pixels_ids[0])
+            pool.give_back(a)
+            b = pool.borrow(self.pixels_ids[1])
+            assert b is a and b.getPixelsId() == self.pixels_ids[1]
+            c = pool.borrow(self.pixels_ids[2])
+            assert c is not b
+            pool.give_back(b)
+            pool.give_back(c)
+        assert pool.created == 2
+        assert self.server.log.calls["rps.close"] == 2
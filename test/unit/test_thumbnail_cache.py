@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+   Tests of omero.script_helpers.thumbnail_cache
+   Copyright 2024 University of Muenster. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+"""
+
+from omero.rtypes import rint
+
+import benchmarks
+import fake_gateway as fake
+from omero.script_helpers import thumbnail_cache
+from omero.script_helpers.panel_cache import PanelCache
+from omero.script_helpers.thumbnail_cache import ThumbnailCache
+
+
+class TestThumbnailCache(object):
+
+    def setup_method(self):
+        self.server = fake.FakeServer()
+        self.conn = fake.FakeGateway(self.server)
+        self.pixel_ids = []
+        for i in range(7):
+            iid = self.server.add_image("t%d.tif" % i, 40, 30)
+            self.pixel_ids.append(
+                self.server.get("Image", iid).getPrimaryPixels().id.val)
+
+    def thumbnails(self, tmpdir, max_bytes=1024 * 1024):
+        return ThumbnailCache(self.conn, files=PanelCache(
+            self.conn, str(tmpdir), max_bytes))
+
+    def test_fetches_missing_and_stale(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(thumbnail_cache, "THUMBNAIL_BATCH", 3)
+        monkeypatch.setattr(thumbnail_cache, "QUERY_BATCH", 5)
+        first = self.thumbnails(tmpdir).getThumbnailByLongestSideSet(
+            rint(32), self.pixel_ids)
+        assert sorted(first) == sorted(self.pixel_ids)
+        assert self.server.log.calls["thumbs.getThumbnailByLongestSideSet"] \
+            == 3
+
+        self.server.log.reset()
+        thumbnails = self.thumbnails(tmpdir)
+        assert thumbnails.getThumbnailByLongestSideSet(
+            rint(32), self.pixel_ids) == first
+        assert not self.server.log.calls.get(
+            "thumbs.getThumbnailByLongestSideSet")
+        assert self.server.log.calls["query.projection"] == 2
+
+        # new settings and another size are fetched again
+        self.server.rdefs[self.pixel_ids[0]].version += 1
+        thumbnails = self.thumbnails(tmpdir)
+        thumbnails.getThumbnailByLongestSideSet(rint(32), self.pixel_ids)
+        thumbnails.getThumbnailByLongestSideSet(rint(16), self.pixel_ids[:2])
+        assert thumbnails.fetched == 3
+        assert "3 fetched, 6 from the cache" in thumbnails.report()
+
+    def test_cache_off(self, tmpdir):
+        thumbnails = self.thumbnails(tmpdir, 0)
+        for i in range(2):
+            thumbnails.getThumbnailByLongestSideSet(rint(32), self.pixel_ids)
+        assert thumbnails.fetched == 14
+        assert not self.server.log.calls.get("query.projection")
+
+    def test_figure_grid(self, tmpdir):
+        script = benchmarks.load_script("figure_scripts/Thumbnail_Figure.py")
+        grids = [script.paint_thumbnail_grid(
+            self.thumbnails(tmpdir), 32, 2, self.pixel_ids, 4)
+            for i in range(2)]
+        assert grids[0].size == (4 * 34 + 2, 2 * 34 + 4)
+        assert grids[0].tobytes() == grids[1].tobytes()
+        assert self.server.log.calls["thumbs.getThumbnailByLongestSideSet"] \
+            == 1
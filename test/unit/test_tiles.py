@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+   Tests of omero.script_helpers.tiles
+   Copyright 2024 University of Muenster. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+"""
+
+import fake_gateway as fake
+from omero.script_helpers.tiles import (TileReader, level_for_size,
+                                        tile_grid)
+
+
+class TestTiles(object):
+
+    def setup_method(self):
+        self.server = fake.FakeServer()
+        self.server.max_plane_size = (256, 256)
+        self.conn = fake.FakeGateway(self.server)
+        image_id = self.server.add_image("big.tif", 1100, 700, size_c=2)
+        self.pixels = self.conn.getObject("Image", image_id) \
+            .getPrimaryPixels()
+        self.pixels_id = self.pixels.getId()
+
+    def test_tile_grid(self):
+        tiles = list(tile_grid(5, 3, 2, 2, x0=10))
+        assert tiles == [(10, 0, 2, 2), (12, 0, 2, 2), (14, 0, 1, 2),
+                         (10, 2, 2, 1), (12, 2, 2, 1), (14, 2, 1, 1)]
+        assert level_for_size([(100, 100), (50, 50), (25, 25)], 2500) == 1
+        assert level_for_size([(100, 100)], 10) is None
+
+    def test_tiles_follow_server_grid(self):
+        with TileReader(self.conn, self.pixels) as reader:
+            assert (reader.tile_width, reader.tile_height) == (512, 512)
+            assert len(list(reader.tiles())) == 3 * 2
+            tiles = list(reader.tiles((500, 500, 30, 30)))
+            assert tiles == [(500, 500, 12, 12), (512, 500, 18, 12),
+                             (500, 512, 12, 18), (512, 512, 18, 18)]
+            assert list(reader.tiles((2000, 0, 10, 10))) == []
+
+    def test_read_region(self):
+        plane = self.server.plane(self.pixels_id, 0, 1, 0)
+        with TileReader(self.conn, self.pixels) as reader:
+            region = reader.read_region(0, 1, 0, (400, 300, 300, 200))
+            assert region.dtype == plane.dtype
+            assert (region == plane[300:500, 400:700]).all()
+            assert reader.tiles_read == 2
+            # outside the image is 0
+            edge = reader.read_region(0, 1, 0, (1000, -10, 200, 20))
+            assert (edge[10:, :100] == plane[:10, 1000:]).all()
+            assert not edge[:10].any() and not edge[:, 100:].any()
+
+    def test_resolution_levels(self):
+        with TileReader(self.conn, self.pixels, level=1) as reader:
+            assert (reader.size_x, reader.size_y) == (550, 350)
+            data = reader.read_region(0, 0, 0, (0, 0, 550, 350))
+        expected = self.server.tile(self.pixels_id, 0, 0, 0, 0, 0, 550, 350,
+                                    level=1)
+        assert (data == expected).all()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+   Tests of omero.script_helpers.uploader
+   Copyright 2024 University of Muenster. All rights reserved.
+   Use is subject to license terms supplied in LICENSE.txt
+"""
+
+import numpy
+import pytest
+
+import fake_gateway as fake
+from omero.script_helpers.uploader import (PlaneUploader,
+                                           create_image_from_numpy_seq)
+
+
+def planes(size_z, size_c, size_t, dtype=numpy.uint16):
+    rng = numpy.random.RandomState(2)
+    for z in range(size_z):
+        for c in range(size_c):
+            for t in range(size_t):
+                yield rng.randint(c * 100, c * 100 + 50, (6, 8)).astype(dtype)
+
+
+class TestUploader(object):
+
+    def setup_method(self):
+        self.server = fake.FakeServer()
+        self.conn = fake.FakeGateway(self.server)
+
+    def pixels_id(self, image):
+        return image.getPrimaryPixels().getId()
+
+    def test_same_image_as_gateway(self):
+        # slow enough uploads that every worker gets a plane
+        self.server.log.latency = 0.002
+        expected = self.conn.createImageFromNumpySeq(
+            planes(3, 2, 4), "serial", 3, 2, 4)
+        image = create_image_from_numpy_seq(
+            self.conn, planes(3, 2, 4), "parallel", 3, 2, 4, workers=3)
+        assert image.getName() == "parallel"
+        for z in range(3):
+            for c in range(2):
+                for t in range(4):
+                    assert (self.server.plane(self.pixels_id(image), z, c, t)
+                            == self.server.plane(self.pixels_id(expected),
+                                                 z, c, t)).all()
+        assert self.server.log.calls["session.createRawPixelsStore"] == 1 + 3
+
+    def test_min_max_and_settings(self):
+        did = self.server.add_dataset("out")
+        self.server.log.reset()
+        image = create_image_from_numpy_seq(
+            self.conn, planes(2, 3, 2), "mm", 2, 3, 2,
+            dataset=self.conn.getObject("Dataset", did))
+        calls = self.server.log.calls
+        assert calls["pixels.setChannelGlobalMinMax"] == 3
+        assert calls["rendering_settings.resetDefaultsInSet"] == 1
+        assert self.server.children("DatasetImage", did) == [image.getId()]
+
+    def test_copies_source_type(self):
+        source = self.server.add_image("src.tif", 8, 6, size_c=2)
+        image = create_image_from_numpy_seq(
+            self.conn, planes(1, 1, 1, numpy.float64), "copy", 1, 1, 1,
+            sourceImageId=source, channelList=[1])
+        pid = self.pixels_id(image)
+        assert self.server.plane(pid, 0, 0, 0).dtype == numpy.uint16
+
+    def test_upload_errors_raised(self):
+        uploader = PlaneUploader(self.conn, -1, numpy.uint8, workers=2)
+        with pytest.raises(Exception):
+            with uploader:
+                for i in range(10):
+                    uploader.write(numpy.zeros((2, 2)), i, 0, 0)